@@ -1,8 +1,9 @@
 import os
+import socket
 import logging
 import tempfile
 
-from addons.base.lock import Lock
+from osf.utils.locks import AdvisoryLock
 
 logger = logging.getLogger(__name__)
 
@@ -19,16 +20,13 @@ def DEBUG(msg):
         logger.debug(msg)
 
 #############################################################
-LOCK_RUN = Lock(TMPDIR, LOCK_PREFIX, 'RUN')
-LOCK_PLAN = Lock(TMPDIR, LOCK_PREFIX, 'PLAN')
-
-def init_lock():
-    LOCK_RUN.unlock()
-    LOCK_PLAN.unlock()
+# The plan is saved in a file of this host, so the locks are per host
+LOCK_RUN = AdvisoryLock(LOCK_PREFIX + socket.gethostname() + '_RUN')
+LOCK_PLAN = AdvisoryLock(LOCK_PREFIX + socket.gethostname() + '_PLAN')
 
 def add_plan(team_ids):
     try:
-        LOCK_PLAN.lock()
+        LOCK_PLAN.acquire()
         DEBUG('PLAN_FILE={}'.format(PLAN_FILE))
         with open(PLAN_FILE, 'a') as f:
             for team_id in team_ids:
@@ -36,13 +34,13 @@ def add_plan(team_ids):
     except Exception as e:
         DEBUG(str(e))
     finally:
-        LOCK_PLAN.unlock()
+        LOCK_PLAN.release()
 
 def get_plan(team_ids):
     try:
         new_ids = set(team_ids)
         lines = []
-        LOCK_PLAN.lock()
+        LOCK_PLAN.acquire()
         tmp_lines = []
         with open(PLAN_FILE, 'r') as f:
             tmp_lines = f.readlines()
@@ -52,7 +50,7 @@ def get_plan(team_ids):
     except Exception as e:
         DEBUG(str(e))
     finally:
-        LOCK_PLAN.unlock()
+        LOCK_PLAN.release()
     DEBUG('requested team_ids={}'.format(lines))
     new_ids.update(lines)
     return new_ids
@@ -1315,25 +1315,26 @@ def celery_check_updated_files(self, team_ids):
         opt.extended[KEY_LIST_CURSOR] = cursor
         opt.save()
 
-    if not lock.LOCK_RUN.trylock():
+    if not lock.LOCK_RUN.acquire(blocking=False):
         lock.add_plan(team_ids)
         return  # exit
 
-    while True:
-        team_ids = lock.get_plan(team_ids)
-        if len(team_ids) == 0:
-            break
-        # to wait for updating timestamp in create_waterbutler_log()
-        time.sleep(5)
-        for dbtid in team_ids:
-            institution = team_id_to_instituion(dbtid)
-            name = u'Institution={}, Dropbox Business Team ID={}'.format(
-                institution, dbtid)
-            try:
-                DEBUG(u'check and update timestamp: {}'.format(name))
-                _check_team_files(dbtid)
-            except Exception:
-                logger.exception(name)
-        team_ids = []
-
-    lock.LOCK_RUN.unlock()
+    try:
+        while True:
+            team_ids = lock.get_plan(team_ids)
+            if len(team_ids) == 0:
+                break
+            # to wait for updating timestamp in create_waterbutler_log()
+            time.sleep(5)
+            for dbtid in team_ids:
+                institution = team_id_to_instituion(dbtid)
+                name = u'Institution={}, Dropbox Business Team ID={}'.format(
+                    institution, dbtid)
+                try:
+                    DEBUG(u'check and update timestamp: {}'.format(name))
+                    _check_team_files(dbtid)
+                except Exception:
+                    logger.exception(name)
+            team_ids = []
+    finally:
+        lock.LOCK_RUN.release()
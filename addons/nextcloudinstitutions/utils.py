@@ -20,8 +20,8 @@ from osf.models.external import ExternalAccount
 from osf.models.rdm_addons import RdmAddonOption
 from website.util import timestamp, waterbutler
 from addons.nextcloudinstitutions import apps, settings
-from addons.nextcloudinstitutions.lock import TMPDIR, LOCK_PREFIX
-from addons.base.lock import Lock
+from addons.nextcloudinstitutions.lock import LOCK_PREFIX
+from osf.utils.locks import AdvisoryLock
 
 
 logger = logging.getLogger(__name__)
@@ -309,59 +309,61 @@ def celery_check_updated_files(self, provider_id, since, interval):
         provider=SHORT_NAME, provider_id=provider_id)
     DEBUG(u'external account id: {}'.format(ea._id))
 
-    lock = Lock(TMPDIR, LOCK_PREFIX, ea._id)
-    if not lock.trylock():
+    lock = AdvisoryLock(LOCK_PREFIX + ea._id)
+    if not lock.acquire(blocking=False):
         DEBUG(u'lock acquisition failed')
         return  # exit
 
-    opt = RdmAddonOption.objects.get(
-        provider=SHORT_NAME, external_accounts=ea)
-    if opt.extended is None:
-        opt.extended = {}
-
-    val = opt.extended.get(NEXTCLOUD_FILE_UPDATE_SINCE)
-    if val and val.isdigit():
-        DEBUG(u'get "since" from DB: {}'.format(val))
-        since = val
-
-    updated_files = _list_updated_files(ea, since)
-    DEBUG(u'update files: {}'.format(str(updated_files)))
-
-    latest = since
-    for f in updated_files:
-        DEBUG(u'path: {}, mtime: {}, modified user: {}'.format(f.path, f.mtime, f.muser))
-        if f.ftype == 'file':
-            try:
-                _check_project_files(opt, f)
-                if latest < f.mtime:
-                    latest = f.mtime
-                    DEBUG(u'latest: {}'.format(str(latest)))
-            except Exception:
-                logger.exception(u'Insititution={}, Nextcloud ID={}'.format(opt.institution, provider_id))
-
-    # wait for the specified interval
-    current_time = time.time()
-    recheck_time = start_time + float(interval)
-    sleep_time = 0
-    if recheck_time - current_time > 0:
-        sleep_time = math.ceil(recheck_time - current_time)
-        time.sleep(sleep_time)
-    DEBUG(u'current: {}, recheck: {}, sleep: {}'.format(current_time, recheck_time, sleep_time))
-
-    updated_files2 = _list_updated_files(ea, latest)
-    DEBUG(u'update files2: {}'.format(str(updated_files2)))
-
-    for f in updated_files2:
-        DEBUG(u'path: {}, mtime: {}, modified user: {}'.format(f.path, f.mtime, f.muser))
-        if f.ftype == 'file':
-            try:
-                _check_project_files(opt, f)
-                if latest < f.mtime:
-                    latest = f.mtime
-                    DEBUG(u'latest: {}'.format(str(latest)))
-            except Exception:
-                logger.exception(u'Insititution={}, Nextcloud ID={}'.format(opt.institution, provider_id))
-
-    opt.extended[NEXTCLOUD_FILE_UPDATE_SINCE] = latest
-    opt.save()
-    lock.unlock()
+    try:
+        opt = RdmAddonOption.objects.get(
+            provider=SHORT_NAME, external_accounts=ea)
+        if opt.extended is None:
+            opt.extended = {}
+
+        val = opt.extended.get(NEXTCLOUD_FILE_UPDATE_SINCE)
+        if val and val.isdigit():
+            DEBUG(u'get "since" from DB: {}'.format(val))
+            since = val
+
+        updated_files = _list_updated_files(ea, since)
+        DEBUG(u'update files: {}'.format(str(updated_files)))
+
+        latest = since
+        for f in updated_files:
+            DEBUG(u'path: {}, mtime: {}, modified user: {}'.format(f.path, f.mtime, f.muser))
+            if f.ftype == 'file':
+                try:
+                    _check_project_files(opt, f)
+                    if latest < f.mtime:
+                        latest = f.mtime
+                        DEBUG(u'latest: {}'.format(str(latest)))
+                except Exception:
+                    logger.exception(u'Insititution={}, Nextcloud ID={}'.format(opt.institution, provider_id))
+
+        # wait for the specified interval
+        current_time = time.time()
+        recheck_time = start_time + float(interval)
+        sleep_time = 0
+        if recheck_time - current_time > 0:
+            sleep_time = math.ceil(recheck_time - current_time)
+            time.sleep(sleep_time)
+        DEBUG(u'current: {}, recheck: {}, sleep: {}'.format(current_time, recheck_time, sleep_time))
+
+        updated_files2 = _list_updated_files(ea, latest)
+        DEBUG(u'update files2: {}'.format(str(updated_files2)))
+
+        for f in updated_files2:
+            DEBUG(u'path: {}, mtime: {}, modified user: {}'.format(f.path, f.mtime, f.muser))
+            if f.ftype == 'file':
+                try:
+                    _check_project_files(opt, f)
+                    if latest < f.mtime:
+                        latest = f.mtime
+                        DEBUG(u'latest: {}'.format(str(latest)))
+                except Exception:
+                    logger.exception(u'Insititution={}, Nextcloud ID={}'.format(opt.institution, provider_id))
+
+        opt.extended[NEXTCLOUD_FILE_UPDATE_SINCE] = latest
+        opt.save()
+    finally:
+        lock.release()
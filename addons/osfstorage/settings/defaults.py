@@ -33,6 +33,11 @@ try:
 except Exception as ex:
     logger.warn('No migration settings loaded for OSFStorage, falling back to local dev. {}'.format(ex))
 
+# Number of children of a folder fetched per query when they are streamed to WaterButler
+GET_CHILDREN_PAGE_SIZE = 1000
+# Largest page of children WaterButler may request
+MAX_GET_CHILDREN_PAGE_SIZE = 10000
+
 # Max file size permitted by frontend in megabytes
 MAX_UPLOAD_SIZE = 5 * 1024  # 5 GB
 
@@ -920,6 +920,98 @@ class TestOsfStorageFileVersion(StorageTestCase):
 
         assert_equal(version2.archive, 'erchiv')
 
+    def test_version_summary(self):
+        fnode = self.project.get_addon('osfstorage').get_root().append_file('MyCoolTestFile')
+        location = {'service': 'cloud', settings.WATERBUTLER_RESOURCE: 'osf', 'object': '06d80e'}
+        version = fnode.create_version(self.user, location, {'size': 100, 'md5': 'first'})
+        version2 = fnode.create_version(self.user, dict(location, object='07d80a'), {'size': 50, 'md5': 'second'})
+
+        summary = models.FileVersionSummary.objects.get(file=fnode)
+        assert_equal(summary.version_count, 2)
+        assert_equal(summary.total_size, 150)
+        assert_equal(summary.latest_version, version2)
+        assert_equal(summary.size, 50)
+        assert_equal(summary.md5, 'second')
+        assert_equal(summary.earliest_version, version)
+        assert_equal(summary.earliest_version_created, version.created)
+
+        version2.update_metadata({'size': 60, 'sha256': 'hash'})
+        summary.reload()
+        assert_equal(summary.size, 60)
+        assert_equal(summary.sha256, 'hash')
+        assert_equal(summary.total_size, 160)
+
+    def test_backfill_version_summaries(self):
+        from osf.management.commands.backfill_file_version_summaries import backfill_file_version_summaries
+        fnode = self.project.get_addon('osfstorage').get_root().append_file('MyCoolTestFile')
+        fnode.create_version(self.user, {
+            'service': 'cloud', settings.WATERBUTLER_RESOURCE: 'osf', 'object': '06d80e'
+        }, {'size': 100})
+        models.FileVersionSummary.objects.all().delete()
+
+        backfill_file_version_summaries(chunk_size=2)
+
+        summary = models.FileVersionSummary.objects.get(file=fnode)
+        assert_equal(summary.version_count, 1)
+        assert_equal(summary.size, 100)
+
+    def test_storage_usage_counts_version_changes(self):
+        fnode = self.project.get_addon('osfstorage').get_root().append_file('MyCoolTestFile')
+        location = {'service': 'cloud', settings.WATERBUTLER_RESOURCE: 'osf', 'object': '06d80e'}
+        fnode.create_version(self.user, location, {'size': 100})
+        assert_equal(self.project.storage_usage, 100)
+
+        version = fnode.create_version(self.user, dict(location, object='07d80a'), {'size': 50})
+        assert_equal(models.NodeStorageUsage.objects.get(node=self.project).total_size, 150)
+
+        version.update_metadata({'size': 70})
+        assert_equal(self.project.storage_usage, 170)
+
+    def test_delete_versions(self):
+        fnode = self.project.get_addon('osfstorage').get_root().append_file('MyCoolTestFile')
+        location = {'service': 'cloud', settings.WATERBUTLER_RESOURCE: 'osf', 'object': '06d80e'}
+        version = fnode.create_version(self.user, location, {'size': 100, 'md5': 'first'})
+        version2 = fnode.create_version(self.user, dict(location, object='07d80a'), {'size': 50, 'md5': 'second'})
+        assert_equal(self.project.storage_usage, 150)
+
+        # e.g. the duplicate versions deleted by the restore of an export
+        models.FileVersion.objects.filter(id__in=[version2.id]).delete()
+        summary = models.FileVersionSummary.objects.get(file=fnode)
+        assert_equal(summary.version_count, 1)
+        assert_equal(summary.total_size, 100)
+        assert_equal(summary.latest_version, version)
+        assert_equal(summary.md5, 'first')
+        assert_equal(models.NodeStorageUsage.objects.get(node=self.project).total_size, 100)
+
+        fnode.versions.all().delete()
+        assert_false(models.FileVersionSummary.objects.filter(file=fnode).exists())
+        assert_equal(models.NodeStorageUsage.objects.get(node=self.project).total_size, 0)
+
+    def test_storage_usage_counts_changes_before_first_read(self):
+        fnode = self.project.get_addon('osfstorage').get_root().append_file('MyCoolTestFile')
+        location = {'service': 'cloud', settings.WATERBUTLER_RESOURCE: 'osf', 'object': '06d80e'}
+        fnode.create_version(self.user, location, {'size': 100})
+        # the first change creates the counter with an unknown usage
+        assert_is_none(models.NodeStorageUsage.objects.get(node=self.project).total_size)
+        fnode.create_version(self.user, dict(location, object='07d80a'), {'size': 50})
+        assert_is_none(models.NodeStorageUsage.objects.get(node=self.project).total_size)
+
+        assert_equal(self.project.storage_usage, 150)
+        assert_equal(models.NodeStorageUsage.objects.get(node=self.project).total_size, 150)
+
+    def test_reconcile_storage_usage(self):
+        from osf.management.commands.reconcile_storage_usage import reconcile_storage_usage
+        fnode = self.project.get_addon('osfstorage').get_root().append_file('MyCoolTestFile')
+        fnode.create_version(self.user, {
+            'service': 'cloud', settings.WATERBUTLER_RESOURCE: 'osf', 'object': '06d80e'
+        }, {'size': 100})
+        assert_equal(self.project.storage_usage, 100)
+        models.NodeStorageUsage.objects.filter(node=self.project).update(total_size=42)
+
+        assert_equal(reconcile_storage_usage(), 1)
+        assert_equal(self.project.storage_usage, 100)
+        assert_equal(reconcile_storage_usage(), 0)
+
     def test_no_matching_archive(self):
         models.FileVersion.objects.all().delete()
         assert_is(False, factories.FileVersionFactory(
@@ -24,7 +24,6 @@ from addons.osfstorage.tests.utils import make_payload
 from framework.auth import signing
 from website.util import rubeus, api_url_for
 from framework.auth import cas
-from api.caching.utils import storage_usage_cache
 
 from osf import features
 from osf.models import Tag, QuickFilesNode
@@ -34,7 +33,6 @@ from addons.osfstorage import utils
 from addons.base.views import make_auth, addon_view_file
 from addons.osfstorage import settings as storage_settings
 from api_tests.utils import create_test_file, create_test_preprint_file
-from api.caching.settings import STORAGE_USAGE_KEY
 
 from osf_tests.factories import ProjectFactory, ApiOAuth2PersonalTokenFactory, PreprintFactory
 from website.files.utils import attach_versions
@@ -172,6 +170,57 @@ class TestGetMetadataHook(HookTestCase):
         assert_equal(res_date_modified, expected_date_modified)
         assert_equal(res_date_created, expected_date_created)
 
+    def test_children_metadata_pages(self):
+        root = self.node_settings.get_root()
+        for name in ['c.txt', 'a.txt', 'b.txt']:
+            record = root.append_file(name)
+            record.add_version(factories.FileVersionFactory())
+            record.save()
+
+        res = self.send_hook(
+            'osfstorage_get_children',
+            {'fid': root._id, 'user_id': self.user._id, 'limit': 2},
+            {},
+            self.node
+        )
+        assert_equal([child['name'] for child in res.json['data']], ['a.txt', 'b.txt'])
+        assert_equal(res.json['data'][0]['downloads'], 0)
+        assert_is_not_none(res.json['next'])
+
+        res = self.send_hook(
+            'osfstorage_get_children',
+            {'fid': root._id, 'user_id': self.user._id, 'limit': 2, 'cursor': res.json['next'], 'lean': 'true'},
+            {},
+            self.node
+        )
+        assert_equal([child['name'] for child in res.json['data']], ['c.txt'])
+        assert_is_none(res.json['data'][0]['downloads'])
+        assert_is_none(res.json['next'])
+
+    @mock.patch('addons.osfstorage.settings.GET_CHILDREN_PAGE_SIZE', 2)
+    def test_children_metadata_streamed_in_pages(self):
+        root = self.node_settings.get_root()
+        for name in ['c.txt', 'a.txt', 'b.txt', 'd.txt']:
+            root.append_file(name)
+
+        res = self.send_hook(
+            'osfstorage_get_children',
+            {'fid': root._id, 'user_id': self.user._id},
+            {},
+            self.node
+        )
+        assert_equal([child['name'] for child in res.json], ['a.txt', 'b.txt', 'c.txt', 'd.txt'])
+
+    def test_children_metadata_invalid_cursor(self):
+        res = self.send_hook(
+            'osfstorage_get_children',
+            {'fid': self.node_settings.get_root()._id, 'user_id': self.user._id, 'limit': 2, 'cursor': 'invalid'},
+            {},
+            self.node,
+            expect_errors=True
+        )
+        assert_equal(res.status_code, 400)
+
     def test_osf_storage_root(self):
         auth = Auth(self.project.creator)
         result = osf_storage_root(self.node_settings.config, self.node_settings, auth)
@@ -441,27 +490,26 @@ class TestUploadFileHook(HookTestCase):
     # def test_upload_update_deleted(self):
     #     pass
 
-    def test_add_file_updates_cache(self):
+    def test_add_file_updates_storage_usage(self):
         name = 'ლ(ಠ益ಠლ).unicode'
         parent = self.node_settings.get_root()
-        key = STORAGE_USAGE_KEY.format(target_id=self.node._id)
-        assert storage_usage_cache.get(key) is None
+        assert self.node.storage_usage == 0
 
         with override_flag(features.STORAGE_USAGE, active=True):
             self.send_upload_hook(parent, payload=self.make_payload(name=name))
-        assert storage_usage_cache.get(key) == 123
+        assert self.node.storage_usage == 123
 
-        # Don't update the cache for duplicate uploads
+        # Don't count duplicate uploads
         with override_flag(features.STORAGE_USAGE, active=True):
             self.send_upload_hook(parent, payload=self.make_payload(name=name))
-        assert storage_usage_cache.get(key) == 123
+        assert self.node.storage_usage == 123
 
-        # Do update the cache for new versions
+        # Do count new versions
         payload = self.make_payload(name=name)
         payload['metadata']['name'] = 'new hash'
         with override_flag(features.STORAGE_USAGE, active=True):
             self.send_upload_hook(parent, payload=payload)
-        assert storage_usage_cache.get(key) == 246
+        assert self.node.storage_usage == 246
 
 
 @pytest.mark.django_db
@@ -980,9 +1028,7 @@ class TestDeleteHookNode(DeleteHook):
 @pytest.mark.django_db
 class TestDeleteHookProjectOnly(DeleteHook):
 
-    def test_delete_reduces_cache_size(self):
-        key = STORAGE_USAGE_KEY.format(target_id=self.node._id)
-
+    def test_delete_reduces_storage_usage(self):
         file = create_record_with_version('new file', self.node_settings, size=123)
         assert self.node.storage_usage == 123
 
@@ -992,8 +1038,10 @@ class TestDeleteHookProjectOnly(DeleteHook):
         assert_equal(resp.status_code, 200)
         assert_equal(resp.json, {'status': 'success'})
 
-        assert storage_usage_cache.get(key) == 0
-        assert_is(self.node.storage_usage, 0)
+        assert self.node.storage_usage == 0
+
+        models.BaseFileNode.load(file._id).restore()
+        assert self.node.storage_usage == 123
 
 
 @pytest.mark.django_db
@@ -1322,13 +1370,14 @@ class TestMoveHookPreprint(TestMoveHook):
 @pytest.mark.django_db
 class TestMoveHookProjectsOnly(TestMoveHook):
 
-    def test_move_hook_updates_cache_intra_target(self):
+    def test_move_hook_updates_storage_usage_intra_target(self):
         """
-        Moving within a single target shouldn't update the cache because net storage usage hasn't changed
+        Moving within a single target doesn't change the storage usage
         """
 
         file = create_record_with_version('new file', self.node_settings, size=123)
         folder = self.root_node.append_folder('Nina Simone')
+        assert self.project.storage_usage == 123
 
         with override_flag(features.STORAGE_USAGE, active=True):
             res = self.send_hook(
@@ -1347,13 +1396,11 @@ class TestMoveHookProjectsOnly(TestMoveHook):
                 target=self.node,
                 method='post_json',)
 
-        # Cache should stay untouched because net storage usage hasn't changed
-        key = STORAGE_USAGE_KEY.format(target_id=self.project._id)
-        assert storage_usage_cache.get(key) is None
+        assert self.project.storage_usage == 123
 
         assert_equal(res.status_code, 200)
 
-    def test_move_hook_updates_cache_inter_target(self):
+    def test_move_hook_updates_storage_usage_inter_target(self):
         """
         Moving from one target to another should update both targets
         """
@@ -1384,12 +1431,9 @@ class TestMoveHookProjectsOnly(TestMoveHook):
                 target=self.node,
                 method='post_json',)
 
-        # both caches are updated
-        source_key = STORAGE_USAGE_KEY.format(target_id=self.project._id)
-        assert storage_usage_cache.get(source_key) == 0
-
-        destination = STORAGE_USAGE_KEY.format(target_id=other_target._id)
-        assert storage_usage_cache.get(destination) == 123
+        # both targets are updated
+        assert self.project.storage_usage == 0
+        assert other_target.storage_usage == 123
 
         assert_equal(res.status_code, 200)
 
@@ -1427,11 +1471,10 @@ class TestCopyHook(HookTestCase):
         assert_equal(res.status_code, 201)
 
     @pytest.mark.enable_implicit_clean
-    def test_copy_hook_updates_cache(self):
+    def test_copy_hook_updates_storage_usage(self):
+        """
+        Copying only adds to the storage usage of the destination
         """
-        Whether intra or inter copying the storage usage cache only has to re-calculate the destination, because if it's
-        a inter-copy the source hasn't changed, but if it's a intra the source IS the destination.
-       """
 
         other_target = ProjectFactory()
         other_root = other_target.get_addon('osfstorage').get_root()
@@ -1459,12 +1502,8 @@ class TestCopyHook(HookTestCase):
                 target=self.node,
                 method='post_json',)
 
-        # both caches are updated
-        source_key = STORAGE_USAGE_KEY.format(target_id=self.project._id)
-        assert storage_usage_cache.get(source_key) == 123
-
-        destination = STORAGE_USAGE_KEY.format(target_id=other_target._id)
-        assert storage_usage_cache.get(destination) == 123
+        assert self.project.storage_usage == 123
+        assert other_target.storage_usage == 123
 
         assert_equal(res.status_code, 201)
 
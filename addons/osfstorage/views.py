@@ -3,6 +3,8 @@ from __future__ import unicode_literals
 from django.db.models import IntegerField
 from django.db.models.functions import Cast
 from rest_framework import status as http_status
+import base64
+import json
 import logging
 
 from django.core.exceptions import ValidationError
@@ -10,14 +12,13 @@ from django.db import IntegrityError
 from django.db import connection
 from django.db import transaction
 
-from flask import request
+from flask import request, Response, stream_with_context
 
 from framework.auth import Auth
 from framework.sessions import get_session
 from framework.exceptions import HTTPError
 from framework.auth.decorators import must_be_signed, must_be_logged_in
 
-from api.caching.tasks import update_storage_usage
 from osf.exceptions import InvalidTagError, TagNotFoundError
 from osf.models import FileVersion, OSFUser, ExportDataRestore, ExportData
 from osf.utils.permissions import WRITE
@@ -127,16 +128,13 @@ def osfstorage_get_revisions(file_node, payload, target, **kwargs):
 
 @decorators.waterbutler_opt_hook
 def osfstorage_copy_hook(source, destination, name=None, **kwargs):
-    ret = source.copy_under(destination, name=name).serialize(), http_status.HTTP_201_CREATED
-    update_storage_usage(destination.target)
-    return ret
+    return source.copy_under(destination, name=name).serialize(), http_status.HTTP_201_CREATED
 
 @decorators.waterbutler_opt_hook
 def osfstorage_move_hook(source, destination, name=None, **kwargs):
-    source_target = source.target
     is_check_permission = kwargs.get('is_check_permission')
     try:
-        ret = source.move_under(destination, name=name, is_check_permission=is_check_permission).serialize(), http_status.HTTP_200_OK
+        return source.move_under(destination, name=name, is_check_permission=is_check_permission).serialize(), http_status.HTTP_200_OK
     except exceptions.FileNodeCheckedOutError:
         raise HTTPError(http_status.HTTP_405_METHOD_NOT_ALLOWED, data={
             'message_long': 'Cannot move file as it is checked out.'
@@ -146,13 +144,6 @@ def osfstorage_move_hook(source, destination, name=None, **kwargs):
             'message_long': 'Cannot move file as it is the primary file of preprint.'
         })
 
-    # once the move is complete recalculate storage for both targets if it's a inter-target move.
-    if is_check_permission and source_target != destination.target:
-        update_storage_usage(destination.target)
-        update_storage_usage(source_target)
-
-    return ret
-
 @must_be_signed
 @decorators.autoload_filenode(default_root=True)
 def osfstorage_get_lineage(file_node, **kwargs):
@@ -176,113 +167,219 @@ def osfstorage_get_metadata(file_node, **kwargs):
     return file_node.serialize(version=version, include_full=True)
 
 
+# Read the documentation on FileVersion's fields before reading this code
+GET_CHILDREN_SQL = """
+    SELECT COALESCE(F.name, ''), F.id, (CASE
+        WHEN F.type = 'osf.osfstoragefile' THEN
+            json_build_object(
+                'id', F._id
+                , 'path', '/' || F._id
+                , 'name', F.name
+                , 'kind', 'file'
+                , 'size', VERSIONS.size
+                , 'downloads', {downloads}
+                , 'version', COALESCE(VERSIONS.version_count, 0)
+                , 'contentType', VERSIONS.content_type
+                , 'modified', VERSIONS.latest_version_created
+                , 'created', VERSIONS.earliest_version_created
+                , 'checkout', CHECKOUT_GUID
+                , 'md5', VERSIONS.md5
+                , 'sha256', VERSIONS.sha256
+                , 'sha512', VERSIONS.sha512
+                , 'latestVersionSeen', {latest_version_seen}
+            )
+        ELSE
+            json_build_object(
+                'id', F._id
+                , 'path', '/' || F._id || '/'
+                , 'name', F.name
+                , 'kind', 'folder'
+            )
+        END
+    )::text
+    FROM osf_basefilenode AS F
+    LEFT JOIN LATERAL (
+        SELECT S.version_count, S.latest_version_id, S.latest_version_created, S.size, S.content_type
+            , S.md5, S.sha256, S.sha512, S.earliest_version_created
+        FROM osf_fileversionsummary AS S
+        WHERE S.file_id = F.id
+        UNION ALL
+        -- Files without a summary, only read when the first query returns no row
+        SELECT (SELECT COUNT(*) FROM osf_basefileversionsthrough WHERE osf_basefileversionsthrough.basefilenode_id = F.id)
+            , LATEST_VERSION.id, LATEST_VERSION.created, LATEST_VERSION.size, LATEST_VERSION.content_type
+            , LATEST_VERSION.metadata ->> 'md5', LATEST_VERSION.metadata ->> 'sha256', LATEST_VERSION.metadata ->> 'sha512'
+            , EARLIEST_VERSION.created
+        FROM (
+            SELECT osf_fileversion.* FROM osf_fileversion
+            JOIN osf_basefileversionsthrough ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
+            WHERE osf_basefileversionsthrough.basefilenode_id = F.id
+            ORDER BY created DESC
+            LIMIT 1
+        ) LATEST_VERSION, (
+            SELECT osf_fileversion.* FROM osf_fileversion
+            JOIN osf_basefileversionsthrough ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
+            WHERE osf_basefileversionsthrough.basefilenode_id = F.id
+            ORDER BY created ASC
+            LIMIT 1
+        ) EARLIEST_VERSION
+        LIMIT 1
+    ) VERSIONS ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT _id from osf_guid
+        WHERE object_id = F.checkout_id
+        AND content_type_id = %(user_content_type_id)s
+        LIMIT 1
+    ) CHECKOUT_GUID ON TRUE
+    {user_joins}
+    WHERE parent_id = %(parent_id)s
+    AND (NOT F.type IN ('osf.trashedfilenode', 'osf.trashedfile', 'osf.trashedfolder'))
+    -- Children without a name are sorted as if named '', the index has the same expression
+    AND (COALESCE(F.name, ''), F.id) > (%(cursor_name)s, %(cursor_id)s)
+    ORDER BY COALESCE(F.name, ''), F.id
+    LIMIT %(limit)s
+"""
+
+# Download counts and seen state of the requesting user, skipped in lean mode
+GET_CHILDREN_USER_JOINS = """
+    LEFT JOIN LATERAL (
+        SELECT P.total AS DOWNLOAD_COUNT FROM osf_pagecounter AS P
+        WHERE P.resource_id = %(resource_id)s
+        AND P.file_id = F.id
+        AND P.action = 'download'
+        AND P.version ISNULL
+        LIMIT 1
+    ) DOWNLOAD_COUNT ON TRUE
+    LEFT JOIN LATERAL (
+      SELECT EXISTS(
+        SELECT (1) FROM osf_fileversionusermetadata
+          INNER JOIN osf_fileversion ON osf_fileversionusermetadata.file_version_id = osf_fileversion.id
+          INNER JOIN osf_basefileversionsthrough ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
+          WHERE osf_fileversionusermetadata.user_id = %(user_pk)s
+          AND osf_basefileversionsthrough.basefilenode_id = F.id
+        LIMIT 1
+      )
+    ) SEEN_FILE ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT CASE WHEN SEEN_FILE.exists
+        THEN
+            CASE WHEN EXISTS(
+              SELECT (1) FROM osf_fileversionusermetadata
+              WHERE osf_fileversionusermetadata.file_version_id = VERSIONS.latest_version_id
+              AND osf_fileversionusermetadata.user_id = %(user_pk)s
+              LIMIT 1
+            )
+            THEN
+              json_build_object('user', %(user_id)s, 'seen', TRUE)
+            ELSE
+              json_build_object('user', %(user_id)s, 'seen', FALSE)
+            END
+        ELSE
+          NULL
+        END
+    ) SEEN_LATEST_VERSION ON TRUE
+"""
+
+
+def encode_children_cursor(name, id_):
+    return base64.urlsafe_b64encode(json.dumps([name, id_]).encode('utf-8')).decode('ascii')
+
+
+def decode_children_cursor(cursor):
+    """Return the name and the id of the last child of the previous page"""
+    try:
+        name, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise HTTPError(http_status.HTTP_400_BAD_REQUEST, data={'message_long': 'Invalid cursor'})
+    if not isinstance(id_, int):
+        raise HTTPError(http_status.HTTP_400_BAD_REQUEST, data={'message_long': 'Invalid cursor'})
+    return name, id_
+
+
+def get_children_page(file_node, user_id=None, lean=False, cursor=None, limit=None):
+    """Fetch a page of the children of a folder ordered by name, following cursor.
+
+    :return: list of (name, id, serialized child as a JSON string)
+    """
+    from django.contrib.contenttypes.models import ContentType
+    if lean:
+        sql = GET_CHILDREN_SQL.format(downloads='NULL', latest_version_seen='NULL', user_joins='')
+    else:
+        sql = GET_CHILDREN_SQL.format(
+            downloads='COALESCE(DOWNLOAD_COUNT, 0)',
+            latest_version_seen='SEEN_LATEST_VERSION.case',
+            user_joins=GET_CHILDREN_USER_JOINS,
+        )
+    cursor_name, cursor_id = cursor or ('', 0)
+    params = {
+        'user_content_type_id': ContentType.objects.get_for_model(OSFUser).id,
+        'parent_id': file_node.id,
+        'cursor_name': cursor_name,
+        'cursor_id': cursor_id,
+        'limit': limit or osf_storage_settings.GET_CHILDREN_PAGE_SIZE,
+    }
+    if not lean:
+        params.update({
+            'resource_id': file_node.target.guids.first().id,
+            'user_pk': OSFUser.objects.filter(guids___id=user_id, guids___id__isnull=False).values_list('pk', flat=True).first(),
+            'user_id': user_id,
+        })
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        return db_cursor.fetchall()
+
+
+def iter_children_json(file_node, user_id=None, lean=False):
+    """Stream the JSON list of all the children of a folder, one page at a time"""
+    yield '['
+    cursor = None
+    separator = ''
+    while True:
+        rows = get_children_page(file_node, user_id=user_id, lean=lean, cursor=cursor)
+        for name, id_, child in rows:
+            yield separator + child
+            separator = ','
+        if len(rows) < osf_storage_settings.GET_CHILDREN_PAGE_SIZE:
+            break
+        cursor = rows[-1][:2]
+    yield ']'
+
+
 @must_be_signed
 @decorators.autoload_filenode(must_be='folder')
 def osfstorage_get_children(file_node, **kwargs):
-    from django.contrib.contenttypes.models import ContentType
+    """List the children of a folder, ordered by name.
+
+    Without ``limit`` all the children are streamed as a JSON list. With ``limit``,
+    a page of at most ``limit`` children is returned with the cursor of the next page,
+    ``{'data': [...], 'next': cursor}``, and the following page is requested with
+    ``cursor``. ``lean=true`` skips the download counts and the seen state of the user.
+    """
     user_id = request.args.get('user_id')
-    user_content_type_id = ContentType.objects.get_for_model(OSFUser).id
-    user_pk = OSFUser.objects.filter(guids___id=user_id, guids___id__isnull=False).values_list('pk', flat=True).first()
-    with connection.cursor() as cursor:
-        # Read the documentation on FileVersion's fields before reading this code
-        cursor.execute("""
-            SELECT json_agg(CASE
-                WHEN F.type = 'osf.osfstoragefile' THEN
-                    json_build_object(
-                        'id', F._id
-                        , 'path', '/' || F._id
-                        , 'name', F.name
-                        , 'kind', 'file'
-                        , 'size', LATEST_VERSION.size
-                        , 'downloads',  COALESCE(DOWNLOAD_COUNT, 0)
-                        , 'version', (SELECT COUNT(*) FROM osf_basefileversionsthrough WHERE osf_basefileversionsthrough.basefilenode_id = F.id)
-                        , 'contentType', LATEST_VERSION.content_type
-                        , 'modified', LATEST_VERSION.created
-                        , 'created', EARLIEST_VERSION.created
-                        , 'checkout', CHECKOUT_GUID
-                        , 'md5', LATEST_VERSION.metadata ->> 'md5'
-                        , 'sha256', LATEST_VERSION.metadata ->> 'sha256'
-                        , 'sha512', LATEST_VERSION.metadata ->> 'sha512'
-                        , 'latestVersionSeen', SEEN_LATEST_VERSION.case
-                    )
-                ELSE
-                    json_build_object(
-                        'id', F._id
-                        , 'path', '/' || F._id || '/'
-                        , 'name', F.name
-                        , 'kind', 'folder'
-                    )
-                END
-            )
-            FROM osf_basefilenode AS F
-            LEFT JOIN LATERAL (
-                SELECT * FROM osf_fileversion
-                JOIN osf_basefileversionsthrough ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
-                WHERE osf_basefileversionsthrough.basefilenode_id = F.id
-                ORDER BY created DESC
-                LIMIT 1
-            ) LATEST_VERSION ON TRUE
-            LEFT JOIN LATERAL (
-                SELECT * FROM osf_fileversion
-                JOIN osf_basefileversionsthrough ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
-                WHERE osf_basefileversionsthrough.basefilenode_id = F.id
-                ORDER BY created ASC
-                LIMIT 1
-            ) EARLIEST_VERSION ON TRUE
-            LEFT JOIN LATERAL (
-                SELECT _id from osf_guid
-                WHERE object_id = F.checkout_id
-                AND content_type_id = %s
-                LIMIT 1
-            ) CHECKOUT_GUID ON TRUE
-            LEFT JOIN LATERAL (
-                SELECT P.total AS DOWNLOAD_COUNT FROM osf_pagecounter AS P
-                WHERE P.resource_id = %s
-                AND P.file_id = F.id
-                AND P.action = 'download'
-                AND P.version ISNULL
-                LIMIT 1
-            ) DOWNLOAD_COUNT ON TRUE
-            LEFT JOIN LATERAL (
-              SELECT EXISTS(
-                SELECT (1) FROM osf_fileversionusermetadata
-                  INNER JOIN osf_fileversion ON osf_fileversionusermetadata.file_version_id = osf_fileversion.id
-                  INNER JOIN osf_basefileversionsthrough ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
-                  WHERE osf_fileversionusermetadata.user_id = %s
-                  AND osf_basefileversionsthrough.basefilenode_id = F.id
-                LIMIT 1
-              )
-            ) SEEN_FILE ON TRUE
-            LEFT JOIN LATERAL (
-                SELECT CASE WHEN SEEN_FILE.exists
-                THEN
-                    CASE WHEN EXISTS(
-                      SELECT (1) FROM osf_fileversionusermetadata
-                      WHERE osf_fileversionusermetadata.file_version_id = LATEST_VERSION.fileversion_id
-                      AND osf_fileversionusermetadata.user_id = %s
-                      LIMIT 1
-                    )
-                    THEN
-                      json_build_object('user', %s, 'seen', TRUE)
-                    ELSE
-                      json_build_object('user', %s, 'seen', FALSE)
-                    END
-                ELSE
-                  NULL
-                END
-            ) SEEN_LATEST_VERSION ON TRUE
-            WHERE parent_id = %s
-            AND (NOT F.type IN ('osf.trashedfilenode', 'osf.trashedfile', 'osf.trashedfolder'))
-        """, [
-            user_content_type_id,
-            file_node.target.guids.first().id,
-            user_pk,
-            user_pk,
-            user_id,
-            user_id,
-            file_node.id
-        ])
-        return cursor.fetchone()[0] or []
+    lean = request.args.get('lean', '').lower() in ('true', '1')
+    if 'limit' not in request.args:
+        return Response(
+            stream_with_context(iter_children_json(file_node, user_id=user_id, lean=lean)),
+            mimetype='application/json',
+        )
+
+    try:
+        limit = int(request.args['limit'])
+    except ValueError:
+        raise HTTPError(http_status.HTTP_400_BAD_REQUEST, data={'message_long': 'Invalid limit'})
+    if not 0 < limit <= osf_storage_settings.MAX_GET_CHILDREN_PAGE_SIZE:
+        raise HTTPError(http_status.HTTP_400_BAD_REQUEST, data={
+            'message_long': 'limit must be between 1 and {}'.format(osf_storage_settings.MAX_GET_CHILDREN_PAGE_SIZE)
+        })
+    cursor = request.args.get('cursor')
+    rows = get_children_page(
+        file_node, user_id=user_id, lean=lean,
+        cursor=decode_children_cursor(cursor) if cursor else None,
+        limit=limit,
+    )
+    return {
+        'data': [json.loads(child) for name, id_, child in rows],
+        'next': encode_children_cursor(*rows[-1][:2]) if len(rows) == limit else None,
+    }
 
 
 @must_be_signed
@@ -354,12 +451,7 @@ def osfstorage_create_child(file_node, payload, **kwargs):
         except KeyError:
             raise HTTPError(http_status.HTTP_400_BAD_REQUEST)
 
-        current_version = file_node.get_version()
         new_version = file_node.create_version(user, location, metadata)
-
-        if not current_version or not current_version.is_duplicate(new_version):
-            update_storage_usage(file_node.target)
-
         version_id = new_version._id
         archive_exists = new_version.archive is not None
     else:
@@ -397,7 +489,6 @@ def osfstorage_delete(file_node, payload, target, **kwargs):
             'message_long': 'Cannot delete file as it is the primary file of preprint.'
         })
 
-    update_storage_usage(file_node.target)
     return {'status': 'success'}
 
 
@@ -221,6 +221,7 @@ MIDDLEWARE = (
     'api.base.middleware.DjangoGlobalMiddleware',
     'api.base.middleware.CeleryTaskMiddleware',
     'api.base.middleware.PostcommitTaskMiddleware',
+    'api.base.middleware.SearchIndexMiddleware',
 
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -353,3 +354,11 @@ TEMPORARY_PATH = '/tmp/'
 
 # Time out for calling copy API in Export/Restore processes
 EACH_FILE_EXPORT_RESTORE_TIME_OUT = 1800
+
+# Maximum number of files copied at the same time in Export processes
+EXPORT_DATA_COPY_MAX_WORKERS = 4
+
+# Maximum number of files copied at the same time in Restore processes
+RESTORE_DATA_COPY_MAX_WORKERS = 4
+# Number of restored files whose database records are updated together
+RESTORE_DATA_POST_PROCESS_BATCH_SIZE = 100
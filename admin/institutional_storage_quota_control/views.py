@@ -5,6 +5,7 @@ from django.http import Http404
 
 from admin.institutions.views import QuotaUserList
 from osf.models import Institution, OSFUser, UserQuota
+from website.util import quota
 from admin.base import settings
 from addons.osfstorage.models import Region
 from django.views.generic import ListView, View
@@ -104,13 +105,10 @@ class UserListByInstitutionStorageID(RdmPermissionMixin, UserPassesTestMixin, Qu
 
     def get_userlist(self):
         """ Get user list by institution_id """
-        user_list = []
-        for user in OSFUser.objects.filter(
-                affiliated_institutions=self.institution_id):
-            user_list.append(self.get_user_quota_info(
-                user, UserQuota.CUSTOM_STORAGE)
-            )
-        return user_list
+        return quota.get_quota_summary(
+            OSFUser.objects.filter(affiliated_institutions=self.institution_id),
+            UserQuota.CUSTOM_STORAGE
+        )
 
     def get_institution(self):
         """ Get institution that is not using NII Storage """
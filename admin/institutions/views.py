@@ -2,16 +2,15 @@ from __future__ import unicode_literals
 
 import json
 import logging
-from operator import itemgetter
 
 from django.db import connection
-from django.db.models import Q
+from django.db.models import F, Q
 from django.http import Http404
 from django.core import serializers
 from django.shortcuts import redirect
 from django.forms.models import model_to_dict
 from django.urls import reverse_lazy, reverse
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.generic import ListView, DetailView, View, CreateView, UpdateView, DeleteView, TemplateView
 from django.views.generic.edit import FormView
 from django.contrib import messages
@@ -291,46 +290,44 @@ class QuotaUserList(ListView):
     def get_user_quota_info(self, user, storage_type):
         max_quota, used_quota = quota.get_quota_info(user, storage_type)
         max_quota_bytes = max_quota * api_settings.SIZE_UNIT_GB
-        remaining_quota = max_quota_bytes - used_quota
-        used_quota_abbr = self.custom_size_abbreviation(*quota.abbreviate_size(used_quota))
-        remaining_abbr = self.custom_size_abbreviation(*quota.abbreviate_size(remaining_quota))
-        if max_quota == 0:
-            return {
-                'id': user.guids.first()._id,
-                'fullname': user.fullname,
-                'eppn': user.eppn or '',
-                'username': user.username,
-                'ratio': 100,
-                'usage': used_quota,
-                'usage_value': used_quota_abbr[0],
-                'usage_abbr': used_quota_abbr[1],
-                'remaining': remaining_quota,
-                'remaining_value': remaining_abbr[0],
-                'remaining_abbr': remaining_abbr[1],
-                'quota': max_quota
-            }
-        else:
-            return {
-                'id': user.guids.first()._id,
-                'fullname': user.fullname,
-                'eppn': user.eppn or '',
-                'username': user.username,
-                'ratio': float(used_quota) / max_quota_bytes * 100,
-                'usage': used_quota,
-                'usage_value': used_quota_abbr[0],
-                'usage_abbr': used_quota_abbr[1],
-                'remaining': remaining_quota,
-                'remaining_value': remaining_abbr[0],
-                'remaining_abbr': remaining_abbr[1],
-                'quota': max_quota
-            }
+        return self.get_quota_row_info({
+            'guid': user.guids.first()._id,
+            'fullname': user.fullname,
+            'eppn': user.eppn or '',
+            'username': user.username,
+            'ratio': 100 if max_quota == 0 else float(used_quota) / max_quota_bytes * 100,
+            'usage': used_quota,
+            'remaining': max_quota_bytes - used_quota,
+            'quota': max_quota
+        })
+
+    def get_quota_row_info(self, row):
+        """ Add the abbreviated sizes to a row of quota.get_quota_summary """
+        used_quota_abbr = self.custom_size_abbreviation(*quota.abbreviate_size(row['usage']))
+        remaining_abbr = self.custom_size_abbreviation(*quota.abbreviate_size(row['remaining']))
+        return {
+            'id': row['guid'],
+            'fullname': row['fullname'],
+            'eppn': row['eppn'] or '',
+            'username': row['username'],
+            'ratio': row['ratio'],
+            'usage': row['usage'],
+            'usage_value': used_quota_abbr[0],
+            'usage_abbr': used_quota_abbr[1],
+            'remaining': row['remaining'],
+            'remaining_value': remaining_abbr[0],
+            'remaining_abbr': remaining_abbr[1],
+            'quota': row['quota']
+        }
 
     def get_queryset(self):
-        user_list = self.get_userlist()
-        order_by = self.get_order_by()
-        reverse = self.get_direction() != 'asc'
-        user_list.sort(key=itemgetter(order_by), reverse=reverse)
-        return user_list
+        # users without eppn are sorted as an empty eppn
+        order_by = F(self.get_order_by())
+        if self.get_direction() != 'asc':
+            order_by = order_by.desc(nulls_last=True)
+        else:
+            order_by = order_by.asc(nulls_first=True)
+        return self.get_userlist().order_by(order_by, 'id')
 
     def get_order_by(self):
         order_by = self.request.GET.get('order_by', 'ratio')
@@ -358,7 +355,7 @@ class QuotaUserList(ListView):
             self.paginate_queryset(self.query_set, self.page_size)
 
         kwargs['requested_user'] = self.request.user
-        kwargs['users'] = self.query_set
+        kwargs['users'] = [self.get_quota_row_info(row) for row in self.query_set]
         kwargs['page'] = self.page
         kwargs['order_by'] = self.get_order_by()
         kwargs['direction'] = self.get_direction()
@@ -374,34 +371,33 @@ class ExportFileTSV(PermissionRequiredMixin, QuotaUserList):
         if not Institution.objects.filter(id=institution_id, is_deleted=False).exists():
             raise Http404(f'Institution with id "{institution_id}" not found. Please double check.')
 
-        response = HttpResponse(content_type='text/tsv')
-        writer = csv.writer(response, delimiter='\t')
-        writer.writerow(['GUID', 'Username', 'Fullname', 'Ratio (%)', 'Usage (Byte)', 'Remaining (Byte)', 'Quota (Byte)'])
-
-        for user in OSFUser.objects.filter(affiliated_institutions=institution_id):
-            max_quota, used_quota = quota.get_quota_info(user, UserQuota.NII_STORAGE)
-            max_quota_bytes = max_quota * api_settings.SIZE_UNIT_GB
-            remaining_quota = max_quota_bytes - used_quota
-
-            if max_quota == 0:
-                writer.writerow([user.guids.first()._id, user.username,
-                                 user.fullname,
-                                 round(100, 1),
-                                 round(used_quota, 0),
-                                 round(remaining_quota, 0),
-                                 round(max_quota_bytes, 0)])
-            else:
-                writer.writerow([user.guids.first()._id, user.username,
-                                 user.fullname,
-                                 round(float(used_quota) / max_quota_bytes * 100, 1),
-                                 round(used_quota, 0),
-                                 round(remaining_quota, 0),
-                                 round(max_quota_bytes, 0)])
+        users = OSFUser.objects.filter(affiliated_institutions=institution_id)
+        rows = quota.get_quota_summary(users, UserQuota.NII_STORAGE).order_by('id')
+        response = StreamingHttpResponse(self.generate_rows(rows), content_type='text/tsv')
         query = 'attachment; filename=user_list_by_institution_{}_export.tsv'.format(
             institution_id)
         response['Content-Disposition'] = query
         return response
 
+    def generate_rows(self, rows):
+        """ Yield the TSV lines of the export one by one """
+        writer = csv.writer(_PseudoBuffer(), delimiter='\t')
+        yield writer.writerow(['GUID', 'Username', 'Fullname', 'Ratio (%)', 'Usage (Byte)', 'Remaining (Byte)', 'Quota (Byte)'])
+        for row in rows.iterator():
+            yield writer.writerow([row['guid'], row['username'],
+                                   row['fullname'],
+                                   round(row['ratio'], 1),
+                                   round(row['usage'], 0),
+                                   round(row['remaining'], 0),
+                                   round(row['quota'] * api_settings.SIZE_UNIT_GB, 0)])
+
+
+class _PseudoBuffer(object):
+    """ File-like object which returns the written value instead of buffering it """
+
+    def write(self, value):
+        return value
+
 
 class UserListByInstitutionID(RdmPermissionMixin, UserPassesTestMixin, QuotaUserList):
     """
@@ -439,7 +435,7 @@ class UserListByInstitutionID(RdmPermissionMixin, UserPassesTestMixin, QuotaUser
             raise Http404
 
         if not email and not guid and not name:
-            return [self.get_user_quota_info(user, user_quota_type) for user in queryset]
+            return quota.get_quota_summary(queryset, user_quota_type)
 
         query_email = query_guid = query_name = None
 
@@ -458,13 +454,13 @@ class UserListByInstitutionID(RdmPermissionMixin, UserPassesTestMixin, QuotaUser
                                          Q(family_name__icontains=name))
 
         if query_email is not None and query_email.exists():
-            return [self.get_user_quota_info(user, user_quota_type) for user in query_email]
+            return quota.get_quota_summary(query_email, user_quota_type)
         elif query_guid is not None and query_guid.exists():
-            return [self.get_user_quota_info(user, user_quota_type) for user in query_guid]
+            return quota.get_quota_summary(query_guid, user_quota_type)
         elif query_name is not None and query_name.exists():
-            return [self.get_user_quota_info(user, user_quota_type) for user in query_name]
+            return quota.get_quota_summary(query_name, user_quota_type)
         else:
-            return []
+            return quota.get_quota_summary(queryset.none(), user_quota_type)
 
     def get_institution(self):
         """ Get institution by institution_id """
@@ -541,7 +537,6 @@ class StatisticalStatusDefaultStorage(RdmPermissionMixin, UserPassesTestMixin, Q
 
     def get_userlist(self):
         """ Get list of users' quota info """
-        user_list = []
         institution = self.get_institution()
         if not institution:
             # If institution is not found, redirect to HTTP 404 page
@@ -553,9 +548,8 @@ class StatisticalStatusDefaultStorage(RdmPermissionMixin, UserPassesTestMixin, Q
             # Institution is not using NII storage, redirect to 404 page
             raise Http404
         # Get user quota for each user in the institution
-        for user in OSFUser.objects.filter(affiliated_institutions=institution.id):
-            user_list.append(self.get_user_quota_info(user, user_quota_type))
-        return user_list
+        return quota.get_quota_summary(
+            OSFUser.objects.filter(affiliated_institutions=institution.id), user_quota_type)
 
     def get_institution(self):
         """ Get logged in user's first affiliated institution """
@@ -5,7 +5,7 @@ from addons.osfstorage.models import Region
 from api.base import settings as api_settings
 from osf.models import OSFUser, UserQuota
 from osf.utils.requests import check_select_for_update
-from website.util.quota import used_quota
+from website.util.quota import recalculate_used_quota, used_quota
 
 
 def calculate_quota(user):
@@ -40,10 +40,7 @@ def calculate_quota(user):
                 )
 
 def all_users(request, **kwargs):
-    c = 0
-    for osf_user in OSFUser.objects.exclude(deleted__isnull=False):
-        calculate_quota(osf_user)
-        c += 1
+    c = recalculate_used_quota()
     return JsonResponse({
         'status': 'OK',
         'message': str(c) + ' users\' quota successfully recalculated!'
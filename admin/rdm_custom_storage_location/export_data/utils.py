@@ -3,6 +3,7 @@ import inspect  # noqa
 import json  # noqa
 import logging  # noqa
 import re
+import types
 from copy import deepcopy
 
 import jsonschema
@@ -51,6 +52,8 @@ __all__ = [
     'process_data_information',
     'validate_exported_data',
     'write_json_file',
+    'write_json_file_stream',
+    'read_json_file_stream',
     'check_diff_between_version',
     'count_files_ng_ok',
     'check_for_file_existent_on_export_location',
@@ -75,6 +78,60 @@ def write_json_file(json_data, output_file):
             raise Exception(f'Cannot write json file. Exception: {str(exc)}')
 
 
+def write_json_file_stream(json_data, output_file):
+    """Write json data to a file, consuming its list and generator values item by item
+
+    Each item of these values is written on its own line, so the items can be read back
+    one by one with read_json_file_stream without holding the whole data in memory.
+
+    Args:
+        json_data: dictionary whose values may be generators
+        output_file: the full path of output file
+
+    Raises:
+        Exception - Exception when writing the file
+    """
+    with open(output_file, 'w', encoding='utf-8') as write_file:
+        try:
+            key_separator = '{\n'
+            for key, value in json_data.items():
+                write_file.write(f'{key_separator}  {json.dumps(key)}: ')
+                key_separator = ',\n'
+                if not isinstance(value, (list, types.GeneratorType)):
+                    json.dump(value, write_file, ensure_ascii=False, sort_keys=False)
+                    continue
+                write_file.write('[')
+                item_separator = '\n    '
+                for item in value:
+                    write_file.write(item_separator)
+                    json.dump(item, write_file, ensure_ascii=False, sort_keys=False)
+                    item_separator = ',\n    '
+                write_file.write('\n  ]')
+            write_file.write('\n}\n' if key_separator != '{\n' else '{}\n')
+        except Exception as exc:
+            raise Exception(f'Cannot write json file. Exception: {str(exc)}')
+
+
+def read_json_file_stream(input_file, key):
+    """Yield the items of a list value of a file written by write_json_file_stream
+
+    Args:
+        input_file: the full path of input file
+        key: the key of the list value
+    """
+    list_start = f'  {json.dumps(key)}: ['
+    with open(input_file, 'r', encoding='utf-8') as read_file:
+        in_list = False
+        for line in read_file:
+            line = line.rstrip('\n')
+            if not in_list:
+                in_list = line == list_start
+                continue
+            if line.startswith('  ]'):
+                return
+            yield json.loads(line.strip().rstrip(','))
+
+
 def update_storage_location(institution_guid, storage_name, wb_credentials, wb_settings):
     try:
         storage_location = ExportDataLocation.objects.get(institution_guid=institution_guid, name=storage_name)
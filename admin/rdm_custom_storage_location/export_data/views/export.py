@@ -5,6 +5,7 @@ import logging
 import os
 import time
 import traceback
+from concurrent import futures
 from celery import states
 from celery.contrib.abortable import AbortableAsyncResult, ABORTED
 from celery.exceptions import Ignore, CeleryError
@@ -21,11 +22,13 @@ from rest_framework.views import APIView
 from requests.exceptions import ReadTimeout, ConnectionError
 
 from addons.osfstorage.models import Region
+from admin.base import settings as admin_settings
 from admin.rdm_custom_storage_location import tasks
-from osf.models import Institution, ExportDataLocation, ExportData
+from osf.models import Institution, ExportDataLocation, ExportData, ExportDataCopiedFile
+from osf.utils.locks import AdvisoryLock
 from website.util import inspect_info  # noqa
 from .location import ExportStorageLocationViewBaseView
-from ..utils import write_json_file
+from ..utils import read_json_file_stream, write_json_file, write_json_file_stream
 
 logger = logging.getLogger(__name__)
 TASK_NO_WORKING_STATES = [
@@ -52,6 +55,8 @@ MSG_EXPORT_FAILED_UPLOAD_TO_LOCATION = f'Cannot create folder or upload file to
 # the delta seconds between call check data function
 # it is used to avoid too many check calls in a short period of time
 CHECK_DATA_INTERVAL_MIN_SECS = 10
+# name of the advisory lock held by the export process of an export data
+EXPORT_DATA_LOCK_NAME = 'export_data:{}'
 MSG_EXPORT_INVALID_INPUT = f'The input data must be a integer'
 MSG_EXPORT_MISSING_REQUIRED_INPUT = f'The required input data is missing'
 MSG_EXPORT_NOT_EXIST_INPUT = f'The data for input value is not exist'
@@ -222,7 +227,119 @@ def check_export_data_process_status(
     return _check_time
 
 
+class ExportDataFileCopier(object):
+    """Copy the data files of an export process to the export storage location
+
+    Up to max_workers files are copied at the same time. Each file is copied once per hash
+    value, and the hash values of the copied files are recorded as the checkpoint manifest
+    of the export process in the database, so a restarted process does not copy them again.
+    """
+
+    def __init__(self, export_data, cookies, task_id, location_id=None, source_id=None, max_workers=None, **kwargs):
+        self.export_data = export_data
+        self.cookies = cookies
+        self.task_id = task_id
+        self.location_id = location_id
+        self.source_id = source_id
+        self.max_workers = max_workers or admin_settings.EXPORT_DATA_COPY_MAX_WORKERS
+        self.kwargs = kwargs
+        self.files_versions_not_found = {}
+        self._prev_time = time.time()
+
+    def read_manifest(self):
+        return set(self.export_data.copied_files.values_list('file_name', flat=True))
+
+    def group_by_file_name(self, file_versions):
+        """Group the file versions by hash value, keeping the order of the first occurrences"""
+        groups = {}
+        for file in file_versions:
+            groups.setdefault(file[4], []).append(file)
+        return groups
+
+    def copy_file(self, file_name, files):
+        """Copy one of the file versions whose content is file_name, trying them in order
+
+        :return: the (file_id, version) pairs which cannot be copied, and whether the file is copied
+        """
+        failed = []
+        for project_id, provider, file_path, version, _, file_id in files:
+            _up_file_start_time = time.time()
+            logger.debug(f'file: projects/{project_id}/providers/{provider}/files/{file_id}/versions/{version}/'
+                         f'?hash={file_name}&path={file_path}')
+            try:
+                response = self.export_data.copy_export_data_file_to_location(
+                    self.cookies, project_id, provider, file_path, file_name,
+                    **dict(self.kwargs, version=version))
+            except (ReadTimeout, ConnectionError):
+                logger.error(f'Timeout exception occurs. Add file_id to list failed files. file_id: {file_id}')
+                failed.append((file_id, version))
+                continue
+            # 201: created
+            if response.status_code == 201:
+                logger.debug(f'Upload file successfully.'
+                             f' ({time.time() - _up_file_start_time}s)')
+                return failed, True
+            logger.debug(f'File upload failed.'
+                         f' ({time.time() - _up_file_start_time}s)')
+            failed.append((file_id, version))
+        return failed, False
+
+    def collect(self, future, file_name):
+        failed, is_copied = future.result()
+        for file_id, version in failed:
+            self.files_versions_not_found.setdefault(file_id, []).append(version)
+        if is_copied:
+            ExportDataCopiedFile.objects.get_or_create(export_data=self.export_data, file_name=file_name)
+
+    def run(self, file_versions):
+        """Copy the file versions of get_source_file_versions_min
+
+        :return: dict of file id to the list of versions which cannot be copied
+        """
+        copied = self.read_manifest()
+        groups = self.group_by_file_name(file_versions)
+        if copied:
+            logger.info(f'Resume the export process, {len(copied)} files have already been copied.')
+        # load the relations used by the copy requests before the worker threads start
+        self.export_data.location
+        self.export_data.source
+        pending = {}
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for index, (file_name, files) in enumerate(groups.items()):
+                    if file_name in copied:
+                        logger.debug(f'Ignore uploaded file')
+                        continue
+                    while len(pending) >= self.max_workers:
+                        done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                        for future in done:
+                            self.collect(future, pending.pop(future))
+                    # [Important] check process status before each step
+                    self._prev_time = check_export_data_process_status(
+                        self._prev_time, self.task_id, self.export_data.id, self.location_id, self.source_id)
+                    logger.debug(f'[{1 + index}/{len(groups)}] file: {file_name}')
+                    pending[executor.submit(self.copy_file, file_name, files)] = file_name
+                for future in futures.as_completed(list(pending)):
+                    self.collect(future, pending.pop(future))
+            finally:
+                for future in pending:
+                    future.cancel()
+        return self.files_versions_not_found
+
+
 def export_data_process(task, cookies, export_data_id, location_id, source_id, **kwargs):
+    # a redelivered message must not start a second process while the first one is running
+    lock = AdvisoryLock(EXPORT_DATA_LOCK_NAME.format(export_data_id))
+    if not lock.acquire(blocking=False):
+        logger.warning(f'Export process of export data {export_data_id} is already running. (skipped)')
+        raise Ignore()
+    try:
+        return _export_data_process(task, cookies, export_data_id, location_id, source_id, **kwargs)
+    finally:
+        lock.release()
+
+
+def _export_data_process(task, cookies, export_data_id, location_id, source_id, **kwargs):
     logger.debug('----{}:{}::{} from {}:{}::{}'.format(*inspect_info(inspect.currentframe(), inspect.stack())))
     _start_time = time.time()
     task_id = task.request.id
@@ -233,6 +350,8 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         # get corresponding export data record to update
         export_data = ExportData.objects.get(pk=export_data_id)
 
+        # the record is already running if the process is restarted, e.g. after its worker is lost
+        is_resumed = export_data.status == ExportData.STATUS_RUNNING
         # start process - update record in DB
         export_data.task_id = task.request.id
         export_data.status = ExportData.STATUS_RUNNING
@@ -243,11 +362,8 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         _prev_time = check_export_data_process_status(
             _prev_time, task_id, export_data_id, location_id, source_id)
 
-        # extract file information
-        _step_start_time = time.time()
-        export_data_json, file_info_json = export_data.extract_file_information_json_from_source_storage()
-        logger.info(f'Extracted file information.'
-                    f' ({time.time() - _step_start_time}s)')
+        # extract file information, the files are read from the source storage while writing them
+        export_data_json, file_info_json = export_data.extract_file_information_json_from_source_storage(stream=True)
 
         # [Important] check process status before each step
         _prev_time = check_export_data_process_status(
@@ -257,7 +373,7 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         logger.debug(f'creating export data process folder')
         _step_start_time = time.time()
         response = export_data.create_export_data_folder(cookies, **kwargs)
-        if not task.is_aborted() and response.status_code != 201:
+        if not task.is_aborted() and response.status_code != 201 and not (is_resumed and response.status_code == 409):
             raise ExportDataTaskException(MSG_EXPORT_FAILED_UPLOAD_TO_LOCATION)
         logger.info(f'Created \'{export_data.export_data_folder_path}\' folder path.'
                     f' ({time.time() - _step_start_time}s)')
@@ -270,7 +386,10 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
             raise ExportDataTaskException(MSG_EXPORT_ABORTED)
         # create files' information file
         logger.debug(f'creating files information file')
-        write_json_file(file_info_json, temp_file_path)
+        _step_start_time = time.time()
+        write_json_file_stream(file_info_json, temp_file_path)
+        logger.info(f'Extracted file information.'
+                    f' ({time.time() - _step_start_time}s)')
         response = export_data.upload_file_info_full_data_file(cookies, temp_file_path, **kwargs)
         if not task.is_aborted() and response.status_code not in [201, 204]:
             raise ExportDataTaskException(MSG_EXPORT_FAILED_UPLOAD_TO_LOCATION)
@@ -286,7 +405,7 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         logger.debug(f'creating files folder')
         _step_start_time = time.time()
         response = export_data.create_export_data_files_folder(cookies, **kwargs)
-        if not task.is_aborted() and response.status_code != 201:
+        if not task.is_aborted() and response.status_code != 201 and not (is_resumed and response.status_code == 409):
             raise ExportDataTaskException(MSG_EXPORT_FAILED_UPLOAD_TO_LOCATION)
         logger.info(f'Created \'{export_data.export_data_files_folder_path}\' folder path.'
                     f' ({time.time() - _step_start_time}s)')
@@ -297,7 +416,9 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
 
         logger.debug(f'prepare list of file versions data to upload')
         _step_start_time = time.time()
-        file_versions = export_data.get_source_file_versions_min(file_info_json)
+        file_versions = export_data.get_source_file_versions_min({
+            'files': read_json_file_stream(temp_file_path, 'files'),
+        })
         _length = len(file_versions)
         logger.info(f'There is {_length} file versions needed to upload to the export storage destination.'
                     f' ({time.time() - _step_start_time}s)')
@@ -305,51 +426,9 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         # upload file versions
         logger.debug(f'upload file versions')
         _step_start_time = time.time()
-        # cached the filename in hash value
-        created_filename_list = []
-        files_versions_not_found = {}
-        for index, file in enumerate(file_versions):
-            project_id, provider, file_path, version, file_name, file_id = file
-            logger.debug(f'[{1 + index}/{_length}] file: '
-                         f'projects/{project_id}/providers/{provider}/files/{file_id}/versions/{version}/'
-                         f'?hash={file_name}&path={file_path}')
-
-            # prevent uploading duplicate file_name in hash value
-            if file_name in created_filename_list:
-                logger.debug(f'Ignore uploaded file')
-                continue
-
-            # [Important] check process status before each step
-            _prev_time = check_export_data_process_status(
-                _prev_time, task_id, export_data_id, location_id, source_id)
-
-            _up_file_start_time = time.time()
-            kwargs.update({'version': version})
-            # copy data file from source storage to location storage
-
-            try:
-                response = export_data.copy_export_data_file_to_location(
-                    cookies, project_id, provider, file_path, file_name, **kwargs)
-                # 201: created -> update cache list
-                if response.status_code == 201:
-                    created_filename_list.append(file_name)
-                    logger.debug(f'Upload file successfully.'
-                                 f' ({time.time() - _up_file_start_time}s)')
-                else:
-                    if file_id not in files_versions_not_found:
-                        files_versions_not_found[file_id] = [version]
-                    else:
-                        files_versions_not_found[file_id].append(version)
-                    logger.debug(f'File upload failed.'
-                                 f' ({time.time() - _up_file_start_time}s)')
-                    continue
-            except (ReadTimeout, ConnectionError):
-                logger.error(f'Timeout exception occurs. Add file_id to list failed files. file_id: {file_id}')
-                if file_id not in files_versions_not_found:
-                    files_versions_not_found[file_id] = [version]
-                else:
-                    files_versions_not_found[file_id].append(version)
-                continue
+        copier = ExportDataFileCopier(
+            export_data, cookies, task_id, location_id=location_id, source_id=source_id, **kwargs)
+        files_versions_not_found = copier.run(file_versions)
         logger.info(f'Have gone through the entire list of file versions.'
                     f' ({time.time() - _step_start_time}s)')
 
@@ -358,10 +437,17 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
             _prev_time, task_id, export_data_id, location_id, source_id)
 
         # Separate the failed file list from the file_info_json
+        # and create files' information JSON file
         logger.debug('Separate the failed file list from the file_info_json')
         _step_start_time = time.time()
-        files = file_info_json.get('files', [])
-        files_not_found, sub_size, sub_files_numb = separate_failed_files(files, files_versions_not_found)
+        files_not_found = []
+        separated_file_path = temp_file_path + '.separated'
+        file_info_json['folders'] = read_json_file_stream(temp_file_path, 'folders')
+        file_info_json['files'] = iter_succeeded_files(
+            read_json_file_stream(temp_file_path, 'files'), files_versions_not_found, files_not_found)
+        write_json_file_stream(file_info_json, separated_file_path)
+        os.replace(separated_file_path, temp_file_path)
+        sub_size, sub_files_numb = count_failed_files(files_not_found)
         export_data_json['size'] -= sub_size
         export_data_json['files_numb'] -= sub_files_numb
         logger.info(f'Separated the failed file list from the file_info_json.')
@@ -373,13 +459,9 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         _prev_time = check_export_data_process_status(
             _prev_time, task_id, export_data_id, location_id, source_id)
 
-        # temporary file
-        # temp_file_path = export_data.export_data_temp_file_path
-
-        # create files' information JSON file
-        logger.debug(f'creating files information JSON file')
+        # upload files' information JSON file
+        logger.debug(f'uploading files information JSON file')
         _step_start_time = time.time()
-        write_json_file(file_info_json, temp_file_path)
         response = export_data.upload_file_info_file(cookies, temp_file_path, **kwargs)
         if not task.is_aborted() and response.status_code not in [201, 204]:
             raise ExportDataTaskException(MSG_EXPORT_FAILED_UPLOAD_TO_LOCATION)
@@ -402,9 +484,10 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
         logger.info(f'Created export data JSON file.'
                     f' ({time.time() - _step_start_time}s)')
 
-        # remove temporary file
+        # remove temporary file and checkpoint manifest
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
+        export_data.copied_files.all().delete()
         logger.debug(f'removed temporary file')
 
         # [Important] check process status before each step
@@ -444,6 +527,39 @@ def export_data_process(task, cookies, export_data_id, location_id, source_id, *
             task, cookies, export_data_id, location_id, source_id, **kwargs)
 
 
+def separate_failed_versions(file, ver_ids):
+    """Split the failed versions ver_ids from a file of the file_info_json
+
+    :return: the file with its succeeded versions or None if no version succeeded,
+        and the file with its failed versions or None if no version failed
+    """
+    versions = file.get('version', [])
+    # move all file versions
+    is_no_versions = not versions
+    versions_ids_set = set([_ver['identifier'] for _ver in versions])
+    is_same_ver_ids = versions_ids_set == set(ver_ids)
+    if is_no_versions or is_same_ver_ids:
+        return None, file
+
+    # move some versions
+    file_cop = copy.copy(file)
+    file_cop['version'] = [_ver for _ver in file_cop['version'] if _ver['identifier'] in ver_ids]
+    # not match any file versions
+    if not file_cop['version']:
+        return file, None
+    file['version'] = [_ver for _ver in versions if _ver['identifier'] not in ver_ids]
+    return file, file_cop
+
+
+def count_failed_files(files_not_found):
+    """Return the size and the number of the file versions in files_not_found"""
+    sub_size = sub_files_numb = 0
+    for file in files_not_found:
+        sub_size += sum([ver.get('size') for ver in file['version']])
+        sub_files_numb += len(file.get('version', []))
+    return sub_size, sub_files_numb
+
+
 def separate_failed_files(files, files_versions_not_found):
     files_not_found = []
     for file_id, ver_ids in files_versions_not_found.items():
@@ -460,33 +576,34 @@ def separate_failed_files(files, files_versions_not_found):
         if file is None:
             continue
 
-        # move all file versions
-        versions = file.get('version', [])
-        is_no_versions = not versions
-        versions_ids_set = set([_ver['identifier'] for _ver in versions])
-        is_same_ver_ids = versions_ids_set == set(ver_ids)
-        if is_no_versions or is_same_ver_ids:
-            files_not_found.append(files.pop(idx))
-            continue
-
-        # move some versions
-        file_cop = copy.copy(file)
-        file_cop['version'] = [_ver for _ver in file_cop['version'] if _ver['identifier'] in ver_ids]
-        # not match any file versions
-        if not file_cop['version']:
-            continue
-        files_not_found.append(file_cop)
-        file['version'] = [_ver for _ver in versions if _ver['identifier'] not in ver_ids]
+        succeeded_file, failed_file = separate_failed_versions(file, ver_ids)
+        if succeeded_file is None:
+            files.pop(idx)
+        if failed_file is not None:
+            files_not_found.append(failed_file)
 
     # size and number of files are subtracted
-    sub_size = sub_files_numb = 0
-    for file in files_not_found:
-        sub_size += sum([ver.get('size') for ver in file['version']])
-        sub_files_numb += len(file.get('version', []))
+    sub_size, sub_files_numb = count_failed_files(files_not_found)
 
     return files_not_found, sub_size, sub_files_numb
 
 
+def iter_succeeded_files(files, files_versions_not_found, files_not_found):
+    """Same as separate_failed_files for an iterable of files
+
+    Yield the files with their succeeded versions and append the failed ones to files_not_found.
+    """
+    for file in files:
+        ver_ids = files_versions_not_found.get(file['id'])
+        if ver_ids:
+            file, failed_file = separate_failed_versions(file, ver_ids)
+            if failed_file is not None:
+                files_not_found.append(failed_file)
+            if file is None:
+                continue
+        yield file
+
+
 @method_decorator(transaction.non_atomic_requests, name='dispatch')
 class StopExportDataActionView(ExportDataBaseActionView):
 
@@ -580,9 +697,11 @@ def export_data_rollback_process(task, cookies, export_data_id, location_id, sou
         _prev_time = check_export_data_process_status(
             _prev_time, task_id, export_data_id, location_id, source_id)
 
-        file_path = export_data.export_data_temp_file_path
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        for file_path in [export_data.export_data_temp_file_path,
+                          export_data.export_data_temp_file_path + '.separated']:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        export_data.copied_files.all().delete()
         logger.debug(f'Removed temporary file.')
 
         # delete export data file
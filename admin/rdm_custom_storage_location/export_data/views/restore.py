@@ -4,27 +4,33 @@ from __future__ import absolute_import
 import inspect  # noqa
 import json
 import logging
+from concurrent import futures
 from functools import partial
 
+from bulk_update.helper import bulk_update
 from celery.states import PENDING
 from celery.contrib.abortable import AbortableAsyncResult, ABORTED
 from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.decorators import method_decorator
 from rest_framework import authentication as drf_authentication
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from addons.osfstorage.models import Region, NodeSettings
+from addons.osfstorage.models import Region, NodeSettings, OsfStorageFile
+from admin.base import settings as admin_settings
 from admin.rdm.utils import RdmPermissionMixin
 from admin.rdm_custom_storage_location import tasks
 from admin.rdm_custom_storage_location.export_data import utils
 from admin.rdm_custom_storage_location.export_data.views import export
 from osf.models import ExportData, ExportDataRestore, BaseFileNode, Tag, RdmFileTimestamptokenVerifyResult, Institution, OSFUser, FileVersion, AbstractNode, \
     ProjectStorageType, UserQuota
+from osf.models.files import BaseFileVersionsThrough
 from framework.transactions.handlers import no_auto_transaction
+from website.search import search
 from website.util.quota import update_user_used_quota
 from django.contrib.auth.mixins import UserPassesTestMixin
 from admin.rdm.utils import get_institution_id_by_region
@@ -32,6 +38,11 @@ from rest_framework.renderers import JSONRenderer
 
 logger = logging.getLogger(__name__)
 INSTITUTIONAL_STORAGE_PROVIDER_NAME = 'osfstorage'
+TIMESTAMP_VERIFY_DATA_FIELDS = [
+    'timestamp_token', 'verify_date', 'verify_file_modified_at', 'upload_file_created_at',
+    'upload_file_modified_at', 'verify_file_created_at', 'path', 'inspection_result_status', 'key_file_name',
+    'upload_file_created_user', 'upload_file_modified_user', 'upload_file_size', 'verify_file_size', 'verify_user',
+]
 
 
 class ProcessError(Exception):
@@ -555,6 +566,11 @@ def add_timestamp_to_file_node(file_node, project_id, timestamp):
         verify_data.project_id = timestamp.get('project_id', project_id)
         verify_data.provider = timestamp.get('provider', file_node.provider)
 
+    set_timestamp_verify_data(verify_data, file_node, timestamp, timestamp_obj)
+    verify_data.save()
+
+
+def set_timestamp_verify_data(verify_data, file_node, timestamp, timestamp_obj):
     if timestamp_obj:
         verify_data.timestamp_token = timestamp_obj.timestamp_token
         verify_data.verify_date = timestamp_obj.verify_date
@@ -570,7 +586,64 @@ def add_timestamp_to_file_node(file_node, project_id, timestamp):
     verify_data.upload_file_size = timestamp.get('upload_file_size', None)
     verify_data.verify_file_size = timestamp.get('verify_file_size', None)
     verify_data.verify_user = timestamp.get('verify_user', None)
-    verify_data.save()
+
+
+def add_tags_to_file_nodes(file_nodes_tags):
+    """Bulk version of add_tags_to_file_node for a list of (file_node, tags)"""
+    file_nodes_tags = [(file_node, tags) for file_node, tags in file_nodes_tags if file_node and tags]
+    tag_names = set(tag for _, tags in file_nodes_tags for tag in tags)
+    if not tag_names:
+        return
+
+    existing_tag_names = set(Tag.objects.filter(name__in=tag_names).values_list('name', flat=True))
+    Tag.objects.bulk_create([Tag(name=tag) for tag in tag_names - existing_tag_names])
+    tag_ids = dict(Tag.objects.filter(name__in=tag_names).values_list('name', 'id'))
+
+    FileNodeTag = BaseFileNode.tags.through
+    file_node_ids = set(file_node.id for file_node, _ in file_nodes_tags)
+    existing_file_node_tags = set(FileNodeTag.objects.filter(
+        basefilenode_id__in=file_node_ids, tag_id__in=tag_ids.values()
+    ).values_list('basefilenode_id', 'tag_id'))
+    new_file_node_tags = set(
+        (file_node.id, tag_ids[tag]) for file_node, tags in file_nodes_tags for tag in tags
+    ) - existing_file_node_tags
+    FileNodeTag.objects.bulk_create([
+        FileNodeTag(basefilenode_id=file_node_id, tag_id=tag_id) for file_node_id, tag_id in new_file_node_tags
+    ])
+
+
+def add_timestamps_to_file_nodes(file_nodes_timestamps):
+    """Bulk version of add_timestamp_to_file_node for a list of (file_node, project_id, timestamp)"""
+    file_nodes_timestamps = dict(
+        (file_node._id, (file_node, project_id, timestamp))
+        for file_node, project_id, timestamp in file_nodes_timestamps
+        if file_node and project_id and timestamp
+    )
+    if not file_nodes_timestamps:
+        return
+
+    timestamp_objs = RdmFileTimestamptokenVerifyResult.objects.in_bulk([
+        timestamp.get('timestamp_id') for _, _, timestamp in file_nodes_timestamps.values()
+        if timestamp.get('timestamp_id') is not None
+    ])
+    existing_verify_data = {
+        verify_data.file_id: verify_data
+        for verify_data in RdmFileTimestamptokenVerifyResult.objects.filter(file_id__in=file_nodes_timestamps.keys())
+    }
+    new_verify_data = []
+    for file_id, (file_node, project_id, timestamp) in file_nodes_timestamps.items():
+        verify_data = existing_verify_data.get(file_id)
+        if verify_data is None:
+            verify_data = RdmFileTimestamptokenVerifyResult()
+            verify_data.file_id = file_id
+            verify_data.project_id = timestamp.get('project_id', project_id)
+            verify_data.provider = timestamp.get('provider', file_node.provider)
+            new_verify_data.append(verify_data)
+        set_timestamp_verify_data(verify_data, file_node, timestamp, timestamp_objs.get(timestamp.get('timestamp_id')))
+
+    if existing_verify_data:
+        bulk_update(list(existing_verify_data.values()), update_fields=TIMESTAMP_VERIFY_DATA_FIELDS)
+    RdmFileTimestamptokenVerifyResult.objects.bulk_create(new_verify_data)
 
 
 def read_export_data_and_check_schema(export_data, cookies, **kwargs):
@@ -726,68 +799,77 @@ def create_folder_in_destination(task, current_process_step, export_data_folders
         recalculate_user_quota(destination_region)
 
 
-def copy_files_from_export_data_to_destination(task, current_process_step,
-                                               export_data_files, export_data_restore, cookies, **kwargs):
-    export_data = export_data_restore.export
-
-    destination_region = export_data_restore.destination
-    destination_provider = INSTITUTIONAL_STORAGE_PROVIDER_NAME
-    destination_base_url = destination_region.waterbutler_url
-    is_destination_addon_storage = utils.is_add_on_storage(destination_provider)
-
-    list_created_file_nodes = []
-    files_versions_restore_fail = {}
-    for file in export_data_files:
-        check_if_restore_process_stopped(task, current_process_step)
-
-        file_id = file.get('id')
+class RestoreDataFileCopier(object):
+    """Copy the files of an export data to the destination storage of a restore process
+
+    Up to max_workers files are copied at the same time, the versions of a file are copied
+    in order by the same worker. The database records of the copied files are updated
+    in batches of batch_size files.
+    """
+
+    def __init__(self, task, current_process_step, export_data_restore, cookies,
+                 max_workers=None, batch_size=None, **kwargs):
+        self.task = task
+        self.current_process_step = current_process_step
+        self.export_data = export_data_restore.export
+        self.destination_base_url = export_data_restore.destination.waterbutler_url
+        self.destination_provider = INSTITUTIONAL_STORAGE_PROVIDER_NAME
+        self.is_destination_addon_storage = utils.is_add_on_storage(self.destination_provider)
+        self.cookies = cookies
+        self.max_workers = max_workers or admin_settings.RESTORE_DATA_COPY_MAX_WORKERS
+        self.batch_size = batch_size or admin_settings.RESTORE_DATA_POST_PROCESS_BATCH_SIZE
+        self.kwargs = kwargs
+        self.list_created_file_nodes = []
+        self.files_versions_restore_fail = {}
+        self.copied_files = []
+
+    def get_version_paths(self, file):
+        """Return the (version, version_id, location file path, destination file path) of the file versions"""
         file_materialized_path = file.get('materialized_path')
         file_versions = file.get('version')
-        file_project_id = file.get('project', {}).get('id')
-        file_tags = file.get('tags')
-        file_timestamp = file.get('timestamp', {})
-        file_checkout_id = file.get('checkout_id')
-        file_created = file.get('created_at')
-        file_modified = file.get('modified_at')
-
-        # Sort file by version id
-        file_versions.sort(key=lambda k: k.get('identifier', 0))
-
+        version_paths = []
         for index, version in enumerate(file_versions):
-            try:
-                check_if_restore_process_stopped(task, current_process_step)
-
-                # Prepare file name and file path for uploading
-                metadata = version.get('metadata', {})
-                file_hash = metadata.get('sha256', metadata.get('md5'))
-                version_id = version.get('identifier')
-                if file_hash is None or version_id is None:
-                    # Cannot get path in export data storage, pass this file
-                    continue
+            # Prepare file name and file path for uploading
+            metadata = version.get('metadata', {})
+            file_hash = metadata.get('sha256', metadata.get('md5'))
+            version_id = version.get('identifier')
+            if file_hash is None or version_id is None:
+                # Cannot get path in export data storage, pass this file
+                continue
 
-                file_hash_path = f'/{export_data.export_data_folder_name}/{ExportData.EXPORT_DATA_FILES_FOLDER}/{file_hash}'
+            file_hash_path = f'/{self.export_data.export_data_folder_name}/{ExportData.EXPORT_DATA_FILES_FOLDER}/{file_hash}'
+
+            # If the destination storage is add-on institutional storage:
+            # - for past version files, rename and save each version as filename_{version} in '_version_files' folder
+            # - the latest version is saved as the original
+            if self.is_destination_addon_storage:
+                is_file_not_latest_version = index < len(file_versions) - 1
+                new_file_path = generate_new_file_path(
+                    file_materialized_path=file_materialized_path,
+                    version_id=version_id,
+                    is_file_not_latest_version=is_file_not_latest_version)
+            else:
+                new_file_path = file_materialized_path
+            version_paths.append((version, version_id, file_hash_path, new_file_path))
+        return version_paths
 
-                # If the destination storage is add-on institutional storage:
-                # - for past version files, rename and save each version as filename_{version} in '_version_files' folder
-                # - the latest version is saved as the original
-                if is_destination_addon_storage:
-                    is_file_not_latest_version = index < len(file_versions) - 1
-                    new_file_path = generate_new_file_path(
-                        file_materialized_path=file_materialized_path,
-                        version_id=version_id,
-                        is_file_not_latest_version=is_file_not_latest_version)
-                else:
-                    new_file_path = file_materialized_path
+    def copy_file(self, file, version_paths):
+        """Copy the versions of a file, this runs in a worker thread and does not access the database
 
+        :return: the (version, response version id, file node _id) of the copied versions
+            and the ids of the versions which cannot be copied
+        """
+        file_project_id = file.get('project', {}).get('id')
+        copied = []
+        failed = []
+        for version, version_id, file_hash_path, new_file_path in version_paths:
+            try:
                 # Copy file from location to destination storage
                 response_body = utils.copy_file_from_location_to_destination(
-                    export_data, file_project_id, destination_provider, file_hash_path, new_file_path,
-                    cookies, base_url=destination_base_url, **kwargs)
+                    self.export_data, file_project_id, self.destination_provider, file_hash_path, new_file_path,
+                    self.cookies, base_url=self.destination_base_url, **self.kwargs)
                 if response_body is None:
-                    if file_id not in files_versions_restore_fail:
-                        files_versions_restore_fail[file_id] = [version_id]
-                    else:
-                        files_versions_restore_fail[file_id].append(version_id)
+                    failed.append(version_id)
                     continue
 
                 response_id = response_body.get('data', {}).get('id')
@@ -797,50 +879,141 @@ def copy_files_from_export_data_to_destination(task, current_process_step,
                     file_path_splits = response_id.split('/')
                     # Check if path is file (/_id)
                     if len(file_path_splits) == 2:
-                        file_node_id = file_path_splits[1]
-                        node_set = BaseFileNode.objects.filter(_id=file_node_id)
-                        if node_set.exists():
-                            node = node_set.first()
-
-                            # update creator, created, modified back to the file version
-                            file_version = node.get_version(response_file_version_id, required=False)
-
-                            if file_version is not None:
-                                file_version_created_at = version.get('created_at')
-                                file_version_modified_at = version.get('modified_at')
-
-                                # Find records of old versions with the same 'created_at' and 'modified_at' values
-                                same_file_versions = node.versions.exclude(
-                                    identifier=response_file_version_id
-                                ).filter(
-                                    created=file_version_created_at,
-                                    modified=file_version_modified_at
-                                )
-
-                                if same_file_versions.exists():
-                                    # delete duplicate new record
-                                    file_version.delete()
-
-                            if file_checkout_id:
-                                node.checkout_id = file_checkout_id
-
-                            # update created/modified date to basefilenode
-                            node.created = file_created
-                            node.modified = file_modified
-                            # ignore storing the value of `django.utils.timezone.now()` to `modified` field
-                            node.save(update_modified=False)
-
-                            list_created_file_nodes.append({
-                                'node': node,
-                                'file_tags': file_tags,
-                                'file_timestamp': file_timestamp,
-                                'project_id': file_project_id
-                            })
+                        copied.append((version, response_file_version_id, file_path_splits[1]))
             except Exception as e:
                 logger.error(f'Download or upload exception: {e}')
-                check_if_restore_process_stopped(task, current_process_step)
                 # Did not download or upload, pass this file
                 continue
+        return copied, failed
+
+    def collect(self, future, file):
+        copied, failed = future.result()
+        if failed:
+            self.files_versions_restore_fail.setdefault(file.get('id'), []).extend(failed)
+        if copied:
+            self.copied_files.append((file, copied))
+        if len(self.copied_files) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        check_if_restore_process_stopped(self.task, self.current_process_step)
+        self.list_created_file_nodes.extend(update_copied_file_nodes(self.copied_files))
+        self.copied_files = []
+
+    def run(self, export_data_files):
+        """Copy the files of the file_info_json
+
+        :return: list of created file nodes and dict of file id to the list of versions which cannot be copied
+        """
+        # load the relations used by the copy requests before the worker threads start
+        self.export_data.location
+        pending = {}
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for file in export_data_files:
+                    check_if_restore_process_stopped(self.task, self.current_process_step)
+                    while len(pending) >= self.max_workers:
+                        done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                        for future in done:
+                            self.collect(future, pending.pop(future))
+
+                    # Sort file by version id
+                    file.get('version').sort(key=lambda k: k.get('identifier', 0))
+                    version_paths = self.get_version_paths(file)
+                    if not version_paths:
+                        continue
+                    pending[executor.submit(self.copy_file, file, version_paths)] = file
+                for future in futures.as_completed(list(pending)):
+                    self.collect(future, pending.pop(future))
+            finally:
+                for future in pending:
+                    future.cancel()
+        if self.copied_files:
+            self.flush()
+        return self.list_created_file_nodes, self.files_versions_restore_fail
+
+
+def parse_file_info_datetime(value):
+    """Parse a datetime of the file_info_json, which is written by str(datetime)"""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.utc)
+    return parsed
+
+
+def update_copied_file_nodes(copied_files):
+    """Update the file nodes created by copying the files of a batch
+
+    Remove the new file versions which duplicate an existing version, and update
+    checkout, created and modified of the file nodes back to the exported values.
+
+    :param copied_files: list of (file, list of (version, response version id, file node _id))
+    :return: list of created file nodes
+    """
+    file_node_ids = set(file_node_id for _, copied in copied_files for _, _, file_node_id in copied)
+    file_nodes = {file_node._id: file_node for file_node in BaseFileNode.objects.filter(_id__in=file_node_ids)}
+    if not file_nodes:
+        return []
+
+    file_node_versions = {}
+    for through in BaseFileVersionsThrough.objects.filter(
+            basefilenode__in=file_nodes.values()).select_related('fileversion'):
+        file_node_versions.setdefault(through.basefilenode_id, []).append(through.fileversion)
+
+    list_created_file_nodes = []
+    duplicate_version_ids = set()
+    updated_file_nodes = {}
+    for file, copied in copied_files:
+        for version, response_file_version_id, file_node_id in copied:
+            node = file_nodes.get(file_node_id)
+            if node is None:
+                continue
+
+            node_versions = file_node_versions.get(node.id, [])
+            new_versions = [_ver for _ver in node_versions if _ver.identifier == response_file_version_id]
+            if len(new_versions) == 1:
+                # Find records of old versions with the same 'created_at' and 'modified_at' values
+                file_version_created_at = parse_file_info_datetime(version.get('created_at'))
+                file_version_modified_at = parse_file_info_datetime(version.get('modified_at'))
+                is_duplicate = any(
+                    _ver.identifier != response_file_version_id
+                    and _ver.created == file_version_created_at
+                    and _ver.modified == file_version_modified_at
+                    for _ver in node_versions
+                )
+                if is_duplicate:
+                    # delete duplicate new record
+                    duplicate_version_ids.add(new_versions[0].id)
+
+            if file.get('checkout_id'):
+                node.checkout_id = file.get('checkout_id')
+
+            # update created/modified date to basefilenode
+            node.created = file.get('created_at')
+            node.modified = file.get('modified_at')
+            updated_file_nodes[node.id] = node
+
+            list_created_file_nodes.append({
+                'node': node,
+                'file_tags': file.get('tags'),
+                'file_timestamp': file.get('timestamp', {}),
+                'project_id': file.get('project', {}).get('id'),
+            })
+
+    with transaction.atomic():
+        if duplicate_version_ids:
+            FileVersion.objects.filter(id__in=duplicate_version_ids).delete()
+        # bulk_update does not store the value of `django.utils.timezone.now()` to `modified` field
+        bulk_update(list(updated_file_nodes.values()), update_fields=['checkout', 'created', 'modified'])
+    return list_created_file_nodes
+
+
+def copy_files_from_export_data_to_destination(task, current_process_step,
+                                               export_data_files, export_data_restore, cookies, **kwargs):
+    copier = RestoreDataFileCopier(task, current_process_step, export_data_restore, cookies, **kwargs)
+    list_created_file_nodes, files_versions_restore_fail = copier.run(export_data_files)
 
     # Separate the failed file list from the file_info_json
     list_file_restore_fail, _, _ = export.separate_failed_files(export_data_files, files_versions_restore_fail)
@@ -848,20 +1021,24 @@ def copy_files_from_export_data_to_destination(task, current_process_step,
 
 
 def add_tag_and_timestamp_to_database(task, current_process_step, list_created_file_nodes):
+    batch_size = admin_settings.RESTORE_DATA_POST_PROCESS_BATCH_SIZE
     with transaction.atomic():
-        for item in list_created_file_nodes:
+        for start in range(0, len(list_created_file_nodes), batch_size):
             check_if_restore_process_stopped(task, current_process_step)
-
-            node = item.get('node')
-            file_tags = item.get('file_tags')
-            file_timestamp = item.get('file_timestamp')
-            project_id = item.get('project_id')
+            items = list_created_file_nodes[start:start + batch_size]
 
             # Add tags to DB
-            add_tags_to_file_node(node, file_tags)
+            add_tags_to_file_nodes([(item.get('node'), item.get('file_tags')) for item in items])
 
             # Add timestamp to DB
-            add_timestamp_to_file_node(node, project_id, file_timestamp)
+            add_timestamps_to_file_nodes([
+                (item.get('node'), item.get('project_id'), item.get('file_timestamp')) for item in items
+            ])
+
+            # Update the search index of the files once their tags are added
+            for node in set(item.get('node') for item in items):
+                if isinstance(node, OsfStorageFile):
+                    search.update_file(node)
         check_if_restore_process_stopped(task, current_process_step)
 
 
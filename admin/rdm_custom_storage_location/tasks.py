@@ -15,7 +15,9 @@ __all__ = [
 ]
 
 
-@celery_app.task(bind=True, base=AbortableTask, track_started=True)
+# the export is redelivered if its worker is lost, and resumes from its checkpoint manifest
+# on any worker; a delivery of a still running export, e.g. after the consumer timeout, is ignored
+@celery_app.task(bind=True, base=AbortableTask, track_started=True, acks_late=True, reject_on_worker_lost=True)
 def run_export_data_process(
         self, cookies, export_data_id, location_id, source_id, **kwargs):
     return export.export_data_process(
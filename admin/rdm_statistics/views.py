@@ -3,7 +3,10 @@ from __future__ import unicode_literals
 
 import os.path
 from io import BytesIO
+import collections
 import datetime
+import functools
+import operator
 import pytz
 import re
 import json
@@ -13,8 +16,13 @@ import csv
 import pandas as pd
 import numpy as np
 import hashlib
+from concurrent import futures
 
 from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.core.cache import cache
+from django.db.models import BigIntegerField, Count, Max, OuterRef, Q, Subquery
 from django.views.generic import TemplateView, View
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.shortcuts import redirect
@@ -25,11 +33,14 @@ from django.core import mail
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 # from OSF
+from addons.osfstorage.models import OsfStorageFile
 from osf.models import (
     Institution,
     OSFUser,
     AbstractNode,
-    RdmStatistics)
+    FileVersion,
+    RdmStatistics,
+    RdmStatisticsRollup)
 from website import settings as website_settings
 from website.settings import SUPPORT_EMAIL
 from api.base.utils import waterbutler_api_url_for
@@ -51,6 +62,9 @@ STATISTICS_IMAGE_WIDTH = 8
 STATISTICS_IMAGE_HEIGHT = 4
 RECURSIVE_LIMIT = 10000
 WB_MAX_RETRY = 3
+GATHER_MAX_WORKERS = 4
+GATHER_BULK_SIZE = 1000
+STATISTICS_CACHE_TIMEOUT = 60 * 60 * 24 * 7
 SITE_KEY = 'rdm_statistics'
 
 class InstitutionListViewStat(RdmPermissionMixin, UserPassesTestMixin, TemplateView):
@@ -148,33 +162,30 @@ class ProviderData(object):
 
     def __create_statistics_data(self, data_type='ext', **kwargs):
         """get data"""
-        self.stat_data = RdmStatistics.objects.filter(institution=self.institution,
-                                                      provider=self.provider, date_acquired__lte=self.end_date).\
-                                                      filter(date_acquired__gte=self.start_date)
+        stat_data = RdmStatisticsRollup.objects.filter(institution_id=self.institution.id,
+                                                       provider=self.provider, date_acquired__lte=self.end_date).\
+                                                       filter(date_acquired__gte=self.start_date)
+        totals = {}
+        for date_acquired, ext, number, size in stat_data.values_list(
+                'date_acquired', 'extention_type', 'subtotal_file_number', 'subtotal_file_size'):
+            totals[(date_acquired.strftime('%Y-%m-%d'), ext)] = (number, size)
         # file extention list
-        extentions = self.stat_data.values_list('extention_type', flat=True)
-        self.ext_list = np.unique(extentions)
+        self.ext_list = np.unique([ext for _, ext in totals.keys()])
         self.ext_list.sort()
-        self.date_list = self.stat_data.values_list('date_acquired', flat=True)
-        self.x_tk = np.unique(list(map(lambda x: x.strftime('%Y/%m/%d'), self.date_list)))
+        self.x_tk = np.unique([date_acquired.replace('-', '/') for date_acquired, _ in totals.keys()])
         self.x_tk.sort()
-        self.left = np.unique(list(map(lambda x: x.strftime('%Y-%m-%d'), self.date_list)))
+        self.left = np.unique([date_acquired for date_acquired, _ in totals.keys()])
         cols = ['left', 'height', 'type']
         self.size_df = pd.DataFrame(index=[], columns=cols)
         self.number_df = pd.DataFrame(index=[], columns=cols)
         for ext in self.ext_list:
-            ext = ext.replace('$', '\\$')
             size_row_list = []
             number_row_list = []
             for acquired_date in self.left:
-                entries = self.stat_data.filter(date_acquired=acquired_date, extention_type=ext)
-                sum_size = 0
-                sum_number = 0
-                for entry in entries:
-                    sum_size += entry.subtotal_file_size
-                    sum_number += entry.subtotal_file_number
+                sum_number, sum_size = totals.get((acquired_date, ext), (0, 0))
                 size_row_list.append(sum_size)
                 number_row_list.append(sum_number)
+            ext = ext.replace('$', '\\$')
             self.size_df = self.size_df.append(pd.DataFrame({'left': self.left,
                                                              'height': size_row_list,
                                                              'type': ext}))
@@ -244,18 +255,40 @@ class StatisticsData(object):
         self.data[ext] = data
 
 
+def get_statistics_cache_key(name, institution, start_date, end_date, *args):
+    """cache key of data created from the statistics of the institution in the period
+
+    The key changes when the statistics of the period are gathered again.
+    """
+    generation = RdmStatisticsRollup.objects.filter(institution_id=institution.id, date_acquired__lte=end_date).\
+        filter(date_acquired__gte=start_date).aggregate(count=Count('id'), modified=Max('modified'))
+    key = ':'.join(str(value) for value in (
+        name, institution.id, start_date, end_date, generation['count'], generation['modified']) + args)
+    return '{}:{}'.format(SITE_KEY, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+def get_cached_statistics(name, institution, start_date, end_date, create, *args):
+    """get data created by create() from the cache"""
+    cache_key = get_statistics_cache_key(name, institution, start_date, end_date, *args)
+    data = cache.get(cache_key)
+    if data is None:
+        data = create()
+        cache.set(cache_key, data, STATISTICS_CACHE_TIMEOUT)
+    return data
+
 def get_provider_data_array(institution, start_date, end_date, **kwargs):
     """retrieve statistics data array by provider"""
-    provider_list_data = RdmStatistics.objects.filter(institution=institution, date_acquired__lte=end_date).\
-                                            filter(date_acquired__gte=start_date).values_list('provider', flat=True)\
-                                            .order_by('provider').distinct()
-    provider_list = np.unique(provider_list_data)
-    provider_data_array = []
-    for provider in provider_list:
-        provider_data = ProviderData(provider=provider, institution=institution,
-                                     start_date=start_date, end_date=end_date)
-        provider_data_array.append(provider_data)
-    return provider_data_array
+    def create_provider_data_array():
+        provider_list_data = RdmStatisticsRollup.objects.filter(institution_id=institution.id, date_acquired__lte=end_date).\
+                                                filter(date_acquired__gte=start_date).values_list('provider', flat=True)\
+                                                .order_by('provider').distinct()
+        provider_list = np.unique(provider_list_data)
+        provider_data_array = []
+        for provider in provider_list:
+            provider_data = ProviderData(provider=provider, institution=institution,
+                                         start_date=start_date, end_date=end_date)
+            provider_data_array.append(provider_data)
+        return provider_data_array
+    return get_cached_statistics('provider_data_array', institution, start_date, end_date, create_provider_data_array)
 
 def create_image_string(provider, statistics_data):
     cols = ['left', 'height', 'type']
@@ -311,12 +344,13 @@ def create_pdf(request, is_pdf=True, **kwargs):
     ctx['current_date'] = current_date
     ctx['user'] = user
     ctx['provider_data_array'] = provider_data_array
-    html_string = render_to_string(template_name, ctx)
     # if html
     if is_pdf:
         # if PDF
         try:
-            converted_pdf = convert_to_pdf(html_string=html_string, file=False)
+            converted_pdf = get_cached_statistics(
+                'pdf', institution, start_date, current_date,
+                lambda: convert_to_pdf(html_string=render_to_string(template_name, ctx), file=False))
             pdf_file_name = 'statistics.' + current_date.strftime('%Y%m%d') + '.pdf'
             response = HttpResponse(converted_pdf, content_type='application/pdf')
             response['Content-Disposition'] = 'attachment; filename="' + pdf_file_name + '"'
@@ -324,6 +358,7 @@ def create_pdf(request, is_pdf=True, **kwargs):
         except OSError as e:
             response = HttpResponse(str(e), content_type='text/html', status=501)
     else:
+        html_string = render_to_string(template_name, ctx)
         response = HttpResponse(html_string, content_type='text/html')
     return response
 
@@ -375,7 +410,7 @@ def create_csv(request, **kwargs):
 
 def get_all_statistic_data_csv(institution, **kwargs):
     target_fields = ['provider', 'extention_type', 'subtotal_file_number', 'subtotal_file_size', 'date_acquired']
-    all_stat_dict = RdmStatistics.objects.filter(institution=institution).order_by('provider', 'extention_type', 'date_acquired').values(*target_fields)
+    all_stat_dict = RdmStatisticsRollup.objects.filter(institution_id=institution.id).order_by('provider', 'extention_type', 'date_acquired').values(*target_fields)
     # csv data list
     header_list = ['institution_name']
     header_list.extend(target_fields)
@@ -406,6 +441,16 @@ class ImageView(RdmPermissionMixin, UserPassesTestMixin, View):
         institution_id = int(self.kwargs.get('institution_id'))
         institution = Institution.objects.get(pk=institution_id)
 
+        current_date = get_current_date()
+        start_date = get_start_date(end_date=current_date)
+        png_data = get_cached_statistics(
+            'image', institution, start_date, current_date,
+            lambda: self.create_image(provider=provider, institution=institution, graph_type=graph_type),
+            provider, graph_type)
+        return HttpResponse(png_data, content_type='image/png')
+
+    def create_image(self, provider, institution, graph_type):
+        """create png data of the graph"""
         # create provider data
         provider_data = self.__get_data(provider=provider, institution=institution)
         cols = ['left', 'height', 'type']
@@ -429,11 +474,11 @@ class ImageView(RdmPermissionMixin, UserPassesTestMixin, View):
         ax.tick_params(labelsize=9)
         ax.yaxis.set_major_locator(ticker.MaxNLocator(integer=True))
         plt.legend(loc='upper right', bbox_to_anchor=(1.1255555, 1), ncol=1, borderaxespad=1, shadow=True)
-        response = HttpResponse(content_type='image/png')
         canvas = FigureCanvasAgg(fig)
-        canvas.print_png(response)
+        png_output = BytesIO()
+        canvas.print_png(png_output)
         plt.close()
-        return response
+        return png_output.getvalue()
 
     def __get_data(self, provider, institution):
         current_date = get_current_date()
@@ -454,33 +499,9 @@ class GatherView(TemplateView):
             response_json = json.dumps(response_hash)
             response = HttpResponse(response_json, content_type='application/json')
             return response
-        # user
-        user = self.request.user
-        self.cnt = 0
-        self.stat_list = []
         current_date = get_current_date()
         try:
-            # create session
-            self.session = requests.Session()
-            self.adapter = requests.adapters.HTTPAdapter(max_retries=WB_MAX_RETRY)
-            # user crawling
-            for user in self.get_users():
-                if user.affiliated_institutions.first():
-                    institution = user.affiliated_institutions.first()
-                else:
-                    institution = get_dummy_institution()
-                cookie = self.get_cookie(user)
-                for node in self.get_user_nodes(user):
-                    providers = node.get_addon_names()
-                    for guid in node.guids.all():
-                        for provider in providers:
-                            self.count_list = []
-                            path = '/'
-                            self.count_project_files(node_id=guid._id, provider=provider, path=path, cookies=cookie)
-                            if len(self.count_list) > 0:
-                                self.regist_database(node=node, guid=guid, owner=user, institution=institution,
-                                             provider=provider, date_acquired=current_date, count_list=self.count_list)
-                                self.stat_list.append([institution.name, guid._id, provider])
+            self.stat_list = self.gather(date_acquired=current_date)
             response_json = json.dumps(self.stat_list)
             response = HttpResponse(response_json, content_type='application/json')
             # statistics mail send
@@ -490,42 +511,149 @@ class GatherView(TemplateView):
             response_json = json.dumps(response_hash)
             response = HttpResponse(response_json, content_type='application/json')
             send_error_mail(err)
-        finally:
-            self.session.close()
         return response
 
+    def aggregate_count_list(self, count_list):
+        """aggregate number and size of files by extension"""
+        ext_sum = collections.OrderedDict()
+        for count_type, _, size, ext in count_list:
+            if count_type != 'file':
+                continue
+            number, total_size = ext_sum.get(ext, (0, 0))
+            ext_sum[ext] = (number + 1, total_size + size)
+        return ext_sum
+
     def regist_database(self, node, guid, owner, institution, provider, date_acquired, count_list):
-        """regist count data to database"""
+        """create statistics of count data, they are saved by save_statistics"""
         reg_list = []
-        cols = ['type', 'id', 'size', 'ext']
-        count_data = pd.DataFrame(count_list, columns=cols)
-        number_sum = count_data[count_data['type'] == 'file'].groupby('ext').count()
-        ext_sum = count_data[count_data['type'] == 'file'].groupby('ext').sum(numeric_only=True)
-        number_sum.fillna(0, inplace=True)
-        ext_sum.fillna(0, inplace=True)
-        for ext in number_sum.index:
-            RdmStatistics.objects.update_or_create(
+        for ext, (number, size) in self.aggregate_count_list(count_list).items():
+            reg_list.append(RdmStatistics(
                 project_id=node.id,
                 provider=provider,
                 extention_type=ext,
-                date_acquired=date_acquired.strftime('%Y-%m-%d'),
-                defaults={
-                    'owner': owner,
-                    'institution': institution,
-                    'storage_account_id': guid._id,
-                    'project_root_path': '/',
-                    'subtotal_file_number': number_sum[number_sum.index == ext]['type'].values[0],
-                    'subtotal_file_size': ext_sum[ext_sum.index == ext]['size'].values[0],
-                },
-            )
-            reg_list.append([node.id, owner.id, provider, institution.name, ext,
-                            number_sum[number_sum.index == ext]['type'].values[0],
-                            ext_sum[ext_sum.index == ext]['size'].values[0],
-                            date_acquired.strftime('%Y-%m-%d')])
+                date_acquired=date_acquired,
+                owner=owner,
+                institution=institution,
+                storage_account_id=guid._id,
+                project_root_path='/',
+                subtotal_file_number=number,
+                subtotal_file_size=size,
+            ))
         return reg_list
 
-    def gather(**kwargs):
-        """gathering storage data"""
+    def save_statistics(self, statistics):
+        """replace statistics of the same project, provider and date by the given ones"""
+        if not statistics:
+            return
+        keys = set((stat.project_id, stat.provider, stat.date_acquired) for stat in statistics)
+        query = functools.reduce(operator.or_, (
+            Q(project_id=project_id, provider=provider, date_acquired=date_acquired)
+            for project_id, provider, date_acquired in keys
+        ))
+        with transaction.atomic():
+            RdmStatistics.objects.filter(query).delete()
+            RdmStatistics.objects.bulk_create(statistics)
+
+    def gather(self, date_acquired):
+        """gathering storage data
+
+        osfstorage files are counted from the database and the files of the other providers
+        are crawled with WaterButler by up to GATHER_MAX_WORKERS threads. The osfstorage
+        statistics of projects which have no log since their previous gathering are copied
+        from it. The other providers are always crawled, as their files can be changed
+        without any log of the project.
+        """
+        stat_list = []
+        statistics = []
+        unchanged_nodes = {}
+        previous_dates = dict(
+            RdmStatistics.objects.filter(date_acquired__lt=date_acquired)
+            .values('project_id').annotate(last_date_acquired=Max('date_acquired'))
+            .values_list('project_id', 'last_date_acquired')
+        )
+        pending = {}
+
+        def collect(target, count_list):
+            node, guid, owner, institution, provider = target
+            if len(count_list) > 0:
+                statistics.extend(self.regist_database(
+                    node=node, guid=guid, owner=owner, institution=institution,
+                    provider=provider, date_acquired=date_acquired, count_list=count_list))
+                stat_list.append([institution.name, guid._id, provider])
+
+        with futures.ThreadPoolExecutor(max_workers=GATHER_MAX_WORKERS) as executor:
+            try:
+                # user crawling
+                for user in self.get_users():
+                    institution = user.affiliated_institutions.first() or get_dummy_institution()
+                    cookie = None
+                    for node in self.get_user_nodes(user):
+                        previous_date = previous_dates.get(node.id)
+                        is_unchanged = previous_date and not self.is_storage_changed(node, previous_date)
+                        if is_unchanged:
+                            unchanged_nodes[node.id] = (node, institution)
+                        providers = node.get_addon_names()
+                        for guid in node.guids.all():
+                            for provider in providers:
+                                target = (node, guid, user, institution, provider)
+                                if provider == 'osfstorage':
+                                    if not is_unchanged:
+                                        collect(target, self.count_osfstorage_files(node))
+                                    continue
+                                while len(pending) >= GATHER_MAX_WORKERS:
+                                    done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                                    for future in done:
+                                        collect(pending.pop(future), future.result())
+                                cookie = cookie or self.get_cookie(user)
+                                pending[executor.submit(self.count_project_files, guid._id, provider, '/', cookie)] = target
+                        if len(statistics) >= GATHER_BULK_SIZE:
+                            self.save_statistics(statistics)
+                            statistics = []
+                for future in futures.as_completed(list(pending)):
+                    collect(pending.pop(future), future.result())
+            finally:
+                for future in pending:
+                    future.cancel()
+        self.save_statistics(statistics)
+        stat_list.extend(self.copy_previous_statistics(unchanged_nodes, previous_dates, date_acquired))
+        RdmStatisticsRollup.update_date(date_acquired)
+        return stat_list
+
+    def copy_previous_statistics(self, unchanged_nodes, previous_dates, date_acquired):
+        """copy the previous osfstorage statistics of unchanged projects to date_acquired"""
+        stat_list = []
+        stat_items = set()
+        node_ids = list(unchanged_nodes.keys())
+        for index in range(0, len(node_ids), GATHER_BULK_SIZE):
+            statistics = []
+            previous_statistics = RdmStatistics.objects.filter(
+                project_id__in=node_ids[index:index + GATHER_BULK_SIZE], provider='osfstorage').order_by('id')
+            for stat in previous_statistics.iterator():
+                if stat.date_acquired != previous_dates[stat.project_id]:
+                    continue
+                node, institution = unchanged_nodes[stat.project_id]
+                stat.pk = None
+                stat.date_acquired = date_acquired
+                stat.institution = institution
+                statistics.append(stat)
+                stat_item = (institution.name, stat.storage_account_id, stat.provider)
+                if stat_item not in stat_items:
+                    stat_items.add(stat_item)
+                    stat_list.append(list(stat_item))
+            self.save_statistics(statistics)
+        return stat_list
+
+    def is_storage_changed(self, node, previous_date):
+        """whether the project is logged since the day of the previous gathering
+
+        Every change of the osfstorage files of a project is logged, but the changes of
+        the files of the other providers are not, so this only applies to osfstorage.
+        """
+        if node.last_logged is None:
+            return True
+        previous_datetime = pytz.timezone('Asia/Tokyo').localize(
+            datetime.datetime.combine(previous_date, datetime.time.min))
+        return node.last_logged >= previous_datetime
 
     def get_users(self):
         return OSFUser.objects.all()
@@ -542,33 +670,59 @@ class GatherView(TemplateView):
         url = waterbutler_api_url_for(node_id=node_id, _internal=True, meta=True, provider=provider, path=path, cookie=cookie)
         return url
 
-    def count_project_files(self, node_id, provider, path, cookies):
-        """recursive count"""
+    def get_extension(self, path):
+        root, ext = os.path.splitext(path)
+        if not ext:
+            ext = 'none'
+        if len(ext) > RdmStatistics._meta.get_field('extention_type').max_length:
+            ext = 'unknown'
+        return ext
+
+    def count_osfstorage_files(self, node):
+        """count osfstorage files of the project from the database"""
+        latest_version_size = FileVersion.objects.filter(
+            basefilenode=OuterRef('pk')
+        ).order_by('-created').values('size')[:1]
+        files = OsfStorageFile.objects.filter(
+            target_object_id=node.id,
+            target_content_type=ContentType.objects.get_for_model(AbstractNode),
+        ).annotate(
+            latest_version_size=Subquery(latest_version_size, output_field=BigIntegerField())
+        ).values_list('_id', 'name', 'latest_version_size')
+        return [
+            ['file', 'osfstorage/' + file_id, int(size or 0), self.get_extension(name)]
+            for file_id, name, size in files.iterator()
+        ]
+
+    def count_project_files(self, node_id, provider, path, cookies, session=None, count_list=None, counter=None):
+        """recursive count, this runs in a worker thread of gather and does not access the database"""
+        if session is None:
+            with requests.Session() as session:
+                session.mount('http://', requests.adapters.HTTPAdapter(max_retries=WB_MAX_RETRY))
+                count_list = []
+                self.count_project_files(node_id, provider, path, cookies,
+                                         session=session, count_list=count_list, counter=[0])
+                return count_list
         url_api = self.get_wb_url(node_id=node_id, provider=provider, path=re.sub(r'^//', '/', path), cookie=cookies)
-        self.session.mount('http://', self.adapter)
         headers = {'content-type': 'application/json'}
         # connect timeout:10sec, read timeout:300sec
-        res = self.session.get(url=url_api, headers=headers, timeout=(10.0, 300.0))
+        res = session.get(url=url_api, headers=headers, timeout=(10.0, 300.0))
         if not res.status_code == requests.codes.ok:
             return None
         response_json = res.json()
-        self.cnt += 1
-        if self.cnt > RECURSIVE_LIMIT:
+        counter[0] += 1
+        if counter[0] > RECURSIVE_LIMIT:
             return None
         # parse response json
         if 'data' in response_json.keys():
             for obj in response_json['data']:
                 if provider != 'osfstorage':
-                    root, ext = os.path.splitext(obj['id'])
+                    ext = self.get_extension(obj['id'])
                 else:
-                    root, ext = os.path.splitext(obj['attributes']['materialized'])
-                if not ext:
-                    ext = 'none'
-                if len(ext) > RdmStatistics._meta.get_field('extention_type').max_length:
-                    ext = 'unknown'
+                    ext = self.get_extension(obj['attributes']['materialized'])
                 if obj['attributes']['kind'] == 'file':
                     try:
-                        self.count_list.append(['file', obj['id'], int(obj['attributes']['size'] if obj['attributes']['size'] else 0), ext])
+                        count_list.append(['file', obj['id'], int(obj['attributes']['size'] if obj['attributes']['size'] else 0), ext])
                     except Exception as err:
                         logger.error('resource:{} {}{} error occured (file size:{}). - {}'.format(obj['attributes']['resource'],
                                                                                                   obj['attributes']['provider'],
@@ -579,7 +733,7 @@ class GatherView(TemplateView):
                 elif obj['attributes']['kind'] == 'folder':
                     path = re.sub('^' + provider, '', obj['id'])
                     try:
-                        self.count_list.append(['folder', obj['id'], int(obj['attributes']['size'] if obj['attributes']['size'] else 0), ext])
+                        count_list.append(['folder', obj['id'], int(obj['attributes']['size'] if obj['attributes']['size'] else 0), ext])
                     except Exception as err:
                         logger.error('resource:{} {}{} error occured (file size:{}). - {}'.format(obj['attributes']['resource'],
                                                                                                   obj['attributes']['provider'],
@@ -587,7 +741,8 @@ class GatherView(TemplateView):
                                                                                                   obj['attributes']['size'],
                                                                                                   err))
                         pass
-                    self.count_project_files(provider=provider, node_id=node_id, path='/' + path, cookies=cookies)
+                    self.count_project_files(provider=provider, node_id=node_id, path='/' + path, cookies=cookies,
+                                             session=session, count_list=count_list, counter=counter)
 
 def simple_auth(access_token):
     digest = hashlib.sha512(SITE_KEY.encode('utf-8')).hexdigest()
@@ -683,10 +838,10 @@ def get_pdf_data(institution):
         ctx['institution'] = institution
     ctx['current_date'] = current_date
     ctx['provider_data_array'] = provider_data_array
-    html_string = render_to_string(template_name, ctx)
     # if PDF
-    converted_pdf = convert_to_pdf(html_string=html_string, file=False)
-    return converted_pdf
+    return get_cached_statistics(
+        'pdf', institution, start_date, current_date,
+        lambda: convert_to_pdf(html_string=render_to_string(template_name, ctx), file=False))
 
 def get_current_date(is_str=False):
     current_datetime = datetime.datetime.now(pytz.timezone('Asia/Tokyo'))
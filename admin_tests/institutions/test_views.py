@@ -22,6 +22,7 @@ from osf.models import Institution, Node, UserQuota, OSFUser
 from admin_tests.utilities import setup_form_view, setup_user_view, setup_view
 
 from admin.institutions import views
+from website.util import quota
 from admin.institutions.forms import InstitutionForm
 from admin.base.forms import ImportFileForm
 
@@ -1031,13 +1032,10 @@ class TestQuotaUserList(AdminTestCase):
         return institution.first()
 
     def get_userlist(self):
-        user_list = []
-        for user in OSFUser.objects.filter(
-                affiliated_institutions=self.institution.id):
-            user_list.append(self.view.get_user_quota_info(
-                user, UserQuota.CUSTOM_STORAGE)
-            )
-        return user_list
+        return quota.get_quota_summary(
+            OSFUser.objects.filter(affiliated_institutions=self.institution.id),
+            UserQuota.CUSTOM_STORAGE
+        )
 
     def test_get_user_quota_info_eppn_is_none(self):
         default_value_eppn = ''
@@ -1075,6 +1073,19 @@ class TestQuotaUserList(AdminTestCase):
         nt.assert_is_instance(response, dict)
         nt.assert_false('institution_storage_name' in response)
 
+    def test_get_context_data_users(self):
+        self.view.get_institution = self.get_institution
+        UserQuota.objects.create(user=self.user,
+                                 storage_type=UserQuota.CUSTOM_STORAGE,
+                                 max_quota=200, used=1500)
+
+        response = self.view.get_context_data()
+
+        nt.assert_equal(len(response['users']), 1)
+        nt.assert_equal(response['users'][0]['id'], self.user._id)
+        nt.assert_equal(response['users'][0]['usage'], 1500)
+        nt.assert_equal(response['users'][0]['quota'], 200)
+
     def test_get_context_data_has_storage_name(self):
         self.view.get_institution = self.get_institution_has_storage_name
         UserQuota.objects.create(user=self.user,
@@ -1136,7 +1147,9 @@ class TestUserListByInstitutionID(AdminTestCase):
     def test_default_user_list_by_institution_id(self, *args, **kwargs):
 
         res = self.view.get_userlist()
-        nt.assert_is_instance(res, list)
+        nt.assert_equal(len(res), 2)
+        nt.assert_equal(UserQuota.objects.filter(
+            user__in=[self.user, self.user2], storage_type=UserQuota.NII_STORAGE).count(), 2)
 
     def test_default_user_list_by_institution_id_not_found(self, *args, **kwargs):
         view = setup_view(self.view,
@@ -1183,7 +1196,7 @@ class TestUserListByInstitutionID(AdminTestCase):
                           institution_id=self.institution.id)
         res = view.get_userlist()
 
-        nt.assert_equal(res[0]['id'], self.user2._id)
+        nt.assert_equal(res[0]['guid'], self.user2._id)
         nt.assert_equal(len(res), 1)
 
     def test_search_name_by_institution_id(self):
@@ -1219,7 +1232,7 @@ class TestUserListByInstitutionID(AdminTestCase):
                           institution_id=self.institution.id)
         res = view.get_userlist()
 
-        nt.assert_equal(res[0]['id'], self.user._id)
+        nt.assert_equal(res[0]['guid'], self.user._id)
         nt.assert_in(res[0]['fullname'], self.user.fullname)
         nt.assert_equal(len(res), 1)
 
@@ -1281,7 +1294,7 @@ class TestExportFileTSV(AdminTestCase):
                           institution_id=self.institution.id)
         res = view.get(request)
 
-        result = res.content.decode('utf-8')
+        result = b''.join(res.streaming_content).decode('utf-8')
 
         nt.assert_equal(res.status_code, 200)
         nt.assert_equal(res['content-type'], 'text/tsv')
@@ -1311,7 +1324,7 @@ class TestExportFileTSV(AdminTestCase):
                           institution_id=self.institution.id)
         res = view.get(request)
 
-        result = res.content.decode('utf-8')
+        result = b''.join(res.streaming_content).decode('utf-8')
 
         nt.assert_equal(res.status_code, 200)
         nt.assert_equal(res['content-type'], 'text/tsv')
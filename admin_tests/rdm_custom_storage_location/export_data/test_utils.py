@@ -1,5 +1,8 @@
 import copy
 import json
+import os
+import shutil
+import tempfile
 import uuid
 
 import mock
@@ -748,6 +751,27 @@ class TestUtils(AdminTestCase):
 
         mock_json_dump_patcher.stop()
 
+    def test_write_json_file_stream__read_json_file_stream(self):
+        def iter_files():
+            yield {'id': 1, 'name': 'file,\n1'}
+            yield {'id': 2, 'name': 'file2'}
+
+        output_file = os.path.join(tempfile.mkdtemp(), '_temp.json')
+        json_data = {'institution': institution_json, 'folders': [], 'files': iter_files()}
+
+        utils.write_json_file_stream(json_data, output_file)
+
+        with open(output_file) as fp:
+            nt.assert_equal(json.load(fp), {
+                'institution': institution_json,
+                'folders': [],
+                'files': [{'id': 1, 'name': 'file,\n1'}, {'id': 2, 'name': 'file2'}],
+            })
+        nt.assert_equal(list(utils.read_json_file_stream(output_file, 'folders')), [])
+        nt.assert_equal(list(utils.read_json_file_stream(output_file, 'files')),
+                        [{'id': 1, 'name': 'file,\n1'}, {'id': 2, 'name': 'file2'}])
+        shutil.rmtree(os.path.dirname(output_file))
+
     def test_update_storage_location__create_new(self):
         result = utils.update_storage_location(
             institution_guid=self.institution.guid,
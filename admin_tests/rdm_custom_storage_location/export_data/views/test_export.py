@@ -16,7 +16,8 @@ from rest_framework import status
 
 from admin.rdm_custom_storage_location.export_data.views import export
 from framework.celery_tasks import app as celery_app
-from osf.models import ExportData
+from osf.models import ExportData, ExportDataCopiedFile
+from osf.utils.locks import AdvisoryLock
 from osf_tests.factories import (
     InstitutionFactory,
     ExportDataLocationFactory,
@@ -415,6 +416,28 @@ class TestSeparateFailedFiles(unittest.TestCase):
         self.assertEqual(_sub_files_numb, len(versions))
 
 
+class TestIterSucceededFiles(unittest.TestCase):
+    def test_iter_succeeded_files(self):
+        files = [
+            {'id': 1, 'version': [{'identifier': '1', 'size': 10}]},
+            {'id': 2, 'version': [{'identifier': '1', 'size': 10}, {'identifier': '2', 'size': 20}]},
+            {'id': 3, 'version': [{'identifier': '1', 'size': 10}]},
+        ]
+        files_not_found = []
+
+        result = list(export.iter_succeeded_files(files, {1: ['1'], 2: ['2'], 3: []}, files_not_found))
+
+        nt.assert_equal(result, [
+            {'id': 2, 'version': [{'identifier': '1', 'size': 10}]},
+            {'id': 3, 'version': [{'identifier': '1', 'size': 10}]},
+        ])
+        nt.assert_equal(files_not_found, [
+            {'id': 1, 'version': [{'identifier': '1', 'size': 10}]},
+            {'id': 2, 'version': [{'identifier': '2', 'size': 20}]},
+        ])
+        nt.assert_equal(export.count_failed_files(files_not_found), (30, 2))
+
+
 class TestExportDataProcess(unittest.TestCase):
     def setUp(self):
         super(TestExportDataProcess, self).setUp()
@@ -751,6 +774,85 @@ class TestExportDataProcess(unittest.TestCase):
             self.export_data.process_start_timestamp
         ))
 
+    @pytest.mark.django_db
+    @mock.patch(f'{EXPORT_DATA_PATH}._export_data_process')
+    def test_export_data_process__ignore_running_process(self, mock_export_data_process):
+        lock = AdvisoryLock(export.EXPORT_DATA_LOCK_NAME.format(self.export_data.id))
+        # the advisory lock is held by the other connection of a worker running the same export
+        with mock.patch.object(AdvisoryLock, 'acquire', return_value=False):
+            with self.assertRaises(Ignore):
+                export.export_data_process(
+                    self.task, self.cookies, self.export_data.id, self.location.id, self.source.id,
+                )
+        mock_export_data_process.assert_not_called()
+
+        mock_export_data_process.return_value = {'message': export.MSG_EXPORT_COMPLETED}
+        _task_result = export.export_data_process(
+            self.task, self.cookies, self.export_data.id, self.location.id, self.source.id,
+        )
+        nt.assert_equal(_task_result, {'message': export.MSG_EXPORT_COMPLETED})
+        # the lock is released after the process
+        nt.assert_is_none(lock.holder())
+
+
+@pytest.mark.django_db
+class TestExportDataFileCopier(unittest.TestCase):
+    def setUp(self):
+        super(TestExportDataFileCopier, self).setUp()
+        self.export_data = ExportDataFactory()
+        # (project_id, provider, file_path, version, file_name, file_id)
+        self.file_versions = [
+            ('prj01', 'osfstorage', '/file1', '1', 'hash1', 1),
+            ('prj01', 'osfstorage', '/file2', '1', 'hash1', 2),
+            ('prj01', 'osfstorage', '/file3', '1', 'hash2', 3),
+            ('prj01', 'osfstorage', '/file3', '2', 'hash3', 3),
+        ]
+
+    def copy_response(self, cookies, project_id, provider, file_path, file_name, **kwargs):
+        if file_path == '/file1' or kwargs.get('version') == '2':
+            return mock.MagicMock(status_code=status.HTTP_400_BAD_REQUEST)
+        return mock.MagicMock(status_code=status.HTTP_201_CREATED)
+
+    @mock.patch(f'{EXPORT_DATA_PATH}.check_export_data_process_status')
+    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.copy_export_data_file_to_location')
+    def test_run(self, mock_copy, mock_check_status):
+        mock_copy.side_effect = self.copy_response
+        copier = export.ExportDataFileCopier(self.export_data, {}, FAKE_TASK_ID, max_workers=2)
+
+        files_versions_not_found = copier.run(self.file_versions)
+
+        # hash1 is copied from the second file after the first one fails
+        nt.assert_equal(files_versions_not_found, {1: ['1'], 3: ['2']})
+        nt.assert_equal(mock_copy.call_count, 4)
+        copied = self.export_data.copied_files.values_list('file_name', flat=True)
+        nt.assert_equal(sorted(copied), ['hash1', 'hash2'])
+
+    @mock.patch(f'{EXPORT_DATA_PATH}.check_export_data_process_status')
+    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.copy_export_data_file_to_location')
+    def test_run_resume(self, mock_copy, mock_check_status):
+        mock_copy.return_value.status_code = status.HTTP_201_CREATED
+        ExportDataCopiedFile.objects.create(export_data=self.export_data, file_name='hash1')
+        ExportDataCopiedFile.objects.create(export_data=self.export_data, file_name='hash2')
+        copier = export.ExportDataFileCopier(self.export_data, {}, FAKE_TASK_ID)
+
+        files_versions_not_found = copier.run(self.file_versions)
+
+        nt.assert_equal(files_versions_not_found, {})
+        mock_copy.assert_called_once()
+        nt.assert_equal(mock_copy.call_args[0][4], 'hash3')
+
+    @mock.patch(f'{EXPORT_DATA_PATH}.check_export_data_process_status')
+    @mock.patch(f'{EXPORT_DATA_PATH}.ExportData.copy_export_data_file_to_location')
+    def test_run_aborted(self, mock_copy, mock_check_status):
+        mock_copy.return_value.status_code = status.HTTP_201_CREATED
+        mock_check_status.side_effect = export.ExportDataTaskException(export.MSG_EXPORT_ABORTED)
+        copier = export.ExportDataFileCopier(self.export_data, {}, FAKE_TASK_ID)
+
+        with nt.assert_raises(export.ExportDataTaskException):
+            copier.run(self.file_versions)
+        mock_copy.assert_not_called()
+        nt.assert_false(self.export_data.copied_files.exists())
+
 
 class TestExportDataRollbackProcess(unittest.TestCase):
     def setUp(self):
@@ -15,7 +15,7 @@ from rest_framework.test import APIRequestFactory
 from admin.rdm_custom_storage_location.export_data.views import restore
 from admin.rdm_custom_storage_location.export_data.views.restore import ProcessError
 from framework.celery_tasks import app as celery_app
-from osf.models import RdmFileTimestamptokenVerifyResult, ExportData, ExportDataRestore, FileVersion
+from osf.models import RdmFileTimestamptokenVerifyResult, ExportData, ExportDataRestore, FileVersion, Tag
 from osf_tests.factories import (
     AuthUserFactory,
     ExportDataFactory,
@@ -1226,41 +1226,31 @@ class TestRestoreDataFunction(AdminTestCase):
             mock_copy.assert_called()
             nt.assert_equal(result[0], [])
 
-    @mock.patch('osf.models.BaseFileNode')
-    @mock.patch('osf.models.BaseFileNode.objects')
-    @mock.patch('osf.models.FileVersion.objects')
     @mock.patch(f'{EXPORT_DATA_UTIL_PATH}.copy_file_from_location_to_destination')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.generate_new_file_path')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
     def test_copy_files_from_export_data_to_destination_osfstorage(self, mock_check_progress,
-                                                                   mock_generate_new_file_path, mock_copy,
-                                                                   mock_file_version, mock_file_node,
-                                                                   mock_base_file_node):
-        def create_node(*args, **kwargs):
-            OsfStorageFileFactory.create(_id='fake_id')
-            return {
-                'data': {
-                    'id': 'osfstorage/fake_id'
-                }
-            }
-
+                                                                   mock_generate_new_file_path, mock_copy):
         bulkmount_export_files = self.test_export_data_files
 
         task = AbortableTask()
         task.request_stack = LocalStack()
         task.request.id = FAKE_TASK_ID
 
+        # the file node is created by the copy API of WaterButler
+        node = OsfStorageFileFactory.create(_id='fake_id')
         user = AuthUserFactory.create(username='fake_user')
-        file_version = FileVersionFactory.create(creator=user, identifier='1')
-        mock_base_file_node.get_version.return_value = file_version
-        mock_file_node.filter.return_value.update.return_value = {}
-        mock_file_version.filter.return_value.update.return_value = {}
+        node.add_version(FileVersionFactory.create(creator=user, identifier='1'))
 
         mock_is_add_on = mock.MagicMock()
         mock_is_add_on.return_value = False
         mock_check_progress.return_value = None
         mock_generate_new_file_path.return_value = '/@ember-decorators/utils/collapse-proto.d.ts'
-        mock_copy.side_effect = create_node
+        mock_copy.return_value = {
+            'data': {
+                'id': 'osfstorage/fake_id'
+            }
+        }
 
         with mock.patch(f'{EXPORT_DATA_UTIL_PATH}.is_add_on_storage', mock_is_add_on):
             result = self.view.copy_files_from_export_data_to_destination(task, 1, bulkmount_export_files,
@@ -1271,35 +1261,30 @@ class TestRestoreDataFunction(AdminTestCase):
             mock_generate_new_file_path.assert_not_called()
             mock_copy.assert_called()
             nt.assert_equal(len(result), 2)
+            nt.assert_equal(result[0][0].get('node'), node)
             nt.assert_equal(result[0][0].get('file_tags'), ['hello', 'world'])
             nt.assert_equal(result[0][0].get('file_timestamp'), {})
             nt.assert_equal(result[0][0].get('project_id'), 'pmockt')
+            node.reload()
+            nt.assert_equal(str(node.created), '2023-04-18 04:40:25+00:00')
+            nt.assert_equal(str(node.modified), '2023-04-18 04:40:25+00:00')
+            nt.assert_equal(node.versions.count(), 1)
 
     @mock.patch(f'{EXPORT_DATA_UTIL_PATH}.copy_file_from_location_to_destination')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.generate_new_file_path')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
     def test_copy_files_from_export_data_to_destination_osfstorage_not_add_new_version(self, mock_check_progress,
                                                                                        mock_generate_new_file_path, mock_copy):
-        def create_node(*args, **kwargs):
-            file = OsfStorageFileFactory.create(_id='fake_id')
-            user = AuthUserFactory.create(username='fake_user')
-            version_1 = FileVersionFactory(creator=user, identifier='1')
-            FileVersion.objects.filter(id=version_1.id).update(created='2023-04-18 04:40:25', modified='2023-04-18 04:40:25')
-            file.add_version(version_1)
-            file.add_version(FileVersionFactory(creator=user, identifier='2'))
-            return {
-                'data': {
-                    'id': 'osfstorage/fake_id',
-                    'attributes': {
-                        'extra': {
-                            'version': '2'
-                        }
-                    }
-                }
-            }
-
         bulkmount_export_files = self.test_export_data_files
 
+        # the version 2 is added by the copy API of WaterButler
+        file = OsfStorageFileFactory.create(_id='fake_id')
+        user = AuthUserFactory.create(username='fake_user')
+        version_1 = FileVersionFactory(creator=user, identifier='1')
+        FileVersion.objects.filter(id=version_1.id).update(created='2023-04-18 04:40:25', modified='2023-04-18 04:40:25')
+        file.add_version(version_1)
+        file.add_version(FileVersionFactory(creator=user, identifier='2'))
+
         task = AbortableTask()
         task.request_stack = LocalStack()
         task.request.id = FAKE_TASK_ID
@@ -1308,7 +1293,16 @@ class TestRestoreDataFunction(AdminTestCase):
         mock_is_add_on.return_value = False
         mock_check_progress.return_value = None
         mock_generate_new_file_path.return_value = '/@ember-decorators/utils/collapse-proto.d.ts'
-        mock_copy.side_effect = create_node
+        mock_copy.return_value = {
+            'data': {
+                'id': 'osfstorage/fake_id',
+                'attributes': {
+                    'extra': {
+                        'version': '2'
+                    }
+                }
+            }
+        }
 
         with mock.patch(f'{EXPORT_DATA_UTIL_PATH}.is_add_on_storage', mock_is_add_on):
             result = self.view.copy_files_from_export_data_to_destination(task, 1, bulkmount_export_files,
@@ -1527,10 +1521,10 @@ class TestRestoreDataFunction(AdminTestCase):
                 nt.assert_equal(result, None)
 
     # add_tag_and_timestamp_to_database
-    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_timestamp_to_file_node')
-    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_tags_to_file_node')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_timestamps_to_file_nodes')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_tags_to_file_nodes')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
-    def test_add_tag_and_timestamp_to_database(self, mock_check_process, mock_add_tags, mock_add_timestamp):
+    def test_add_tag_and_timestamp_to_database(self, mock_check_process, mock_add_tags, mock_add_timestamps):
         task = AbortableTask()
         task.request_stack = LocalStack()
         task.request.id = FAKE_TASK_ID
@@ -1551,29 +1545,66 @@ class TestRestoreDataFunction(AdminTestCase):
 
         mock_check_process.return_value = None
         mock_add_tags.return_value = None
-        mock_add_timestamp.return_value = None
+        mock_add_timestamps.return_value = None
 
-        self.view.add_tag_and_timestamp_to_database(task, 1, list_file_nodes)
+        with mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.admin_settings.RESTORE_DATA_POST_PROCESS_BATCH_SIZE', 1):
+            self.view.add_tag_and_timestamp_to_database(task, 1, list_file_nodes)
         nt.assert_equal(mock_check_process.call_count, 3)
         nt.assert_equal(mock_add_tags.call_count, 2)
-        nt.assert_equal(mock_add_timestamp.call_count, 2)
+        nt.assert_equal(mock_add_timestamps.call_count, 2)
+        mock_add_tags.assert_called_with([(2, ['tag1'])])
+        mock_add_timestamps.assert_called_with([(2, self.project_id, {})])
 
-    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_timestamp_to_file_node')
-    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_tags_to_file_node')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_timestamps_to_file_nodes')
+    @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.add_tags_to_file_nodes')
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.check_if_restore_process_stopped')
-    def test_add_tag_and_timestamp_to_database_empty_nodes(self, mock_check_process, mock_add_tags, mock_add_timestamp):
+    def test_add_tag_and_timestamp_to_database_empty_nodes(self, mock_check_process, mock_add_tags, mock_add_timestamps):
         task = AbortableTask()
         task.request_stack = LocalStack()
         task.request.id = FAKE_TASK_ID
 
         mock_check_process.return_value = None
         mock_add_tags.return_value = None
-        mock_add_timestamp.return_value = None
+        mock_add_timestamps.return_value = None
 
         self.view.add_tag_and_timestamp_to_database(task, 1, [])
         mock_check_process.assert_called_once()
         mock_add_tags.assert_not_called()
-        mock_add_timestamp.assert_not_called()
+        mock_add_timestamps.assert_not_called()
+
+    # add_tags_to_file_nodes
+    def test_add_tags_to_file_nodes(self):
+        node_1 = OsfStorageFileFactory()
+        node_2 = OsfStorageFileFactory()
+        self.view.add_tags_to_file_node(node_1, ['tag1'])
+
+        self.view.add_tags_to_file_nodes([(node_1, ['tag1', 'tag2']), (node_2, ['tag2']), (None, ['tag3'])])
+
+        nt.assert_equal(set(node_1.tags.values_list('name', flat=True)), {'tag1', 'tag2'})
+        nt.assert_equal(set(node_2.tags.values_list('name', flat=True)), {'tag2'})
+        nt.assert_false(Tag.objects.filter(name='tag3').exists())
+
+    # add_timestamps_to_file_nodes
+    def test_add_timestamps_to_file_nodes(self):
+        node_1 = OsfStorageFileFactory()
+        node_2 = OsfStorageFileFactory()
+        RdmFileTimestamptokenVerifyResult.objects.create(file_id=node_1._id, project_id='project_id', key_file_name='old.txt')
+        timestamp = {
+            'key_file_name': 'mocked.txt',
+            'inspection_result_status': 1,
+        }
+
+        self.view.add_timestamps_to_file_nodes([
+            (node_1, self.project_id, timestamp),
+            (node_2, self.project_id, timestamp),
+            (OsfStorageFileFactory(), self.project_id, {}),
+        ])
+
+        verify_data = RdmFileTimestamptokenVerifyResult.objects.filter(file_id__in=[node_1._id, node_2._id])
+        nt.assert_equal(verify_data.count(), 2)
+        nt.assert_equal(set(verify_data.values_list('key_file_name', flat=True)), {'mocked.txt'})
+        nt.assert_equal(set(verify_data.values_list('inspection_result_status', flat=True)), {1})
+        nt.assert_equal(RdmFileTimestamptokenVerifyResult.objects.count(), 2)
 
     # restore_export_data_rollback_process
     @mock.patch(f'{RESTORE_EXPORT_DATA_PATH}.move_all_files_from_backup_folder_to_root')
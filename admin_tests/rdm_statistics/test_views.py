@@ -22,7 +22,8 @@ import os
 import uuid
 import shutil
 import json
-from osf.models import OSFUser
+import pytz
+from osf.models import AbstractNode, OSFUser, RdmStatistics, RdmStatisticsRollup
 
 
 class TestInstitutionListViewStat(AdminTestCase):
@@ -425,6 +426,69 @@ class TestGatherView(AdminTestCase):
         resp = json.loads(self.view.get(self, self.request, self.view.args, self.view.kwargs).content)
         nt.assert_equal(len(resp), 2)
 
+    @patch('admin.rdm_statistics.views.requests.Session.get', side_effect=mocked_requests_get)
+    def test_gather(self, mock_sessionget):
+        current_date = views.get_current_date()
+        stat_list = self.view.gather(date_acquired=current_date)
+        nt.assert_in([self.institution1.name, self.project._id, 'osfstorage'], stat_list)
+        statistics = RdmStatistics.objects.get(project=self.project, provider='osfstorage', date_acquired=current_date)
+        nt.assert_equal(statistics.extention_type, 'unknown')
+        nt.assert_equal(statistics.subtotal_file_number, 1)
+        nt.assert_equal(statistics.subtotal_file_size, 1337)
+        # the osfstorage files are counted from the database
+        for call in mock_sessionget.call_args_list:
+            nt.assert_not_in('osfstorage', call[1]['url'])
+
+        # gathering again replaces the statistics of the same day
+        self.view.gather(date_acquired=current_date)
+        nt.assert_equal(RdmStatistics.objects.filter(project=self.project, provider='osfstorage').count(), 1)
+        rollup = RdmStatisticsRollup.objects.get(institution=self.institution1, provider='osfstorage', date_acquired=current_date)
+        nt.assert_equal(rollup.subtotal_file_number, 1)
+        nt.assert_equal(rollup.subtotal_file_size, 1337)
+
+    @patch('admin.rdm_statistics.views.create_image_string', return_value='')
+    def test_get_provider_data_array_cache(self, mock_create_image_string):
+        current_date = views.get_current_date()
+        start_date = views.get_start_date(end_date=current_date)
+        rdm_statistics_factories.RdmStatisticsFactory(
+            project=self.project, owner=self.user, institution=self.institution1, provider='osfstorage',
+            date_acquired=current_date)
+        RdmStatisticsRollup.update_date(current_date)
+
+        provider_data_array = views.get_provider_data_array(self.institution1, start_date, current_date)
+        nt.assert_equal([provider_data.provider for provider_data in provider_data_array], ['osfstorage'])
+        views.get_provider_data_array(self.institution1, start_date, current_date)
+        nt.assert_equal(mock_create_image_string.call_count, 3)
+
+        # the cache is invalidated by gathering the statistics again
+        RdmStatisticsRollup.update_date(current_date)
+        views.get_provider_data_array(self.institution1, start_date, current_date)
+        nt.assert_equal(mock_create_image_string.call_count, 6)
+
+    @patch('osf.models.AbstractNode.get_addon_names', return_value=['osfstorage', 's3'])
+    @patch('admin.rdm_statistics.views.requests.Session.get', side_effect=mocked_requests_get)
+    def test_gather_unchanged_project(self, mock_sessionget, mock_get_addon_names):
+        current_date = views.get_current_date()
+        previous_date = current_date - datetime.timedelta(days=7)
+        rdm_statistics_factories.RdmStatisticsFactory(
+            project=self.project, owner=self.user, institution=self.institution1, provider='osfstorage',
+            storage_account_id=self.project._id, date_acquired=previous_date)
+        AbstractNode.objects.filter(id=self.project.id).update(
+            last_logged=datetime.datetime.combine(previous_date - datetime.timedelta(days=1), datetime.time.min).replace(tzinfo=pytz.utc))
+
+        stat_list = self.view.gather(date_acquired=current_date)
+
+        nt.assert_in([self.institution1.name, self.project._id, 'osfstorage'], stat_list)
+        statistics = RdmStatistics.objects.get(project=self.project, provider='osfstorage', date_acquired=current_date)
+        nt.assert_equal(statistics.extention_type, 'png')
+        nt.assert_equal(statistics.subtotal_file_number, 10)
+        nt.assert_equal(RdmStatistics.objects.filter(project=self.project, provider='osfstorage').count(), 2)
+        # the files of the other providers are crawled even if the project is not logged
+        nt.assert_in([self.institution1.name, self.project._id, 's3'], stat_list)
+        urls = [call[1]['url'] for call in mock_sessionget.call_args_list]
+        nt.assert_true(any('/providers/s3/' in url for url in urls))
+        nt.assert_true(RdmStatistics.objects.filter(project=self.project, provider='s3', date_acquired=current_date).exists())
+
     def test_send_stat_mail(self, *args, **kwargs):
         nt.assert_equal(views.send_stat_mail(self.request).status_code, 200)
 
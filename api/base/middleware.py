@@ -17,11 +17,17 @@ from framework.postcommit_tasks.handlers import (
     postcommit_after_request,
     postcommit_before_request,
 )
+from api.caching.tasks import ban_before_request
 from framework.celery_tasks.handlers import (
     celery_before_request,
     celery_after_request,
     celery_teardown_request,
 )
+from website.search.handlers import (
+    search_before_request,
+    search_after_request,
+    search_teardown_request,
+)
 from .api_globals import api_globals
 from api.base import settings as api_settings
 from waffle.middleware import WaffleMiddleware
@@ -82,6 +88,22 @@ class CeleryTaskMiddleware(MiddlewareMixin):
         return response
 
 
+class SearchIndexMiddleware(MiddlewareMixin):
+    """Send the search documents written by the request in bulk after it is committed."""
+
+    def process_request(self, request):
+        search_before_request()
+
+    def process_exception(self, request, exception):
+        search_teardown_request(error=exception)
+        return None
+
+    def process_response(self, request, response):
+        search_after_request(response, base_status_code_error=400)
+        search_teardown_request()
+        return response
+
+
 class DjangoGlobalMiddleware(MiddlewareMixin):
     """
     Store request object on a thread-local variable for use in database caching mechanism.
@@ -143,6 +165,7 @@ class PostcommitTaskMiddleware(MiddlewareMixin):
     """
     def process_request(self, request):
         postcommit_before_request()
+        ban_before_request()
 
     def process_response(self, request, response):
         postcommit_after_request(response=response, base_status_error_code=400)
@@ -274,13 +274,20 @@ class NodeContributorPagination(JSONAPIPagination):
         resource_id = kwargs.get('node_id', None)
         return AbstractNode.load(resource_id)
 
+    def get_total_bibliographic(self, kwargs):
+        view = self.request.parser_context.get('view')
+        embedded_queryset = getattr(view, 'embedded_queryset', None)
+        if embedded_queryset is not None:
+            # all the contributors of the node are already loaded
+            return len([contributor for contributor in embedded_queryset if contributor.visible])
+        return self.get_resource(kwargs).visible_contributors.count()
+
     def get_paginated_response(self, data):
         """ Add number of bibliographic contributors to links.meta"""
         response = super(NodeContributorPagination, self).get_paginated_response(data)
         response_dict = response.data
         kwargs = self.request.parser_context['kwargs'].copy()
-        node = self.get_resource(kwargs)
-        total_bibliographic = node.visible_contributors.count()
+        total_bibliographic = self.get_total_bibliographic(kwargs)
         if self.request.version < '2.1':
             response_dict['links']['meta']['total_bibliographic'] = total_bibliographic
         else:
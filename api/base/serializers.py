@@ -1207,6 +1207,12 @@ class JSONAPIListSerializer(ser.ListSerializer):
                 self.child.to_esi_representation(item, envelope=None) for item in data
             ]
         else:
+            data = list(data)
+            # Load the embedded resources of the whole page at once
+            for embed in self.context.get('embed', {}).values():
+                prefetch = getattr(embed, 'prefetch', None)
+                if prefetch is not None:
+                    prefetch(data)
             ret = [
                 self.child.to_representation(item, envelope=envelope) for item in data
             ]
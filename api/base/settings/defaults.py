@@ -231,6 +231,7 @@ MIDDLEWARE = (
     'api.base.middleware.DjangoGlobalMiddleware',
     'api.base.middleware.CeleryTaskMiddleware',
     'api.base.middleware.PostcommitTaskMiddleware',
+    'api.base.middleware.SearchIndexMiddleware',
     # A profiling middleware. ONLY FOR DEV USE
     # Uncomment and add "prof" to url params to recieve a profile for that url
     # 'api.base.middleware.ProfileMiddleware',
@@ -318,8 +319,13 @@ ANONYMOUS_USER_NAME = None
 # If set to True, automated tests with extra queries will fail.
 NPLUSONE_RAISE = False
 
-# Timestamp - number of requests to send to cloud storages per minute
+# Timestamp - number of requests to send to cloud storages per minute,
+# shared by all the workers of a verification task
 TS_REQUESTS_PER_MIN = 30
+# Timestamp - number of files verified concurrently by a verification task
+TS_VERIFY_MAX_WORKERS = 4
+# Timestamp - number of verification results written to the database at once
+TS_VERIFY_CHUNK_SIZE = 100
 
 # salt used for generating hashids
 HASHIDS_SALT = 'pinkhimalayan'
@@ -336,6 +342,8 @@ ELASTICSEARCH_METRICS_DATE_FORMAT = '%Y'
 
 WAFFLE_CACHE_NAME = 'waffle_cache'
 STORAGE_USAGE_CACHE_NAME = 'storage_usage'
+CAS_PROFILE_CACHE_NAME = 'cas_profile'
+NOTIFICATION_SUBSCRIPTIONS_CACHE_NAME = 'notification_subscriptions'
 
 
 CACHES = {
@@ -349,6 +357,25 @@ CACHES = {
     WAFFLE_CACHE_NAME: {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     },
+    # Shared by the web and API workers. A table of its own keeps the culling
+    # over MAX_ENTRIES, which drops expired rows and then a fraction of the
+    # rows in cache_key order, away from the storage usage and notification caches
+    CAS_PROFILE_CACHE_NAME: {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'osf_cas_profile_cache_table',
+        'KEY_PREFIX': CAS_PROFILE_CACHE_NAME,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    NOTIFICATION_SUBSCRIPTIONS_CACHE_NAME: {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'osf_cache_table',
+        'KEY_PREFIX': NOTIFICATION_SUBSCRIPTIONS_CACHE_NAME,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
 
 SLOAN_ID_COOKIE_NAME = 'sloan_id'
@@ -453,6 +480,12 @@ SSL_GET_TIMESTAMP_HASH_RESPONSE = 'openssl ts -verify {digest_type} -digest {dig
 
 # openssl ts verify check value
 OPENSSL_VERIFY_RESULT_OK = 'OK'
+# build timestamp requests and verify timestamp tokens without the openssl command
+TIME_STAMP_IN_PROCESS = False
+# hash the download stream of files whose storage does not provide a hash,
+# instead of downloading them into a temporary directory
+TIME_STAMP_STREAMING_HASH = True
+TIME_STAMP_HASH_CHUNK_SIZE = 1024 * 1024
 # timestamp verify rootKey
 VERIFY_ROOT_CERTIFICATE = 'root_cert_verifycate.pem'
 # timestamp request const
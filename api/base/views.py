@@ -40,7 +40,7 @@ from api.nodes.permissions import ReadOnlyIfRegistration
 from api.nodes.permissions import ExcludeWithdrawals
 from api.users.serializers import UserSerializer
 from framework.auth.oauth_scopes import CoreScopes
-from osf.models import Contributor, MaintenanceState, BaseFileNode
+from osf.models import Contributor, MaintenanceState, BaseFileNode, Node
 from osf.utils.permissions import API_CONTRIBUTOR_PERMISSIONS, READ, WRITE, ADMIN
 from waffle.models import Flag, Switch, Sample
 from waffle import sample_is_active
@@ -65,9 +65,68 @@ class JSONAPIBaseView(generics.GenericAPIView):
         if getattr(field, 'field', None):
             field = field.field
 
+        # resolved views, embedded nodes and embedded lists loaded by prefetch(), shared by the items of a page
+        resolved_views = {}
+        prefetched_nodes = {}
+        prefetched_querysets = {}
+
+        def resolve_view(item):
+            key = (type(item), getattr(item, 'pk', None) or id(item))
+            if key not in resolved_views:
+                # resolve must be implemented on the field
+                resolved_views[key] = field.resolve(item, field_name, self.request)
+            v, view_args, view_kwargs = resolved_views[key]
+            # the view kwargs are updated by partial()
+            return v, view_args, dict(view_kwargs) if view_kwargs is not None else None
+
+        def get_embedded_node_id(v, view_kwargs):
+            # Node detail views look up the node from request.parents when embedded, see NodeMixin.get_node
+            lookup_url_kwarg = getattr(v.cls, 'node_lookup_url_kwarg', None)
+            if not lookup_url_kwarg or issubclass(v.cls, ListModelMixin):
+                return None
+            return view_kwargs.get(lookup_url_kwarg)
+
+        def get_embedded_list_key(v, view_kwargs):
+            # List views which can load the lists of many parents at once, see get_embedded_querysets
+            lookup_url_kwarg = getattr(v.cls, 'node_lookup_url_kwarg', None)
+            if not lookup_url_kwarg or not hasattr(v.cls, 'get_embedded_querysets'):
+                return None
+            return v.cls, view_kwargs.get(lookup_url_kwarg)
+
+        def prefetch(items):
+            """Load the nodes and the lists embedded for all the items with one query per view,
+            instead of one query per item"""
+            node_ids = set()
+            list_parents = defaultdict(dict)
+            for item in items:
+                try:
+                    v, view_args, view_kwargs = resolve_view(item)
+                except Exception:
+                    # the error is reported when the item is embedded
+                    continue
+                if not v:
+                    continue
+                list_key = get_embedded_list_key(v, view_kwargs)
+                if list_key is not None and list_key[1] and list_key not in prefetched_querysets:
+                    list_parents[list_key[0]][list_key[1]] = item
+                node_id = get_embedded_node_id(v, view_kwargs)
+                if node_id and node_id not in prefetched_nodes:
+                    node_ids.add(node_id)
+            for view_cls, parents in list_parents.items():
+                for lookup, queryset in view_cls.get_embedded_querysets(parents).items():
+                    prefetched_querysets[(view_cls, lookup)] = queryset
+            if not node_ids:
+                return
+            # deleted nodes are left to get_node, which responds 410 Gone for them
+            nodes = Node.objects.filter(guids___id__in=node_ids, is_deleted=False).annotate(
+                region=F('addons_osfstorage_node_settings__region___id'),
+                embedded_node_id=F('guids___id'),
+            ).exclude(region=None)
+            for node in nodes:
+                prefetched_nodes[node.embedded_node_id] = node
+
         def partial(item):
-            # resolve must be implemented on the field
-            v, view_args, view_kwargs = field.resolve(item, field_name, self.request)
+            v, view_args, view_kwargs = resolve_view(item)
             if not v:
                 return None
 
@@ -78,6 +137,9 @@ class JSONAPIBaseView(generics.GenericAPIView):
             cache = request._request._embed_cache
 
             request.parents.setdefault(type(item), {})[item._id] = item
+            embedded_node_id = get_embedded_node_id(v, view_kwargs)
+            if embedded_node_id in prefetched_nodes:
+                request.parents.setdefault(Node, {}).setdefault(embedded_node_id, prefetched_nodes[embedded_node_id])
 
             view_kwargs.update({
                 'request': request,
@@ -92,6 +154,7 @@ class JSONAPIBaseView(generics.GenericAPIView):
             view.request = request
             view.request.parser_context['kwargs'] = view_kwargs
             view.format_kwarg = view.get_format_suffix(**view_kwargs)
+            view.embedded_queryset = prefetched_querysets.get(get_embedded_list_key(v, view_kwargs))
 
             if not isinstance(view, ListModelMixin):
                 try:
@@ -137,6 +200,7 @@ class JSONAPIBaseView(generics.GenericAPIView):
 
             return ret
 
+        partial.prefetch = prefetch
         return partial
 
     def get_serializer_context(self):
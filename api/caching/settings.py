@@ -1,4 +1,13 @@
 NEVER_TIMEOUT = None  # for django caches setting None as a timeout value means the cache never times out.
 FIVE_MIN_TIMEOUT = 60 * 5
 
-STORAGE_USAGE_KEY = 'storage_usage:{target_id}'
+CAS_PROFILE_TIMEOUT = 60
+CAS_PROFILE_KEY = 'cas_profile:{generation}:{token_hash}'
+# Incremented to invalidate all the cached profiles, e.g. when the tokens of an application are revoked
+CAS_PROFILE_GENERATION_KEY = 'cas_profile_generation'
+
+NOTIFICATION_SUBSCRIPTIONS_TIMEOUT = FIVE_MIN_TIMEOUT
+NOTIFICATION_SUBSCRIPTIONS_KEY = 'subscriptions:{node_id}:{event_type}:{event}:{lineage_hash}'
+# Incremented to invalidate the cached subscriptions of a node and its descendants,
+# the global generation (node_id 'all') invalidates the subscriptions of all the nodes
+NOTIFICATION_SUBSCRIPTIONS_GENERATION_KEY = 'subscriptions_generation:{node_id}'
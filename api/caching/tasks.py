@@ -1,141 +1,230 @@
+from collections import defaultdict
+from concurrent import futures
 from future.moves.urllib.parse import urlparse
-from django.db import connection
 
+import contextlib
+import os
 import requests
 import logging
+import threading
 
-from django.apps import apps
-from api.caching.utils import storage_usage_cache
 from framework.postcommit_tasks.handlers import enqueue_postcommit_task
-
-from api.caching import settings as cache_settings
 from framework.celery_tasks import app
 from website import settings
 
 logger = logging.getLogger(__name__)
 
+BAN_TIMEOUT = 0.3  # 300ms timeout for bans
+# Longest path of a BAN request, the paths of a host are merged up to this length
+BAN_MAX_PATH_LENGTH = 2000
+
+# BAN requests sent and failed in this process
+BAN_STATS = {'sent': 0, 'failed': 0}
+_ban_stats_lock = threading.Lock()
+_ban_dispatcher_local = threading.local()
+# Keep-alive sessions to the Varnish servers
+_varnish_sessions = {}
+_varnish_sessions_lock = threading.Lock()
+
 
 def get_varnish_servers():
     #  TODO: this should get the varnish servers from HAProxy or a setting
     return settings.VARNISH_SERVERS
 
 
-def get_bannable_urls(instance):
+def get_bannable_paths(instance):
+    """Return the paths of the API URLs to ban for an instance, and the hostname of the API"""
     from osf.models import Comment
-    bannable_urls = []
-    parsed_absolute_url = {}
 
     if not hasattr(instance, 'absolute_api_v2_url'):
         logger.warning('Tried to ban {}:{} but it didn\'t have a absolute_api_v2_url method'.format(instance.__class__, instance))
         return [], ''
 
-    for host in get_varnish_servers():
-        # add instance url
-        varnish_parsed_url = urlparse(host)
-        parsed_absolute_url = urlparse(instance.absolute_api_v2_url)
-        url_string = '{scheme}://{netloc}{path}.*'.format(
-            scheme=varnish_parsed_url.scheme,
-            netloc=varnish_parsed_url.netloc,
-            path=parsed_absolute_url.path,
-        )
-        bannable_urls.append(url_string)
-        if isinstance(instance, Comment):
+    parsed_absolute_url = urlparse(instance.absolute_api_v2_url)
+    bannable_paths = [parsed_absolute_url.path]
+    if isinstance(instance, Comment):
+        try:
+            bannable_paths.append(urlparse(instance.target.referent.absolute_api_v2_url).path)
+        except AttributeError:
+            # some referents don't have an absolute_api_v2_url
+            pass
+        try:
+            bannable_paths.append(urlparse(instance.root_target.referent.absolute_api_v2_url).path)
+        except AttributeError:
+            # some root_targets don't have an absolute_api_v2_url
+            pass
+    return bannable_paths, parsed_absolute_url.hostname
+
+
+def merge_bannable_paths(paths, max_length=BAN_MAX_PATH_LENGTH):
+    """Merge paths into regex alternations sharing their common directory,
+    e.g. /v2/(nodes/abcde/|users/fghij/), each of them at most max_length long.
+
+    The patterns contain no ``?`` as Varnish sorts the query string of the BAN requests.
+    """
+    chunks = []
+    chunk = []
+    chunk_length = 0
+    for path in sorted(set(paths)):
+        if chunk and chunk_length + len(path) + 1 > max_length:
+            chunks.append(chunk)
+            chunk = []
+            chunk_length = 0
+        chunk.append(path)
+        chunk_length += len(path) + 1
+    if chunk:
+        chunks.append(chunk)
+
+    patterns = []
+    for chunk in chunks:
+        if len(chunk) == 1:
+            patterns.append(chunk[0])
+            continue
+        prefix = os.path.commonprefix(chunk)
+        prefix = prefix[:prefix.rfind('/') + 1]
+        patterns.append('{}({})'.format(prefix, '|'.join(path[len(prefix):] for path in chunk)))
+    return patterns
+
+
+def get_varnish_session(host):
+    with _varnish_sessions_lock:
+        if host not in _varnish_sessions:
+            _varnish_sessions[host] = requests.Session()
+        return _varnish_sessions[host]
+
+
+def count_ban(result):
+    with _ban_stats_lock:
+        BAN_STATS[result] += 1
+
+
+def send_bans(host, patterns_by_hostname):
+    """Send the BAN requests of all the patterns to a Varnish server over one connection"""
+    varnish_parsed_url = urlparse(host)
+    session = get_varnish_session(host)
+    for hostname, patterns in patterns_by_hostname.items():
+        for pattern in patterns:
+            url_to_ban = '{scheme}://{netloc}{pattern}.*'.format(
+                scheme=varnish_parsed_url.scheme,
+                netloc=varnish_parsed_url.netloc,
+                pattern=pattern,
+            )
+            request = requests.Request('BAN', url_to_ban, headers=dict(Host=hostname)).prepare()
+            # requests would quote the | of the alternations, Varnish matches the raw URL
+            request.url = url_to_ban
             try:
-                parsed_target_url = urlparse(instance.target.referent.absolute_api_v2_url)
-            except AttributeError:
-                # some referents don't have an absolute_api_v2_url
-                # I'm looking at you NodeWikiPage
-                # Note: NodeWikiPage has been deprecated. Is this an issue with WikiPage/WikiVersion?
-                pass
+                response = session.send(request, timeout=BAN_TIMEOUT)
+            except Exception as ex:
+                count_ban('failed')
+                logger.error('Banning {} failed: {}'.format(url_to_ban, ex))
             else:
-                url_string = '{scheme}://{netloc}{path}.*'.format(
-                    scheme=varnish_parsed_url.scheme,
-                    netloc=varnish_parsed_url.netloc,
-                    path=parsed_target_url.path,
-                )
-                bannable_urls.append(url_string)
+                if not response.ok:
+                    count_ban('failed')
+                    logger.error('Banning {} failed: {}'.format(url_to_ban, response.text))
+                else:
+                    count_ban('sent')
+                    logger.info('Banning {} succeeded'.format(url_to_ban))
 
-            try:
-                parsed_root_target_url = urlparse(instance.root_target.referent.absolute_api_v2_url)
-            except AttributeError:
-                # some root_targets don't have an absolute_api_v2_url
-                pass
-            else:
-                url_string = '{scheme}://{netloc}{path}.*'.format(
-                    scheme=varnish_parsed_url.scheme,
-                    netloc=varnish_parsed_url.netloc,
-                    path=parsed_root_target_url.path,
-                )
-                bannable_urls.append(url_string)
 
-    return bannable_urls, parsed_absolute_url.hostname
+class BanDispatcher(object):
+    """Collect the URLs to ban for the instances changed in a request or a task
 
+    The paths of the instances are merged into a few regex alternations per API
+    hostname, which are sent to all the Varnish servers concurrently.
+    """
 
-@app.task(max_retries=5, default_retry_delay=60)
-def ban_url(instance):
-    # TODO: Refactor; Pull url generation into postcommit_task handling so we only ban urls once per request
-    timeout = 0.3  # 300ms timeout for bans
-    if settings.ENABLE_VARNISH:
-        bannable_urls, hostname = get_bannable_urls(instance)
+    def __init__(self):
+        self.paths = defaultdict(set)
+
+    def add(self, instance):
+        bannable_paths, hostname = get_bannable_paths(instance)
+        self.paths[hostname].update(bannable_paths)
+
+    def dispatch(self):
+        paths = self.paths
+        self.paths = defaultdict(set)
+        if not settings.ENABLE_VARNISH or not paths:
+            return
+        patterns_by_hostname = {
+            hostname: merge_bannable_paths(hostname_paths)
+            for hostname, hostname_paths in paths.items()
+        }
+        servers = get_varnish_servers()
+        if not servers:
+            return
+        with futures.ThreadPoolExecutor(max_workers=len(servers)) as executor:
+            for future in [executor.submit(send_bans, host, patterns_by_hostname) for host in servers]:
+                future.result()
 
-        for url_to_ban in set(bannable_urls):
-            try:
-                response = requests.request(
-                    'BAN', url_to_ban, timeout=timeout, headers=dict(
-                        Host=hostname,
-                    ),
-                )
-            except Exception as ex:
-                logger.error('Banning {} failed: {}'.format(
-                    url_to_ban,
-                    ex.message,
-                ))
-            else:
-                if not response.ok:
-                    logger.error('Banning {} failed: {}'.format(
-                        url_to_ban,
-                        response.text,
-                    ))
-                else:
-                    logger.info('Banning {} succeeded'.format(
-                        url_to_ban,
-                    ))
 
+def get_ban_dispatcher():
+    return getattr(_ban_dispatcher_local, 'dispatcher', None)
 
-@app.task(max_retries=5, default_retry_delay=10)
-def update_storage_usage_cache(target_id, target_guid, per_page=500000):
-    if not settings.ENABLE_STORAGE_USAGE_CACHE:
+
+@contextlib.contextmanager
+def ban_dispatcher():
+    """Collect the bans of the block and send them when the block exits
+
+    Nested blocks share the outermost dispatcher. The bans are discarded if the block raises.
+    """
+    if get_ban_dispatcher() is not None:
+        yield get_ban_dispatcher()
         return
-    sql = """
-        SELECT count(size), sum(size) from
-        (SELECT size FROM osf_basefileversionsthrough AS obfnv
-        LEFT JOIN osf_basefilenode file ON obfnv.basefilenode_id = file.id
-        LEFT JOIN osf_fileversion version ON obfnv.fileversion_id = version.id
-        LEFT JOIN django_content_type type on file.target_content_type_id = type.id
-        WHERE file.provider = 'osfstorage'
-        AND type.model = 'abstractnode'
-        AND file.deleted_on IS NULL
-        AND file.target_object_id=%s
-        ORDER BY version.id
-        LIMIT %s OFFSET %s) file_page
+    dispatcher = BanDispatcher()
+    _ban_dispatcher_local.dispatcher = dispatcher
+    try:
+        yield dispatcher
+    finally:
+        _ban_dispatcher_local.dispatcher = None
+    dispatcher.dispatch()
+
+
+def ban_before_request():
+    """Start the request with a new dispatcher, dropping the bans left by a previous request
+    of the thread whose postcommit tasks did not run"""
+    _ban_dispatcher_local.request_dispatcher = None
+
+
+def enqueue_ban(instance):
+    """Ban the API URLs of an instance once the request is committed
+
+    All the bans of a request are sent together. Inside a ``ban_dispatcher`` block,
+    they are sent when the block exits.
     """
-    count = per_page
-    offset = 0
-    storage_usage_total = 0
-    with connection.cursor() as cursor:
-        while count:
-            cursor.execute(sql, [target_id, per_page, offset])
-            result = cursor.fetchall()
-            storage_usage_total += int(result[0][1]) if result[0][1] else 0
-            count = int(result[0][0]) if result[0][0] else 0
-            offset += count
-
-    key = cache_settings.STORAGE_USAGE_KEY.format(target_id=target_guid)
-    storage_usage_cache.set(key, storage_usage_total, cache_settings.FIVE_MIN_TIMEOUT)
-
-
-def update_storage_usage(target):
-    Preprint = apps.get_model('osf.preprint')
-
-    if settings.ENABLE_STORAGE_USAGE_CACHE and not isinstance(target, Preprint) and not target.is_quickfiles:
-        enqueue_postcommit_task(update_storage_usage_cache, (target.id, target._id,), {}, celery=True)
+    if not settings.ENABLE_VARNISH:
+        return
+    dispatcher = get_ban_dispatcher()
+    if dispatcher is not None:
+        dispatcher.add(instance)
+        return
+    dispatcher = getattr(_ban_dispatcher_local, 'request_dispatcher', None)
+    if dispatcher is None:
+        dispatcher = _ban_dispatcher_local.request_dispatcher = BanDispatcher()
+    dispatcher.add(instance)
+    enqueue_postcommit_task(dispatch_bans, (dispatcher, ), {}, celery=False, once_per_request=True)
+
+
+def dispatch_bans(dispatcher):
+    dispatcher.dispatch()
+
+
+def get_bannable_urls(instance):
+    bannable_paths, hostname = get_bannable_paths(instance)
+    bannable_urls = []
+    for host in get_varnish_servers():
+        varnish_parsed_url = urlparse(host)
+        for path in bannable_paths:
+            bannable_urls.append('{scheme}://{netloc}{path}.*'.format(
+                scheme=varnish_parsed_url.scheme,
+                netloc=varnish_parsed_url.netloc,
+                path=path,
+            ))
+    return bannable_urls, hostname
+
+
+@app.task(max_retries=5, default_retry_delay=60)
+def ban_url(instance):
+    if settings.ENABLE_VARNISH:
+        with ban_dispatcher() as dispatcher:
+            dispatcher.add(instance)
+
@@ -0,0 +1,74 @@
+import mock
+import pytest
+
+from api.caching import tasks
+from osf_tests.factories import ProjectFactory, UserFactory
+
+
+def test_merge_bannable_paths():
+    assert tasks.merge_bannable_paths(['/v2/nodes/abcde/']) == ['/v2/nodes/abcde/']
+    assert tasks.merge_bannable_paths(
+        ['/v2/users/fghij/', '/v2/nodes/abcde/', '/v2/nodes/klmno/', '/v2/nodes/abcde/']
+    ) == ['/v2/(nodes/abcde/|nodes/klmno/|users/fghij/)']
+
+
+def test_merge_bannable_paths_max_length():
+    paths = ['/v2/nodes/{}/'.format(i) for i in range(10, 20)]
+    patterns = tasks.merge_bannable_paths(paths, max_length=50)
+    assert len(patterns) > 1
+    assert all(len(pattern) <= 50 + len('()') for pattern in patterns)
+    assert patterns[0] == '/v2/nodes/(10/|11/|12/)'
+
+
+@pytest.mark.django_db
+@mock.patch('api.caching.tasks.settings.ENABLE_VARNISH', True)
+@mock.patch('api.caching.tasks.settings.VARNISH_SERVERS', ['http://varnish1:8080', 'http://varnish2:8080'])
+class TestBanDispatcher:
+
+    @mock.patch('api.caching.tasks.get_varnish_session')
+    def test_ban_once_per_server(self, mock_get_session):
+        mock_get_session.return_value.send.return_value.ok = True
+        sent = tasks.BAN_STATS['sent']
+        nodes = [ProjectFactory(), ProjectFactory()]
+        user = UserFactory()
+
+        with tasks.ban_dispatcher():
+            for instance in nodes + [user, nodes[0]]:
+                tasks.enqueue_ban(instance)
+            assert not mock_get_session.return_value.send.called
+
+        assert sorted(call[0][0] for call in mock_get_session.call_args_list) == \
+            ['http://varnish1:8080', 'http://varnish2:8080']
+        requests = [call[0][0] for call in mock_get_session.return_value.send.call_args_list]
+        assert len(requests) == 2
+        for request in requests:
+            assert request.method == 'BAN'
+            assert '|' in request.url
+            for instance in nodes + [user]:
+                assert '{}/'.format(instance._id) in request.url
+        assert tasks.BAN_STATS['sent'] == sent + 2
+
+    @mock.patch('api.caching.tasks.get_varnish_session')
+    def test_failed_ban_is_counted(self, mock_get_session):
+        mock_get_session.return_value.send.side_effect = ValueError()
+        failed = tasks.BAN_STATS['failed']
+
+        tasks.ban_url(ProjectFactory())
+
+        assert tasks.BAN_STATS['failed'] == failed + 2
+
+    @mock.patch('api.caching.tasks.enqueue_postcommit_task')
+    def test_request_dispatcher_is_reset_by_next_request(self, mock_enqueue):
+        # the postcommit tasks of the first request do not run, e.g. it failed
+        tasks.ban_before_request()
+        first, second = ProjectFactory(), ProjectFactory()
+        tasks.enqueue_ban(first)
+
+        tasks.ban_before_request()
+        tasks.enqueue_ban(second)
+
+        dispatcher = mock_enqueue.call_args[0][1][0]
+        assert dispatcher is not mock_enqueue.call_args_list[0][0][1][0]
+        paths = set().union(*dispatcher.paths.values())
+        assert any(second._id in path for path in paths)
+        assert not any(first._id in path for path in paths)
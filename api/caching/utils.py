@@ -1,4 +1,5 @@
 from django.core.cache import caches
 from django.conf import settings
 
-storage_usage_cache = caches[settings.STORAGE_USAGE_CACHE_NAME]
+cas_profile_cache = caches[settings.CAS_PROFILE_CACHE_NAME]
+notification_subscriptions_cache = caches[settings.NOTIFICATION_SUBSCRIPTIONS_CACHE_NAME]
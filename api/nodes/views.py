@@ -1,5 +1,6 @@
 import re
 
+from collections import defaultdict
 from datetime import datetime
 from distutils.version import StrictVersion
 from django.apps import apps
@@ -129,7 +130,7 @@ from framework.exceptions import HTTPError, PermissionsError
 from framework.auth.oauth_scopes import CoreScopes
 from framework.sentry import log_exception
 from osf.features import OSF_GROUPS
-from osf.models import AbstractNode, NodeLog
+from osf.models import AbstractNode, Contributor, NodeLog
 from osf.models import (Node, PrivateLink, Institution, Comment, DraftRegistration, Registration, )
 from osf.models import OSFUser
 from osf.models import OSFGroup
@@ -469,9 +470,39 @@ class NodeContributorsList(BaseContributorList, bulk_views.BulkUpdateJSONAPIView
     view_name = 'node-contributors'
     ordering = ('_order',)  # default ordering
 
+    # contributors loaded with the contributors of the other nodes of a page, see get_embedded_querysets
+    embedded_queryset = None
+
+    @classmethod
+    def get_embedded_querysets(cls, parents):
+        """Load the contributors embedded for the nodes of a page with one query
+
+        :param dict parents: nodes by guid
+        :return dict: evaluated querysets of the contributors of the nodes, by guid
+        """
+        nodes = {node.id: (guid, node) for guid, node in parents.items() if isinstance(node, AbstractNode)}
+        contributors = defaultdict(list)
+        for contributor in Contributor.objects.filter(
+            node_id__in=list(nodes.keys()),
+        ).order_by('node_id', '_order').include('user__guids'):
+            contributors[contributor.node_id].append(contributor)
+        querysets = {}
+        for node_id, (guid, node) in nodes.items():
+            queryset = node.contributor_set.all().include('user__guids')
+            queryset._result_cache = contributors[node_id]
+            queryset._prefetch_done = True
+            querysets[guid] = queryset
+        return querysets
+
     def get_resource(self):
         return self.get_node()
 
+    def get_default_queryset(self):
+        queryset = super(NodeContributorsList, self).get_default_queryset()
+        if self.embedded_queryset is not None:
+            return self.embedded_queryset
+        return queryset
+
     # overrides ListBulkCreateJSONAPIView, BulkUpdateJSONAPIView, BulkDeleteJSONAPIView
     def get_serializer_class(self):
         """
@@ -1,12 +1,15 @@
 import functools
+import mock
 import pytest
 
 from api.base.settings.defaults import API_BASE
+from api.nodes.views import NodeContributorsList
 from framework.auth.core import Auth
 from osf_tests.factories import (
     ProjectFactory,
     AuthUserFactory
 )
+from osf.models import Node
 from osf.utils.permissions import WRITE
 from rest_framework import exceptions
 
@@ -156,3 +159,60 @@ class TestNodeEmbeds:
         res = app.get(url, auth=write_contrib_one.auth)
         assert res.status_code == 200
         assert res.json['data']['embeds']['contributors']['meta']['total_bibliographic'] == 3
+
+    def test_node_list_embed_parent(
+            self, app, user, write_contrib_one,
+            subchild, root_node, child_one, child_two):
+        # the parents of all nodes of the page are loaded at once
+        url = '/{}nodes/{}/children/?embed=parent'.format(API_BASE, root_node._id)
+        res = app.get(url, auth=user.auth)
+        assert res.status_code == 200
+        parents = {
+            node['id']: node['embeds']['parent']['data']['id']
+            for node in res.json['data']
+        }
+        assert parents == {
+            child_one._id: root_node._id,
+            child_two._id: root_node._id,
+        }
+
+        # the permissions of the prefetched parents are checked
+        url = '/{}users/{}/nodes/?embed=parent'.format(API_BASE, write_contrib_one._id)
+        res = app.get(url, auth=write_contrib_one.auth)
+        assert res.status_code == 200
+        embeds = {node['id']: node['embeds'] for node in res.json['data']}
+        assert embeds[child_one._id]['parent']['data']['id'] == root_node._id
+        assert embeds[subchild._id]['parent']['errors'][0]['detail'] == exceptions.PermissionDenied.default_detail
+
+    def test_node_list_embed_deleted_parent(
+            self, app, write_contrib_one, root_node, child_one):
+        Node.objects.filter(id=root_node.id).update(is_deleted=True)
+        url = '/{}users/{}/nodes/?embed=parent'.format(API_BASE, write_contrib_one._id)
+        res = app.get(url, auth=write_contrib_one.auth)
+        assert res.status_code == 200
+        embeds = {node['id']: node['embeds'] for node in res.json['data']}
+        assert embeds[child_one._id]['parent']['errors'][0]['detail'] == 'The requested node is no longer available.'
+
+    def test_node_list_embed_contributors(
+            self, app, user, write_contribs, root_node, child_one, child_two):
+        url = '/{}nodes/{}/children/?embed=contributors'.format(API_BASE, root_node._id)
+        with mock.patch.object(
+                NodeContributorsList, 'get_embedded_querysets',
+                wraps=NodeContributorsList.get_embedded_querysets) as mock_get_embedded_querysets:
+            res = app.get(url, auth=user.auth)
+        assert res.status_code == 200
+        # the contributors of all nodes of the page are loaded at once
+        assert mock_get_embedded_querysets.call_count == 1
+        contributors = {
+            node['id']: [contrib['id'] for contrib in node['embeds']['contributors']['data']]
+            for node in res.json['data']
+        }
+        assert contributors == {
+            child_one._id: ['{}-{}'.format(child_one._id, contrib._id) for contrib in [user] + write_contribs],
+            child_two._id: ['{}-{}'.format(child_two._id, user._id)],
+        }
+        total_bibliographic = {
+            node['id']: node['embeds']['contributors']['links']['meta']['total_bibliographic']
+            for node in res.json['data']
+        }
+        assert total_bibliographic == {child_one._id: 3, child_two._id: 1}
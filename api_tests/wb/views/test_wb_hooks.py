@@ -5,8 +5,6 @@ import pytest
 from addons.osfstorage.models import OsfStorageFolder
 from framework.auth import signing
 
-from api.caching.tasks import update_storage_usage_cache
-
 from osf_tests.factories import (
     AuthUserFactory,
     ProjectFactory,
@@ -330,23 +328,22 @@ class TestMove():
 
     def test_storage_usage_move_within_node(self, app, node, signed_payload, move_url):
         """
-        Checking moves within a node, since the net value hasn't changed the cache will remain expired at None.
+        Checking moves within a node, the net value doesn't change.
         """
-        assert node.storage_usage is None
+        assert node.storage_usage == 1337
 
         res = app.post_json(move_url, signed_payload)
 
         assert res.status_code == 200
-        assert node.storage_usage is None  # this is intentional, the cache shouldn't be touched
+        assert node.storage_usage == 1337
 
     def test_storage_usage_move_between_nodes(self, app, node, node_two, file, root_node, user, node_two_root_node, move_url):
         """
-        Checking storage usage when moving files outside a node mean both need to be recalculated, as both values have
-        changed.
+        Checking storage usage when moving files outside a node, the size moves from one node to the other.
         """
 
-        assert node.storage_usage is None  # the cache starts expired, but there is 1337 bytes in there
-        assert node_two.storage_usage is None  # zero bytes here
+        assert node.storage_usage == 1337
+        assert node_two.storage_usage == 0
 
         signed_payload = sign_payload(
             {
@@ -363,7 +360,7 @@ class TestMove():
         res = app.post_json(move_url, signed_payload)
         assert res.status_code == 200
 
-        assert node.storage_usage is None
+        assert node.storage_usage == 0
         assert node_two.storage_usage == 1337
 
 
@@ -846,7 +843,7 @@ class TestCopy():
         """
         Checking copys within a node, since the net size will double the storage usage should be the file size * 2
         """
-        assert node.storage_usage is None
+        assert node.storage_usage == 1337
 
         res = app.post_json(copy_url, signed_payload)
 
@@ -855,11 +852,11 @@ class TestCopy():
 
     def test_storage_usage_copy_between_nodes(self, app, node, node_two, file, user, node_two_root_node, copy_url):
         """
-        Checking storage usage when copying files to outside a node means only the destination should be recalculated.
+        Checking storage usage when copying files to outside a node means only the destination changes.
         """
 
-        assert node.storage_usage is None  # The node cache starts expired, but there is 1337 bytes in there
-        assert node_two.storage_usage is None  # There are zero bytes in node_two
+        assert node.storage_usage == 1337
+        assert node_two.storage_usage == 0
 
         signed_payload = sign_payload(
             {
@@ -876,11 +873,6 @@ class TestCopy():
         res = app.post_json(copy_url, signed_payload)
         assert res.status_code == 201
 
-        # The node cache is None because it's value should be unchanged --
-        assert node.storage_usage is None
-
-        # But there's really 1337 bytes in the node
-        update_storage_usage_cache(node.id, node._id)
         assert node.storage_usage == 1337
 
         # And we have exactly 1337 bytes copied in node_two
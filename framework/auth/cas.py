@@ -2,18 +2,27 @@
 
 import furl
 from rest_framework import status as http_status
+import hashlib
 import json
+import logging
 from future.moves.urllib.parse import quote, urlparse, parse_qs, urlunparse, urlencode
 
 from lxml import etree
 import requests
 
+from api.caching import settings as cache_settings
+from api.caching.utils import cas_profile_cache
 from framework.auth import authenticate, external_first_login_authenticate
 from framework.auth.core import get_user, generate_verification_key
 from framework.flask import redirect
 from framework.exceptions import HTTPError
 from website import settings
 
+logger = logging.getLogger(__name__)
+
+# Hits and misses of the profile cache in this process
+PROFILE_CACHE_STATS = {'hit': 0, 'miss': 0}
+
 
 class CasError(HTTPError):
     """General CAS-related error."""
@@ -124,18 +133,31 @@ class CasClient(object):
         """
         Send request to get profile information, given an access token.
 
+        Authenticated profiles are cached for ``CAS_PROFILE_TIMEOUT`` seconds.
+
         :param str access_token: CAS access_token.
         :rtype: CasResponse
         :raises: CasError if an unexpected response is returned.
         """
 
+        key = get_profile_cache_key(access_token)
+        cas_resp = cas_profile_cache.get(key)
+        if cas_resp is not None:
+            PROFILE_CACHE_STATS['hit'] += 1
+            return cas_resp
+        PROFILE_CACHE_STATS['miss'] += 1
+        logger.debug('CAS profile cache miss ({hit} hits, {miss} misses)'.format(**PROFILE_CACHE_STATS))
+
         url = self.get_profile_url()
         headers = {
             'Authorization': 'Bearer {}'.format(access_token),
         }
         resp = requests.get(url, headers=headers)
         if resp.status_code == 200:
-            return self._parse_profile(resp.content, access_token)
+            cas_resp = self._parse_profile(resp.content, access_token)
+            if cas_resp.authenticated:
+                cas_profile_cache.set(key, cas_resp, cache_settings.CAS_PROFILE_TIMEOUT)
+            return cas_resp
         else:
             self._handle_error(resp)
 
@@ -184,11 +206,33 @@ class CasClient(object):
 
         resp = requests.post(url, data=payload)
         if resp.status_code == 204:
+            # drop the cached profiles once CAS no longer accepts the tokens, a
+            # profile cached while the revocation was in flight is dropped too
+            if 'token' in payload:
+                cas_profile_cache.delete(get_profile_cache_key(payload['token']))
+            else:
+                clear_profile_cache()
             return True
         else:
             self._handle_error(resp)
 
 
+def get_profile_cache_key(access_token):
+    # do not store the token itself in the cache
+    return cache_settings.CAS_PROFILE_KEY.format(
+        generation=cas_profile_cache.get(cache_settings.CAS_PROFILE_GENERATION_KEY, 0),
+        token_hash=hashlib.sha256(access_token.encode('utf-8')).hexdigest(),
+    )
+
+
+def clear_profile_cache():
+    """Invalidate all the cached profiles"""
+    try:
+        cas_profile_cache.incr(cache_settings.CAS_PROFILE_GENERATION_KEY)
+    except ValueError:
+        cas_profile_cache.set(cache_settings.CAS_PROFILE_GENERATION_KEY, 1, cache_settings.NEVER_TIMEOUT)
+
+
 def parse_auth_header(header):
     """
     Given an Authorization header string, e.g. 'Bearer abc123xyz',
@@ -68,14 +68,16 @@ MAPCORE_SYNC_IGNORE_ERROR = True
 
 # for GakuNin mAP Core (API v2)
 # If node is not None, mapcore_sync_rdm_project_or_map_group() is called.
+# On my projects pages, mapcore_sync_user_groups() is enqueued.
 def mapcore_check_token(auth, node, use_mapcore=True):
+    from framework.celery_tasks.handlers import enqueue_task
     from nii.mapcore_api import MAPCoreTokenExpired
     from nii.mapcore import (mapcore_sync_is_enabled,
                              mapcore_api_is_available,
                              mapcore_log_error,
                              mapcore_url_is_my_projects,
-                             mapcore_sync_rdm_my_projects,
                              mapcore_sync_rdm_project_or_map_group)
+    from nii.mapcore_sync_groups import mapcore_sync_user_groups
 
     # from framework import status
     # msg = 'test mapcore message'
@@ -87,8 +89,10 @@ def mapcore_check_token(auth, node, use_mapcore=True):
         try:
             try:
                 if mapcore_url_is_my_projects(request.url):
-                    # include MAPCore.get_my_groups() to check my token
-                    mapcore_sync_rdm_my_projects(auth.user, use_raise=True)
+                    mapcore_api_is_available(auth.user)  # to check my token
+                    # the page shows the synchronized projects, and the
+                    # groups are synchronized in background
+                    enqueue_task(mapcore_sync_user_groups.s(auth.user._id))
                 elif node:
                     node_page = True
                     mapcore_api_is_available(auth.user)  # to check my token
@@ -64,8 +64,124 @@ def send_email(from_addr, to_addr, subject, message, mimetype='html', ttls=True,
         )
 
 
+@app.task
+def send_emails(emails):
+    """Send many emails, reusing a SMTP connection or a Sendgrid client for all of them.
+
+    An email which cannot be sent is logged and skipped. A SMTP connection closed by the
+    server is opened again for the next email. An email to a recipient which is not in
+    SENDGRID_EMAIL_WHITELIST is skipped and counted as done, as it would never be sent.
+
+    :param list emails: The keyword arguments of ``send_email`` for each email
+    :return: The list of whether each email is done
+    """
+    if not settings.USE_EMAIL:
+        return
+    if settings.SENDGRID_API_KEY:
+        client = sendgrid.SendGridClient(settings.SENDGRID_API_KEY)
+        return [_send_with_sendgrid_client(email, client) for email in emails]
+
+    connections = {}
+    try:
+        return [_send_with_smtp_connections(email, connections) for email in emails]
+    finally:
+        for connection in connections.values():
+            _quit_smtp_connection(connection)
+
+
+def _send_with_smtp_connections(email, connections):
+    """Send an email of ``send_emails`` with the connection of its SMTP settings
+
+    :param dict connections: The open connections by SMTP settings, updated when a connection is opened or lost
+    :return: True if the email is sent
+    """
+    ttls = email.get('ttls', True)
+    login = email.get('login', True)
+    username = email.get('username') or settings.MAIL_USERNAME
+    password = email.get('password') or settings.MAIL_PASSWORD
+    if login and (username is None or password is None):
+        logger.error('Mail username and password not set; skipping send.')
+        return False
+    key = (ttls, login, username, password)
+    for retry in (False, True):
+        try:
+            if key not in connections:
+                connections[key] = _open_smtp_connection(ttls, login, username, password)
+            return bool(_send_with_smtp(
+                from_addr=email['from_addr'],
+                to_addr=email['to_addr'],
+                cc_addr=email.get('cc_addr'),
+                replyto=email.get('replyto'),
+                subject=email['subject'],
+                message=email['message'],
+                _charset=email.get('_charset') or 'utf-8',
+                mimetype=email.get('mimetype', 'html'),
+                ttls=ttls,
+                login=login,
+                username=username,
+                password=password,
+                connection=connections[key],
+            ))
+        except smtplib.SMTPServerDisconnected:
+            _quit_smtp_connection(connections.pop(key, None))
+            if not retry:
+                logger.warning('SMTP server disconnected; reconnecting.')
+                continue
+            logger.exception('SMTP server disconnected; cannot send email to {}'.format(email['to_addr']))
+        except (smtplib.SMTPException, OSError):
+            logger.exception('Cannot send email to {}'.format(email['to_addr']))
+        return False
+
+
+def _send_with_sendgrid_client(email, client):
+    """Send an email of ``send_emails`` with the shared Sendgrid client
+
+    :return: True if the email is sent or skipped by the whitelist mode
+    """
+    try:
+        sent = _send_with_sendgrid(
+            from_addr=email['from_addr'],
+            to_addr=email['to_addr'],
+            cc_addr=email.get('cc_addr'),
+            replyto=email.get('replyto'),
+            subject=email['subject'],
+            message=email['message'],
+            mimetype=email.get('mimetype', 'html'),
+            categories=email.get('categories'),
+            attachment_name=email.get('attachment_name'),
+            attachment_content=email.get('attachment_content'),
+            client=client,
+        )
+    except Exception:
+        logger.exception('Cannot send email to {}'.format(email['to_addr']))
+        return False
+    # None when the recipient is not whitelisted
+    return sent is None or sent
+
+
+def _quit_smtp_connection(connection):
+    """Close the connection, ignoring the errors of a connection which is already lost"""
+    if connection is None:
+        return
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
+
+
+def _open_smtp_connection(ttls, login, username, password):
+    s = smtplib.SMTP(settings.MAIL_SERVER, settings.MAIL_PORT)
+    s.ehlo()
+    if ttls:
+        s.starttls()
+        s.ehlo()
+    if login:
+        s.login(username, password)
+    return s
+
+
 def _send_with_smtp(from_addr, to_addr, subject, message, mimetype='html', ttls=True, login=True, username=None, password=None,
-                    cc_addr=None, replyto=None, _charset='utf-8'):
+                    cc_addr=None, replyto=None, _charset='utf-8', connection=None):
     username = username or settings.MAIL_USERNAME
     password = password or settings.MAIL_PASSWORD
 
@@ -87,19 +203,15 @@ def _send_with_smtp(from_addr, to_addr, subject, message, mimetype='html', ttls=
     if replyto is not None:
         msg['Reply-To'] = replyto
 
-    s = smtplib.SMTP(settings.MAIL_SERVER, settings.MAIL_PORT)
-    s.ehlo()
-    if ttls:
-        s.starttls()
-        s.ehlo()
-    if login:
-        s.login(username, password)
+    # Use the given connection as is, e.g. from send_emails
+    s = connection or _open_smtp_connection(ttls, login, username, password)
     s.sendmail(
         from_addr=from_addr,
         to_addrs=[a for a in to_addrs if len(a) > 0],
         msg=msg.as_string()
     )
-    s.quit()
+    if connection is None:
+        s.quit()
     return True
 
 
@@ -4,19 +4,23 @@
 
 import time
 import datetime
+import hashlib
+import json
 import logging
 import os
 import sys
+import threading
 import requests
 import base64
 from urllib.parse import quote, urlencode
 import re
 from operator import attrgetter
+from concurrent import futures
 from pprint import pformat as pp
 from urllib.parse import urlparse
 
 from django.utils import timezone
-from django.db import transaction
+from django.db import connection, transaction
 from django.core.exceptions import ObjectDoesNotExist
 
 logger = logging.getLogger(__name__)
@@ -40,11 +44,13 @@ from website.settings import (MAPCORE_HOSTNAME,
                               MAPCORE_CLIENTID,
                               MAPCORE_SECRET,
                               MAPCORE_AUTHCODE_MAGIC,
+                              MAPCORE_SYNC_CONCURRENCY,
                               DOMAIN)
 from nii.mapcore_api import (MAPCore, MAPCoreException, VERIFY,
                              mapcore_logger,
                              mapcore_api_disable_log,
-                             mapcore_group_member_is_private)
+                             mapcore_group_member_is_private,
+                             mapcore_lock, mapcore_unlock)
 
 logger = mapcore_logger(logger)
 
@@ -130,66 +136,31 @@ def mapcore_log_error(msg):
 # lock node or user
 #
 class MAPCoreLocker():
-    def lock_user(self, user):
-        while True:
-            #print('before transaction.atomic')
-            with transaction.atomic():
-                #print('transaction.atomic start')
-                u = OSFUser.objects.select_for_update().get(username=user.username)
-                if not u.mapcore_api_locked:
-                    #print('before lock')
-                    #time.sleep(5) # for debug
-                    u.mapcore_api_locked = True
-                    u.save()
-                    logger.debug('OSFUser(' + u.username + ').mapcore_api_locked=True')
-                    return
-            #print('cannot get lock, sleep 1')
-            time.sleep(1)
+    def lock_user(self, user, blocking=True):
+        if not mapcore_lock(self._user_lock_name(user), blocking=blocking):
+            return False
+        logger.debug('OSFUser(' + user.username + ') is locked')
+        return True
 
     def unlock_user(self, user):
-        with transaction.atomic():
-            u = OSFUser.objects.select_for_update().get(username=user.username)
-            u.mapcore_api_locked = False
-            u.save()
-            logger.debug('OSFUser(' + u.username + ').mapcore_api_locked=False')
+        mapcore_unlock(self._user_lock_name(user))
+        logger.debug('OSFUser(' + user.username + ') is unlocked')
 
     def lock_node(self, node):
-        while True:
-            with transaction.atomic():
-                #print('transaction.atomic start')
-                n = Node.objects.select_for_update().get(guids___id=node._id)
-                if not n.mapcore_api_locked:
-                    n.mapcore_api_locked = True
-                    n.save()
-                    logger.debug('Node(' + n._id + ').mapcore_api_locked=True')
-                    return
-            #print('cannot get lock, sleep 1')
-            time.sleep(1)
+        mapcore_lock(self._node_lock_name(node))
+        logger.debug('Node(' + node._id + ') is locked')
 
     def unlock_node(self, node):
-        with transaction.atomic():
-            n = Node.objects.select_for_update().get(guids___id=node._id)
-            #print('n.mapcore_api_locked={}'.format(n.mapcore_api_locked))
-            n.mapcore_api_locked = False
-            n.save()
-            logger.debug('Node(' + n._id + ').mapcore_api_locked=False')
+        mapcore_unlock(self._node_lock_name(node))
+        logger.debug('Node(' + node._id + ') is unlocked')
 
-locker = MAPCoreLocker()
+    def _user_lock_name(self, user):
+        return 'mapcore_user:{}'.format(user.username)
 
-def mapcore_unlock_all():
-    logger.info('mapcore_unlock_all() start')
-    with transaction.atomic():
-        for user in OSFUser.objects.all():
-            if user.mapcore_api_locked:
-                user.mapcore_api_locked = False
-                user.save()
-                logger.info('mapcore_unlock_all(): unlocked: User={}'.format(user.username))
-        for node in Node.objects.all():
-            if node.mapcore_api_locked:
-                node.mapcore_api_locked = False
-                node.save()
-                logger.info('mapcore_unlock_all(): unlocked: Node={}'.format(node._id))
-    logger.info('mapcore_unlock_all() done')
+    def _node_lock_name(self, node):
+        return 'mapcore_node:{}'.format(node._id)
+
+locker = MAPCoreLocker()
 
 def mapcore_request_authcode(user, params):
     '''
@@ -700,17 +671,19 @@ def mapcore_sync_map_new_group(user, node, use_raise=False):
             return None
 
 
-def mapcore_create_new_node_from_mapgroup(mapcore, map_group):
+def mapcore_create_new_node_from_mapgroup(mapcore, map_group, group_info_ext=None):
     '''
     create new Node from mAP group info
     :param map_group: dict: mAP group info by get_my_group
+    :param group_info_ext: dict: extended group info of map_group when already have
     :return: Node object or None at error
     '''
 
     logger.debug('mapcore_create_new_node_from_mapgroup({}, group_name={}) start'.format(mapcore.user.username, map_group['group_name']))
     # switch to admin user
     group_key = map_group['group_key']
-    group_info_ext = mapcore_get_extended_group_info(mapcore.user, None, group_key, base_grp=map_group)
+    if group_info_ext is None:
+        group_info_ext = mapcore_get_extended_group_info(mapcore.user, None, group_key, base_grp=map_group)
 
     logger.debug('mapcore_create_new_node_from_mapgroup({}, group_name={}) mapcore_get_extended_group_info done'.format(mapcore.user.username, map_group['group_name']))
 
@@ -756,9 +729,9 @@ def mapcore_sync_rdm_project0(access_user, node, title_desc=False, contributors=
     from osf.utils.permissions import CREATOR_PERMISSIONS, DEFAULT_CONTRIBUTOR_PERMISSIONS
     logger.debug('mapcore_sync_rdm_project0(' + utf8(node.title) + ') start')
 
+    if lock_node:
+        locker.lock_node(node)
     try:
-        if lock_node:
-            locker.lock_node(node)
         # take mAP group info
         group_key = node.map_group_key
         map_group = mapcore_get_extended_group_info(access_user, node, group_key)
@@ -876,9 +849,9 @@ def mapcore_sync_map_group0(access_user, node, title_desc=True, contributors=Tru
         logger.info('Node is deleted.  nothing to do.')
         return False
 
+    if lock_node:
+        locker.lock_node(node)
     try:
-        if lock_node:
-            locker.lock_node(node)
         group_key = node.map_group_key
 
         # sync group info
@@ -980,13 +953,55 @@ def mapcore_url_is_my_projects(request_url):
             return True
     return False
 
-def mapcore_sync_rdm_my_projects0(user):
+def mapcore_group_fingerprint(group_ext):
+    '''
+    mAPグループの情報とメンバー一覧のハッシュ値 (Node.mapcore_group_fingerprint と比較する)
+    :param group_ext: dict: extended group info by mapcore_get_extended_group_info
+    :return: str: hex digest
+    '''
+    snapshot = [
+        group_ext['group_name'],
+        group_ext['introduction'],
+        group_ext['active'],
+        group_ext['public'],
+        group_ext.get('open_member'),
+        sorted([usr['eppn'], usr['is_admin']] for usr in group_ext['group_member_list']),
+    ]
+    return hashlib.sha1(json.dumps(snapshot, sort_keys=True).encode('utf-8')).hexdigest()
+
+def mapcore_set_group_fingerprint(node, fingerprint):
+    Node.objects.filter(id=node.id).update(mapcore_group_fingerprint=fingerprint)
+    node.mapcore_group_fingerprint = fingerprint
+
+def mapcore_run_concurrently(func, items, max_workers=MAPCORE_SYNC_CONCURRENCY):
+    '''
+    call func for each item in at most max_workers threads
+    :return: list of the results in the order of items
+    '''
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    def run(item):
+        try:
+            return func(item)
+        finally:
+            connection.close()  # opened by this thread
+
+    with futures.ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(run, items))
+
+def mapcore_sync_rdm_my_projects0(user, max_workers=MAPCORE_SYNC_CONCURRENCY, wait=True):
     '''
     自分が所属しているRDMプロジェクトとmAPグループを比較する。
+    (nii/mapcore_sync_groups.py のタスクから呼ばれる)
+
+    mAPグループのメンバー一覧を最大max_workers並列で取得し、
+    前回同期時のfingerprint (Node.mapcore_group_fingerprint) と比較する。
+    同期が必要なプロジェクトは最大max_workers並列で同期する。
 
     RDMとmAPの両方にグループに所属:
-       タイトルが変わっていない場合: なにもしない
-       タイトルが変わっている場合: RDM側に(またはmAP側に)タイトルを反映
+       fingerprintとタイトルが変わっていない場合: なにもしない
+       変わっている場合: RDM側に(またはmAP側に)反映
 
     mAPグループだけに所属:
       対応するプロジェクトがRDM側に存在:
@@ -1009,29 +1024,32 @@ def mapcore_sync_rdm_my_projects0(user):
           プロジェクトをis_deleted=Trueにする
 
     :param user: OSFUser
-    :return: なし。エラー時には例外投げる
+    :param max_workers: mAP APIを並列に呼ぶスレッド数
+    :param wait: Falseの場合、同じユーザーの同期が実行中ならば何もしない
+    :return: 同期したプロジェクト数 (同期しなかった場合はNone)。エラー時には例外投げる
 
     '''
 
     logger.debug('starting mapcore_sync_rdm_my_projects(\'' + user.eppn + '\').')
 
+    if not locker.lock_user(user, blocking=wait):
+        logger.debug('mapcore_sync_rdm_my_projects is running for OSFUser(' + user.username + '). (skipped)')
+        return None
     try:
-        locker.lock_user(user)
-
         my_rdm_projects = {}
-        sync_id_list = []
         for project in Node.objects.filter(contributor__user__id=user.id):
             if project.map_group_key:
                 my_rdm_projects[project.map_group_key] = project
             # if project.map_group_key is None:
             # ... This project will be synchronized in _view_project()
 
+        # refresh the token here if necessary, before the threads use it
         mapcore = MAPCore(user)
         result = mapcore.get_my_groups()
         my_map_groups = {}
+        candidates = []
         for grp in result['result']['groups']:
-            group_key = grp['group_key']
-            my_map_groups[group_key] = grp
+            my_map_groups[grp['group_key']] = grp
 
             if not grp['active'] or not grp['public']:
                 logger.warning('mAP group [' + grp['group_name'] + '] has unsuitable attribute(s). (ignored)')
@@ -1040,65 +1058,88 @@ def mapcore_sync_rdm_my_projects0(user):
                 logger.warning('mAP group( {} ) member list is private. (skipped)'.format(grp['group_name']))
                 continue
             logger.debug('mAP group [' + grp['group_name'] + '] (' + grp['group_key'] + ') is a candidate to Sync.')
+            candidates.append(grp)
+
+        local = threading.local()
 
-            project_exists = False
+        def worker_user():
+            # each worker has its own copy of the user, whose tokens are updated by a refresh
+            if getattr(local, 'user', None) is None:
+                local.user = OSFUser.objects.get(id=user.id)
+            return local.user
+
+        def get_group_info(grp):
             try:
-                node = Node.objects.get(map_group_key=group_key)
-                project_exists = True
-                # exists in RDM and mAP
-            except ObjectDoesNotExist:
+                return mapcore_get_extended_group_info(worker_user(), None, grp['group_key'], base_grp=dict(grp))
+            except MAPCoreException as e:
+                if e.group_does_not_exist():
+                    return None
+                logger.error('mAP group [{}] members cannot be listed, reason={}'.format(grp['group_name'], utf8(str(e))))
+                return False
+
+        new_groups = []  # (group info, fingerprint)
+        changed_projects = []  # (Node, fingerprint or None)
+        for grp, group_ext in zip(candidates, mapcore_run_concurrently(get_group_info, candidates, max_workers)):
+            group_key = grp['group_key']
+            if group_ext is None:
+                # This group is not linked to this RDM SP.
+                # Other SPs may have the group.
+                del my_map_groups[group_key]
+                logger.info('mAP group({}, group_key={}) exists but it is not linked to this GRDM service provider.'.format(grp['group_name'], group_key))
+                continue
+            if group_ext is False:
+                continue  # retry next time
+            fingerprint = mapcore_group_fingerprint(group_ext)
+
+            node = Node.objects.filter(map_group_key=group_key).first()
+            if node is None:
                 # exists only in mAP -> create new Node in RDM
-                try:
-                    node = mapcore_create_new_node_from_mapgroup(mapcore, grp)
-                    if node is None:
-                        logger.error('cannot create GRDM project for mAP group [' + grp['group_name'] + '].  skip.')
-                        continue
-                    #logger.info('New node is created from mAP group [' + grp['group_name'] + '] (' + group_key + ')')
-                    # copy info and members to RDM
-                    mapcore_sync_rdm_project(user, node,
-                                             title_desc=True,
-                                             contributors=True,
-                                             use_raise=True)
-                except MAPCoreException as e:
-                    if e.group_does_not_exist():
-                        # This group is not linked to this RDM SP.
-                        # Other SPs may have the group.
-                        del my_map_groups[group_key]
-                        logger.info('mAP group({}, group_key={}) exists but it is not linked to this GRDM service provider.'.format(grp['group_name'], group_key))
-                    else:
-                        logger.debug('MAPCoreException: {}'.format(utf8(str(e))))
-                        raise
-
-            if project_exists and not node.is_deleted:
-                # different contributors or title
-                if my_rdm_projects.get(group_key) is None:
-                    logger.debug('different contributors: group_key={}'.format(node.map_group_key))
-                    mapcore_sync_rdm_project_or_map_group(user, node)
-                    sync_id_list.append(node._id)
-                elif node.title != utf8dec(grp['group_name']):
-                    #logger.debug('node.title={}, grp[group_name]={}'.format(utf8(node.title), grp['group_name']))
-                    logger.debug('different title: group_key={}'.format(node.map_group_key))
-                    mapcore_sync_rdm_project_or_map_group(user, node)
-                    sync_id_list.append(node._id)
+                new_groups.append((group_ext, fingerprint))
+            elif node.is_deleted:
+                continue
+            elif my_rdm_projects.get(group_key) is None:
+                logger.debug('different contributors: group_key={}'.format(group_key))
+                changed_projects.append((node, fingerprint))
+            elif node.mapcore_standby_to_upload is not None:
+                logger.debug('standby to upload: group_key={}'.format(group_key))
+                changed_projects.append((node, None))  # mAP group will change
+            elif node.mapcore_group_fingerprint != fingerprint or node.title != utf8dec(grp['group_name']):
+                logger.debug('different group info or members: group_key={}'.format(group_key))
+                changed_projects.append((node, fingerprint))
 
         for group_key, project in my_rdm_projects.items():
             if project.is_deleted:
-                #logger.info('GRDM project [{} ({})] was deleted. (skipped)'.format(utf8(project.title), project._id))
-                continue
-            if project._id in sync_id_list:
                 continue
-
-            grp = my_map_groups.get(group_key)
-            if grp:
-                if project.title == utf8dec(grp['group_name']):
-                    # already synchronized project
-                    continue
-                else:
-                    logger.debug('different title')
-                    mapcore_sync_rdm_project_or_map_group(user, project)
-            else:
+            if group_key not in my_map_groups:
                 # Project contributors is different from mAP group members.
-                mapcore_sync_rdm_project_or_map_group(user, project)
+                changed_projects.append((project, None))
+
+        def create_project(item):
+            group_ext, fingerprint = item
+            node = mapcore_create_new_node_from_mapgroup(MAPCore(worker_user()), group_ext, group_info_ext=group_ext)
+            if node is None:
+                logger.error('cannot create GRDM project for mAP group [' + group_ext['group_name'] + '].  skip.')
+                return False
+            # copy info and members to RDM
+            mapcore_sync_rdm_project(worker_user(), node,
+                                     title_desc=True,
+                                     contributors=True,
+                                     use_raise=True)
+            mapcore_set_group_fingerprint(node, fingerprint)
+            return True
+
+        def sync_project(item):
+            node, fingerprint = item
+            try:
+                mapcore_sync_rdm_project_or_map_group(worker_user(), node, use_raise=True)
+            except Exception:
+                return False  # logged, retry next time
+            if fingerprint:
+                mapcore_set_group_fingerprint(node, fingerprint)
+            return True
+
+        synced = mapcore_run_concurrently(create_project, new_groups, max_workers)
+        synced += mapcore_run_concurrently(sync_project, changed_projects, max_workers)
 
         ### to create new mAP groups at /myprojects/
         # for project in Node.objects.filter(contributor__user__id=user.id):
@@ -1108,11 +1149,12 @@ def mapcore_sync_rdm_my_projects0(user):
     finally:
         locker.unlock_user(user)
 
-    logger.debug('mapcore_sync_rdm_my_projects finished.')
+    logger.debug('mapcore_sync_rdm_my_projects finished: {}/{} projects synchronized.'.format(synced.count(True), len(synced)))
+    return synced.count(True)
 
-def mapcore_sync_rdm_my_projects(user, use_raise=False):
+def mapcore_sync_rdm_my_projects(user, use_raise=False, max_workers=MAPCORE_SYNC_CONCURRENCY, wait=True):
     try:
-        mapcore_sync_rdm_my_projects0(user)
+        return mapcore_sync_rdm_my_projects0(user, max_workers=max_workers, wait=wait)
     except Exception as e:
         logger.error('User(username={}, eppn={}) cannot compare my GRDM Projects and my mAP groups, reason={}'.format(user.username, user.eppn, utf8(str(e))))
         if use_raise:
@@ -1203,8 +1245,8 @@ def mapcore_sync_rdm_project_or_map_group0(access_user, node, use_raise=False):
     mapcore_set_sync_time(node)
 
 def mapcore_sync_rdm_project_or_map_group(access_user, node, use_raise=False):
+    locker.lock_node(node)
     try:
-        locker.lock_node(node)
         mapcore_sync_rdm_project_or_map_group0(access_user, node,
                                                use_raise=use_raise)
     finally:
@@ -1330,11 +1372,11 @@ if __name__ == '__main__':
             group_key = grp['group_key']
             print('mAP group [' + grp['group_name'] + '] has key [' + group_key + '].')
             try:
-                json = mapcore.get_group_members(group_key)
+                members = mapcore.get_group_members(group_key)
             except Exception as e:
                 print('Exception: ', type(e), e.message)
                 continue
-            print(pp(json))
+            print(pp(members))
         exit(0)
 
     if False:
@@ -14,14 +14,16 @@ import requests
 from urllib.parse import urlencode
 
 from django.utils import timezone
-from django.db import transaction
 
-from osf.models.user import OSFUser
+from osf.exceptions import LockTimeoutError
+from osf.utils.locks import AdvisoryLock
 from website.settings import (MAPCORE_HOSTNAME,
                               MAPCORE_REFRESH_PATH,
                               MAPCORE_API_PATH,
                               MAPCORE_CLIENTID,
-                              MAPCORE_SECRET)
+                              MAPCORE_SECRET,
+                              MAPCORE_LOCK_TIMEOUT,
+                              MAPCORE_LOCK_LEASE)
 
 #
 # Global settings.
@@ -134,6 +136,24 @@ else:
     OPEN_MEMBER_MEMBER_ONLY = 2
     OPEN_MEMBER_DEFAULT = OPEN_MEMBER_PUBLIC
 
+def mapcore_lock(name, blocking=True):
+    '''
+    acquire a lock of the mAP core synchronization, which expires after MAPCORE_LOCK_LEASE
+    seconds without any use of the database by its holder
+    :param blocking: wait MAPCORE_LOCK_TIMEOUT seconds at most, otherwise return at once
+    :return: False if blocking is False and the lock is held
+    :raise LockTimeoutError: if the lock is not acquired in MAPCORE_LOCK_TIMEOUT seconds
+    '''
+    lock = AdvisoryLock(name, lease=MAPCORE_LOCK_LEASE)
+    if lock.acquire(blocking=blocking, timeout=MAPCORE_LOCK_TIMEOUT):
+        return True
+    if blocking:
+        raise LockTimeoutError('Lock {} was not acquired in {} seconds'.format(name, MAPCORE_LOCK_TIMEOUT))
+    return False
+
+def mapcore_unlock(name):
+    AdvisoryLock(name).release()
+
 def mapcore_group_member_is_private(group_info):
     return group_info['open_member'] == OPEN_MEMBER_PRIVATE
 
@@ -204,8 +224,14 @@ class MAPCore(object):
         return True
 
     def refresh_token(self):
+        expired_token = self.user.map_profile.oauth_access_token
+        self.lock_refresh()
         try:
-            self.lock_refresh()
+            # the token may be refreshed by another thread or process while waiting for the lock
+            self.user.map_profile.refresh_from_db()
+            if self.user.map_profile.oauth_access_token != expired_token:
+                logger.debug('MAPCore::refresh_token: already refreshed: user=' + str(self.user))
+                return True
             return self.refresh_token0()
         finally:
             self.unlock_refresh()
@@ -214,30 +240,18 @@ class MAPCore(object):
     # Lock refresh process.
     #
     def lock_refresh(self):
-        while True:
-            #print('before transaction.atomic')
-            with transaction.atomic():
-                #print('transaction.atomic start')
-                u = OSFUser.objects.select_for_update().get(username=self.user.username)
-                if not u.mapcore_refresh_locked:
-                    #print('before lock')
-                    #time.sleep(5) # for debug
-                    u.mapcore_refresh_locked = True
-                    u.save()
-                    logger.debug('OSFUser(' + u.username + ').mapcore_refresh_locked=True')
-                    return
-            #print('cannot get lock, sleep 1')
-            time.sleep(1)
+        mapcore_lock(self._refresh_lock_name())
+        logger.debug('OSFUser(' + self.user.username + ') refresh is locked')
 
     #
     # Unlock refresh process.
     #
     def unlock_refresh(self):
-        with transaction.atomic():
-            u = OSFUser.objects.select_for_update().get(username=self.user.username)
-            u.mapcore_refresh_locked = False
-            u.save()
-            logger.debug('OSFUser(' + u.username + ').mapcore_refresh_locked=False')
+        mapcore_unlock(self._refresh_lock_name())
+        logger.debug('OSFUser(' + self.user.username + ') refresh is unlocked')
+
+    def _refresh_lock_name(self):
+        return 'mapcore_refresh:{}'.format(self.user.username)
 
     #
     # GET|POST|DELETE for methods.
@@ -17,6 +17,7 @@ if __name__ == '__main__':
     from website.app import init_app
     init_app(routes=False, set_backends=False)
 
+from osf.exceptions import LockTimeoutError
 from osf.models.user import OSFUser
 from nii.mapcore_api import MAPCore
 
@@ -28,7 +29,11 @@ def mapcore_refresh_tokens(debug=False):
                     logger.info('Refreshing: ' + user.username + ' (' + user.map_profile.oauth_access_token + ')')
 
                 mapcore_api = MAPCore(user)
-                mapcore_api.refresh_token()
+                try:
+                    mapcore_api.refresh_token()
+                except LockTimeoutError:
+                    # the token is being refreshed by another process
+                    logger.warning('Refreshing the token of {} is skipped'.format(user.username))
 
 @celery_app.task(name='nii.mapcore_refresh_tokens')
 def run_main(rate_limit=(5, 1), dry_run=True):
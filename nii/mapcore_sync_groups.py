@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# @COPYRIGHT@
+#
+
+import logging
+import os
+import sys
+
+from framework.celery_tasks import app as celery_app
+
+# global setting
+logger = logging.getLogger(__name__)
+if __name__ == '__main__':
+    logger.setLevel(level=logging.DEBUG)
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'api.base.settings'
+    from website.app import init_app
+    init_app(routes=False, set_backends=False)
+
+from osf.models.user import OSFUser
+from osf.utils.locks import AdvisoryLock
+from nii.mapcore import mapcore_sync_is_enabled, mapcore_sync_rdm_my_projects
+
+SYNC_ALL_LOCK_NAME = 'mapcore_sync_groups'
+
+def mapcore_sync_groups_of_users(users, debug=False):
+    count = 0
+    for user in users:
+        if debug:
+            logger.info('Synchronizing: ' + user.username)
+        count += mapcore_sync_rdm_my_projects(user, wait=False) or 0
+    return count
+
+@celery_app.task(name='nii.mapcore_sync_groups')
+def mapcore_sync_groups():
+    '''
+    synchronize the mAP groups of all the users with an access token
+    :return: number of synchronized projects, None when another run is not finished
+    '''
+    if not mapcore_sync_is_enabled():
+        return None
+    lock = AdvisoryLock(SYNC_ALL_LOCK_NAME)
+    if not lock.acquire(blocking=False):
+        logger.info('mapcore_sync_groups is still running. (skipped)')
+        return None
+    try:
+        users = OSFUser.objects.filter(
+            is_active=True,
+            map_profile__oauth_access_token__isnull=False,
+        ).select_related('map_profile')
+        return mapcore_sync_groups_of_users(users.iterator())
+    finally:
+        lock.release()
+
+@celery_app.task(name='nii.mapcore_sync_user_groups')
+def mapcore_sync_user_groups(user_id):
+    '''
+    synchronize the mAP groups of a user, e.g. after the user opened the my projects page
+    :param user_id: guid of OSFUser
+    :return: number of synchronized projects
+    '''
+    if not mapcore_sync_is_enabled():
+        return None
+    user = OSFUser.load(user_id)
+    if user is None or user.map_profile is None:
+        return None
+    return mapcore_sync_groups_of_users([user])
+
+# for test
+if __name__ == '__main__':
+    users = OSFUser.objects.filter(map_profile__oauth_access_token__isnull=False)
+    count = mapcore_sync_groups_of_users(users, True)
+
+    logger.info('{} projects are synchronized'.format(count))
+    sys.exit()
@@ -154,3 +154,8 @@ class SchemaBlockConversionError(OSFError):
     'schema block' format.
     """
     pass
+
+
+class LockTimeoutError(OSFError):
+    """Raised when a lock cannot be acquired before its timeout"""
+    pass
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import logging
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from osf.models import BaseFileNode, FileVersionSummary
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK_SIZE = 10000
+
+
+def backfill_file_version_summaries(start_id=0, chunk_size=BACKFILL_CHUNK_SIZE):
+    """Recompute the version summaries of all the files, one id range per transaction
+
+    Files without versions are skipped. The command can be run again, e.g. from
+    the last logged id after an interruption.
+    """
+    max_id = BaseFileNode.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    count = 0
+    for range_start in range(start_id, max_id + 1, chunk_size):
+        with transaction.atomic():
+            count += FileVersionSummary.update_range(range_start, range_start + chunk_size)
+        logger.info('Backfilled the version summaries of the files up to id {}/{} ({} files)'.format(
+            min(range_start + chunk_size, max_id + 1), max_id + 1, count))
+    return count
+
+
+class Command(BaseCommand):
+    """Backfill the latest and earliest versions of the files in FileVersionSummary
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start-id',
+            type=int,
+            default=0,
+            help='Id of the file node to start from',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=BACKFILL_CHUNK_SIZE,
+            help='Number of file node ids backfilled in a transaction',
+        )
+
+    def handle(self, *args, **options):
+        script_start_time = datetime.datetime.now()
+        logger.info('Script started time: {}'.format(script_start_time))
+
+        count = backfill_file_version_summaries(options['start_id'], options['chunk_size'])
+
+        script_finish_time = datetime.datetime.now()
+        logger.info('Backfilled the version summaries of {} files'.format(count))
+        logger.info('Run time {}'.format(script_finish_time - script_start_time))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import logging
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from osf.models import Institution, OSFUser
+from website.util.quota import RECALCULATE_CHUNK_SIZE, recalculate_used_quota
+
+logger = logging.getLogger(__name__)
+
+
+def recalculate_quota(institution_id=None, chunk_size=RECALCULATE_CHUNK_SIZE):
+    users = OSFUser.objects.exclude(deleted__isnull=False)
+    if institution_id is not None:
+        institution = Institution.load(institution_id)
+        if institution is None:
+            raise CommandError('Institution {} not found'.format(institution_id))
+        users = users.filter(affiliated_institutions=institution)
+
+    def log_progress(done, total):
+        logger.info('Recalculated quota of {}/{} users'.format(done, total))
+
+    return recalculate_used_quota(users, chunk_size=chunk_size, progress_callback=log_progress)
+
+
+class Command(BaseCommand):
+    """Recalculate the used quota of all users, or of the users of an institution
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--institution',
+            type=str,
+            default=None,
+            help='Guid of the institution whose users are recalculated',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=RECALCULATE_CHUNK_SIZE,
+            help='Number of users recalculated in a transaction',
+        )
+
+    def handle(self, *args, **options):
+        script_start_time = datetime.datetime.now()
+        logger.info('Script started time: {}'.format(script_start_time))
+
+        count = recalculate_quota(options['institution'], options['chunk_size'])
+
+        script_finish_time = datetime.datetime.now()
+        logger.info('Recalculated quota of {} users'.format(count))
+        logger.info('Run time {}'.format(script_finish_time - script_start_time))
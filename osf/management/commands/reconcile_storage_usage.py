@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import logging
+import datetime
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+
+from framework.celery_tasks import app as celery_app
+from osf.models import AbstractNode, BaseFileNode, NodeStorageUsage
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_CHUNK_SIZE = 1000
+
+
+@celery_app.task(name='management.commands.reconcile_storage_usage')
+def reconcile_storage_usage(all_nodes=False, chunk_size=RECONCILE_CHUNK_SIZE):
+    """Recompute the storage usage of the nodes and correct the counters which drifted
+
+    By default only the nodes with a counter are reconciled, the others are computed the
+    first time their usage is read. With all_nodes, the counters of all the nodes with
+    osfstorage files are created as well, e.g. to fill them after a deployment.
+
+    :return: number of counters which were corrected
+    """
+    if all_nodes:
+        node_ids = BaseFileNode.objects.filter(
+            type='osf.osfstoragefile',
+            target_content_type=ContentType.objects.get_for_model(AbstractNode),
+        ).values_list('target_object_id', flat=True).distinct()
+    else:
+        node_ids = NodeStorageUsage.objects.values_list('node_id', flat=True)
+    node_ids = sorted(node_ids)
+
+    drifted = 0
+    for start in range(0, len(node_ids), chunk_size):
+        for node_id, (counted, actual) in NodeStorageUsage.reconcile(node_ids[start:start + chunk_size]).items():
+            if counted is not None and counted != actual:
+                drifted += 1
+                logger.warning('Storage usage of node {} drifted by {} bytes'.format(node_id, counted - actual))
+        logger.info('Reconciled the storage usage of {}/{} nodes'.format(
+            min(start + chunk_size, len(node_ids)), len(node_ids)))
+    return drifted
+
+
+class Command(BaseCommand):
+    """Reconcile the storage usage counters of the nodes with their files
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all-nodes',
+            action='store_true',
+            dest='all_nodes',
+            help='Create the counters of the nodes which have none as well',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=RECONCILE_CHUNK_SIZE,
+            help='Number of nodes reconciled in a transaction',
+        )
+
+    def handle(self, *args, **options):
+        script_start_time = datetime.datetime.now()
+        logger.info('Script started time: {}'.format(script_start_time))
+
+        drifted = reconcile_storage_usage(options['all_nodes'], options['chunk_size'])
+
+        script_finish_time = datetime.datetime.now()
+        logger.info('Corrected the storage usage of {} nodes'.format(drifted))
+        logger.info('Run time {}'.format(script_finish_time - script_start_time))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+def fill_rdm_statistics_rollup(apps, schema_editor):
+    RdmStatistics = apps.get_model('osf', 'RdmStatistics')
+    RdmStatisticsRollup = apps.get_model('osf', 'RdmStatisticsRollup')
+    totals = RdmStatistics.objects.values(
+        'institution_id', 'provider', 'extention_type', 'date_acquired'
+    ).annotate(
+        number=models.Sum('subtotal_file_number'),
+        size=models.Sum('subtotal_file_size'),
+    ).order_by()
+    RdmStatisticsRollup.objects.bulk_create([
+        RdmStatisticsRollup(
+            institution_id=total['institution_id'],
+            provider=total['provider'],
+            extention_type=total['extention_type'],
+            subtotal_file_number=total['number'],
+            subtotal_file_size=total['size'],
+            date_acquired=total['date_acquired'],
+        ) for total in totals.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0238_timestampinventorycursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RdmStatisticsRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('provider', models.CharField(max_length=50, null=True)),
+                ('extention_type', models.CharField(max_length=10, null=True)),
+                ('subtotal_file_number', models.BigIntegerField()),
+                ('subtotal_file_size', models.FloatField()),
+                ('date_acquired', models.DateField(db_index=True)),
+                ('institution', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='osf.Institution')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='rdmstatisticsrollup',
+            unique_together=set([('institution', 'provider', 'extention_type', 'date_acquired')]),
+        ),
+        migrations.RunPython(fill_rdm_statistics_rollup, migrations.RunPython.noop),
+    ]
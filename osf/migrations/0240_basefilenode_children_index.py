@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    atomic = False  # CREATE INDEX CONCURRENTLY cannot be run in a txn
+
+    dependencies = [
+        ('osf', '0239_rdmstatisticsrollup'),
+    ]
+
+    operations = [
+        migrations.RunSQL([
+            # Keyset pagination of the children of a folder, see osfstorage_get_children
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS basefilenode_parent_name_id_idx ON osf_basefilenode (parent_id, name, id);',
+        ], [
+            'DROP INDEX IF EXISTS basefilenode_parent_name_id_idx, RESTRICT;'
+        ])
+    ]
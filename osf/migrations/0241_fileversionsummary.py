@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+import osf.utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0240_basefilenode_children_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileVersionSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('version_count', models.PositiveIntegerField(default=0)),
+                ('total_size', models.BigIntegerField(blank=True, null=True)),
+                ('latest_version_created', osf.utils.fields.NonNaiveDateTimeField(blank=True, null=True)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('content_type', models.CharField(blank=True, max_length=100, null=True)),
+                ('md5', models.TextField(blank=True, null=True)),
+                ('sha256', models.TextField(blank=True, null=True)),
+                ('sha512', models.TextField(blank=True, null=True)),
+                ('earliest_version_created', osf.utils.fields.NonNaiveDateTimeField(blank=True, null=True)),
+                ('earliest_version', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='osf.FileVersion')),
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='version_summary', to='osf.BaseFileNode')),
+                ('latest_version', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='osf.FileVersion')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Keep the oldest UserQuota of each user and storage type
+DELETE_DUPLICATES_SQL = """
+    DELETE FROM osf_userquota AS Q
+    USING osf_userquota AS O
+    WHERE Q.user_id = O.user_id AND Q.storage_type = O.storage_type AND Q.id > O.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0243_abstractnode_mapcore_group_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATES_SQL, migrations.RunSQL.noop),
+        migrations.AlterUniqueTogether(
+            name='userquota',
+            unique_together=set([('user', 'storage_type')]),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    atomic = False  # CREATE INDEX CONCURRENTLY cannot be run in a txn
+
+    dependencies = [
+        ('osf', '0245_exportdatacopiedfile'),
+    ]
+
+    operations = [
+        migrations.RunSQL([
+            # Keyset pagination of the children of a folder, the children without a name sort as ''
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS basefilenode_parent_coalesce_name_id_idx ON osf_basefilenode (parent_id, COALESCE(name, ''), id);",
+            'DROP INDEX CONCURRENTLY IF EXISTS basefilenode_parent_name_id_idx;',
+        ], [
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS basefilenode_parent_name_id_idx ON osf_basefilenode (parent_id, name, id);',
+            'DROP INDEX CONCURRENTLY IF EXISTS basefilenode_parent_coalesce_name_id_idx;',
+        ])
+    ]
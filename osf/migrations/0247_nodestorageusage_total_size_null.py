@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0246_basefilenode_children_index_coalesce_name'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='nodestorageusage',
+            name='total_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
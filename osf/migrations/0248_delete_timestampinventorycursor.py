@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osf', '0247_nodestorageusage_total_size_null'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='timestampinventorycursor',
+            unique_together=set([]),
+        ),
+        migrations.RemoveField(
+            model_name='timestampinventorycursor',
+            name='node',
+        ),
+        migrations.DeleteModel(
+            name='TimestampInventoryCursor',
+        ),
+    ]
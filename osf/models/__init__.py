@@ -54,16 +54,18 @@ from osf.models.blacklisted_email_domain import BlacklistedEmailDomain  # noqa
 from osf.models.brand import Brand  # noqa
 from osf.models.rdm_announcement import RdmAnnouncement, RdmAnnouncementOption  # noqa
 from osf.models.rdm_addons import RdmAddonOption, RdmAddonNoInstitutionOption  # noqa
-from osf.models.rdm_statistics import RdmStatistics  # noqa
+from osf.models.rdm_statistics import RdmStatistics, RdmStatisticsRollup  # noqa
 from osf.models.rdm_file_timestamptoken_verify_result import RdmFileTimestamptokenVerifyResult  # noqa
 from osf.models.rdm_user_key import RdmUserKey  # noqa
 from osf.models.rdm_timestamp_grant_pattern import RdmTimestampGrantPattern  # noqa
 from osf.models.timestamp_task import TimestampTask  # noqa
 from osf.models.fileinfo import FileInfo  # noqa
+from osf.models.fileversionsummary import FileVersionSummary  # noqa
+from osf.models.nodestorageusage import NodeStorageUsage  # noqa
 from osf.models.user_quota import UserQuota  # noqa
 from osf.models.project_storage_type import ProjectStorageType  # noqa
 from osf.models.region_external_account import RegionExternalAccount  # noqa
 from osf.models.institution_entitlement import InstitutionEntitlement  # noqa
 from osf.models.export_data_location import ExportDataLocation  # noqa
-from osf.models.export_data import ExportData  # noqa
+from osf.models.export_data import ExportData, ExportDataCopiedFile  # noqa
 from osf.models.export_data_restore import ExportDataRestore  # noqa
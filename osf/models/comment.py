@@ -221,12 +221,13 @@ class Comment(GuidMixin, SpamMixin, CommentableMixin, BaseModel):
 
         try:
             search.search.update_comment(self, bulk=False, async_update=True)
+            # Comments on the node or a wiki page are not copied to the file documents
             if self.page == Comment.OVERVIEW:
-                self.node.update_search()
+                self.node.update_search(saved_fields=set())
             elif self.page == Comment.FILES:
                 search.search.update_file(self.root_target.referent)
             elif self.page == Comment.WIKI:
-                self.node.update_search(wiki_page=self.root_target.referent)
+                self.node.update_search(wiki_page=self.root_target.referent, saved_fields=set())
         except search.exceptions.SearchUnavailableError as e:
             logger.exception(e)
 
@@ -30,6 +30,7 @@ __all__ = [
     'DateTruncMixin',
     'SecondDateTimeField',
     'ExportData',
+    'ExportDataCopiedFile',
 ]
 
 
@@ -106,7 +107,13 @@ class ExportData(base.BaseModel):
 
     __str__ = __repr__
 
-    def extract_file_information_json_from_source_storage(self):
+    def extract_file_information_json_from_source_storage(self, stream=False):
+        """Extract the export data JSON and the file information JSON from the source storage
+
+        With stream=True, 'folders' and 'files' of the file information JSON are generators
+        which read the source storage with server-side cursors, and the 'files_numb' and 'size'
+        counters of the export data JSON are only complete once 'files' is exhausted.
+        """
         # Get region guid == institution guid
         source_storage_guid = self.source.guid
         # Get Institution by guid
@@ -161,7 +168,6 @@ class ExportData(base.BaseModel):
         # Combine two project lists and remove duplicates if have
         projects = projects.union(institution_users_projects)
         projects__ids = projects.values_list('id', flat=True)
-        source_project_ids = set()
 
         # get folder nodes
         base_folder_nodes = BaseFileNode.objects.filter(
@@ -172,22 +178,6 @@ class ExportData(base.BaseModel):
             # exclude deleted folders
             Q(deleted__isnull=False) | Q(deleted_on__isnull=False) | Q(deleted_by_id__isnull=False),
         )
-        folders = []
-        for folder in base_folder_nodes:
-            folder_info = {
-                'path': folder.path,
-                'materialized_path': folder.materialized_path,
-                'project': {}
-            }
-            # project
-            project = folder.target
-            source_project_ids.add(project.id)
-            project_info = {
-                'id': project._id,
-                'name': project.title,
-            }
-            folder_info['project'] = project_info
-            folders.append(folder_info)
 
         # get base_file_nodes
         base_file_nodes = BaseFileNode.objects.filter(
@@ -198,11 +188,38 @@ class ExportData(base.BaseModel):
             Q(deleted__isnull=False) | Q(deleted_on__isnull=False) | Q(deleted_by_id__isnull=False),
         )
 
-        total_size = 0
-        total_file = 0
-        files = []
-        # get file information
-        for file in base_file_nodes:
+        export_data_json['files_numb'] = 0
+        export_data_json['size'] = 0
+        export_data_json['projects_numb'] = len(projects__ids)
+
+        file_info_json['folders'] = self._iter_folder_information(base_folder_nodes)
+        file_info_json['files'] = self._iter_file_information(base_file_nodes, export_data_json)
+        if not stream:
+            file_info_json['folders'] = list(file_info_json['folders'])
+            file_info_json['files'] = list(file_info_json['files'])
+
+        return export_data_json, file_info_json
+
+    def _iter_folder_information(self, base_folder_nodes):
+        projects = {}
+        for folder in base_folder_nodes.iterator():
+            # project
+            if folder.target_object_id not in projects:
+                project = folder.target
+                projects[folder.target_object_id] = {
+                    'id': project._id,
+                    'name': project.title,
+                }
+            yield {
+                'path': folder.path,
+                'materialized_path': folder.materialized_path,
+                'project': projects[folder.target_object_id],
+            }
+
+    def _iter_file_information(self, base_file_nodes, export_data_json):
+        """Yield the information of each file, counting its versions in export_data_json"""
+        projects = {}
+        for file in base_file_nodes.iterator():
             file_info = {
                 'id': file.id,
                 'path': file.path,
@@ -221,13 +238,13 @@ class ExportData(base.BaseModel):
             }
 
             # project
-            project = file.target
-            source_project_ids.add(project.id)
-            project_info = {
-                'id': project._id,
-                'name': project.title,
-            }
-            file_info['project'] = project_info
+            if file.target_object_id not in projects:
+                project = file.target
+                projects[file.target_object_id] = {
+                    'id': project._id,
+                    'name': project.title,
+                }
+            file_info['project'] = projects[file.target_object_id]
 
             # file's tags
             if not file._state.adding:
@@ -236,7 +253,7 @@ class ExportData(base.BaseModel):
 
             # timestamp by project_id and file_id
             timestamp = RdmFileTimestamptokenVerifyResult.objects.filter(
-                project_id=file.target._id, file_id=file._id).first()
+                project_id=file_info['project']['id'], file_id=file._id).first()
             if timestamp:
                 timestamp_info = {
                     'timestamp_id': timestamp.id,
@@ -254,7 +271,7 @@ class ExportData(base.BaseModel):
                 file_info['timestamp'] = timestamp_info
 
             # file versions
-            file_versions = file.versions.order_by('-created')
+            file_versions = file.versions.select_related('creator').order_by('-created')
             file_versions_info = []
             for version in file_versions:
                 file_version_thru = version.get_basefilenode_version(file)
@@ -269,22 +286,13 @@ class ExportData(base.BaseModel):
                     'location': version.location,
                 }
                 file_versions_info.append(version_info)
-                total_file += 1
-                total_size += version.size
+                export_data_json['files_numb'] += 1
+                export_data_json['size'] += version.size
 
             file_info['version'] = file_versions_info
             file_info['size'] = file_versions_info[0]['size']
             file_info['location'] = file_versions_info[0]['location']
-            files.append(file_info)
-
-        file_info_json['folders'] = folders
-        file_info_json['files'] = files
-
-        export_data_json['files_numb'] = total_file
-        export_data_json['size'] = total_size
-        export_data_json['projects_numb'] = len(projects__ids)
-
-        return export_data_json, file_info_json
+            yield file_info
 
     def get_source_file_versions_min(self, file_info_json):
         file_versions = []
@@ -563,3 +571,18 @@ class ExportData(base.BaseModel):
 
     def get_latest_restored_data_with_destination_id(self, destination_id):
         return self.get_all_restored().filter(destination_id=destination_id).latest('process_end')
+
+
+class ExportDataCopiedFile(base.BaseModel):
+    """A data file which an export process has copied to the storage location
+
+    The rows are the checkpoint manifest of the export process, so a restarted process
+    does not copy the files again, whichever worker it runs on.
+    """
+    export_data = models.ForeignKey(ExportData, related_name='copied_files', on_delete=models.CASCADE)
+    # hash value used as the name of the data file
+    file_name = models.CharField(max_length=255)
+
+    class Meta:
+        db_table = 'osf_export_data_copied_file'
+        unique_together = ('export_data', 'file_name')
@@ -6,7 +6,7 @@ import os
 import requests
 from dateutil.parser import parse as parse_date
 from django.apps import apps
-from django.db import models, IntegrityError
+from django.db import models, transaction, IntegrityError
 from django.db.models import Manager
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
@@ -19,7 +19,9 @@ from framework.analytics import get_basic_counters
 from framework import sentry
 from osf.models.base import BaseModel, OptionalGuidMixin, ObjectIDMixin
 from osf.models.comment import CommentableMixin
+from osf.models.fileversionsummary import FileVersionSummary
 from osf.models.mixins import Taggable
+from osf.models.nodestorageusage import NodeStorageUsage
 from osf.models.validators import validate_location
 from osf.utils.datetime_aware_jsonfield import DateTimeAwareJSONField
 from osf.utils.fields import NonNaiveDateTimeField
@@ -271,7 +273,10 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
         :return: Returns version that was passed in
         """
         version_name = name or self.name
-        BaseFileVersionsThrough.objects.create(fileversion=version, basefilenode=self, version_name=version_name)
+        with transaction.atomic():
+            BaseFileVersionsThrough.objects.create(fileversion=version, basefilenode=self, version_name=version_name)
+            FileVersionSummary.update_files([self.id])
+            NodeStorageUsage.add_file_size([self.id], version.size)
         return version
 
     @classmethod
@@ -427,10 +432,15 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
         logger.warn('BaseFileNode._repoint_guids is deprecated.')
 
     def _update_node(self, recursive=True, save=True):
+        moved = save and self.is_file and self.parent is not None and self.target != self.parent.target
+        if moved:
+            NodeStorageUsage.remove_files([self.id])
         if self.parent is not None:
             self.target = self.parent.target
         if save:
             self.save()
+        if moved:
+            NodeStorageUsage.add_files([self.id])
         if recursive and not self.is_file:
             for child in self.children:
                 child._update_node(save=save)
@@ -461,6 +471,8 @@ class BaseFileNode(TypedModel, CommentableMixin, OptionalGuidMixin, Taggable, Ob
             for child in BaseFileNode.objects.filter(parent=self.id).exclude(type__in=TrashedFileNode._typedmodels_subtypes):
                 child.delete(user=user, save=save, deleted_on=deleted)
         else:
+            if save:
+                NodeStorageUsage.remove_files([self.id])
             self.recast(TrashedFile._typedmodels_type)
 
             guid = self.guids.first()
@@ -690,6 +702,8 @@ class TrashedFileNode(BaseFileNode):
 
         if save:
             self.save()
+            if self.is_file:
+                NodeStorageUsage.add_files([self.id])
 
         return self
 
@@ -763,6 +777,20 @@ class FileVersionUserMetadata(BaseModel):
         unique_together = ('user', 'file_version')
 
 
+class FileVersionQuerySet(models.QuerySet):
+
+    def delete(self):
+        """Delete the versions, updating the summaries and the storage usage of their files"""
+        with transaction.atomic():
+            version_ids = list(self.values_list('id', flat=True))
+            file_ids = list(BaseFileVersionsThrough.objects.filter(
+                fileversion_id__in=version_ids).values_list('basefilenode_id', flat=True).distinct())
+            NodeStorageUsage.remove_versions(version_ids)
+            result = super(FileVersionQuerySet, self).delete()
+            FileVersionSummary.update_files(file_ids)
+        return result
+
+
 class FileVersion(ObjectIDMixin, BaseModel):
     """A version of an OsfStorageFileNode. contains information
     about where the file is located, hashes and datetimes
@@ -775,6 +803,8 @@ class FileVersion(ObjectIDMixin, BaseModel):
     #       this date may be earlier than the date of upload if the file already
     #       exists on the backend
 
+    objects = FileVersionQuerySet.as_manager()
+
     creator = models.ForeignKey('OSFUser', null=True, blank=True, on_delete=models.CASCADE)
 
     identifier = models.CharField(max_length=100, blank=False, null=False)  # max length on staging was 51
@@ -808,6 +838,7 @@ class FileVersion(ObjectIDMixin, BaseModel):
         return self.basefileversionsthrough_set.filter(basefilenode=file).first()
 
     def update_metadata(self, metadata, save=True):
+        size = self.size
         self.metadata.update(metadata)
         # metadata has no defined structure so only attempt to set attributes
         # If its are not in this callback it'll be in the next
@@ -817,7 +848,11 @@ class FileVersion(ObjectIDMixin, BaseModel):
             self.external_modified = parse_date(self.metadata['modified'], ignoretz=False)
 
         if save:
-            self.save()
+            with transaction.atomic():
+                self.save()
+                FileVersionSummary.update_version_files(self)
+                if self.size != size:
+                    NodeStorageUsage.add_version_size(self, (self.size or 0) - (size or 0))
 
     def _find_matching_archive(self, save=True):
         """Find another version with the same sha256 as this file.
@@ -0,0 +1,107 @@
+from django.db import connection, models
+from osf.models.base import BaseModel
+from osf.utils.fields import NonNaiveDateTimeField
+
+
+# Recompute the summaries of the files matching {condition} from their versions
+UPDATE_SUMMARIES_SQL = """
+    INSERT INTO osf_fileversionsummary (
+        created, modified, file_id, version_count, total_size,
+        latest_version_id, latest_version_created, size, content_type, md5, sha256, sha512,
+        earliest_version_id, earliest_version_created
+    )
+    SELECT
+        now(), now(), F.id, VERSIONS.version_count, VERSIONS.total_size,
+        LATEST_VERSION.id, LATEST_VERSION.created, LATEST_VERSION.size, LATEST_VERSION.content_type,
+        LATEST_VERSION.metadata ->> 'md5', LATEST_VERSION.metadata ->> 'sha256', LATEST_VERSION.metadata ->> 'sha512',
+        EARLIEST_VERSION.id, EARLIEST_VERSION.created
+    FROM osf_basefilenode AS F
+    JOIN LATERAL (
+        SELECT COUNT(*) AS version_count, SUM(V.size) AS total_size
+        FROM osf_basefileversionsthrough AS T
+        JOIN osf_fileversion AS V ON V.id = T.fileversion_id
+        WHERE T.basefilenode_id = F.id
+    ) VERSIONS ON TRUE
+    JOIN LATERAL (
+        SELECT V.* FROM osf_basefileversionsthrough AS T
+        JOIN osf_fileversion AS V ON V.id = T.fileversion_id
+        WHERE T.basefilenode_id = F.id
+        ORDER BY V.created DESC, V.id DESC
+        LIMIT 1
+    ) LATEST_VERSION ON TRUE
+    JOIN LATERAL (
+        SELECT V.* FROM osf_basefileversionsthrough AS T
+        JOIN osf_fileversion AS V ON V.id = T.fileversion_id
+        WHERE T.basefilenode_id = F.id
+        ORDER BY V.created ASC, V.id ASC
+        LIMIT 1
+    ) EARLIEST_VERSION ON TRUE
+    WHERE {condition}
+    ON CONFLICT (file_id) DO UPDATE SET
+        modified = EXCLUDED.modified,
+        version_count = EXCLUDED.version_count,
+        total_size = EXCLUDED.total_size,
+        latest_version_id = EXCLUDED.latest_version_id,
+        latest_version_created = EXCLUDED.latest_version_created,
+        size = EXCLUDED.size,
+        content_type = EXCLUDED.content_type,
+        md5 = EXCLUDED.md5,
+        sha256 = EXCLUDED.sha256,
+        sha512 = EXCLUDED.sha512,
+        earliest_version_id = EXCLUDED.earliest_version_id,
+        earliest_version_created = EXCLUDED.earliest_version_created
+"""
+
+
+class FileVersionSummary(BaseModel):
+    """Saves the latest and the earliest versions of a file and their totals.
+
+    Maintained when versions are added to a file, deleted or their metadata is updated, so that
+    listings and aggregates do not need to sort the versions of every file.
+    Files without a summary have no version or were not backfilled yet, see the
+    ``backfill_file_version_summaries`` command.
+    """
+    file = models.OneToOneField('osf.BaseFileNode', related_name='version_summary', on_delete=models.CASCADE)
+    version_count = models.PositiveIntegerField(default=0)
+    # Sum of the sizes of all the versions
+    total_size = models.BigIntegerField(null=True, blank=True)
+
+    latest_version = models.ForeignKey('osf.FileVersion', related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    latest_version_created = NonNaiveDateTimeField(null=True, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, null=True, blank=True)
+    md5 = models.TextField(null=True, blank=True)
+    sha256 = models.TextField(null=True, blank=True)
+    sha512 = models.TextField(null=True, blank=True)
+
+    earliest_version = models.ForeignKey('osf.FileVersion', related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    earliest_version_created = NonNaiveDateTimeField(null=True, blank=True)
+
+    @classmethod
+    def update_files(cls, file_ids):
+        """Recompute the summaries of files from their versions, e.g. after versions are added or deleted
+
+        The summaries of the files which have no version left are removed.
+        """
+        file_ids = list(file_ids)
+        cls.objects.filter(file_id__in=file_ids, file__versions__isnull=True).delete()
+        return cls._update('F.id = ANY(%s)', [file_ids])
+
+    @classmethod
+    def update_version_files(cls, version):
+        """Recompute the summaries of the files of a version"""
+        return cls._update(
+            'F.id IN (SELECT basefilenode_id FROM osf_basefileversionsthrough WHERE fileversion_id = %s)',
+            [version.id],
+        )
+
+    @classmethod
+    def update_range(cls, start_id, end_id):
+        """Recompute the summaries of the files with start_id <= id < end_id"""
+        return cls._update('F.id >= %s AND F.id < %s', [start_id, end_id])
+
+    @classmethod
+    def _update(cls, condition, params):
+        with connection.cursor() as cursor:
+            cursor.execute(UPDATE_SUMMARIES_SQL.format(condition=condition), params)
+            return cursor.rowcount
@@ -48,6 +48,7 @@ from osf.models.mixins import (AddonModelMixin, CommentableMixin, Loggable, Guar
                                EditableFieldsMixin)
 from osf.models.node_relation import NodeRelation
 from osf.models.nodelog import NodeLog
+from osf.models.nodestorageusage import NodeStorageUsage
 from osf.models.sanctions import RegistrationApproval
 from osf.models.private_link import PrivateLink
 from osf.models.tag import Tag
@@ -81,9 +82,6 @@ from osf.utils.permissions import (
 from website.util.metrics import OsfSourceTags, CampaignSourceTags
 from website.util import api_url_for, api_v2_url, web_url_for
 from .base import BaseModel, GuidMixin, GuidMixinQuerySet
-from api.caching.tasks import update_storage_usage
-from api.caching import settings as cache_settings
-from api.caching.utils import storage_usage_cache
 from api.share.utils import update_share
 
 
@@ -259,6 +257,18 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
         'node_license',
     }
 
+    # Node fields that are copied to the search documents of the files of the node
+    FILE_SEARCH_UPDATE_FIELDS = {
+        'title',
+        'is_public',
+        'is_deleted',
+        'deleted',
+        'spam_status',
+        'archiving',
+        'contributors',
+        'tags',
+    }
+
     # Node fields that trigger an identifier update on save
     IDENTIFIER_UPDATE_FIELDS = {
         'title',
@@ -464,6 +474,8 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
     mapcore_api_locked = models.BooleanField(default=False)
     mapcore_standby_to_upload = NonNaiveDateTimeField(null=True, blank=True)
     mapcore_sync_time = NonNaiveDateTimeField(null=True, blank=True)
+    # hash of the mAP group and its members at the last sync, see mapcore_group_fingerprint()
+    mapcore_group_fingerprint = models.CharField(max_length=40, null=True, blank=True)
 
     def title_with_group(self, title):
         value = title
@@ -742,12 +754,12 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
             logger.exception(e)
             log_exception()
 
-    def update_search(self, wiki_page=None):
+    def update_search(self, wiki_page=None, saved_fields=None):
         from website import search
 
         try:
             search.search.update_node(self, bulk=False, async_update=True,
-                                      wiki_page=wiki_page)
+                                      saved_fields=saved_fields, wiki_page=wiki_page)
             if self.is_collected and self.is_public:
                 search.search.update_collected_metadata(self._id)
         except search.exceptions.SearchUnavailableError as e:
@@ -1995,6 +2007,7 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
     def clone(self, *args, **kwargs):
         new = super(AbstractNode, self).clone(*args, **kwargs)
         new.map_group_key = None
+        new.mapcore_group_fingerprint = None
         return new
 
     def update_or_enqueue_on_node_updated(self, user_id, first_save, saved_fields):
@@ -2425,14 +2438,7 @@ class AbstractNode(DirtyFieldsMixin, TypedModel, AddonModelMixin, IdentifierMixi
 
     @property
     def storage_usage(self):
-        key = cache_settings.STORAGE_USAGE_KEY.format(target_id=self._id)
-
-        storage_usage_total = storage_usage_cache.get(key)
-        if storage_usage_total:
-            return storage_usage_total
-        else:
-            update_storage_usage(self)  # sets cache
-            return storage_usage_cache.get(key)
+        return NodeStorageUsage.get_total(self)
 
     # Overrides ContributorMixin
     # TODO: Deprecate this when we emberize contributors management for nodes
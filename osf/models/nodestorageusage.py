@@ -0,0 +1,173 @@
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, models, transaction
+
+from bulk_update.helper import bulk_update
+from osf.models.base import BaseModel
+from osf.utils.requests import check_select_for_update
+
+
+# Size of all the versions of the file F, summed from its versions when it has no summary yet
+FILE_SIZE_SQL = """
+    COALESCE(S.total_size, (
+        SELECT SUM(V.size) FROM osf_basefileversionsthrough AS T
+        JOIN osf_fileversion AS V ON V.id = T.fileversion_id
+        WHERE T.basefilenode_id = F.id
+    ), 0)
+"""
+
+# Size of the versions of the file F which are in %(version_ids)s
+VERSIONS_SIZE_SQL = """
+    (
+        SELECT COALESCE(SUM(V.size), 0) FROM osf_basefileversionsthrough AS T
+        JOIN osf_fileversion AS V ON V.id = T.fileversion_id
+        WHERE T.basefilenode_id = F.id AND V.id = ANY(%(version_ids)s)
+    )
+"""
+
+# The osfstorage files of nodes matching {condition}, counted by {size}, grouped by node
+NODE_SIZES_SQL = """
+    SELECT F.target_object_id AS node_id, SUM({size}) AS size
+    FROM osf_basefilenode AS F
+    LEFT JOIN osf_fileversionsummary AS S ON S.file_id = F.id
+    WHERE F.type = 'osf.osfstoragefile'
+    AND F.target_content_type_id = %(content_type_id)s
+    AND {condition}
+    GROUP BY F.target_object_id
+"""
+
+# A node without a row gets one with an unknown usage, which is computed when it is read
+ADD_SIZES_SQL = """
+    WITH D AS ({node_sizes})
+    INSERT INTO osf_nodestorageusage (created, modified, node_id, total_size)
+    SELECT now(), now(), D.node_id, NULL FROM D WHERE D.size <> 0
+    ON CONFLICT (node_id) DO UPDATE
+    SET total_size = osf_nodestorageusage.total_size + (SELECT D.size FROM D WHERE D.node_id = EXCLUDED.node_id),
+        modified = now()
+"""
+
+CREATE_USAGES_SQL = """
+    INSERT INTO osf_nodestorageusage (created, modified, node_id, total_size)
+    SELECT now(), now(), unnest(%(node_ids)s), NULL
+    ON CONFLICT (node_id) DO NOTHING
+"""
+
+
+class NodeStorageUsage(BaseModel):
+    """Bytes used by the versions of the osfstorage files of a node.
+
+    Adding, deleting, restoring or moving files or deleting versions applies their delta
+    in the transaction of the change, so reading the usage is a single row. A node without
+    a row gets one with an unknown usage, None, on its first change. The unknown usage is
+    computed when it is read, and ``reconcile`` corrects the rows that drifted, see the
+    ``reconcile_storage_usage`` command.
+    """
+    node = models.OneToOneField('osf.AbstractNode', related_name='storage_usage_counter', on_delete=models.CASCADE)
+    # None until the usage is computed
+    total_size = models.BigIntegerField(null=True, blank=True)
+
+    @classmethod
+    def get_total(cls, node):
+        """Return the bytes used by a node, computing them the first time"""
+        total_size = cls.objects.filter(node_id=node.id).values_list('total_size', flat=True).first()
+        if total_size is None:
+            total_size = cls.reconcile([node.id])[node.id][1]
+        return total_size
+
+    @classmethod
+    def add_file_size(cls, file_ids, size):
+        """Add size to the usage of the nodes of the files, once per file"""
+        cls._add('%(size)s', 'F.id = ANY(%(file_ids)s)', {'size': size, 'file_ids': list(file_ids)})
+
+    @classmethod
+    def add_version_size(cls, version, size):
+        """Add size to the usage of the nodes of the files of a version, once per file"""
+        cls._add(
+            '%(size)s',
+            'F.id IN (SELECT basefilenode_id FROM osf_basefileversionsthrough WHERE fileversion_id = %(version_id)s)',
+            {'size': size, 'version_id': version.id},
+        )
+
+    @classmethod
+    def remove_versions(cls, version_ids):
+        """Subtract the sizes of versions from the usage of the nodes of their files, before they are deleted"""
+        if not version_ids:
+            return
+        cls._add(
+            '-' + VERSIONS_SIZE_SQL,
+            'F.id IN (SELECT basefilenode_id FROM osf_basefileversionsthrough WHERE fileversion_id = ANY(%(version_ids)s))',
+            {'version_ids': list(version_ids)},
+        )
+
+    @classmethod
+    def add_files(cls, file_ids):
+        """Add the sizes of files to the usage of their nodes"""
+        cls._add(FILE_SIZE_SQL, 'F.id = ANY(%(file_ids)s)', {'file_ids': list(file_ids)})
+
+    @classmethod
+    def remove_files(cls, file_ids):
+        """Subtract the sizes of files from the usage of their nodes"""
+        cls._add('-' + FILE_SIZE_SQL, 'F.id = ANY(%(file_ids)s)', {'file_ids': list(file_ids)})
+
+    @classmethod
+    def compute_totals(cls, node_ids):
+        """Compute the usage of nodes from their files
+
+        :return: dict of node primary key to used bytes, nodes without files are omitted
+        """
+        if not node_ids:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                NODE_SIZES_SQL.format(size=FILE_SIZE_SQL, condition='F.target_object_id = ANY(%(node_ids)s)'),
+                {'content_type_id': cls._node_content_type_id(), 'node_ids': list(node_ids)},
+            )
+            return {node_id: int(size) for node_id, size in cursor.fetchall()}
+
+    @classmethod
+    def reconcile(cls, node_ids):
+        """Recompute the usage of nodes and correct the counted usage where it differs
+
+        The missing rows are created and all the rows are locked before the files are summed.
+        A concurrent change either commits before the sum, which then includes it, or waits
+        for the lock and applies its delta on top of the recomputed usage.
+
+        :return: dict of node primary key to (counted bytes or None, actual bytes)
+        """
+        node_ids = list(node_ids)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(CREATE_USAGES_SQL, {'node_ids': node_ids})
+            usages = cls.objects.filter(node_id__in=node_ids)
+            if check_select_for_update():
+                usages = usages.select_for_update()
+            usages = {usage.node_id: usage for usage in usages}
+            totals = cls.compute_totals(node_ids)
+
+            result = {}
+            changed = []
+            for node_id in node_ids:
+                total_size = totals.get(node_id, 0)
+                usage = usages[node_id]
+                result[node_id] = (usage.total_size, total_size)
+                if usage.total_size != total_size:
+                    usage.total_size = total_size
+                    changed.append(usage)
+            if changed:
+                bulk_update(changed, update_fields=['total_size'])
+        return result
+
+    @classmethod
+    def _add(cls, size, condition, params):
+        if not params.get('file_ids', True):
+            return
+        params = dict(params, content_type_id=cls._node_content_type_id())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                ADD_SIZES_SQL.format(node_sizes=NODE_SIZES_SQL.format(size=size, condition=condition)),
+                params,
+            )
+
+    @staticmethod
+    def _node_content_type_id():
+        return ContentType.objects.get_for_model(apps.get_model('osf.AbstractNode')).id
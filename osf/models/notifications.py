@@ -1,11 +1,18 @@
+import re
+
+from django.contrib.auth.models import Group
 from django.contrib.postgres.fields import ArrayField
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from osf.models import Node
+from osf.models.node import NodeGroupObjectPermission
 from osf.models import OSFUser
 from osf.models.base import BaseModel, ObjectIDMixin
 from osf.models.validators import validate_subscription_type
 from osf.utils.fields import NonNaiveDateTimeField
 from website.notifications.constants import NOTIFICATION_TYPES
+from website.notifications.utils import clear_subscriptions_cache
 from website.util import api_v2_url
 
 
@@ -100,3 +107,53 @@ class NotificationDigest(ObjectIDMixin, BaseModel):
     message = models.TextField()
     # TODO: Could this be a m2m with or without an order field?
     node_lineage = ArrayField(models.CharField(max_length=5))
+    # Number of runs which could not send the email of the digest
+    send_attempts = models.PositiveIntegerField(default=0)
+
+
+# Django groups of the node permissions, e.g. node_1_read, and of the members of OSF Groups
+NODE_GROUP_NAME_RE = re.compile(r'^node_(?P<node_id>\d+)_')
+OSF_GROUP_NAME_PREFIX = 'osfgroup_'
+
+
+@receiver(post_save, sender=NotificationSubscription)
+@receiver(post_delete, sender=NotificationSubscription)
+def clear_subscriptions_cache_on_subscription_change(sender, instance, **kwargs):
+    if instance.node_id:
+        clear_subscriptions_cache(instance.node_id)
+
+
+@receiver(m2m_changed, sender=NotificationSubscription.none.through)
+@receiver(m2m_changed, sender=NotificationSubscription.email_digest.through)
+@receiver(m2m_changed, sender=NotificationSubscription.email_transactional.through)
+def clear_subscriptions_cache_on_subscribers_change(sender, instance, action, reverse, **kwargs):
+    if action.startswith('post_') and not reverse and instance.node_id:
+        clear_subscriptions_cache(instance.node_id)
+
+
+@receiver(m2m_changed, sender=OSFUser.groups.through)
+def clear_subscriptions_cache_on_permissions_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Contributors and OSF Group members get their permissions through Django groups"""
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        group_names = [instance.name]
+    elif action == 'post_clear':
+        clear_subscriptions_cache()
+        return
+    else:
+        group_names = Group.objects.filter(id__in=pk_set).values_list('name', flat=True)
+    for name in group_names:
+        match = NODE_GROUP_NAME_RE.match(name)
+        if match:
+            clear_subscriptions_cache(int(match.group('node_id')))
+        elif name.startswith(OSF_GROUP_NAME_PREFIX):
+            clear_subscriptions_cache()
+            return
+
+
+@receiver(post_save, sender=NodeGroupObjectPermission)
+@receiver(post_delete, sender=NodeGroupObjectPermission)
+def clear_subscriptions_cache_on_group_permissions_change(sender, instance, **kwargs):
+    """OSF Groups are added to or removed from a node"""
+    clear_subscriptions_cache(instance.content_object_id)
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """model for rdm statistics"""
 
-from django.db import models
+from django.db import models, transaction
 from osf.models.base import BaseModel
 from osf.models import AbstractNode, OSFUser, Institution
 
@@ -19,3 +19,41 @@ class RdmStatistics(BaseModel):
     subtotal_file_number = models.BigIntegerField(null=False)
     subtotal_file_size = models.FloatField(null=False)
     date_acquired = models.DateField(null=False)
+
+
+class RdmStatisticsRollup(BaseModel):
+    """store totals of the statistics of an institution by provider, extension and date
+
+    The rows of a date are replaced when the statistics of the date are gathered.
+    """
+    institution = models.ForeignKey(Institution, blank=False, null=True)
+    provider = models.CharField(max_length=50, blank=False, null=True)
+    extention_type = models.CharField(max_length=10, null=True)
+    subtotal_file_number = models.BigIntegerField(null=False)
+    subtotal_file_size = models.FloatField(null=False)
+    date_acquired = models.DateField(null=False, db_index=True)
+
+    class Meta:
+        unique_together = (('institution', 'provider', 'extention_type', 'date_acquired'),)
+
+    @classmethod
+    def update_date(cls, date_acquired):
+        """replace the rollup rows of date_acquired by the totals of RdmStatistics"""
+        totals = RdmStatistics.objects.filter(date_acquired=date_acquired).values(
+            'institution_id', 'provider', 'extention_type'
+        ).annotate(
+            number=models.Sum('subtotal_file_number'),
+            size=models.Sum('subtotal_file_size'),
+        ).order_by()
+        with transaction.atomic():
+            cls.objects.filter(date_acquired=date_acquired).delete()
+            cls.objects.bulk_create([
+                cls(
+                    institution_id=total['institution_id'],
+                    provider=total['provider'],
+                    extention_type=total['extention_type'],
+                    subtotal_file_number=total['number'],
+                    subtotal_file_size=total['size'],
+                    date_acquired=date_acquired,
+                ) for total in totals
+            ])
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.db import DatabaseError, connection, transaction
+
+from osf.exceptions import LockTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# First key of the advisory locks of AdvisoryLock, the second one is the hash of their name
+ADVISORY_LOCK_NAMESPACE = 0x6f7366
+# Seconds between two attempts to acquire a lock with a timeout
+LOCK_POLL_INTERVAL = 0.1
+
+HOLDER_SQL = """
+    SELECT l.pid, a.application_name,
+        CASE WHEN a.state LIKE 'idle%%' THEN EXTRACT(EPOCH FROM clock_timestamp() - a.state_change) END
+    FROM pg_locks l LEFT JOIN pg_stat_activity a ON a.pid = l.pid
+    WHERE l.locktype = 'advisory' AND l.granted
+    AND l.classid = %s::int4::oid AND l.objid = hashtext(%s)::oid AND l.objsubid = 2
+"""
+
+
+def get_lock_owner():
+    """Return the default owner of the locks of this thread, e.g. web1:1234:Thread-1"""
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), threading.current_thread().name)
+
+
+class AdvisoryLock(object):
+    """A named lock shared by all the processes using the database.
+
+    Backed by a session level PostgreSQL advisory lock, so it does not depend on the
+    transaction of the caller and locks no row. The database releases it when the
+    connection which holds it is closed, e.g. when the process crashes, so stale locks
+    expire without any cleanup. The connection which holds the lock can acquire it again,
+    and has to release it as many times.
+
+    The owner of the lock, by default the host, process and thread which acquire it, is
+    set as the application_name of the connection which holds it, so that it shows in
+    pg_stat_activity. With a lease, a lock whose connection has
+    not run any query for lease seconds, e.g. because the process which holds it hangs,
+    expires: a process waiting for it terminates that connection.
+
+        with AdvisoryLock('mapcore_node:{}'.format(node._id), timeout=60, lease=600):
+            ...
+    """
+    def __init__(self, name, timeout=None, lease=None, owner=None):
+        self.name = name
+        self.timeout = timeout
+        self.lease = lease
+        self.owner = owner
+
+    def acquire(self, blocking=True, timeout=None):
+        """Acquire the lock
+
+        :param blocking: wait for the lock, otherwise return at once
+        :param timeout: seconds to wait for the lock at most, None waits as long as needed
+        :return: True if the lock was acquired
+        """
+        if blocking and timeout is None and self.lease is None:
+            self._execute('SELECT pg_advisory_lock(%s, hashtext(%s))')
+        else:
+            if not blocking:
+                deadline = 0
+            elif timeout is not None:
+                deadline = time.time() + timeout
+            else:
+                deadline = None
+            while not self._execute('SELECT pg_try_advisory_lock(%s, hashtext(%s))'):
+                # an expired lock is acquired once its connection is gone
+                expired = self._expire()
+                if not expired and deadline is not None and time.time() >= deadline:
+                    logger.debug('Lock {} is held by {}'.format(self.name, self.holder_owner()))
+                    return False
+                time.sleep(LOCK_POLL_INTERVAL)
+        with connection.cursor() as cursor:
+            owner = self.owner or get_lock_owner()
+            cursor.execute('SELECT set_config(\'application_name\', %s, false)', [owner[:63]])
+        return True
+
+    def release(self):
+        """Release the lock
+
+        If the lock cannot be released, e.g. because the transaction of the caller is
+        aborted, the connection is closed so that the database releases its locks.
+
+        :return: True if the lock was held by this connection
+        """
+        try:
+            # In a savepoint, so that a failure does not abort the transaction of the caller
+            with transaction.atomic():
+                released = self._execute('SELECT pg_advisory_unlock(%s, hashtext(%s))')
+        except DatabaseError:
+            logger.exception('Cannot release lock {}, closing the connection'.format(self.name))
+            connection.close()
+            return False
+        if not released:
+            logger.warning('Lock {} was not held'.format(self.name))
+        return released
+
+    def holder(self):
+        """Return the process id of the database backend which holds the lock, or None"""
+        return self._holder()[0]
+
+    def holder_owner(self):
+        """Return the owner of the lock, or None if it is not held"""
+        return self._holder()[1]
+
+    def _holder(self):
+        """Return the backend, the owner and the idle seconds of the holder of the lock"""
+        with connection.cursor() as cursor:
+            cursor.execute(HOLDER_SQL, [ADVISORY_LOCK_NAMESPACE, self.name])
+            row = cursor.fetchone()
+        return row or (None, None, None)
+
+    def _expire(self):
+        """Terminate the connection which holds the lock if its lease is over
+
+        :return: True if the connection was terminated
+        """
+        if self.lease is None:
+            return False
+        pid, owner, idle = self._holder()
+        if pid is None or idle is None or idle < self.lease:
+            return False
+        logger.warning('Lock {} of {} expired after {} idle seconds, terminating backend {}'.format(
+            self.name, owner, int(idle), pid))
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+                    return bool(cursor.fetchone()[0])
+        except DatabaseError:
+            logger.exception('Cannot terminate backend {} holding lock {}'.format(pid, self.name))
+            return False
+
+    def __enter__(self):
+        if not self.acquire(timeout=self.timeout):
+            raise LockTimeoutError('Lock {} was not acquired in {} seconds'.format(self.name, self.timeout))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def _execute(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [ADVISORY_LOCK_NAMESPACE, self.name])
+            row = cursor.fetchone()
+        return row[0] if row else None
@@ -15,6 +15,7 @@ from framework.auth.core import Auth
 from website import settings
 import website.search.search as search
 from website.search import elastic_search
+from website.search import handlers as search_handlers
 from website.search.util import build_query
 from website.search_migration.migrate import migrate
 from osf.models import (
@@ -400,6 +401,94 @@ class TestProject(OsfTestCase):
         docs = query(self.project.title)['results']
         assert_equal(len(docs), 1)
 
+    @mock.patch('website.search.elastic_search.bulk_send_actions')
+    def test_update_node_files_only_when_file_fields_saved(self, mock_bulk_send):
+        elastic_search.update_node(self.project, saved_fields=['description'])
+        assert_false(mock_bulk_send.called)
+
+        elastic_search.update_node(self.project, saved_fields=['title'])
+        assert_equal(mock_bulk_send.call_count, 1)
+
+        elastic_search.update_node(self.project)
+        assert_equal(mock_bulk_send.call_count, 2)
+
+    def test_update_node_files_bulk(self):
+        self.project.set_privacy('public')
+        file_ = OsfStorageFile.create(target=self.project, path='/red_special.txt', name='red_special.txt', materialized_path='/red_special.txt')
+        file_.save()
+        self.project.title = 'Brian May'
+        self.project.save()
+        elastic_search.update_node(self.project, saved_fields=['title'])
+        doc = elastic_search.client().get(index=elastic_search.INDEX, doc_type='file', id=file_._id)
+        assert_equal(doc['_source']['node_title'], 'Brian May')
+
+
+class TestIndexBuffer(unittest.TestCase):
+
+    @mock.patch('website.search.elastic_search.bulk_send_actions')
+    @mock.patch('website.search.elastic_search.client')
+    def test_coalesce_and_flush_once(self, mock_client, mock_bulk_send):
+        with elastic_search.index_buffer():
+            elastic_search.index_document('test', 'user', 'abcde', {'name': 'Freddie'})
+            with elastic_search.index_buffer():
+                elastic_search.index_document('test', 'user', 'fghij', {'name': 'Roger'})
+            elastic_search.index_document('test', 'user', 'abcde', {'name': 'Freddie Mercury'})
+            elastic_search.delete_document('test', 'wiki', 'abcde')
+            assert_false(mock_bulk_send.called)
+
+        assert_false(mock_client.return_value.index.called)
+        assert_equal(mock_bulk_send.call_count, 1)
+        actions = mock_bulk_send.call_args[0][0]
+        assert_equal([(action['_type'], action['_id']) for action in actions], [
+            ('user', 'fghij'),
+            ('user', 'abcde'),
+            ('wiki', 'abcde'),
+        ])
+        assert_equal(actions[1]['_source'], {'name': 'Freddie Mercury'})
+        assert_equal(actions[2]['_op_type'], 'delete')
+        assert_is_none(elastic_search.get_index_buffer())
+
+    @mock.patch('website.search.elastic_search.bulk_send_actions')
+    @mock.patch('website.search.elastic_search.client')
+    def test_discard_on_error(self, mock_client, mock_bulk_send):
+        with assert_raises(ValueError):
+            with elastic_search.index_buffer():
+                elastic_search.index_document('test', 'user', 'abcde', {'name': 'Freddie'})
+                raise ValueError()
+        assert_false(mock_bulk_send.called)
+        assert_is_none(elastic_search.get_index_buffer())
+
+        elastic_search.index_document('test', 'user', 'abcde', {'name': 'Freddie'})
+        mock_client.return_value.index.assert_called_once_with(
+            index='test', doc_type='user', id='abcde', body={'name': 'Freddie'}, refresh=True)
+
+    @mock.patch('website.search.search.search_engine', elastic_search)
+    @mock.patch('website.search.elastic_search.bulk_send_actions')
+    @mock.patch('website.search.elastic_search.client')
+    def test_request_handlers(self, mock_client, mock_bulk_send):
+        search_handlers.search_before_request()
+        elastic_search.index_document('test', 'institution', 'abcde', {'name': 'Queen'})
+        elastic_search.index_document('test', 'institution', 'abcde', {'name': 'Queen II'})
+        search_handlers.search_after_request(mock.Mock(status_code=200))
+        assert_false(mock_bulk_send.called)
+        search_handlers.search_teardown_request()
+        assert_false(mock_client.return_value.index.called)
+        assert_equal(mock_bulk_send.call_count, 1)
+        actions = mock_bulk_send.call_args[0][0]
+        assert_equal([action['_source'] for action in actions], [{'name': 'Queen II'}])
+        assert_is_none(elastic_search.get_index_buffer())
+
+        # the documents of a failed request are discarded
+        search_handlers.search_before_request()
+        elastic_search.index_document('test', 'institution', 'abcde', {'name': 'Queen'})
+        search_handlers.search_after_request(mock.Mock(status_code=500))
+        search_handlers.search_teardown_request()
+        search_handlers.search_before_request()
+        elastic_search.index_document('test', 'institution', 'abcde', {'name': 'Queen'})
+        search_handlers.search_teardown_request(error=ValueError())
+        assert_equal(mock_bulk_send.call_count, 1)
+        assert_is_none(elastic_search.get_index_buffer())
+
 
 @pytest.mark.enable_search
 @pytest.mark.enable_enqueue_task
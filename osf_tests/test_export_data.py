@@ -1,4 +1,5 @@
 import copy
+import types
 from datetime import datetime
 
 import mock
@@ -283,6 +284,20 @@ class TestExportData(TestCase):
         self.file1.deleted_by_id = None
         self.file1.save()
 
+    def test_extract_file_information_json_from_source_storage__06_stream(self):
+        result = self.export_data.extract_file_information_json_from_source_storage(stream=True)
+
+        nt.assert_is_instance(result, tuple)
+        export_data_json, file_info_json = result
+        nt.assert_is_instance(file_info_json['files'], types.GeneratorType)
+        nt.assert_equal(export_data_json['files_numb'], 0)
+
+        files = list(file_info_json['files'])
+
+        nt.assert_equal(len(files), len(self.file_info_json['files']))
+        nt.assert_equal(files[0].get('version'), self.file_info_json['files'][0].get('version'))
+        nt.assert_equal(export_data_json, self.export_data_json)
+
     def test_process_start_timestamp(self):
         nt.assert_equal(self.export_data.process_start_timestamp, self.export_data.process_start.strftime('%s'))
 
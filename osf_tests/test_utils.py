@@ -1,6 +1,12 @@
+import threading
+import time
+
 import pytest
+from django.db import DatabaseError, connection, transaction
 
+from osf.exceptions import LockTimeoutError
 from osf.models import Node
+from osf.utils.locks import AdvisoryLock
 from osf.utils.migrations import disable_auto_now_fields
 from osf_tests.factories import NodeFactory
 
@@ -61,3 +67,121 @@ class TestDisableAutoNowContextManager:
 
         assert node.created == old_created
         assert Node._meta.get_field('created').auto_now is False
+
+
+def acquire_in_thread(name, **kwargs):
+    """Try to acquire a lock from another database connection"""
+    result = {}
+
+    def acquire():
+        try:
+            lock = AdvisoryLock(name)
+            result['acquired'] = lock.acquire(**kwargs)
+            if result['acquired']:
+                lock.release()
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    thread.join()
+    return result['acquired']
+
+
+class TestAdvisoryLock:
+
+    def test_acquire_release(self):
+        lock = AdvisoryLock('test_lock')
+        assert lock.holder() is None
+
+        assert lock.acquire(blocking=False)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            assert lock.holder() == cursor.fetchone()[0]
+
+        assert lock.release()
+        assert lock.holder() is None
+        assert not lock.release()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_held_by_another_connection(self):
+        with AdvisoryLock('test_lock'):
+            assert not acquire_in_thread('test_lock', blocking=False)
+            assert not acquire_in_thread('test_lock', timeout=0.2)
+            assert acquire_in_thread('other_test_lock', blocking=False)
+        assert acquire_in_thread('test_lock', timeout=0.2)
+
+    @pytest.mark.django_db(transaction=True)
+    def test_release_in_aborted_transaction(self):
+        lock = AdvisoryLock('test_lock')
+        assert lock.acquire(blocking=False)
+        with transaction.atomic():
+            with pytest.raises(DatabaseError):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1 / 0')
+            # the connection is closed, which releases the lock
+            assert not lock.release()
+        assert acquire_in_thread('test_lock', blocking=False)
+        assert lock.holder() is None
+
+    @pytest.mark.django_db(transaction=True)
+    def test_context_manager_timeout(self):
+        lock = AdvisoryLock('test_lock', timeout=0.2)
+        holder_acquired = threading.Event()
+        holder_done = threading.Event()
+
+        def hold():
+            try:
+                with AdvisoryLock('test_lock'):
+                    holder_acquired.set()
+                    holder_done.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            holder_acquired.wait(5)
+            with pytest.raises(LockTimeoutError):
+                with lock:
+                    pass
+        finally:
+            holder_done.set()
+            thread.join()
+
+        with lock:
+            assert lock.holder() is not None
+
+    @pytest.mark.django_db(transaction=True)
+    def test_owner(self):
+        with AdvisoryLock('test_lock', owner='test-owner'):
+            assert AdvisoryLock('test_lock').holder_owner() == 'test-owner'
+        assert AdvisoryLock('test_lock').holder_owner() is None
+
+    @pytest.mark.django_db(transaction=True)
+    def test_lease_expires(self):
+        holder_acquired = threading.Event()
+        holder_done = threading.Event()
+
+        def hold():
+            try:
+                AdvisoryLock('test_lock', owner='stale-owner').acquire()
+                holder_acquired.set()
+                # the process hangs without using its connection
+                holder_done.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            holder_acquired.wait(5)
+            assert not AdvisoryLock('test_lock', lease=60).acquire(timeout=0.2)
+            time.sleep(0.3)
+            lock = AdvisoryLock('test_lock', lease=0.2)
+            assert lock.acquire(timeout=5)
+            assert lock.holder_owner() != 'stale-owner'
+            assert lock.release()
+        finally:
+            holder_done.set()
+            thread.join()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Compare the queries sorting the versions of every file with the ones reading
+FileVersionSummary, for the children of a folder and the storage usage of a project.
+
+    python -m scripts.benchmark_file_version_summary --folder FOLDER_ID --node NODE_GUID [-n 20]
+
+Run ``python manage.py backfill_file_version_summaries`` first.
+"""
+import argparse
+import logging
+import time
+
+from website.app import setup_django
+setup_django()
+
+from django.db import connection
+
+from addons.osfstorage.views import get_children_page
+from osf.models import AbstractNode, BaseFileNode, NodeStorageUsage
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# The version columns of the children listing before FileVersionSummary
+CHILDREN_SORTING_VERSIONS_SQL = """
+    SELECT F.id, LATEST_VERSION.size, LATEST_VERSION.content_type, LATEST_VERSION.created,
+        LATEST_VERSION.metadata ->> 'md5', LATEST_VERSION.metadata ->> 'sha256', EARLIEST_VERSION.created,
+        (SELECT COUNT(*) FROM osf_basefileversionsthrough WHERE osf_basefileversionsthrough.basefilenode_id = F.id)
+    FROM osf_basefilenode AS F
+    LEFT JOIN LATERAL (
+        SELECT * FROM osf_fileversion
+        JOIN osf_basefileversionsthrough ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
+        WHERE osf_basefileversionsthrough.basefilenode_id = F.id
+        ORDER BY created DESC
+        LIMIT 1
+    ) LATEST_VERSION ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT * FROM osf_fileversion
+        JOIN osf_basefileversionsthrough ON osf_fileversion.id = osf_basefileversionsthrough.fileversion_id
+        WHERE osf_basefileversionsthrough.basefilenode_id = F.id
+        ORDER BY created ASC
+        LIMIT 1
+    ) EARLIEST_VERSION ON TRUE
+    WHERE parent_id = %s
+    AND (NOT F.type IN ('osf.trashedfilenode', 'osf.trashedfile', 'osf.trashedfolder'))
+"""
+
+CHILDREN_SUMMARY_SQL = """
+    SELECT F.id, S.size, S.content_type, S.latest_version_created,
+        S.md5, S.sha256, S.earliest_version_created, S.version_count
+    FROM osf_basefilenode AS F
+    LEFT JOIN osf_fileversionsummary AS S ON S.file_id = F.id
+    WHERE parent_id = %s
+    AND (NOT F.type IN ('osf.trashedfilenode', 'osf.trashedfile', 'osf.trashedfolder'))
+"""
+
+STORAGE_USAGE_VERSIONS_SQL = """
+    SELECT sum(size) FROM osf_basefileversionsthrough AS obfnv
+    LEFT JOIN osf_basefilenode file ON obfnv.basefilenode_id = file.id
+    LEFT JOIN osf_fileversion version ON obfnv.fileversion_id = version.id
+    WHERE file.provider = 'osfstorage'
+    AND file.deleted_on IS NULL
+    AND file.target_object_id = %s
+"""
+
+STORAGE_USAGE_SUMMARY_SQL = """
+    SELECT sum(summary.total_size) FROM osf_basefilenode file
+    JOIN osf_fileversionsummary summary ON summary.file_id = file.id
+    WHERE file.provider = 'osfstorage'
+    AND file.deleted_on IS NULL
+    AND file.target_object_id = %s
+"""
+
+
+def execute(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return len(cursor.fetchall())
+
+def run(name, func, iterations, *args):
+    result = func(*args)
+    start = time.time()
+    for _ in range(iterations):
+        func(*args)
+    elapsed = time.time() - start
+    logger.info('{:<36} {:>9.3f} ms/call (rows={})'.format(name, elapsed * 1000 / iterations, result))
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FileVersionSummary against sorting the versions')
+    parser.add_argument('--folder', required=True, help='_id of an osfstorage folder')
+    parser.add_argument('--node', required=True, help='guid of a project')
+    parser.add_argument('-n', '--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    folder = BaseFileNode.objects.get(_id=args.folder)
+    node = AbstractNode.load(args.node)
+
+    versions_elapsed = run('children (sorting versions)', execute, args.iterations,
+                           CHILDREN_SORTING_VERSIONS_SQL, [folder.id])
+    summary_elapsed = run('children (summary)', execute, args.iterations,
+                          CHILDREN_SUMMARY_SQL, [folder.id])
+    logger.info('children speedup: x{:.1f}'.format(versions_elapsed / summary_elapsed))
+    run('osfstorage_get_children page', lambda: len(get_children_page(folder)), args.iterations)
+    run('osfstorage_get_children lean page', lambda: len(get_children_page(folder, lean=True)), args.iterations)
+
+    versions_elapsed = run('storage usage (versions)', execute, args.iterations,
+                           STORAGE_USAGE_VERSIONS_SQL, [node.id])
+    summary_elapsed = run('storage usage (summary)', execute, args.iterations,
+                          STORAGE_USAGE_SUMMARY_SQL, [node.id])
+    logger.info('storage usage speedup: x{:.1f}'.format(versions_elapsed / summary_elapsed))
+    run('storage usage (counter)', NodeStorageUsage.get_total, args.iterations, node)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Compare the openssl command and the in-process RFC 3161 implementation
+used by website.util.timestamp.
+
+    python -m scripts.benchmark_timestamp_verify --data FILE --tsr TSR_FILE [--ca-file CA] [-n 100]
+
+TSR_FILE must be a time-stamp response for FILE, e.g. created with
+``openssl ts -query -data FILE -cert -sha512 | curl --data-binary @- ...``.
+"""
+import argparse
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+
+from website.app import setup_django
+setup_django()
+
+from api.base import settings as api_settings
+from website.util import rfc3161
+from website.util.timestamp import filename_formatter
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def create_request_subprocess(data_file):
+    cmd = shlex.split(api_settings.SSL_CREATE_TIMESTAMP_REQUEST.format(filename_formatter(data_file)))
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout_data, _ = process.communicate()
+    return stdout_data
+
+def create_request_in_process(data_file):
+    return rfc3161.create_request(rfc3161.hash_file(data_file, 'sha512'), 'sha512')
+
+def verify_subprocess(data_file, tsr, ca_file):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        tsr_file = os.path.join(tmp_dir, 'benchmark.tsr')
+        with open(tsr_file, 'wb') as fout:
+            fout.write(tsr)
+        cmd = shlex.split(api_settings.SSL_GET_TIMESTAMP_RESPONSE.format(
+            filename_formatter(data_file), tsr_file, ca_file))
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout_data, _ = process.communicate()
+        return stdout_data.__str__().find(api_settings.OPENSSL_VERIFY_RESULT_OK) > -1
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def verify_in_process(data_file, tsr, ca_file):
+    try:
+        rfc3161.TimeStampResponse(tsr).verify_file(data_file, ca_file)
+    except rfc3161.TimestampVerificationError:
+        return False
+    return True
+
+def run(name, func, iterations, *args):
+    result = func(*args)
+    start = time.time()
+    for _ in range(iterations):
+        func(*args)
+    elapsed = time.time() - start
+    logger.info('{:<28} {:>9.3f} ms/call (result={})'.format(name, elapsed * 1000 / iterations, result))
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark timestamp request and verification')
+    parser.add_argument('--data', required=True, help='time-stamped file')
+    parser.add_argument('--tsr', required=True, help='time-stamp response of the file')
+    parser.add_argument('--ca-file', default=os.path.join(
+        api_settings.KEY_SAVE_PATH, api_settings.VERIFY_ROOT_CERTIFICATE))
+    parser.add_argument('-n', '--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    with open(args.tsr, 'rb') as f:
+        tsr = f.read()
+
+    subprocess_elapsed = run('request (openssl command)', create_request_subprocess, args.iterations, args.data)
+    in_process_elapsed = run('request (in-process)', create_request_in_process, args.iterations, args.data)
+    logger.info('request speedup: x{:.1f}'.format(subprocess_elapsed / in_process_elapsed))
+
+    subprocess_elapsed = run('verify (openssl command)', verify_subprocess, args.iterations, args.data, tsr, args.ca_file)
+    in_process_elapsed = run('verify (in-process)', verify_in_process, args.iterations, args.data, tsr, args.ca_file)
+    logger.info('verify speedup: x{:.1f}'.format(subprocess_elapsed / in_process_elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -223,8 +223,6 @@ def celery_worker(ctx, level='debug', hostname=None, beat=False, queues=None, co
         cmd = cmd + ' --concurrency={}'.format(concurrency)
     if max_tasks_per_child:
         cmd = cmd + ' --maxtasksperchild={}'.format(max_tasks_per_child)
-    from addons.base.lock_utils import init_lock
-    init_lock()
     ctx.run(bin_prefix(cmd), pty=True)
 
 
@@ -239,8 +237,12 @@ def celery_beat(ctx, level='debug', schedule=None):
     ctx.run(bin_prefix(cmd), pty=True)
 
 @task
-def migrate_search(ctx, delete=True, remove=False, remove_all=False, index=None):
-    """Migrate the search-enabled models."""
+def migrate_search(ctx, delete=True, remove=False, remove_all=False, index=None, processes=1, checkpoint=None):
+    """Migrate the search-enabled models.
+
+    Nodes, files and users are migrated by `processes` processes. If `checkpoint` is a path,
+    the progress is saved to the file and a failed migration restarts from it.
+    """
     from website.app import init_app
     init_app(routes=False, set_backends=False)
     from website.search_migration.migrate import migrate
@@ -251,7 +253,8 @@ def migrate_search(ctx, delete=True, remove=False, remove_all=False, index=None)
     for logger in SILENT_LOGGERS:
         logging.getLogger(logger).setLevel(logging.ERROR)
 
-    migrate(delete, remove=remove, remove_all=remove_all, index=index)
+    migrate(delete, remove=remove, remove_all=remove_all, index=index,
+            processes=int(processes), checkpoint_file=checkpoint)
 
 @task
 def rebuild_search(ctx):
@@ -1063,16 +1066,6 @@ def mapcore_rmgroups(ctx, user=None, file=None, grdm=False, map=False, key_only=
     remove_multi_groups(options)
 
 
-@task
-def mapcore_unlock_all(ctx):
-    '''Remove all lock flags for mAP core'''
-    from website.app import init_app
-    init_app(routes=False)
-
-    from nii import mapcore
-    mapcore.mapcore_unlock_all()
-
-
 @task
 def mapcore_test_lock(ctx):
     '''test lock functions for mapcore.py'''
@@ -6,7 +6,7 @@ import mock
 from nose.tools import *  # noqa: F403
 import sendgrid
 
-from framework.email.tasks import send_email, _send_with_sendgrid
+from framework.email.tasks import send_email, send_emails, _send_with_sendgrid
 from website import settings
 from tests.base import fake
 from osf_tests.factories import fake_email
@@ -76,6 +76,88 @@ class TestEmail(unittest.TestCase):
         )
         assert_false(ret)
 
+    @mock.patch('framework.email.tasks.settings.SENDGRID_API_KEY', None)
+    @mock.patch('framework.email.tasks.settings.USE_EMAIL', True)
+    @mock.patch('framework.email.tasks.smtplib.SMTP')
+    def test_send_emails_reuses_smtp_connection(self, mock_smtp):
+        emails = [
+            dict(
+                from_addr=fake_email(),
+                to_addr=fake_email(),
+                subject=fake.bs(),
+                message=fake.text(),
+                ttls=False,
+                login=False,
+            )
+            for _ in range(3)
+        ]
+        assert_equal(send_emails(emails), [True, True, True])
+        assert_equal(mock_smtp.call_count, 1)
+        connection = mock_smtp.return_value
+        assert_equal(connection.sendmail.call_count, 3)
+        assert_equal([call[1]['to_addrs'] for call in connection.sendmail.call_args_list],
+                     [[email['to_addr']] for email in emails])
+        assert_equal(connection.quit.call_count, 1)
+
+    @mock.patch('framework.email.tasks.settings.SENDGRID_API_KEY', None)
+    @mock.patch('framework.email.tasks.settings.USE_EMAIL', True)
+    @mock.patch('framework.email.tasks.smtplib.SMTP')
+    def test_send_emails_skips_failed_emails(self, mock_smtp):
+        emails = [
+            dict(from_addr=fake_email(), to_addr=fake_email(), subject=fake.bs(), message=fake.text(),
+                 ttls=False, login=False)
+            for _ in range(3)
+        ]
+        lost_connection = mock.Mock()
+        lost_connection.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+        lost_connection.quit.side_effect = smtplib.SMTPServerDisconnected()
+        connection = mock.Mock()
+        connection.sendmail.side_effect = [smtplib.SMTPDataError(554, 'rejected'), None, None]
+        connection.quit.side_effect = smtplib.SMTPServerDisconnected()
+        mock_smtp.side_effect = [lost_connection, connection]
+
+        # the first email is sent again over a new connection and rejected, the others are sent
+        assert_equal(send_emails(emails), [False, True, True])
+        assert_equal(mock_smtp.call_count, 2)
+        assert_equal(lost_connection.sendmail.call_count, 1)
+        assert_true(lost_connection.close.called)
+        assert_equal(connection.sendmail.call_count, 3)
+        assert_true(connection.close.called)
+
+    @mock.patch('framework.email.tasks.settings.SENDGRID_EMAIL_WHITELIST', [])
+    @mock.patch('framework.email.tasks.settings.SENDGRID_WHITELIST_MODE', False)
+    @mock.patch('framework.email.tasks.settings.SENDGRID_API_KEY', 'key')
+    @mock.patch('framework.email.tasks.settings.USE_EMAIL', True)
+    @mock.patch('framework.email.tasks.sendgrid.SendGridClient')
+    def test_send_emails_with_sendgrid_skips_failed_emails(self, mock_client_class):
+        emails = [
+            dict(from_addr=fake_email(), to_addr=fake_email(), subject=fake.bs(), message=fake.text())
+            for _ in range(3)
+        ]
+        mock_client = mock_client_class.return_value
+        mock_client.send.side_effect = [Exception('timed out'), (400, 'failed'), (200, 'success')]
+
+        assert_equal(send_emails(emails), [False, False, True])
+        assert_equal(mock_client_class.call_count, 1)
+        assert_equal(mock_client.send.call_count, 3)
+
+    @mock.patch('framework.email.tasks.settings.SENDGRID_WHITELIST_MODE', True)
+    @mock.patch('framework.email.tasks.settings.SENDGRID_API_KEY', 'key')
+    @mock.patch('framework.email.tasks.settings.USE_EMAIL', True)
+    @mock.patch('framework.email.tasks.sendgrid.SendGridClient')
+    def test_send_emails_with_sendgrid_whitelist_mode(self, mock_client_class):
+        emails = [
+            dict(from_addr=fake_email(), to_addr=fake_email(), subject=fake.bs(), message=fake.text())
+            for _ in range(2)
+        ]
+        mock_client = mock_client_class.return_value
+        mock_client.send.return_value = 400, 'failed'
+
+        # the email to the recipient which is not whitelisted is done without being sent
+        with mock.patch('framework.email.tasks.settings.SENDGRID_EMAIL_WHITELIST', [emails[1]['to_addr']]):
+            assert_equal(send_emails(emails), [True, False])
+        assert_equal(mock_client.send.call_count, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
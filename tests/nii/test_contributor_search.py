@@ -1,3 +1,8 @@
+import os
+import shutil
+import tempfile
+import unittest
+
 import pytest
 import mock
 
@@ -5,7 +10,7 @@ from nose.tools import *  # noqa PEP8 asserts
 
 from website import settings
 import website.search.search as search
-from website.search_migration.migrate import migrate
+from website.search_migration.migrate import migrate, MigrationCheckpoint
 from website.search.util import build_query, build_query_string, validate_email
 
 from tests.base import OsfTestCase
@@ -232,6 +237,18 @@ class TestSearchMigrationNormalizedField(OsfTestCase):
         self.search_contrib(self.TOTAL_USERS)
         self.search_project(self.TOTAL_PROJECTS)
 
+    def test_rebuild_search_with_checkpoint(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            checkpoint_file = os.path.join(tmp_dir, 'checkpoint.json')
+            migrate(delete=False, remove=True,
+                    index=None, app=self.app.app, checkpoint_file=checkpoint_file)
+            assert_false(os.path.exists(checkpoint_file))
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.search_contrib(self.TOTAL_USERS)
+        self.search_project(self.TOTAL_PROJECTS)
+
     def test_rebuild_search_check_not_normalized(self):
         with mock.patch('website.search_migration.migrate.fill_and_normalize'):
             migrate(delete=False, remove=True,
@@ -241,6 +258,44 @@ class TestSearchMigrationNormalizedField(OsfTestCase):
         self.search_contrib(0)
         self.search_project(0)
 
+class TestMigrationCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_restart(self):
+        checkpoint = MigrationCheckpoint(self.path)
+        assert_is_none(checkpoint.index)
+        checkpoint.index = 'test_v2'
+        checkpoint.done('nodes', 0)
+        checkpoint.done('nodes', 20000)
+        checkpoint.done('wikis')
+
+        checkpoint = MigrationCheckpoint(self.path)
+        assert_equal(checkpoint.index, 'test_v2')
+        assert_true(checkpoint.is_done('nodes', 0))
+        assert_false(checkpoint.is_done('nodes', 10000))
+        assert_true(checkpoint.is_done('nodes', 20000))
+        assert_false(checkpoint.is_done('nodes'))
+        assert_true(checkpoint.is_done('wikis'))
+        assert_false(checkpoint.is_done('comments'))
+
+        checkpoint.remove()
+        assert_false(os.path.exists(self.path))
+
+    def test_without_file(self):
+        checkpoint = MigrationCheckpoint()
+        checkpoint.index = 'test_v2'
+        checkpoint.done('users', 0)
+        assert_true(checkpoint.is_done('users', 0))
+        checkpoint.remove()
+        assert_equal(os.listdir(self.tmp_dir), [])
+
+
 class TestSearchUtils(OsfTestCase):
 
     def test_build_query_with_match_key_and_match_value_valid(self):
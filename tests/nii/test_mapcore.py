@@ -16,7 +16,7 @@ import pytest
 from nose.tools import *  # noqa PEP8 asserts
 
 from framework.auth.core import Auth
-from osf.models import AbstractNode, NodeLog
+from osf.models import AbstractNode, NodeLog, OSFUser
 from osf.models.mapcore import MAPProfile
 from osf.utils.permissions import (CREATOR_PERMISSIONS,
                                    DEFAULT_CONTRIBUTOR_PERMISSIONS)
@@ -211,6 +211,18 @@ class TestFuncOfMAPCore(OsfTestCase):
         self.project_url = self.project.web_url_for('view_project')
         self.project.save()
 
+    @mock.patch('requests.post')
+    def test_refresh_token_already_refreshed(self, mock_post):
+        mapcore = MAPCore(OSFUser.objects.get(id=self.me.id))
+        assert_equal(mapcore.user.map_profile.oauth_access_token, 'fake_access_token')
+        # another worker refreshes the token
+        self.me.map_profile.oauth_access_token = 'new_access_token'
+        self.me.map_profile.save()
+
+        assert_true(mapcore.refresh_token())
+        assert_false(mock_post.called)
+        assert_equal(mapcore.user.map_profile.oauth_access_token, 'new_access_token')
+
     @mock.patch('nii.mapcore.MAPCORE_CLIENTID', None)
     def test_sync_is_disabled(self):
         assert_equal(mapcore_sync_is_enabled(), False)
@@ -830,17 +842,32 @@ class TestFuncOfMAPCore(OsfTestCase):
         assert_equal(mock_remove.call_count, 0)
         assert_equal(mock_edit.call_count, 0)
 
+    def _fake_group_info(self, member_eppns):
+        def get_group_info(access_user, node, group_key, base_grp=None, can_abort=True):
+            group_ext = dict(base_grp)
+            group_ext['introduction'] = 'fake_introduction'
+            group_ext['group_admin_eppn'] = [self.me.eppn]
+            group_ext['group_member_list'] = [
+                {'eppn': eppn, 'admin': MAPCore.MODE_ADMIN if eppn == self.me.eppn else MAPCore.MODE_MEMBER,
+                 'is_admin': eppn == self.me.eppn}
+                for eppn in member_eppns]
+            return group_ext
+        return get_group_info
+
     @mock.patch('nii.mapcore_api.MAPCORE_SECRET', 'fake_secret')
     @mock.patch('nii.mapcore_api.MAPCORE_HOSTNAME', 'fake_hostname')
     @mock.patch('nii.mapcore_api.MAPCORE_API_PATH', '/fake_api_path')
     @mock.patch('nii.mapcore_api.MAPCore.get_my_groups')
+    @mock.patch('nii.mapcore.mapcore_get_extended_group_info')
     @mock.patch('nii.mapcore.mapcore_sync_rdm_project_or_map_group')
     @mock.patch('nii.mapcore.mapcore_sync_rdm_project')
-    def test_sync_rdm_my_projects(self, mock_sync_rdm, mock_or, mock_mygr):
+    def test_sync_rdm_my_projects(self, mock_sync_rdm, mock_or, mock_gi, mock_mygr):
         from django.core.exceptions import ObjectDoesNotExist
         from nii.mapcore import mapcore_sync_rdm_my_projects
 
-        # test #1 : same groups, same title
+        mock_gi.side_effect = self._fake_group_info([self.me.eppn])
+
+        # test #1 : same groups, same title, not synchronized yet
         mock_mygr.return_value = {
             'result': {'groups': [
                 {'group_name': 'fake_group_name1',
@@ -850,23 +877,48 @@ class TestFuncOfMAPCore(OsfTestCase):
         self.project.title = 'fake_group_name1'
         self.project.map_group_key = 'fake_group_key1'
         self.project.save()
-        mapcore_sync_rdm_my_projects(self.me, use_raise=True)
+        assert_equal(mapcore_sync_rdm_my_projects(self.me, use_raise=True, max_workers=1), 1)
         assert_equal(mock_mygr.call_count, 1)
-        assert_equal(mock_or.call_count, 0)
+        assert_equal(mock_gi.call_count, 1)
+        assert_equal(mock_or.call_count, 1)
         assert_equal(mock_sync_rdm.call_count, 0)
+        self.project.reload()
+        fingerprint = self.project.mapcore_group_fingerprint
+        assert_not_equal(fingerprint, None)
+        mock_mygr.call_count = 0
+        mock_gi.call_count = 0
+        mock_or.call_count = 0
+
+        # test #2 : same fingerprint
+        assert_equal(mapcore_sync_rdm_my_projects(self.me, use_raise=True, max_workers=1), 0)
+        assert_equal(mock_mygr.call_count, 1)
+        assert_equal(mock_gi.call_count, 1)
+        assert_equal(mock_or.call_count, 0)
+        mock_mygr.call_count = 0
+        mock_gi.call_count = 0
+
+        # test #3 : members of mAP group are changed
+        mock_gi.side_effect = self._fake_group_info([self.me.eppn, self.user2.eppn])
+        mapcore_sync_rdm_my_projects(self.me, use_raise=True, max_workers=1)
+        assert_equal(mock_or.call_count, 1)
+        self.project.reload()
+        assert_not_equal(self.project.mapcore_group_fingerprint, fingerprint)
         mock_mygr.call_count = 0
+        mock_gi.call_count = 0
+        mock_or.call_count = 0
 
-        # test #2 : same groups, different title
+        # test #4 : same groups, different title
         self.project.title = 'fake_group_name1' + randstr(4)
         self.project.save()
-        mapcore_sync_rdm_my_projects(self.me, use_raise=True)
+        mapcore_sync_rdm_my_projects(self.me, use_raise=True, max_workers=1)
         assert_equal(mock_mygr.call_count, 1)
         assert_equal(mock_or.call_count, 1)
         assert_equal(mock_sync_rdm.call_count, 0)
         mock_mygr.call_count = 0
+        mock_gi.call_count = 0
         mock_or.call_count = 0
 
-        # test #3 : mAP group only, RDM project exists
+        # test #5 : mAP group only, RDM project exists
         mock_mygr.return_value = {
             'result': {'groups': [
                 {'group_name': 'fake_group_name1',
@@ -886,78 +938,77 @@ class TestFuncOfMAPCore(OsfTestCase):
         )
         project2.map_group_key = 'fake_group_key2'
         project2.save()  # self.me is not a member.
-        mapcore_sync_rdm_my_projects(self.me, use_raise=True)
+        mapcore_sync_rdm_my_projects(self.me, use_raise=True, max_workers=1)
         assert_equal(mock_mygr.call_count, 1)
         assert_equal(mock_or.call_count, 1)
         assert_equal(mock_sync_rdm.call_count, 0)
         mock_mygr.call_count = 0
+        mock_gi.call_count = 0
         mock_or.call_count = 0
         project2.delete()
 
-        # test #4 : mAP group only, RDM project does not exist
-        mock_mygr.return_value = {
-            'result': {'groups': [
-                {'group_name': 'fake_group_name1',
-                 'group_key': 'fake_group_key1',
-                 'active': 1, 'public': 1,
-                 'open_member': OPEN_MEMBER_PUBLIC},
-                {'group_name': 'fake_group_name2',
-                 'group_key': 'fake_group_key2',
-                 'active': 1, 'public': 1,
-                 'open_member': OPEN_MEMBER_PUBLIC}]}}
-        # self.project.title = 'fake_group_name1'
-        # self.project.map_group_key = 'fake_group_key1'
-        # self.project.save()
+        # test #6 : mAP group only, RDM project does not exist
         with assert_raises(ObjectDoesNotExist):
             AbstractNode.objects.get(map_group_key='fake_group_key2')
-        with mock.patch('nii.mapcore.mapcore_get_extended_group_info') as mock_gi:
-            mock_gi.return_value = {
-                'group_name': 'fake_group_name2',
-                'group_key': 'fake_group_key2',
-                'introduction': 'fake_introduction2',
-                'active': 1, 'public': 1, 'open_member': OPEN_MEMBER_PUBLIC,
-                'group_admin_eppn': [self.me.eppn],
-                'group_member_list': [
-                    {'eppn': self.me.eppn, 'admin': MAPCore.MODE_ADMIN,
-                     'is_admin': True},
-                    {'eppn': self.user2.eppn, 'admin': MAPCore.MODE_MEMBER,
-                     'is_admin': False}]}
-            mapcore_sync_rdm_my_projects(self.me, use_raise=True)
-            assert_equal(mock_gi.call_count, 1)
-            assert_equal(mock_mygr.call_count, 1)
-            assert_equal(mock_or.call_count, 0)
-            assert_equal(mock_sync_rdm.call_count, 1)
+        mapcore_sync_rdm_my_projects(self.me, use_raise=True, max_workers=1)
+        assert_equal(mock_gi.call_count, 2)  # members of each group only
+        assert_equal(mock_mygr.call_count, 1)
+        assert_equal(mock_or.call_count, 0)
+        assert_equal(mock_sync_rdm.call_count, 1)
         n = AbstractNode.objects.get(map_group_key='fake_group_key2')
         assert_equal(n.is_public, False)
         assert_equal(n.title, 'fake_group_name2')
         assert_equal(n.map_group_key, 'fake_group_key2')
-        assert_equal(n.description, 'fake_introduction2')
+        assert_equal(n.description, 'fake_introduction')
+        assert_not_equal(n.mapcore_group_fingerprint, None)
         n.delete()
         mock_mygr.call_count = 0
+        mock_gi.call_count = 0
         mock_sync_rdm.call_count = 0
 
-        # test #5 : RDM project only, no map_group_key
+        # test #7 : RDM project only, no map_group_key
         mock_mygr.return_value = {'result': {'groups': []}}
         self.project.title = 'fake_group_name1'
         self.project.map_group_key = None
         self.project.save()
-        mapcore_sync_rdm_my_projects(self.me, use_raise=True)
+        mapcore_sync_rdm_my_projects(self.me, use_raise=True, max_workers=1)
         assert_equal(mock_mygr.call_count, 1)
         assert_equal(mock_or.call_count, 0)  # not called
         assert_equal(mock_sync_rdm.call_count, 0)
         mock_mygr.call_count = 0
 
-        # test #6 : RDM project only, has map_group_key
+        # test #8 : RDM project only, has map_group_key
         mock_mygr.return_value = {'result': {'groups': []}}
         self.project.title = 'fake_group_name1'
         self.project.map_group_key = 'fake_group_key1'
         self.project.save()
-        mapcore_sync_rdm_my_projects(self.me, use_raise=True)
+        mapcore_sync_rdm_my_projects(self.me, use_raise=True, max_workers=1)
         assert_equal(mock_mygr.call_count, 1)
         assert_equal(mock_or.call_count, 1)
         assert_equal(mock_sync_rdm.call_count, 0)
         mock_mygr.call_count = 0
 
+    @mock.patch('nii.mapcore.mapcore_sync_rdm_my_projects0')
+    def test_sync_user_groups_task(self, mock_sync):
+        from nii.mapcore_sync_groups import mapcore_sync_groups, mapcore_sync_user_groups
+
+        mock_sync.return_value = 2
+        with mock.patch('nii.mapcore_sync_groups.mapcore_sync_is_enabled', return_value=True):
+            assert_equal(mapcore_sync_user_groups(self.me._id), 2)
+            assert_equal(mock_sync.call_count, 1)
+            args, kwargs = mock_sync.call_args
+            assert_equal(args[0], self.me)
+            assert_equal(kwargs['wait'], False)
+
+            mock_sync.call_count = 0
+            assert_equal(mapcore_sync_groups(), 4)  # self.me and self.user2
+            assert_equal(mock_sync.call_count, 2)
+
+        mock_sync.call_count = 0
+        with mock.patch('nii.mapcore_sync_groups.mapcore_sync_is_enabled', return_value=False):
+            assert_equal(mapcore_sync_groups(), None)
+            assert_equal(mock_sync.call_count, 0)
+
     @mock.patch('nii.mapcore_api.MAPCORE_SECRET', 'fake_secret')
     @mock.patch('nii.mapcore_api.MAPCORE_HOSTNAME', 'fake_hostname')
     @mock.patch('nii.mapcore_api.MAPCORE_API_PATH', '/fake_api_path')
@@ -1022,16 +1073,18 @@ class TestViewsWithMAPCore(OsfTestCase):
 
     @mock.patch('nii.mapcore.MAPCORE_CLIENTID', 'test_dashboard')
     @mock.patch('website.views.use_ember_app')
-    @mock.patch('nii.mapcore.mapcore_sync_rdm_my_projects0')
+    @mock.patch('framework.celery_tasks.handlers.enqueue_task')
+    @mock.patch('nii.mapcore.mapcore_api_is_available0')
     @mock.patch('website.mapcore.views.mapcore_request_authcode')
-    def test_dashboard_without_token(self, mock_ac, mock_sync, mock_ember):
+    def test_dashboard_without_token(self, mock_ac, mock_avail, mock_enqueue, mock_ember):
         mapcore = MAPCore(self.me)
-        mock_sync.side_effect = MAPCoreTokenExpired(mapcore, 'test message')
+        mock_avail.side_effect = MAPCoreTokenExpired(mapcore, 'test message')
 
         url = web_url_for('dashboard', _absolute=True)
         res = self.app.get(url, auth=self.me.auth)
         assert_equal(res.status_code, 302)
-        assert_equal(mock_sync.call_count, 1)
+        assert_equal(mock_avail.call_count, 1)
+        assert_equal(mock_enqueue.call_count, 0)
         assert_equal(mock_ember.call_count, 0)
         mapcore_oauth_start_url = web_url_for('mapcore_oauth_start')
         assert_in(mapcore_oauth_start_url + '?next_url=',
@@ -1040,16 +1093,18 @@ class TestViewsWithMAPCore(OsfTestCase):
         assert_equal(mock_ac.call_count, 1)
 
     @mock.patch('nii.mapcore.MAPCORE_CLIENTID', 'test_my_projects')
-    @mock.patch('nii.mapcore.mapcore_sync_rdm_my_projects0')
+    @mock.patch('framework.celery_tasks.handlers.enqueue_task')
+    @mock.patch('nii.mapcore.mapcore_api_is_available0')
     @mock.patch('website.mapcore.views.mapcore_request_authcode')
-    def test_my_projects_without_token(self, mock_ac, mock_sync):
+    def test_my_projects_without_token(self, mock_ac, mock_avail, mock_enqueue):
         mapcore = MAPCore(self.me)
-        mock_sync.side_effect = MAPCoreTokenExpired(mapcore, 'test message')
+        mock_avail.side_effect = MAPCoreTokenExpired(mapcore, 'test message')
 
         url = web_url_for('my_projects', _absolute=True)
         res = self.app.get(url, auth=self.me.auth)
         assert_equal(res.status_code, 302)
-        assert_equal(mock_sync.call_count, 1)
+        assert_equal(mock_avail.call_count, 1)
+        assert_equal(mock_enqueue.call_count, 0)
         mapcore_oauth_start_url = web_url_for('mapcore_oauth_start')
         assert_in(mapcore_oauth_start_url + '?next_url=',
                   res.headers.get('Location'))
@@ -1076,21 +1131,32 @@ class TestViewsWithMAPCore(OsfTestCase):
 
     @mock.patch('nii.mapcore.MAPCORE_CLIENTID', 'test_dashboard')
     @mock.patch('website.views.use_ember_app')
+    @mock.patch('framework.celery_tasks.handlers.enqueue_task')
+    @mock.patch('nii.mapcore.mapcore_api_is_available0')
     @mock.patch('nii.mapcore.mapcore_sync_rdm_my_projects0')
-    def test_dashboard(self, mock_sync, mock_ember):
+    def test_dashboard(self, mock_sync, mock_avail, mock_enqueue, mock_ember):
         url = web_url_for('dashboard', _absolute=True)
         res = self.app.get(url, auth=self.me.auth)
         assert_equal(res.status_code, 200)
-        assert_equal(mock_sync.call_count, 1)
+        assert_equal(mock_avail.call_count, 1)
+        assert_equal(mock_sync.call_count, 0)  # in background
+        assert_equal(mock_enqueue.call_count, 1)
+        signature = mock_enqueue.call_args[0][0]
+        assert_equal(signature.task, 'nii.mapcore_sync_user_groups')
+        assert_equal(signature.args, (self.me._id,))
         assert_equal(mock_ember.call_count, 1)
 
     @mock.patch('nii.mapcore.MAPCORE_CLIENTID', 'test_my_projects')
+    @mock.patch('framework.celery_tasks.handlers.enqueue_task')
+    @mock.patch('nii.mapcore.mapcore_api_is_available0')
     @mock.patch('nii.mapcore.mapcore_sync_rdm_my_projects0')
-    def test_my_projects(self, mock_sync):
+    def test_my_projects(self, mock_sync, mock_avail, mock_enqueue):
         url = web_url_for('my_projects', _absolute=True)
         res = self.app.get(url, auth=self.me.auth)
         assert_equal(res.status_code, 200)
-        assert_equal(mock_sync.call_count, 1)
+        assert_equal(mock_avail.call_count, 1)
+        assert_equal(mock_sync.call_count, 0)  # in background
+        assert_equal(mock_enqueue.call_count, 1)
 
     @mock.patch('nii.mapcore.MAPCORE_CLIENTID', 'test_view_project')
     @mock.patch('nii.mapcore.mapcore_sync_rdm_project_or_map_group0')
@@ -210,6 +210,70 @@ class TestCASClient(OsfTestCase):
     def test_profile_valid_access_token_returns_cas_response(self):
         assert 0
 
+    @responses.activate
+    def test_profile_is_cached_until_token_revocation(self):
+        user = UserFactory()
+        responses.add(
+            responses.Response(
+                responses.GET,
+                self.client.get_profile_url(),
+                json={'id': user._id, 'scope': ['osf.full_read']},
+                status=200,
+            )
+        )
+        responses.add(
+            responses.Response(
+                responses.POST,
+                self.client.get_auth_token_revocation_url(),
+                status=204,
+            )
+        )
+        hits = cas.PROFILE_CACHE_STATS['hit']
+
+        resp = self.client.profile('cached-access-token')
+        assert_true(resp.authenticated)
+        assert_equal(resp.user, user._id)
+        resp = self.client.profile('cached-access-token')
+        assert_equal(resp.user, user._id)
+        assert_equal(resp.attributes['accessTokenScope'], {'osf.full_read'})
+        assert_equal(len(responses.calls), 1)
+        assert_equal(cas.PROFILE_CACHE_STATS['hit'], hits + 1)
+
+        self.client.revoke_tokens({'token': 'cached-access-token'})
+        self.client.profile('cached-access-token')
+        assert_equal(len(responses.calls), 3)
+
+        self.client.profile('cached-access-token')
+        self.client.revoke_application_tokens('fake_id', 'fake_secret')
+        self.client.profile('cached-access-token')
+        assert_equal(len(responses.calls), 5)
+
+    @responses.activate
+    def test_profile_is_kept_when_token_revocation_fails(self):
+        user = UserFactory()
+        responses.add(
+            responses.Response(
+                responses.GET,
+                self.client.get_profile_url(),
+                json={'id': user._id, 'scope': ['osf.full_read']},
+                status=200,
+            )
+        )
+        responses.add(
+            responses.Response(
+                responses.POST,
+                self.client.get_auth_token_revocation_url(),
+                status=400,
+            )
+        )
+
+        self.client.profile('kept-access-token')
+        with assert_raises(cas.CasHTTPError):
+            self.client.revoke_tokens({'token': 'kept-access-token'})
+        resp = self.client.profile('kept-access-token')
+        assert_equal(resp.user, user._id)
+        assert_equal(len(responses.calls), 2)
+
     @unittest.skip('finish me')
     def test_get_login_url(self):
         assert 0
@@ -9,7 +9,9 @@ from nose.tools import *  # noqa PEP8 asserts
 from framework.auth import Auth
 from osf.models import Comment, NotificationDigest, NotificationSubscription, Guid, OSFUser
 
-from website.notifications.tasks import get_users_emails, send_users_email, group_by_node, remove_notifications
+from website.notifications.tasks import (
+    get_users_emails, send_users_email, group_by_node, remove_notifications, DIGEST_MAX_SEND_ATTEMPTS
+)
 from website.notifications.exceptions import InvalidSubscriptionError
 from website.notifications import constants
 from website.notifications import emails
@@ -1282,6 +1284,30 @@ class TestCompileSubscriptions(NotificationTestCase):
         subs = emails.compile_subscriptions(node5, 'file_updated')
         assert_equal(subs, {'email_transactional': [], 'email_digest': [self.user_1._id], 'none': []})
 
+    def test_subscriptions_are_cached(self):
+        self.base_sub.email_transactional.add(self.user_1)
+        expected = {'email_transactional': [self.user_1._id], 'none': [], 'email_digest': []}
+        assert_equal(emails.compile_subscriptions(self.shared_node, 'file_updated'), expected)
+        with mock.patch('website.notifications.emails.check_node') as mock_check_node:
+            assert_equal(emails.compile_subscriptions(self.shared_node, 'file_updated'), expected)
+        assert_false(mock_check_node.called)
+
+    def test_cache_cleared_on_parent_subscription_change(self):
+        self.base_sub.email_transactional.add(self.user_1)
+        emails.compile_subscriptions(self.shared_node, 'file_updated')
+        self.base_sub.email_transactional.remove(self.user_1)
+        self.base_sub.email_digest.add(self.user_1)
+        result = emails.compile_subscriptions(self.shared_node, 'file_updated')
+        assert_equal({'email_transactional': [], 'none': [], 'email_digest': [self.user_1._id]}, result)
+
+    def test_cache_cleared_on_permission_change(self):
+        self.base_sub.email_transactional.add(self.user_3)
+        result = emails.compile_subscriptions(self.shared_node, 'file_updated')
+        assert_equal({'email_transactional': [self.user_3._id], 'none': [], 'email_digest': []}, result)
+        self.shared_node.remove_contributor(self.user_3, auth=Auth(self.user_1))
+        result = emails.compile_subscriptions(self.shared_node, 'file_updated')
+        assert_equal({'email_transactional': [], 'none': [], 'email_digest': []}, result)
+
 
 class TestMoveSubscription(NotificationTestCase):
     def setUp(self):
@@ -1817,8 +1843,8 @@ class TestSendDigest(OsfTestCase):
         digest_ids = [d._id, d2._id, d3._id]
         remove_notifications(email_notification_ids=digest_ids)
 
-    @mock.patch('website.mails.send_mail')
-    def test_send_users_email_called_with_correct_args(self, mock_send_mail):
+    @mock.patch('website.mails.send_mails', side_effect=lambda mails_kwargs, celery: [True] * len(mails_kwargs))
+    def test_send_users_email_called_with_correct_args(self, mock_send_mails):
         send_type = 'email_transactional'
         d = factories.NotificationDigestFactory(
             send_type=send_type,
@@ -1830,23 +1856,93 @@ class TestSendDigest(OsfTestCase):
         d.save()
         user_groups = list(get_users_emails(send_type))
         send_users_email(send_type)
-        assert_true(mock_send_mail.called)
-        assert_equals(mock_send_mail.call_count, len(user_groups))
+        assert_true(mock_send_mails.called)
+        mails_kwargs = mock_send_mails.call_args[0][0]
+        assert_equals(len(mails_kwargs), len(user_groups))
 
         last_user_index = len(user_groups) - 1
         user = OSFUser.load(user_groups[last_user_index]['user_id'])
 
-        args, kwargs = mock_send_mail.call_args
+        kwargs = mails_kwargs[last_user_index]
 
         assert_equal(kwargs['to_addr'], user.username)
         assert_equal(kwargs['mimetype'], 'html')
         assert_equal(kwargs['mail'], mails.DIGEST)
         assert_equal(kwargs['name'], user.fullname)
         assert_equal(kwargs['can_change_node_preferences'], True)
+        assert_equal(kwargs['node']._id, user_groups[last_user_index]['info'][0]['node_lineage'][-1])
         message = group_by_node(user_groups[last_user_index]['info'])
         assert_equal(kwargs['message'], message)
+        assert_false(NotificationDigest.objects.filter(_id=d._id).exists())
 
-    @mock.patch('website.mails.send_mail')
+    @mock.patch('website.notifications.tasks.DIGEST_BATCH_SIZE', 2)
+    @mock.patch('website.mails.send_mails', side_effect=lambda mails_kwargs, celery: [True] * len(mails_kwargs))
+    def test_send_users_email_in_batches(self, mock_send_mails):
+        send_type = 'email_transactional'
+        users = [factories.UserFactory() for _ in range(3)]
+        for user in users:
+            factories.NotificationDigestFactory(
+                user=user,
+                send_type=send_type,
+                event='comment_replies',
+                timestamp=timezone.now(),
+                message='Hello',
+                node_lineage=[self.project._id]
+            )
+        send_users_email(send_type)
+        assert_equal(mock_send_mails.call_count, 2)
+        to_addrs = [
+            kwargs['to_addr']
+            for call in mock_send_mails.call_args_list
+            for kwargs in call[0][0]
+        ]
+        assert_equal(sorted(to_addrs), sorted(user.username for user in users))
+        assert_false(NotificationDigest.objects.filter(send_type=send_type).exists())
+
+    @mock.patch('website.mails.send_mails')
+    def test_send_users_email_keeps_unsent_digests(self, mock_send_mails):
+        send_type = 'email_transactional'
+        users = [factories.UserFactory() for _ in range(2)]
+        digests = [
+            factories.NotificationDigestFactory(
+                user=user,
+                send_type=send_type,
+                event='comment_replies',
+                timestamp=timezone.now(),
+                message='Hello',
+                node_lineage=[self.project._id]
+            )
+            for user in users
+        ]
+        # the email to the second user cannot be sent
+        mock_send_mails.side_effect = lambda mails_kwargs, celery: [
+            kwargs['to_addr'] != users[1].username for kwargs in mails_kwargs
+        ]
+        send_users_email(send_type)
+        assert_false(NotificationDigest.objects.filter(_id=digests[0]._id).exists())
+        assert_true(NotificationDigest.objects.filter(_id=digests[1]._id).exists())
+
+    @mock.patch('website.mails.send_mails')
+    def test_send_users_email_drops_digests_after_max_attempts(self, mock_send_mails):
+        send_type = 'email_transactional'
+        digest = factories.NotificationDigestFactory(
+            user=factories.UserFactory(),
+            send_type=send_type,
+            event='comment_replies',
+            timestamp=timezone.now(),
+            message='Hello',
+            node_lineage=[self.project._id]
+        )
+        mock_send_mails.side_effect = lambda mails_kwargs, celery: [False] * len(mails_kwargs)
+        for attempts in range(1, DIGEST_MAX_SEND_ATTEMPTS):
+            send_users_email(send_type)
+            digest.reload()
+            assert_equal(digest.send_attempts, attempts)
+        send_users_email(send_type)
+        assert_false(NotificationDigest.objects.filter(_id=digest._id).exists())
+        assert_equal(mock_send_mails.call_count, DIGEST_MAX_SEND_ATTEMPTS)
+
+    @mock.patch('website.mails.send_mails')
     def test_send_users_email_ignores_disabled_users(self, mock_send_mail):
         send_type = 'email_transactional'
         d = factories.NotificationDigestFactory(
@@ -9,7 +9,7 @@ from api.base import settings as api_settings
 from framework.auth import signing
 from tests.base import OsfTestCase
 from osf.models import (
-    FileLog, FileInfo, TrashedFileNode, TrashedFolder, UserQuota, ProjectStorageType, BaseFileNode
+    FileLog, FileInfo, TrashedFileNode, TrashedFolder, UserQuota, ProjectStorageType, BaseFileNode, OSFUser
 )
 from osf_tests.factories import (
     AuthUserFactory, ProjectFactory, UserFactory, InstitutionFactory, RegionFactory
@@ -253,6 +253,121 @@ class TestUsedQuota(OsfTestCase):
         assert_equal(quota.used_quota(self.user._id, storage_type=UserQuota.CUSTOM_STORAGE), 0)
 
 
+class TestRecalculateUsedQuota(OsfTestCase):
+    def setUp(self):
+        super(TestRecalculateUsedQuota, self).setUp()
+        self.user = UserFactory()
+        self.user2 = UserFactory()
+        self.node = ProjectFactory(creator=self.user)
+        self.node2 = ProjectFactory(creator=self.user2)
+
+    def _add_file(self, node, name, size):
+        file_node = OsfStorageFileNode.create(target=node, name=name)
+        file_node.save()
+        FileInfo.objects.create(file=file_node, file_size=size)
+        return file_node
+
+    def test_used_quota_by_user(self):
+        self._add_file(self.node, 'file0', 500)
+        self._add_file(self.node, 'file1', 1000)
+        self._add_file(self.node2, 'file2', 300)
+
+        used = quota.used_quota_by_user([self.user.id, self.user2.id])
+        assert_equal(used, {self.user.id: 1500, self.user2.id: 300})
+        assert_equal(quota.used_quota_by_user([self.user.id]), {self.user.id: 1500})
+        assert_equal(quota.used_quota_by_user([self.user.id], UserQuota.CUSTOM_STORAGE), {})
+        assert_equal(quota.used_quota_by_user([]), {})
+
+    def test_recalculate_used_quota(self):
+        self._add_file(self.node, 'file0', 500)
+        UserQuota.objects.create(user=self.user, storage_type=UserQuota.NII_STORAGE, max_quota=200, used=7000)
+        UserQuota.objects.filter(user=self.user2).delete()
+
+        users = OSFUser.objects.filter(id__in=[self.user.id, self.user2.id])
+        progress = []
+        count = quota.recalculate_used_quota(users, chunk_size=1, progress_callback=lambda *args: progress.append(args))
+
+        assert_equal(count, 2)
+        assert_equal(progress, [(1, 2), (2, 2)])
+        user_quota = UserQuota.objects.get(user=self.user, storage_type=UserQuota.NII_STORAGE)
+        assert_equal(user_quota.max_quota, 200)
+        assert_equal(user_quota.used, 500)
+        user_quota = UserQuota.objects.get(user=self.user2, storage_type=UserQuota.NII_STORAGE)
+        assert_equal(user_quota.max_quota, api_settings.DEFAULT_MAX_QUOTA)
+        assert_equal(user_quota.used, 0)
+        assert_false(UserQuota.objects.filter(storage_type=UserQuota.CUSTOM_STORAGE).exists())
+
+    def test_recalculate_used_quota_custom_storage(self):
+        institution = InstitutionFactory()
+        self.user.affiliated_institutions.add(institution)
+        self.user2.affiliated_institutions.add(InstitutionFactory())
+        RegionFactory(_id=institution._id)
+        ProjectStorageType.objects.filter(node=self.node).update(
+            storage_type=ProjectStorageType.CUSTOM_STORAGE
+        )
+        self._add_file(self.node, 'file0', 500)
+
+        assert_equal(quota.get_custom_storage_user_ids([self.user.id, self.user2.id]), {self.user.id})
+
+        quota.recalculate_used_quota(OSFUser.objects.filter(id__in=[self.user.id, self.user2.id]))
+
+        assert_equal(UserQuota.objects.get(user=self.user, storage_type=UserQuota.NII_STORAGE).used, 0)
+        assert_equal(UserQuota.objects.get(user=self.user, storage_type=UserQuota.CUSTOM_STORAGE).used, 500)
+        assert_false(UserQuota.objects.filter(user=self.user2, storage_type=UserQuota.CUSTOM_STORAGE).exists())
+
+
+class TestQuotaSummary(OsfTestCase):
+    def setUp(self):
+        super(TestQuotaSummary, self).setUp()
+        self.user = UserFactory()
+        self.user2 = UserFactory()
+        self.users = OSFUser.objects.filter(id__in=[self.user.id, self.user2.id])
+
+    def test_get_quota_summary(self):
+        UserQuota.objects.create(user=self.user, storage_type=UserQuota.NII_STORAGE,
+                                 max_quota=10, used=5 * api_settings.SIZE_UNIT_GB)
+        file_node = OsfStorageFileNode.create(target=ProjectFactory(creator=self.user2), name='file0')
+        file_node.save()
+        FileInfo.objects.create(file=file_node, file_size=500)
+
+        rows = {row['guid']: row for row in quota.get_quota_summary(self.users)}
+
+        assert_equal(rows[self.user._id]['quota'], 10)
+        assert_equal(rows[self.user._id]['usage'], 5 * api_settings.SIZE_UNIT_GB)
+        assert_equal(rows[self.user._id]['remaining'], 5 * api_settings.SIZE_UNIT_GB)
+        assert_equal(rows[self.user._id]['ratio'], 50.0)
+        # user2 has no quota yet: the default max quota and the usage of the files, without writing
+        assert_equal(rows[self.user2._id]['quota'], api_settings.DEFAULT_MAX_QUOTA)
+        assert_equal(rows[self.user2._id]['usage'], 500)
+        assert_equal(rows[self.user2._id]['remaining'], api_settings.DEFAULT_MAX_QUOTA * api_settings.SIZE_UNIT_GB - 500)
+        assert_false(UserQuota.objects.filter(user=self.user2).exists())
+
+    def test_create_user_quotas_skips_existing(self):
+        UserQuota.objects.create(user=self.user, storage_type=UserQuota.NII_STORAGE, max_quota=10, used=5)
+
+        created = quota.create_user_quotas([
+            (self.user.id, UserQuota.NII_STORAGE, 100),
+            (self.user2.id, UserQuota.NII_STORAGE, 200),
+        ])
+        # e.g. a concurrent request creating the same rows
+        created_again = quota.create_user_quotas([(self.user2.id, UserQuota.NII_STORAGE, 300)])
+
+        assert_equal(created, 1)
+        assert_equal(created_again, 0)
+        user_quota = UserQuota.objects.get(user=self.user, storage_type=UserQuota.NII_STORAGE)
+        assert_equal((user_quota.max_quota, user_quota.used), (10, 5))
+        user2_quota = UserQuota.objects.get(user=self.user2, storage_type=UserQuota.NII_STORAGE)
+        assert_equal((user2_quota.max_quota, user2_quota.used), (api_settings.DEFAULT_MAX_QUOTA, 200))
+
+    def test_get_quota_summary_zero_max_quota(self):
+        UserQuota.objects.create(user=self.user, storage_type=UserQuota.CUSTOM_STORAGE, max_quota=0)
+
+        rows = list(quota.get_quota_summary(self.users.filter(id=self.user.id), UserQuota.CUSTOM_STORAGE))
+
+        assert_equal(len(rows), 1)
+        assert_equal(rows[0]['ratio'], 100)
+
+
 class TestSaveFileInfo(OsfTestCase):
     def setUp(self):
         super(TestSaveFileInfo, self).setUp()
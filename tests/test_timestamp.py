@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import datetime
+import hashlib
 import mock
 import os
 import pytz
@@ -11,7 +12,7 @@ from nose import tools as nt
 from osf.models import RdmUserKey, RdmFileTimestamptokenVerifyResult, Guid
 from osf_tests.factories import ProjectFactory, AuthUserFactory
 from tests.base import ApiTestCase, OsfTestCase
-from website.util import timestamp
+from website.util import rfc3161, timestamp, waterbutler
 import tempfile
 from website.util.timestamp import (
     AddTimestamp, TimeStampTokenVerifyCheck,
@@ -646,3 +647,392 @@ class TestOSFAbortableResult(OsfTestCase):
         nt.assert_true(task.ready())
         mock_logger.error.assert_any_call('Failed to get task status! Exception message:')
         mock_logger.error.assert_any_call(msg)
+
+
+class TestGetErrorList(OsfTestCase):
+    def setUp(self):
+        super(TestGetErrorList, self).setUp()
+        self.user = AuthUserFactory()
+        self.node = ProjectFactory(creator=self.user)
+
+    def _create_result(self, file_node, provider, status):
+        return RdmFileTimestamptokenVerifyResult.objects.create(
+            file_id=file_node._id,
+            project_id=self.node._id,
+            provider=provider,
+            path='/' + file_node.name,
+            inspection_result_status=status,
+            verify_user=self.user.id,
+        )
+
+    def test_get_error_list_grouped_by_provider(self):
+        file_ok = create_test_file(self.node, self.user, filename='ok.txt')
+        file_ng = create_test_file(self.node, self.user, filename='ng.txt')
+        file_no_data = create_test_file(self.node, self.user, filename='no_data.txt')
+        self._create_result(file_ok, 'osfstorage', api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS)
+        self._create_result(file_ng, 'osfstorage', api_settings.TIME_STAMP_TOKEN_CHECK_NG)
+        self._create_result(file_no_data, 's3', api_settings.TIME_STAMP_TOKEN_NO_DATA)
+
+        provider_list = timestamp.get_error_list(self.node._id)
+
+        nt.assert_equal([p['provider'] for p in provider_list], ['osfstorage', 's3'])
+        osfstorage_errors = provider_list[0]['error_list']
+        nt.assert_equal(len(osfstorage_errors), 1)
+        nt.assert_equal(osfstorage_errors[0]['file_id'], file_ng._id)
+        nt.assert_equal(osfstorage_errors[0]['file_version'], 1)
+        nt.assert_equal(osfstorage_errors[0]['creator_id'], self.user._id)
+        nt.assert_equal(osfstorage_errors[0]['verify_user_id'], self.user._id.upper())
+        nt.assert_equal(osfstorage_errors[0]['verify_result_title'],
+                        api_settings.TIME_STAMP_TOKEN_CHECK_NG_MSG)
+        s3_errors = provider_list[1]['error_list']
+        nt.assert_equal(s3_errors[0]['file_version'], '')
+        nt.assert_equal(s3_errors[0]['verify_result_title'],
+                        api_settings.TIME_STAMP_TOKEN_NO_DATA_MSG)
+
+    def test_iter_error_list_batches(self):
+        for i in range(5):
+            file_node = create_test_file(self.node, self.user, filename='file{}.txt'.format(i))
+            self._create_result(file_node, 'osfstorage', api_settings.TIME_STAMP_TOKEN_CHECK_NG)
+
+        provider_list = timestamp.iter_error_list(self.node._id, batch_size=2)
+
+        provider_errors = next(provider_list)
+        nt.assert_equal(provider_errors['provider'], 'osfstorage')
+        error_list = list(provider_errors['error_list'])
+        nt.assert_equal(len(error_list), 5)
+        for error_info in error_list:
+            nt.assert_equal(error_info['creator_id'], self.user._id)
+        with nt.assert_raises(StopIteration):
+            next(provider_list)
+
+
+class TestFileInventory(OsfTestCase):
+    def setUp(self):
+        super(TestFileInventory, self).setUp()
+        self.user = AuthUserFactory()
+        self.node = ProjectFactory(creator=self.user)
+
+    def test_get_db_file_list(self):
+        root_node = self.node.get_addon('osfstorage').get_root()
+        folder = root_node.append_folder('folder')
+        test_file = folder.append_file('nested.txt')
+        for _ in range(2):
+            test_file.create_version(self.user, {
+                'object': '06d80e',
+                'service': 'cloud',
+                osfstorage_settings.WATERBUTLER_RESOURCE: 'osf',
+            }, {
+                'size': 1337,
+                'contentType': 'img/png'
+            }).save()
+        create_test_file(self.node, self.user, filename='top.txt')
+
+        file_list = timestamp.get_db_file_list(self.node, 'osfstorage')
+
+        files = {f['file_path']: f for f in file_list}
+        nt.assert_equal(set(files.keys()), {'/folder/nested.txt', '/top.txt'})
+        nt.assert_equal(files['/folder/nested.txt']['file_id'], test_file._id)
+        nt.assert_equal(files['/folder/nested.txt']['file_version'], 2)
+        nt.assert_equal(files['/folder/nested.txt']['size'], 1337)
+        nt.assert_equal(files['/top.txt']['file_version'], 1)
+
+    @mock.patch('website.util.timestamp.WaterButlerFileScanner._get_folder_entries')
+    def test_scanner_crawls_nested_folders(self, mock_get_folder_entries):
+        folder_data = {'attributes': {
+            'kind': 'folder', 'path': '/folder/', 'materialized': '/folder/',
+        }}
+        entries = {
+            '/folder/': [
+                {'attributes': {
+                    'kind': 'file', 'name': 'a.txt', 'path': '/folder/a.txt',
+                    'materialized': '/folder/a.txt', 'size': 10,
+                    'created_utc': None, 'modified_utc': None,
+                }},
+                {'attributes': {
+                    'kind': 'folder', 'path': '/folder/sub/', 'materialized': '/folder/sub/',
+                }},
+            ],
+            '/folder/sub/': [{'attributes': {
+                'kind': 'file', 'name': 'b.txt', 'path': '/folder/sub/b.txt',
+                'materialized': '/folder/sub/b.txt', 'size': 20,
+                'created_utc': None, 'modified_utc': None,
+            }}],
+        }
+        mock_get_folder_entries.side_effect = lambda path: entries[path]
+
+        file_list = timestamp.WaterButlerFileScanner(
+            self.node._id, 's3', self.node, {}, {}).scan([folder_data])
+
+        nt.assert_equal(mock_get_folder_entries.call_count, 2)
+        nt.assert_equal([f['file_path'] for f in file_list], ['/folder/a.txt', '/folder/sub/b.txt'])
+        nt.assert_equal([f['size'] for f in file_list], [10, 20])
+
+
+class TestTimestampVerifyPipeline(OsfTestCase):
+    def setUp(self):
+        super(TestTimestampVerifyPipeline, self).setUp()
+        self.user = AuthUserFactory()
+        self.node = ProjectFactory(creator=self.user)
+
+    def _check_file_timestamp(self, uid, node, data, save=True):
+        nt.assert_false(save)
+        verify_data = RdmFileTimestamptokenVerifyResult.objects.filter(
+            file_id=data['file_id']).first()
+        if verify_data is None:
+            verify_data = RdmFileTimestamptokenVerifyResult(
+                file_id=data['file_id'], project_id=node._id, provider=data['provider'])
+        verify_data.inspection_result_status = api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS
+        return {'verify_result': verify_data.inspection_result_status, 'verify_data': verify_data}
+
+    @mock.patch('website.util.timestamp.api_settings.TS_REQUESTS_PER_MIN', 30)
+    def test_rate_limit_shared_by_workers(self):
+        pipeline = timestamp.TimestampVerifyPipeline(self.user.id, self.node, max_workers=1)
+        nt.assert_equal(pipeline.rate_limiter.interval, 2.0)
+        pipeline = timestamp.TimestampVerifyPipeline(self.user.id, self.node, max_workers=4)
+        nt.assert_equal(pipeline.rate_limiter.interval, 2.0)
+
+    @mock.patch('website.util.timestamp.RequestRateLimiter.wait')
+    @mock.patch('website.util.timestamp.check_file_timestamp')
+    def test_run_saves_results_per_chunk(self, mock_check, mock_wait):
+        mock_check.side_effect = self._check_file_timestamp
+        RdmFileTimestamptokenVerifyResult.objects.create(
+            file_id='existing', project_id=self.node._id, provider='osfstorage',
+            inspection_result_status=api_settings.TIME_STAMP_TOKEN_CHECK_NG)
+        file_list = [
+            {'file_id': file_id, 'provider': 'osfstorage'}
+            for file_id in ['existing', 'new1', 'new2']
+        ]
+        progress = []
+
+        done = timestamp.TimestampVerifyPipeline(
+            self.user.id, self.node, max_workers=1, chunk_size=2,
+            progress_callback=lambda done, total: progress.append((done, total)),
+        ).run(file_list)
+
+        nt.assert_equal(done, 3)
+        nt.assert_equal(progress, [(2, 3), (3, 3)])
+        nt.assert_equal(mock_check.call_count, 3)
+        results = RdmFileTimestamptokenVerifyResult.objects.filter(project_id=self.node._id)
+        nt.assert_equal(results.count(), 3)
+        for result in results:
+            nt.assert_equal(result.inspection_result_status,
+                            api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS)
+
+    @mock.patch('website.util.timestamp.check_file_timestamp')
+    def test_run_stops_when_aborted(self, mock_check):
+        done = timestamp.TimestampVerifyPipeline(
+            self.user.id, self.node, max_workers=1, is_aborted=lambda: True,
+        ).run([{'file_id': 'file', 'provider': 'osfstorage'}])
+
+        nt.assert_equal(done, 0)
+        nt.assert_false(mock_check.called)
+
+
+TIMESTAMP_FIXTURES = os.path.join(os.path.dirname(__file__), 'test_files', 'timestamp')
+
+def read_timestamp_fixture(name):
+    with open(os.path.join(TIMESTAMP_FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+@mock.patch('website.util.timestamp.api_settings.KEY_SAVE_PATH', TIMESTAMP_FIXTURES)
+@mock.patch('website.util.timestamp.api_settings.VERIFY_ROOT_CERTIFICATE', 'ca.pem')
+class TestRfc3161(OsfTestCase):
+    # data.tsq and data.tsr were made by "openssl ts -query -sha512 -cert" and
+    # "openssl ts -reply" for data.txt, with a TSA certificate issued by ca.pem.
+    # data_ee_issuer.tsr is signed by a TSA certificate issued by an end entity
+    # certificate of chain_ca.pem, data_pathlen.tsr by a TSA certificate issued by
+    # a CA below pathlen_ca.pem (pathlen:0); "openssl ts -verify" rejects both.
+    # data_sha256.tsr was made by "openssl ts -query -sha256 -cert" for data.txt,
+    # with a TSA certificate issued by chain_ca.pem.
+
+    def test_request_matches_openssl_query(self):
+        query = rfc3161._decode(read_timestamp_fixture('data.tsq'))[0]
+        digest = hashlib.sha512(read_timestamp_fixture('data.txt')).digest()
+        request = rfc3161._decode(rfc3161.create_request(digest, 'sha512'))[0]
+        # version and message imprint
+        nt.assert_equal(request.children[0].raw, query.children[0].raw)
+        nt.assert_equal(request.children[1].raw, query.children[1].raw)
+
+    def test_verify_in_process_returns_success_for_valid_token(self):
+        ret, verify_result_title = timestamp.verify_timestamp_token_in_process(
+            read_timestamp_fixture('data.tsr'), 'osfstorage',
+            file_name=os.path.join(TIMESTAMP_FIXTURES, 'data.txt'))
+        nt.assert_equal(ret, api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS)
+        nt.assert_equal(verify_result_title, api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS_MSG)
+
+        ret, _ = timestamp.verify_timestamp_token_in_process(
+            read_timestamp_fixture('data.tsr'), 'osfstorage',
+            digests={'sha512': hashlib.sha512(read_timestamp_fixture('data.txt')).digest()})
+        nt.assert_equal(ret, api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS)
+
+    def test_verify_in_process_returns_ng_for_changed_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(tmp_dir, 'data.txt')
+            with open(file_name, 'wb') as f:
+                f.write(read_timestamp_fixture('data.txt') + b' changed')
+            ret, verify_result_title = timestamp.verify_timestamp_token_in_process(
+                read_timestamp_fixture('data.tsr'), 'osfstorage', file_name=file_name)
+        finally:
+            shutil.rmtree(tmp_dir)
+        nt.assert_equal(ret, api_settings.TIME_STAMP_TOKEN_CHECK_NG)
+        nt.assert_equal(verify_result_title, api_settings.TIME_STAMP_TOKEN_CHECK_NG_MSG)
+
+    def test_verify_in_process_returns_ng_for_untrusted_tsa(self):
+        with mock.patch('website.util.timestamp.api_settings.VERIFY_ROOT_CERTIFICATE', 'other_ca.pem'):
+            ret, _ = timestamp.verify_timestamp_token_in_process(
+                read_timestamp_fixture('data.tsr'), 'osfstorage',
+                file_name=os.path.join(TIMESTAMP_FIXTURES, 'data.txt'))
+        nt.assert_equal(ret, api_settings.TIME_STAMP_TOKEN_CHECK_NG)
+
+    def test_verify_in_process_returns_ng_for_tsa_issued_by_end_entity(self):
+        with mock.patch('website.util.timestamp.api_settings.VERIFY_ROOT_CERTIFICATE', 'chain_ca.pem'):
+            ret, _ = timestamp.verify_timestamp_token_in_process(
+                read_timestamp_fixture('data_ee_issuer.tsr'), 'osfstorage',
+                file_name=os.path.join(TIMESTAMP_FIXTURES, 'data.txt'))
+        nt.assert_equal(ret, api_settings.TIME_STAMP_TOKEN_CHECK_NG)
+
+        response = rfc3161.TimeStampResponse(read_timestamp_fixture('data_ee_issuer.tsr'))
+        with nt.assert_raises_regex(rfc3161.TimestampVerificationError, 'invalid CA certificate'):
+            response.verify_file(
+                os.path.join(TIMESTAMP_FIXTURES, 'data.txt'), os.path.join(TIMESTAMP_FIXTURES, 'chain_ca.pem'))
+
+    def test_verify_path_length_constraint(self):
+        response = rfc3161.TimeStampResponse(read_timestamp_fixture('data_pathlen.tsr'))
+        with nt.assert_raises_regex(rfc3161.TimestampVerificationError, 'path length constraint exceeded'):
+            response.verify_file(
+                os.path.join(TIMESTAMP_FIXTURES, 'data.txt'), os.path.join(TIMESTAMP_FIXTURES, 'pathlen_ca.pem'))
+
+    def _ext_info(self):
+        data = read_timestamp_fixture('data.txt')
+        hashes = {
+            timestamp.HASH_TYPE_SHA256: hashlib.sha256(data).hexdigest(),
+            timestamp.HASH_TYPE_SHA512: hashlib.sha512(data).hexdigest(),
+        }
+        return mock.Mock(
+            hash_type=timestamp.HASH_TYPE_SHA512, hash_value=hashes[timestamp.HASH_TYPE_SHA512],
+            hashes=hashes, has_timestamp=False)
+
+    def test_select_timestamp_digest(self):
+        ext_info = self._ext_info()
+        nt.assert_equal(
+            timestamp.select_timestamp_digest(read_timestamp_fixture('data_sha256.tsr'), ext_info),
+            (timestamp.HASH_TYPE_SHA256, ext_info.hashes[timestamp.HASH_TYPE_SHA256]))
+        nt.assert_equal(
+            timestamp.select_timestamp_digest(read_timestamp_fixture('data.tsr'), ext_info),
+            (timestamp.HASH_TYPE_SHA512, ext_info.hashes[timestamp.HASH_TYPE_SHA512]))
+        nt.assert_equal(
+            timestamp.select_timestamp_digest(b'invalid', ext_info),
+            (timestamp.HASH_TYPE_SHA512, ext_info.hashes[timestamp.HASH_TYPE_SHA512]))
+
+    @mock.patch('website.util.timestamp.api_settings.USE_UPKI', False)
+    @mock.patch('website.util.timestamp.subprocess.Popen')
+    def test_verify_hash_with_openssl_uses_digest_of_token(self, mock_popen):
+        mock_popen.return_value.communicate.return_value = (b'Verification: OK', b'')
+        ext_info = self._ext_info()
+        verify_result = mock.Mock(
+            timestamp_token=read_timestamp_fixture('data_sha256.tsr'), provider='s3', path='/data.txt')
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            _, _, ret = timestamp.TimeStampTokenVerifyCheckHash._verify(
+                tmp_dir, ext_info, 'user', 'project', verify_result)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        nt.assert_equal(ret, api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS)
+        cmd = mock_popen.call_args[0][0]
+        nt.assert_in('-sha256', cmd)
+        nt.assert_equal(cmd[cmd.index('-digest') + 1], ext_info.hashes[timestamp.HASH_TYPE_SHA256])
+
+    def test_create_request(self):
+        digest = hashlib.sha512(b'test data').digest()
+        request = rfc3161.create_request(digest, 'sha512', nonce=12345)
+
+        root, end = rfc3161._decode(request)
+        nt.assert_equal(end, len(request))
+        version, message_imprint, nonce, cert_req = root.children
+        nt.assert_equal(version.as_int(), 1)
+        algorithm, hashed_message = message_imprint.children
+        nt.assert_equal(algorithm.children[0].as_oid(), rfc3161.HASH_OIDS['sha512'])
+        nt.assert_equal(hashed_message.content, digest)
+        nt.assert_equal(nonce.as_int(), 12345)
+        nt.assert_equal(cert_req.content, b'\xff')
+
+    def test_malformed_response(self):
+        with nt.assert_raises(rfc3161.TimestampVerificationError):
+            rfc3161.TimeStampResponse(b'\x30\x10\x02')
+
+    def test_verify_in_process_returns_ng_for_invalid_token(self):
+        ret, verify_result_title = timestamp.verify_timestamp_token_in_process(
+            b'invalid', 'osfstorage', digest=hashlib.sha512(b'test data').digest())
+        nt.assert_equal(ret, api_settings.TIME_STAMP_TOKEN_CHECK_NG)
+        nt.assert_equal(verify_result_title, api_settings.TIME_STAMP_TOKEN_CHECK_NG_MSG)
+
+    def test_verify_in_process_returns_error_without_token(self):
+        ret, verify_result_title = timestamp.verify_timestamp_token_in_process(
+            None, 'osfstorage', digest=hashlib.sha512(b'test data').digest())
+        nt.assert_equal(ret, api_settings.TIME_STAMP_VERIFICATION_ERR)
+
+
+class TestExternalInfoStreamingHash(OsfTestCase):
+    def setUp(self):
+        super(TestExternalInfoStreamingHash, self).setUp()
+        self.user = AuthUserFactory()
+        self.node = ProjectFactory(creator=self.user)
+        self.file_node = create_test_file(self.node, self.user, filename='large.bin')
+
+    @mock.patch('website.util.waterbutler.hash_file')
+    def test_provider_hash_is_reused(self, mock_hash_file):
+        sha512 = hashlib.sha512(b'data').hexdigest()
+        with mock.patch.object(self.file_node, 'get_hash_for_timestamp',
+                               return_value=(timestamp.HASH_TYPE_SHA512, sha512)):
+            ext_info = timestamp.ExternalInfo(self.node, self.user, self.file_node, False)
+
+        nt.assert_equal(ext_info.hash_value, sha512)
+        nt.assert_equal(ext_info.hashes, {timestamp.HASH_TYPE_SHA512: sha512})
+        nt.assert_false(mock_hash_file.called)
+
+    @mock.patch('website.util.waterbutler.hash_file')
+    def test_streaming_hash(self, mock_hash_file):
+        hashes = {
+            timestamp.HASH_TYPE_SHA256: hashlib.sha256(b'data').hexdigest(),
+            timestamp.HASH_TYPE_SHA512: hashlib.sha512(b'data').hexdigest(),
+        }
+        mock_hash_file.return_value = hashes
+        with mock.patch.object(self.file_node, 'get_hash_for_timestamp', return_value=(None, None)):
+            ext_info = timestamp.ExternalInfo(self.node, self.user, self.file_node, False)
+
+        nt.assert_equal(ext_info.hash_type, timestamp.HASH_TYPE_SHA512)
+        nt.assert_equal(ext_info.hash_value, hashes[timestamp.HASH_TYPE_SHA512])
+        nt.assert_equal(ext_info.hashes, hashes)
+        nt.assert_true(ext_info.file_exists)
+        nt.assert_equal(mock_hash_file.call_args[0][2],
+                        [timestamp.HASH_TYPE_SHA256, timestamp.HASH_TYPE_SHA512])
+
+    @mock.patch('website.util.waterbutler.hash_file')
+    def test_no_streaming_hash_when_verifying_external_only(self, mock_hash_file):
+        with mock.patch.object(self.file_node, 'get_hash_for_timestamp', return_value=(None, None)):
+            ext_info = timestamp.ExternalInfo(self.node, self.user, self.file_node, True)
+
+        nt.assert_is_none(ext_info.hash_value)
+        nt.assert_false(mock_hash_file.called)
+
+    @mock.patch('website.util.waterbutler.requests.get')
+    def test_waterbutler_hash_file(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.iter_content.return_value = [b'da', b'ta']
+
+        hashes = waterbutler.hash_file('cookie', self.file_node, ['sha256', 'sha512'])
+
+        nt.assert_equal(hashes, {
+            'sha256': hashlib.sha256(b'data').hexdigest(),
+            'sha512': hashlib.sha512(b'data').hexdigest(),
+        })
+        nt.assert_true(mock_get.return_value.close.called)
+
+    @mock.patch('website.util.waterbutler.requests.get')
+    def test_waterbutler_hash_file_not_found(self, mock_get):
+        mock_get.return_value.status_code = 404
+
+        nt.assert_is_none(waterbutler.hash_file('cookie', self.file_node, ['sha512']))
@@ -6110,6 +6110,7 @@ class TestTimestampView(OsfTestCase):
     def test_verify_timestamp_token(self, mock_get, mock_shutil, mock_aborted, mock_getfulllist, mock_checkfilets):
         mock_get.return_value.content = ''
         mock_aborted.return_value = False
+        mock_checkfilets.return_value = None
         mock_getfulllist.return_value = [
             {
                 'provider': 'osfstorage',
@@ -10,6 +10,7 @@ from collections import OrderedDict
 
 import django
 from api.caching import listeners  # noqa
+from api.caching.tasks import ban_before_request
 from django.apps import apps
 from framework.addons.utils import render_addon_capabilities
 from framework.celery_tasks import handlers as celery_task_handlers
@@ -27,6 +28,7 @@ from website.mails import listeners  # noqa
 from website.notifications import listeners  # noqa
 from website.identifiers import listeners  # noqa
 from website.reviews import listeners  # noqa
+from website.search import handlers as search_handlers
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 logger = logging.getLogger(__name__)
@@ -56,8 +58,10 @@ def attach_handlers(app, settings):
     # Add callback handlers to application
     add_handlers(app, django_handlers.handlers)
     add_handlers(app, celery_task_handlers.handlers)
+    add_handlers(app, search_handlers.handlers)
     add_handlers(app, transaction_handlers.handlers)
     add_handlers(app, postcommit_handlers.handlers)
+    add_handlers(app, {'before_request': ban_before_request})
     add_handlers(app, csrf_handlers.handlers)
 
     # Attach handler for checking view-only link keys.
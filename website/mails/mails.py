@@ -107,11 +107,58 @@ def send_mail(
     .. note:
          Uses celery if available
     """
-    if waffle.switch_is_active(features.DISABLE_ENGAGEMENT_EMAILS) and mail.engagement:
+    kwargs = build_mail_kwargs(
+        to_addr, mail, mimetype=mimetype, from_addr=from_addr, username=username, password=password,
+        attachment_name=attachment_name, attachment_content=attachment_content, cc_addr=cc_addr,
+        replyto=replyto, **context
+    )
+    if kwargs is None:
         return False
+    mailer = mailer or tasks.send_email
+
+    logger.debug('Preparing to send...')
+    if settings.USE_EMAIL:
+        if settings.USE_CELERY and celery:
+            logger.debug('Sending via celery...')
+            return mailer.apply_async(kwargs=kwargs, link=callback)
+        else:
+            logger.debug('Sending without celery')
+            ret = mailer(**kwargs)
+            if callback:
+                callback()
+
+            return ret
+
+
+def send_mails(mails_kwargs, celery=True):
+    """Send many emails at once. The emails are sent by one task which reuses
+    its SMTP connection, instead of one task and connection per email.
+
+    :param list mails_kwargs: The arguments of ``send_mail`` for each email
+    :param bool celery: Send the emails by a celery task, otherwise send them before returning
+    :return: The async result of ``framework.email.tasks.send_emails`` with celery, otherwise
+        the list of whether each email is done, i.e. sent or disabled. None if emails are not used.
+    """
+    emails = [build_mail_kwargs(**kwargs) for kwargs in mails_kwargs]
+    if not settings.USE_EMAIL:
+        return None
+    to_send = [email for email in emails if email is not None]
+    if settings.USE_CELERY and celery:
+        return tasks.send_emails.apply_async(kwargs={'emails': to_send}) if to_send else None
+    sent = iter(tasks.send_emails(to_send) if to_send else [])
+    return [True if email is None else next(sent) for email in emails]
+
+
+def build_mail_kwargs(
+        to_addr, mail, mimetype='html', from_addr=None, username=None, password=None,
+        attachment_name=None, attachment_content=None, cc_addr=None, replyto=None, **context):
+    """Render an email and return the arguments of ``framework.email.tasks.send_email``,
+    or None if the email is disabled.
+    """
+    if waffle.switch_is_active(features.DISABLE_ENGAGEMENT_EMAILS) and mail.engagement:
+        return None
 
     from_addr = from_addr or settings.FROM_EMAIL
-    mailer = mailer or tasks.send_email
     subject = mail.subject(**context)
     message = mail.html(**context)
     # Don't use ttls and login in DEBUG_MODE
@@ -126,7 +173,7 @@ def send_mail(
     logger.debug('Sending email...')
     logger.debug(u'To: {to_addr}\nFrom: {from_addr}\nSubject: {subject}\nMessage: {message}'.format(**locals()))
 
-    kwargs = dict(
+    return dict(
         from_addr=from_addr,
         to_addr=to_addr,
         cc_addr=cc_addr,
@@ -144,19 +191,6 @@ def send_mail(
         attachment_content=attachment_content,
     )
 
-    logger.debug('Preparing to send...')
-    if settings.USE_EMAIL:
-        if settings.USE_CELERY and celery:
-            logger.debug('Sending via celery...')
-            return mailer.apply_async(kwargs=kwargs, link=callback)
-        else:
-            logger.debug('Sending without celery')
-            ret = mailer(**kwargs)
-            if callback:
-                callback()
-
-            return ret
-
 
 def get_english_article(word):
     """
@@ -1,5 +1,7 @@
 from babel import dates, core, Locale
 
+from api.caching import settings as cache_settings
+from api.caching.utils import notification_subscriptions_cache
 from osf.models import AbstractNode, OSFUser, NotificationDigest, NotificationSubscription
 from osf.utils.permissions import ADMIN, READ
 from website import mails
@@ -120,7 +122,28 @@ def store_emails(recipient_ids, notification_type, event, user, node, timestamp,
         digest.save()
 
 
-def compile_subscriptions(node, event_type, event=None, level=0):
+def compile_subscriptions(node, event_type, event=None):
+    """Get the subscriptions of a node, including the ones inherited from its parents.
+
+    The resolved subscriptions of a node are cached until a subscription or a permission
+    of the node or of one of its parents changes, see ``utils.clear_subscriptions_cache``.
+
+    :param node: current node
+    :param event_type: Generally node_subscriptions_available
+    :param event: Particular event such a file_updated that has specific file subs
+    :return: a dict of notification types with lists of users.
+    """
+    if not isinstance(node, AbstractNode):
+        return _compile_subscriptions(node, event_type, event)
+    key = utils.get_subscriptions_cache_key(node, event_type, event)
+    subscriptions = notification_subscriptions_cache.get(key)
+    if subscriptions is None:
+        subscriptions = _compile_subscriptions(node, event_type, event)
+        notification_subscriptions_cache.set(key, subscriptions, cache_settings.NOTIFICATION_SUBSCRIPTIONS_TIMEOUT)
+    return subscriptions
+
+
+def _compile_subscriptions(node, event_type, event=None, level=0):
     """Recurse through node and parents for subscriptions.
 
     :param node: current node
@@ -132,10 +155,10 @@ def compile_subscriptions(node, event_type, event=None, level=0):
     subscriptions = check_node(node, event_type)
     if event:
         subscriptions = check_node(node, event)  # Gets particular event subscriptions
-        parent_subscriptions = compile_subscriptions(node, event_type, level=level + 1)  # get node and parent subs
+        parent_subscriptions = _compile_subscriptions(node, event_type, level=level + 1)  # get node and parent subs
     elif getattr(node, 'parent_id', False):
         parent_subscriptions = \
-            compile_subscriptions(AbstractNode.load(node.parent_id), event_type, level=level + 1)
+            _compile_subscriptions(AbstractNode.load(node.parent_id), event_type, level=level + 1)
     else:
         parent_subscriptions = check_node(None, event_type)
     for notification_type in parent_subscriptions:
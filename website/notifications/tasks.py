@@ -2,17 +2,27 @@
 Tasks for making even transactional emails consolidated.
 """
 import itertools
+import logging
 
+from django.contrib.contenttypes.models import ContentType
 from django.db import connection
+from django.db.models import F
 
 from framework.celery_tasks import app as celery_app
 from framework.sentry import log_exception
 from osf.models import OSFUser, AbstractNode, AbstractProvider
-from osf.models import NotificationDigest
+from osf.models import Guid, NotificationDigest
 from osf.utils.permissions import ADMIN
 from website import mails, settings
 from website.notifications.utils import NotificationsDict
 
+logger = logging.getLogger(__name__)
+
+# Number of users whose emails are sent and digests removed together
+DIGEST_BATCH_SIZE = 100
+# Number of runs which try to send the email of a digest before it is dropped
+DIGEST_MAX_SEND_ATTEMPTS = 5
+
 
 @celery_app.task(name='website.notifications.tasks.send_users_email', max_retries=0)
 def send_users_email(send_type):
@@ -28,32 +38,52 @@ def send_users_email(send_type):
 def _send_global_and_node_emails(send_type):
     """
     Called by `send_users_email`. Send all global and node-related notification emails.
+
+    The users are processed in batches of DIGEST_BATCH_SIZE. The emails of a batch are sent
+    over one connection and the digests of the sent ones are removed together, so an
+    interrupted run resumes from the batch it was processing.
     """
     grouped_emails = get_users_emails(send_type)
-    for group in grouped_emails:
-        user = OSFUser.load(group['user_id'])
-        if not user:
-            log_exception()
-            continue
-        info = group['info']
-        notification_ids = [message['_id'] for message in info]
-        sorted_messages = group_by_node(info)
-        if sorted_messages:
-            if not user.is_disabled:
-                # If there's only one node in digest we can show it's preferences link in the template.
-                notification_nodes = list(sorted_messages['children'].keys())
-                node = AbstractNode.load(notification_nodes[0]) if len(
-                    notification_nodes) == 1 else None
-                mails.send_mail(
-                    to_addr=user.username,
-                    mimetype='html',
-                    can_change_node_preferences=bool(node),
-                    node=node,
-                    mail=mails.DIGEST,
-                    name=user.fullname,
-                    message=sorted_messages,
-                )
-            remove_notifications(email_notification_ids=notification_ids)
+    for batch_number, groups in enumerate(iter_batches(grouped_emails, DIGEST_BATCH_SIZE), 1):
+        users = load_by_guids(OSFUser, [group['user_id'] for group in groups])
+        sorted_messages = [group_by_node(group['info']) for group in groups]
+        # If there's only one node in digest we can show it's preferences link in the template.
+        single_node_ids = [
+            list(messages['children'].keys())[0] if messages and len(messages['children']) == 1 else None
+            for messages in sorted_messages
+        ]
+        nodes = load_by_guids(AbstractNode, [node_id for node_id in single_node_ids if node_id])
+
+        mails_kwargs = []
+        mails_notification_ids = []
+        notification_ids = []
+        for group, messages, node_id in zip(groups, sorted_messages, single_node_ids):
+            user = users.get(group['user_id'])
+            if not user:
+                log_exception()
+                continue
+            if not messages:
+                continue
+            group_notification_ids = [message['_id'] for message in group['info']]
+            if user.is_disabled:
+                notification_ids.extend(group_notification_ids)
+                continue
+            node = nodes.get(node_id) if node_id else None
+            mails_kwargs.append(dict(
+                to_addr=user.username,
+                mimetype='html',
+                can_change_node_preferences=bool(node),
+                node=node,
+                mail=mails.DIGEST,
+                name=user.fullname,
+                message=messages,
+            ))
+            mails_notification_ids.append(group_notification_ids)
+
+        sent_count = send_digest_mails(mails_kwargs, mails_notification_ids, notification_ids)
+        remove_notifications(email_notification_ids=notification_ids)
+        logger.info('Sent {} of {} digest emails of batch {} ({})'.format(
+            sent_count, len(mails_kwargs), batch_number, send_type))
 
 
 def _send_reviews_moderator_emails(send_type):
@@ -61,13 +91,22 @@ def _send_reviews_moderator_emails(send_type):
     Called by `send_users_email`. Send all reviews triggered emails.
     """
     grouped_emails = get_moderators_emails(send_type)
-    for group in grouped_emails:
-        user = OSFUser.load(group['user_id'])
-        info = group['info']
-        notification_ids = [message['_id'] for message in info]
-        if not user.is_disabled:
-            provider = AbstractProvider.objects.get(id=group['provider_id'])
-            mails.send_mail(
+    for groups in iter_batches(grouped_emails, DIGEST_BATCH_SIZE):
+        users = load_by_guids(OSFUser, [group['user_id'] for group in groups])
+        providers = AbstractProvider.objects.in_bulk({group['provider_id'] for group in groups})
+
+        mails_kwargs = []
+        mails_notification_ids = []
+        notification_ids = []
+        for group in groups:
+            user = users.get(group['user_id'])
+            info = group['info']
+            group_notification_ids = [message['_id'] for message in info]
+            if user.is_disabled:
+                notification_ids.extend(group_notification_ids)
+                continue
+            provider = providers[group['provider_id']]
+            mails_kwargs.append(dict(
                 to_addr=user.username,
                 mimetype='html',
                 mail=mails.DIGEST_REVIEWS_MODERATORS,
@@ -78,10 +117,71 @@ def _send_reviews_moderator_emails(send_type):
                 notification_settings_url='{}reviews/preprints/{}/notifications'.format(settings.DOMAIN, provider._id),
                 is_reviews_moderator_notification=True,
                 is_admin=provider.get_group(ADMIN).user_set.filter(id=user.id).exists()
-            )
+            ))
+            mails_notification_ids.append(group_notification_ids)
+
+        send_digest_mails(mails_kwargs, mails_notification_ids, notification_ids)
         remove_notifications(email_notification_ids=notification_ids)
 
 
+def send_digest_mails(mails_kwargs, mails_notification_ids, notification_ids):
+    """Send the digest emails and add the ids of the digests of the sent ones to notification_ids
+
+    The digests of the emails which cannot be sent are kept, so they are sent again by the next run,
+    until DIGEST_MAX_SEND_ATTEMPTS runs failed to send them. They are then added to notification_ids too.
+
+    :param list mails_kwargs: The arguments of ``mails.send_mail`` for each email
+    :param list mails_notification_ids: The list of the digest ids of each email
+    :return: The number of sent emails
+    """
+    if not mails_kwargs:
+        return 0
+    sent = mails.send_mails(mails_kwargs, celery=False)
+    if sent is None:
+        # emails are not used, the digests are removed as before
+        sent = [True] * len(mails_kwargs)
+    failed_ids = []
+    for is_sent, ids in zip(sent, mails_notification_ids):
+        if is_sent:
+            notification_ids.extend(ids)
+        else:
+            failed_ids.extend(ids)
+    if failed_ids:
+        failed = NotificationDigest.objects.filter(_id__in=failed_ids)
+        failed.update(send_attempts=F('send_attempts') + 1)
+        dropped_ids = list(failed.filter(
+            send_attempts__gte=DIGEST_MAX_SEND_ATTEMPTS,
+        ).values_list('_id', flat=True))
+        if dropped_ids:
+            logger.warning('Dropping {} digests not sent after {} attempts'.format(
+                len(dropped_ids), DIGEST_MAX_SEND_ATTEMPTS))
+            notification_ids.extend(dropped_ids)
+    return sum(1 for is_sent in sent if is_sent)
+
+
+def iter_batches(iterable, size):
+    """Yield lists of at most `size` items of the iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_by_guids(model, guids):
+    """Load the objects of the guids with two queries.
+
+    :return dict: {guid: object}, without the guids that were not found
+    """
+    object_ids = dict(Guid.objects.filter(
+        _id__in=set(guids),
+        content_type=ContentType.objects.get_for_model(model),
+    ).values_list('object_id', '_id'))
+    objects = model.objects.in_bulk(list(object_ids.keys()))
+    return {object_ids[pk]: obj for pk, obj in objects.items()}
+
+
 def get_moderators_emails(send_type):
     """Get all emails for reviews moderators that need to be sent, grouped by users AND providers.
     :param send_type: from NOTIFICATION_TYPES, could be "email_digest" or "email_transactional"
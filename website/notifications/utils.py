@@ -1,8 +1,12 @@
 import collections
+import hashlib
 
 from django.apps import apps
+from django.db import connection
 from django.db.models import Q
 
+from api.caching import settings as cache_settings
+from api.caching.utils import notification_subscriptions_cache
 from framework.postcommit_tasks.handlers import run_postcommit
 from osf.utils.permissions import READ
 from website.notifications import constants
@@ -58,6 +62,56 @@ def from_subscription_key(key):
     }
 
 
+def get_node_lineage_pks(node):
+    """Return the primary keys of the node and its parents, from the node to the top most project"""
+    NodeRelation = apps.get_model('osf.NodeRelation')
+    sql = """
+        WITH RECURSIVE ascendants AS (
+          SELECT parent_id, 1 AS level
+          FROM "{table}"
+          WHERE is_node_link IS FALSE AND child_id = %s
+          UNION ALL
+          SELECT S.parent_id, D.level + 1
+          FROM ascendants AS D
+            JOIN "{table}" AS S ON D.parent_id = S.child_id
+          WHERE S.is_node_link IS FALSE AND D.level < 100
+        ) SELECT parent_id FROM ascendants ORDER BY level;
+    """.format(table=NodeRelation._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [node.pk])
+        return [node.pk] + [row[0] for row in cursor.fetchall()]
+
+
+def get_subscriptions_cache_key(node, event_type, event=None):
+    """Build the cache key of the resolved subscriptions of a node for an event type.
+
+    The key contains the generations of the node and of all its parents, so that
+    clearing the cache of a node also invalidates the subscriptions of its descendants.
+    """
+    generation_keys = [cache_settings.NOTIFICATION_SUBSCRIPTIONS_GENERATION_KEY.format(node_id=node_id)
+                       for node_id in ['all'] + get_node_lineage_pks(node)]
+    generations = notification_subscriptions_cache.get_many(generation_keys)
+    lineage = u','.join(u'{}={}'.format(key, generations.get(key, 0)) for key in generation_keys)
+    return cache_settings.NOTIFICATION_SUBSCRIPTIONS_KEY.format(
+        node_id=node.pk,
+        event_type=event_type,
+        event=event or '',
+        lineage_hash=hashlib.sha1(lineage.encode('utf-8')).hexdigest(),
+    )
+
+
+def clear_subscriptions_cache(node_id=None):
+    """Invalidate the cached subscriptions of a node and its descendants, or of all the nodes
+
+    :param node_id: primary key of the node, None for all the nodes
+    """
+    key = cache_settings.NOTIFICATION_SUBSCRIPTIONS_GENERATION_KEY.format(node_id=node_id or 'all')
+    try:
+        notification_subscriptions_cache.incr(key)
+    except ValueError:
+        notification_subscriptions_cache.set(key, 1, cache_settings.NEVER_TIMEOUT)
+
+
 @signals.contributor_removed.connect
 def remove_contributor_from_subscriptions(node, user):
     """ Remove contributor from node subscriptions unless the user is an
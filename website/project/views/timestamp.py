@@ -20,7 +20,7 @@ def get_init_timestamp_error_data_list(auth, node, **kwargs):
     ctx = _view_project(node, auth, primary=True)
     ctx.update(rubeus.collect_addon_assets(node))
     pid = kwargs.get('pid')
-    ctx['provider_list'] = timestamp.get_error_list(pid)
+    ctx['provider_list'] = timestamp.iter_error_list(pid)
     ctx['project_title'] = node.title
     ctx['guid'] = pid
     ctx['web_api_url'] = settings.DOMAIN + node.api_url
@@ -3,11 +3,14 @@
 
 from __future__ import division
 
+from collections import OrderedDict
+import contextlib
 import copy
 import functools
 import logging
 import math
 import re
+import threading
 from framework import sentry
 import os.path
 
@@ -178,6 +181,81 @@ def client():
     return CLIENT
 
 
+_index_buffer_local = threading.local()
+
+
+class IndexBuffer(object):
+    """Accumulate the index and delete actions of the update_* functions
+
+    Actions for the same document replace the earlier ones, so a document which
+    is updated many times in a task is sent once. The actions are sent with
+    helpers.bulk and the index is refreshed once per flush instead of once per
+    document.
+    """
+
+    def __init__(self, refresh=True):
+        self.refresh = refresh
+        self.actions = OrderedDict()
+
+    def add(self, action):
+        key = (action['_index'], action['_type'], action['_id'])
+        # move the document to the end, after the actions it may depend on
+        self.actions.pop(key, None)
+        self.actions[key] = action
+
+    def flush(self):
+        actions = list(self.actions.values())
+        self.actions.clear()
+        if actions:
+            bulk_send_actions(actions, refresh=self.refresh)
+
+def get_index_buffer():
+    return getattr(_index_buffer_local, 'buffer', None)
+
+def start_index_buffer(refresh=True):
+    """Start buffering the documents written by this thread until stop_index_buffer"""
+    if get_index_buffer() is None:
+        _index_buffer_local.buffer = IndexBuffer(refresh=refresh)
+
+def stop_index_buffer(discard=False):
+    """Stop buffering the documents and send them unless discard is True"""
+    buffer = get_index_buffer()
+    _index_buffer_local.buffer = None
+    if buffer is not None and not discard:
+        buffer.flush()
+
+@contextlib.contextmanager
+def index_buffer(refresh=True):
+    """Buffer the documents written in the block and send them when the block exits
+
+    Nested blocks share the outermost buffer. The buffer is discarded if the block raises.
+    """
+    if get_index_buffer() is not None:
+        yield get_index_buffer()
+        return
+    buffer = IndexBuffer(refresh=refresh)
+    _index_buffer_local.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        _index_buffer_local.buffer = None
+    buffer.flush()
+
+def index_document(index, doc_type, id_, body):
+    buffer = get_index_buffer()
+    if buffer is not None:
+        buffer.add({'_op_type': 'index', '_index': index, '_type': doc_type, '_id': id_, '_source': body})
+    else:
+        client().index(index=index, doc_type=doc_type, id=id_, body=body, refresh=True)
+
+def delete_document(index, doc_type, id_):
+    buffer = get_index_buffer()
+    if buffer is not None:
+        buffer.add({'_op_type': 'delete', '_index': index, '_type': doc_type, '_id': id_})
+    else:
+        client().delete(index=index, doc_type=doc_type, id=id_, refresh=True, ignore=[404])
+
+
 def requires_search(func):
     def wrapped(*args, **kwargs):
         if client() is not None:
@@ -667,7 +745,7 @@ def get_doctype_from_node(node):
         return node.category
 
 @celery_app.task(bind=True, max_retries=5, default_retry_delay=60)
-def update_node_async(self, node_id, index=None, bulk=False, wiki_page_id=None):
+def update_node_async(self, node_id, index=None, bulk=False, wiki_page_id=None, saved_fields=None):
     AbstractNode = apps.get_model('osf.AbstractNode')
     node = AbstractNode.load(node_id)
     if wiki_page_id:
@@ -676,7 +754,8 @@ def update_node_async(self, node_id, index=None, bulk=False, wiki_page_id=None):
     else:
         wiki_page = None
     try:
-        update_node(node=node, index=index, bulk=bulk, async_update=True, wiki_page=wiki_page)
+        with index_buffer():
+            update_node(node=node, index=index, bulk=bulk, async_update=True, wiki_page=wiki_page, saved_fields=saved_fields)
     except Exception as exc:
         self.retry(exc=exc)
 
@@ -685,7 +764,8 @@ def update_preprint_async(self, preprint_id, index=None, bulk=False):
     Preprint = apps.get_model('osf.Preprint')
     preprint = Preprint.load(preprint_id)
     try:
-        update_preprint(preprint=preprint, index=index, bulk=bulk, async_update=True)
+        with index_buffer():
+            update_preprint(preprint=preprint, index=index, bulk=bulk, async_update=True)
     except Exception as exc:
         self.retry(exc=exc)
 
@@ -694,7 +774,8 @@ def update_group_async(self, group_id, index=None, bulk=False, deleted_id=None):
     OSFGroup = apps.get_model('osf.OSFGroup')
     group = OSFGroup.load(group_id)
     try:
-        update_group(group=group, index=index, bulk=bulk, async_update=True, deleted_id=deleted_id)
+        with index_buffer():
+            update_group(group=group, index=index, bulk=bulk, async_update=True, deleted_id=deleted_id)
     except Exception as exc:
         self.retry(exc=exc)
 
@@ -703,7 +784,8 @@ def update_comment_async(self, comment_id, index=None, bulk=False):
     Comment = apps.get_model('osf.Comment')
     comment = Comment.load(comment_id)
     try:
-        update_comment(comment=comment, index=index, bulk=bulk)
+        with index_buffer():
+            update_comment(comment=comment, index=index, bulk=bulk)
     except Exception as exc:
         self.retry(exc=exc)
 
@@ -712,7 +794,8 @@ def update_user_async(self, user_id, index=None):
     OSFUser = apps.get_model('osf.OSFUser')
     user = OSFUser.objects.get(id=user_id)
     try:
-        update_user(user, index)
+        with index_buffer():
+            update_user(user, index)
     except Exception as exc:
         self.retry(exc)
 
@@ -721,7 +804,8 @@ def update_file_metadata_async(self, project_id, path, index=None, bulk=False):
     FileMetadata = apps.get_model(f'addons_{METADATA_SHORT_NAME}.FileMetadata')
     file_metadata = FileMetadata.load(project_id=project_id, path=path)
     try:
-        update_file_metadata(file_metadata=file_metadata, index=index, bulk=bulk)
+        with index_buffer():
+            update_file_metadata(file_metadata=file_metadata, index=index, bulk=bulk)
     except Exception as exc:
         self.retry(exc=exc)
 
@@ -1025,7 +1109,7 @@ def update_comment(comment, index=None, bulk=False):
     if bulk:
         return elastic_document
     else:
-        client().index(index=index, doc_type=category, id=comment._id, body=elastic_document, refresh=True)
+        index_document(index, category, comment._id, elastic_document)
 
 def node_is_ignored(node):
     is_qa_node = bool(set(settings.DO_NOT_INDEX_LIST['tags']).intersection(node.tags.all().values_list('name', flat=True))) or any(substring in node.title for substring in settings.DO_NOT_INDEX_LIST['titles'])
@@ -1053,7 +1137,7 @@ def update_wiki(wiki_page, index=None, bulk=False):
     if bulk:
         return elastic_document
     else:
-        client().index(index=index, doc_type=category, id=wiki_page._id, body=elastic_document, refresh=True)
+        index_document(index, category, wiki_page._id, elastic_document)
 
 @requires_search
 def update_file_metadata(file_metadata, index=None, bulk=False):
@@ -1068,22 +1152,64 @@ def update_file_metadata(file_metadata, index=None, bulk=False):
     if bulk:
         return elastic_document
     else:
-        client().index(index=index, doc_type=category, id=file_metadata._id, body=elastic_document, refresh=True)
+        index_document(index, category, file_metadata._id, elastic_document)
 
-@requires_search
-def update_node(node, index=None, bulk=False, async_update=False, wiki_page=None):
-    if wiki_page:
-        update_wiki(wiki_page, index=index)
-        # NOTE: update_node() may be called twice after WikiPage.save()
+def iter_node_file_actions(node, index):
+    """Yield the bulk actions which update the file and file metadata documents of the node"""
     metadata = node.get_addon(METADATA_SHORT_NAME)
     if metadata is not None:
+        category = 'metadata'
+        is_ignored = node_is_ignored(node)
         for file_metadata in metadata.file_metadata.all():
-            update_file_metadata(file_metadata, index=index)
+            if file_metadata.deleted or is_ignored:
+                yield {'_op_type': 'delete', '_index': index, '_type': category, '_id': file_metadata._id}
+            else:
+                yield {
+                    '_op_type': 'index',
+                    '_index': index,
+                    '_type': category,
+                    '_id': file_metadata._id,
+                    '_source': serialize_file_metadata(file_metadata, category),
+                }
 
     from addons.osfstorage.models import OsfStorageFile
-    index = es_index(index)
+    target_context = get_file_target_context(node)
     for file_ in paginated(OsfStorageFile, Q(target_content_type=ContentType.objects.get_for_model(type(node)), target_object_id=node.id)):
-        update_file(file_, index=index)
+        file_doc = serialize_file(file_, target_context=target_context)
+        if file_doc is None:
+            yield {'_op_type': 'delete', '_index': index, '_type': 'file', '_id': file_._id}
+        else:
+            yield {'_op_type': 'index', '_index': index, '_type': 'file', '_id': file_._id, '_source': file_doc}
+
+def bulk_send_actions(actions, refresh=True):
+    """Send the actions with helpers.bulk, refreshing the index once per chunk
+
+    Deleting a document which is not indexed is not an error.
+    """
+    _, errors = helpers.bulk(client(), actions, refresh=refresh, raise_on_error=False)
+    errors = [error for error in errors if error.get('delete', {}).get('status') != 404]
+    if errors:
+        raise helpers.BulkIndexError('{} document(s) failed to index.'.format(len(errors)), errors)
+
+@requires_search
+def update_node(node, index=None, bulk=False, async_update=False, wiki_page=None, saved_fields=None):
+    """Update the document of the node
+
+    The documents of the files of the node are updated only when saved_fields is None (unknown)
+    or contains one of the node fields reflected to them.
+    """
+    if wiki_page:
+        update_wiki(wiki_page, index=index)
+        # NOTE: update_node() may be called twice after WikiPage.save()
+
+    index = es_index(index)
+    if saved_fields is None or node.FILE_SEARCH_UPDATE_FIELDS.intersection(saved_fields):
+        buffer = get_index_buffer()
+        if buffer is not None:
+            for action in iter_node_file_actions(node, index):
+                buffer.add(action)
+        else:
+            bulk_send_actions(iter_node_file_actions(node, index))
 
     is_qa_node = bool(set(settings.DO_NOT_INDEX_LIST['tags']).intersection(node.tags.all().values_list('name', flat=True))) or any(substring in node.title for substring in settings.DO_NOT_INDEX_LIST['titles'])
     if node.is_deleted or (not settings.ENABLE_PRIVATE_SEARCH and not node.is_public) or node.archiving or node.is_spam or (node.spam_status == SpamStatus.FLAGGED and settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH) or node.is_quickfiles or is_qa_node:
@@ -1096,7 +1222,7 @@ def update_node(node, index=None, bulk=False, async_update=False, wiki_page=None
         if bulk:
             return elastic_document
         else:
-            client().index(index=index, doc_type=category, id=node._id, body=elastic_document, refresh=True)
+            index_document(index, category, node._id, elastic_document)
 
 @requires_search
 def update_preprint(preprint, index=None, bulk=False, async_update=False):
@@ -1114,7 +1240,7 @@ def update_preprint(preprint, index=None, bulk=False, async_update=False):
         if bulk:
             return elastic_document
         else:
-            client().index(index=index, doc_type=category, id=preprint._id, body=elastic_document, refresh=True)
+            index_document(index, category, preprint._id, elastic_document)
 
 @requires_search
 def update_group(group, index=None, bulk=False, async_update=False, deleted_id=None):
@@ -1128,7 +1254,7 @@ def update_group(group, index=None, bulk=False, async_update=False, deleted_id=N
         if bulk:
             return elastic_document
         else:
-            client().index(index=index, doc_type=category, id=group._id, body=elastic_document, refresh=True)
+            index_document(index, category, group._id, elastic_document)
 
 def bulk_update_nodes(serialize, nodes, index=None, category=None):
     """Updates the list of input projects
@@ -1292,18 +1418,12 @@ def update_user(user, index=None):
     index = es_index(index)
     if not user.is_active:
         try:
-            client().delete(index=index, doc_type='user', id=user._id, refresh=True, ignore=[404])
+            delete_document(index, 'user', user._id)
             # update files in their quickfiles node if the user has been marked as spam
             if user.spam_status == SpamStatus.SPAM:
                 quickfiles = QuickFilesNode.objects.get_for_user(user)
                 for quickfile_id in quickfiles.files.values_list('_id', flat=True):
-                    client().delete(
-                        index=index,
-                        doc_type='file',
-                        id=quickfile_id,
-                        refresh=True,
-                        ignore=[404]
-                    )
+                    delete_document(index, 'file', quickfile_id)
         except NotFoundError:
             pass
         return
@@ -1361,41 +1481,41 @@ def update_user(user, index=None):
         'emails': list(user.emails.values_list('address', flat=True))
     }
 
-    client().index(index=index, doc_type='user', body=user_doc, id=user._id, refresh=True)
+    index_document(index, 'user', user._id, user_doc)
 
-@requires_search
-def update_file(file_, index=None, delete=False):
-    index = es_index(index)
+def get_file_target_context(target):
+    """Values of the target used by serialize_file, shared by the files of the target"""
+    return {
+        'is_qa': bool(
+            set(settings.DO_NOT_INDEX_LIST['tags']).intersection(target.tags.all().values_list('name', flat=True))
+        ) or any(substring in target.title for substring in settings.DO_NOT_INDEX_LIST['titles']),
+        'node_contributors': [
+            {
+                'id': x['guids___id']
+            }
+            for x in target._contributors.all().order_by('contributor___order')
+            .values('guids___id')
+        ],
+    }
+
+def serialize_file(file_, target_context=None):
+    """Return the document of the file, or None if the file must not be indexed"""
     target = file_.target
+    if target_context is None:
+        target_context = get_file_target_context(target)
 
     # TODO: Can remove 'not file_.name' if we remove all base file nodes with name=None
     file_node_is_qa = bool(
         set(settings.DO_NOT_INDEX_LIST['tags']).intersection(file_.tags.all().values_list('name', flat=True))
-    ) or bool(
-        set(settings.DO_NOT_INDEX_LIST['tags']).intersection(target.tags.all().values_list('name', flat=True))
-    ) or any(substring in target.title for substring in settings.DO_NOT_INDEX_LIST['titles'])
-    if not file_.name or (not settings.ENABLE_PRIVATE_SEARCH and not target.is_public) or delete or file_node_is_qa or getattr(target, 'is_deleted', False) or getattr(target, 'archiving', False) or target.is_spam or (
+    ) or target_context['is_qa']
+    if not file_.name or (not settings.ENABLE_PRIVATE_SEARCH and not target.is_public) or file_node_is_qa or getattr(target, 'is_deleted', False) or getattr(target, 'archiving', False) or target.is_spam or (
             target.spam_status == SpamStatus.FLAGGED and settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH):
-        client().delete(
-            index=index,
-            doc_type='file',
-            id=file_._id,
-            refresh=True,
-            ignore=[404]
-        )
-        return
+        return None
 
     if isinstance(target, Preprint):
         if not getattr(target, 'verified_publishable', False) or target.primary_file != file_ or target.is_spam or (
                 target.spam_status == SpamStatus.FLAGGED and settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH):
-            client().delete(
-                index=index,
-                doc_type='file',
-                id=file_._id,
-                refresh=True,
-                ignore=[404]
-            )
-            return
+            return None
 
     # We build URLs manually here so that this function can be
     # run outside of a Flask request context (e.g. in a celery task)
@@ -1464,31 +1584,29 @@ def update_file(file_, index=None, delete=False):
         'is_retracted': getattr(target, 'is_retracted', False),
         'extra_search_terms': clean_splitters(file_.name),
         # Contributors for Access control
-        'node_contributors': [
-            {
-                'id': x['guids___id']
-            }
-            for x in target._contributors.all().order_by('contributor___order')
-            .values('guids___id')
-        ],
+        'node_contributors': target_context['node_contributors'],
         'node_public': target.is_public,
         'comments': comments_to_doc(file_guid._id) if file_guid else {}
     }
 
-    client().index(
-        index=index,
-        doc_type='file',
-        body=file_doc,
-        id=file_._id,
-        refresh=True
-    )
+    return file_doc
+
+@requires_search
+def update_file(file_, index=None, delete=False):
+    index = es_index(index)
+    file_doc = None if delete else serialize_file(file_)
+    if file_doc is None:
+        delete_document(index, 'file', file_._id)
+        return
+
+    index_document(index, 'file', file_._id, file_doc)
 
 @requires_search
 def update_institution(institution, index=None):
     index = es_index(index)
     id_ = institution._id
     if institution.is_deleted:
-        client().delete(index=index, doc_type='institution', id=id_, refresh=True, ignore=[404])
+        delete_document(index, 'institution', id_)
     else:
         institution_doc = {
             'id': id_,
@@ -1501,7 +1619,7 @@ def update_institution(institution, index=None):
             'date_modified': institution.modified,
         }
 
-        client().index(index=index, doc_type='institution', body=institution_doc, id=id_, refresh=True)
+        index_document(index, 'institution', id_, institution_doc)
 
 
 @celery_app.task(bind=True, max_retries=5, default_retry_delay=60)
@@ -1541,10 +1659,10 @@ def update_cgm_async(self, cgm_id, collection_id=None, op='update', index=None):
 def update_cgm(cgm, op='update', index=None):
     index = es_index(index)
     if op == 'delete':
-        client().delete(index=index, doc_type='collectionSubmission', id=cgm._id, refresh=True, ignore=[404])
+        delete_document(index, 'collectionSubmission', cgm._id)
         return
     collection_submission_doc = serialize_cgm(cgm)
-    client().index(index=index, doc_type='collectionSubmission', body=collection_submission_doc, id=cgm._id, refresh=True)
+    index_document(index, 'collectionSubmission', cgm._id, collection_submission_doc)
 
 @requires_search
 def delete_all():
@@ -1786,27 +1904,27 @@ def delete_doc(elastic_document_id, node, index=None, category=None):
             category = 'registration'
         else:
             category = node.project_or_component
-    client().delete(index=index, doc_type=category, id=elastic_document_id, refresh=True, ignore=[404])
+    delete_document(index, category, elastic_document_id)
 
 @requires_search
 def delete_group_doc(deleted_id, index=None):
     index = es_index(index)
-    client().delete(index=index, doc_type='group', id=deleted_id, refresh=True, ignore=[404])
+    delete_document(index, 'group', deleted_id)
 
 @requires_search
 def delete_wiki_doc(deleted_id, index=None):
     index = es_index(index)
-    client().delete(index=index, doc_type='wiki', id=deleted_id, refresh=True, ignore=[404])
+    delete_document(index, 'wiki', deleted_id)
 
 @requires_search
 def delete_comment_doc(deleted_id, index=None):
     index = es_index(index)
-    client().delete(index=index, doc_type='comment', id=deleted_id, refresh=True, ignore=[404])
+    delete_document(index, 'comment', deleted_id)
 
 @requires_search
 def delete_file_metadata_doc(deleted_id, index=None):
     index = es_index(index)
-    client().delete(index=index, doc_type='metadata', id=deleted_id, refresh=True, ignore=[404])
+    delete_document(index, 'metadata', deleted_id)
 
 @requires_search
 def search_contributor(query, page=0, size=10, exclude=None, current_user=None):
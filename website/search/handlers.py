@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from website.search import search
+
+logger = logging.getLogger(__name__)
+
+
+def search_before_request():
+    """Buffer the search documents written synchronously while handling the request"""
+    if search.search_engine is not None:
+        search.search_engine.start_index_buffer()
+
+
+def search_after_request(response, base_status_code_error=500):
+    if response.status_code >= base_status_code_error and search.search_engine is not None:
+        search.search_engine.stop_index_buffer(discard=True)
+    return response
+
+
+def search_teardown_request(error=None):
+    """Send the buffered documents in bulk once the transaction of the request is committed
+
+    The documents are discarded if the request failed, as its changes are rolled back.
+    """
+    if search.search_engine is None:
+        return
+    try:
+        search.search_engine.stop_index_buffer(discard=error is not None)
+    except Exception:
+        logger.exception('Failed to update the search documents of the request')
+
+
+handlers = {
+    'before_request': search_before_request,
+    'after_request': search_after_request,
+    'teardown_request': search_teardown_request,
+}
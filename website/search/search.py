@@ -33,6 +33,8 @@ def update_node(node, index=None, bulk=False, async_update=True, saved_fields=No
     if async_update:
         node_id = node._id
         kwargs['wiki_page_id'] = wiki_page._id if wiki_page else None
+        # Celery serializes the arguments as JSON
+        kwargs['saved_fields'] = list(saved_fields) if saved_fields is not None else None
         # We need the transaction to be committed before trying to run celery tasks.
         # For example, when updating a Node's privacy, is_public must be True in the
         # database in order for method that updates the Node's elastic search document
@@ -43,6 +45,7 @@ def update_node(node, index=None, bulk=False, async_update=True, saved_fields=No
             search_engine.update_node_async(node_id=node_id, **kwargs)
     else:
         kwargs['wiki_page'] = wiki_page
+        kwargs['saved_fields'] = saved_fields
         return search_engine.update_node(node, **kwargs)
 
 @requires_search
@@ -1,6 +1,5 @@
 JSON_UPDATE_NODES_SQL = """
-SELECT json_agg(
-    json_build_object(
+SELECT json_build_object(
         '_type', CASE
                  WHEN N.type = 'osf.registration'
                    THEN 'registration'
@@ -135,7 +134,6 @@ SELECT json_agg(
                        END
         )
     )
-)
 FROM osf_abstractnode AS N
   LEFT JOIN LATERAL (
             SELECT _id
@@ -360,12 +358,10 @@ WHERE (TYPE = 'osf.node' OR TYPE = 'osf.registration')
                    AND AJ.dst_node_id IS NOT NULL)))
   AND id > {page_start}
   AND id <= {page_end}
-LIMIT 1;
 """
 
 JSON_UPDATE_FILES_SQL = """
-SELECT json_agg(
-    json_build_object(
+SELECT json_build_object(
         '_type', 'file'
         , '_index', '{index}'
         , 'doc_as_upsert', TRUE
@@ -415,7 +411,6 @@ SELECT json_agg(
             , 'node_public', NODE.DATA ->> 'public'
         )
     )
-)
 FROM osf_basefilenode AS F
   LEFT JOIN LATERAL (
             SELECT _id
@@ -578,12 +573,10 @@ WHERE name IS NOT NULL
       AND target_content_type_id = (SELECT id FROM "django_content_type" WHERE ("django_content_type"."model" = 'abstractnode' AND "django_content_type"."app_label" = 'osf'))
       AND id > {page_start}
       AND id <= {page_end}
-LIMIT 1;
 """
 
 JSON_UPDATE_USERS_SQL = """
-SELECT json_agg(
-    json_build_object(
+SELECT json_build_object(
         '_type', 'user'
         , '_index', '{index}'
         , 'doc_as_upsert', TRUE
@@ -706,7 +699,6 @@ SELECT json_agg(
             , 'emails', (SELECT array_agg(address) from osf_email WHERE osf_email.user_id = U.id)
         )
     )
-)
 FROM osf_osfuser AS U
   LEFT JOIN LATERAL (
             SELECT _id
@@ -738,12 +730,10 @@ FROM osf_osfuser AS U
 WHERE is_active = TRUE
       AND id > {page_start}
       AND id <= {page_end}
-LIMIT 1;
 """
 
 JSON_DELETE_NODES_SQL = """
-SELECT json_agg(
-    json_build_object(
+SELECT json_build_object(
         '_type', CASE
                  WHEN N.type = 'osf.registration'
                    THEN 'registration'
@@ -755,7 +745,6 @@ SELECT json_agg(
         , '_id', NODE_GUID._id
         , '_op_type', 'delete'
     )
-)
 FROM osf_abstractnode AS N
   LEFT JOIN LATERAL (
             SELECT _id
@@ -795,16 +784,15 @@ WHERE NOT ((TYPE = 'osf.node' OR TYPE = 'osf.registration' OR TYPE = 'osf.quickf
   )
   AND id > {page_start}
   AND id <= {page_end}
-LIMIT 1;
 """
 
 JSON_DELETE_FILES_SQL = """
-SELECT json_agg(json_build_object(
+SELECT json_build_object(
     '_type', 'file'
     , '_index', '{index}'
     , '_id', F._id
     , '_op_type', 'delete'
-))
+)
 FROM osf_basefilenode AS F
 WHERE NOT (name IS NOT NULL
       AND name != ''
@@ -833,18 +821,15 @@ WHERE NOT (name IS NOT NULL
       AND target_content_type_id = (SELECT id FROM "django_content_type" WHERE ("django_content_type"."model" = 'abstractnode' AND "django_content_type"."app_label" = 'osf'))
       AND id > {page_start}
       AND id <= {page_end}
-LIMIT 1;
 """
 
 JSON_DELETE_USERS_SQL = """
-SELECT json_agg(
-    json_build_object(
+SELECT json_build_object(
         '_type', 'user'
         , '_index', '{index}'
         , '_id', USER_GUID._id
         , '_op_type', 'delete'
     )
-)
 FROM osf_osfuser AS U
   LEFT JOIN LATERAL (
             SELECT _id
@@ -858,7 +843,6 @@ FROM osf_osfuser AS U
 WHERE is_active != TRUE
   AND id > {page_start}
   AND id <= {page_end}
-LIMIT 1;
 """
 
 def enable_private_search(enable):
@@ -4,13 +4,18 @@
 from __future__ import absolute_import
 from math import ceil
 import functools
+import json
 import logging
+import multiprocessing
+import os
 
-from django.db import connection
+from django import db
+from django.db import connection, transaction
 from django.core.paginator import Paginator
 from elasticsearch2 import helpers
 
 import website.search.search as search
+from website.search import elastic_search
 from website.search.elastic_search import client
 from website.search_migration import (
     enable_private_search,
@@ -35,6 +40,61 @@ from addons.metadata.search import migrate_file_metadata
 
 logger = logging.getLogger(__name__)
 
+# Number of documents in a bulk request
+BULK_CHUNK_SIZE = 500
+# Number of concurrent bulk requests of a worker process
+BULK_THREAD_COUNT = 2
+
+
+class MigrationCheckpoint(object):
+    """Progress of a migration, saved to a JSON file after every completed step
+
+    The file records the new index and the completed id ranges of each stage,
+    so that a failed migration can be restarted where it stopped.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.data = {'index': None, 'stages': {}}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    @property
+    def index(self):
+        return self.data['index']
+
+    @index.setter
+    def index(self, index):
+        self.data['index'] = index
+        self.save()
+
+    def is_done(self, stage, page_start=None):
+        completed = self.data['stages'].get(stage)
+        if page_start is None:
+            return completed is True
+        return isinstance(completed, list) and page_start in completed
+
+    def done(self, stage, page_start=None):
+        if page_start is None:
+            self.data['stages'][stage] = True
+        else:
+            self.data['stages'].setdefault(stage, []).append(page_start)
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.rename(tmp_path, self.path)
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
 # see:
 # - website.search.elastic_search.update_user
 # - website.search.elastic_search.update_file
@@ -130,51 +190,103 @@ def fill_and_normalize(docs):
             node = AbstractNode.load(doc['_id'])
             d['comments'] = comments_to_doc(node._id)
 
-def sql_migrate(index, sql, max_id, increment, es_args=None, **kwargs):
+def init_worker():
+    # Do not share the elasticsearch connections of the parent process
+    elastic_search.CLIENT = None
+
+def migrate_range(args):
+    """Stream the rows of an id range from a server-side cursor to elastic
+
+    The rows are normalized in this thread, BULK_CHUNK_SIZE * BULK_THREAD_COUNT
+    rows at a time, and sent with helpers.parallel_bulk.
+
+    :param tuple args: (page_start, sql, es_args)
+    :return tuple: (page_start, number of migrated objects)
+    """
+    page_start, sql, es_args = args
+    total_objs = 0
+    with transaction.atomic():
+        # named cursors are server-side cursors and must be used in a transaction
+        connection.ensure_connection()
+        with connection.connection.cursor(name='search_migration_{}'.format(page_start)) as cursor:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(BULK_CHUNK_SIZE * BULK_THREAD_COUNT)
+                if not rows:
+                    break
+                docs = [row[0] for row in rows]
+                fill_and_normalize(docs)
+                for _ in helpers.parallel_bulk(client(), docs, thread_count=BULK_THREAD_COUNT,
+                                               chunk_size=BULK_CHUNK_SIZE, **es_args):
+                    pass
+                total_objs += len(docs)
+    return page_start, total_objs
+
+def sql_migrate(index, sql, max_id, increment, es_args=None, processes=1, checkpoint=None, stage=None, **kwargs):
     """ Run provided SQL and send output to elastic.
 
+    The id space is split into ranges of `increment` ids which are migrated
+    by a pool of `processes` processes. The completed ranges are recorded in
+    `checkpoint` so that a failed migration restarts from them.
+
     :param str index: Elastic index to update (formatted into `sql`)
     :param str sql: SQL to format and run. See __init__.py in this module
     :param int max_id: Last known object id. Indicates when to stop paging
     :param int increment: Page size
-    :param  dict es_args:  Dict or None, to pass to `helpers.bulk`
+    :param  dict es_args:  Dict or None, to pass to `helpers.parallel_bulk`
+    :param int processes: Number of worker processes, 1 to migrate in this process
+    :param MigrationCheckpoint checkpoint: Checkpoint of the migration or None
+    :param str stage: Name of the migration in the checkpoint
     :kwargs: Additional format arguments for `sql` arg
 
     :return int: Number of migrated objects
     """
     if es_args is None:
         es_args = {}
-    total_pages = int(ceil(max_id / float(increment)))
+    # An extra page is included to cover the edge case where:
+    #       max_id == (total_pages * increment) - 1
+    # and two additional objects are created during runtime.
+    total_pages = int(ceil(max_id / float(increment))) + 1
+    ranges = [
+        (page_start, sql.format(
+            index=index,
+            page_start=page_start,
+            page_end=page_start + increment,
+            enable_private_search=enable_private_search(settings.ENABLE_PRIVATE_SEARCH),
+            **kwargs), es_args)
+        for page_start in range(0, total_pages * increment, increment)
+        if checkpoint is None or not checkpoint.is_done(stage, page_start)
+    ]
+    if len(ranges) < total_pages:
+        logger.info('Skipping {} pages completed before'.format(total_pages - len(ranges)))
+
     total_objs = 0
-    page_start = 0
-    page_end = 0
-    page = 0
-    while page_end <= (max_id + increment):
-        page += 1
-        page_end += increment
-        if page <= total_pages:
-            logger.info('Updating page {} / {}'.format(page_end / increment, total_pages))
-        else:
-            # An extra page is included to cover the edge case where:
-            #       max_id == (total_pages * increment) - 1
-            # and two additional objects are created during runtime.
-            logger.info('Cleaning up...')
-        with connection.cursor() as cursor:
-            cursor.execute(sql.format(
-                index=index,
-                page_start=page_start,
-                page_end=page_end,
-                enable_private_search=enable_private_search(settings.ENABLE_PRIVATE_SEARCH),
-                **kwargs))
-            ser_objs = cursor.fetchone()[0]
-            if ser_objs:
-                total_objs += len(ser_objs)
-                fill_and_normalize(ser_objs)
-                helpers.bulk(client(), ser_objs, **es_args)
-        page_start = page_end
+    if processes > 1 and len(ranges) > 1:
+        # the worker processes must not share the connections of this process
+        db.connections.close_all()
+        pool = multiprocessing.Pool(processes, initializer=init_worker)
+        results = pool.imap_unordered(migrate_range, ranges)
+    else:
+        pool = None
+        results = (migrate_range(args) for args in ranges)
+    try:
+        for completed, (page_start, count) in enumerate(results, 1):
+            total_objs += count
+            if checkpoint is not None:
+                checkpoint.done(stage, page_start)
+            logger.info('Updated page {} ({} / {})'.format(page_start // increment + 1, completed, len(ranges)))
+        if pool is not None:
+            pool.close()
+    except Exception:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
     return total_objs
 
-def migrate_nodes(index, delete, increment=10000):
+def migrate_nodes(index, delete, increment=10000, processes=1, checkpoint=None):
     logger.info('Migrating nodes to index: {}'.format(index))
     last = AbstractNode.objects.last()
     if last is None:
@@ -186,6 +298,9 @@ def migrate_nodes(index, delete, increment=10000):
         JSON_UPDATE_NODES_SQL,
         max_nid,
         increment,
+        processes=processes,
+        checkpoint=checkpoint,
+        stage='nodes',
         spam_flagged_removed_from_search=settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH)
     logger.info('{} nodes migrated'.format(total_nodes))
     if delete:
@@ -196,6 +311,9 @@ def migrate_nodes(index, delete, increment=10000):
             JSON_DELETE_NODES_SQL,
             max_nid,
             increment,
+            processes=processes,
+            checkpoint=checkpoint,
+            stage='nodes_delete',
             es_args={'raise_on_error': False},  # ignore 404s
             spam_flagged_removed_from_search=settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH)
         logger.info('{} nodes marked deleted'.format(total_nodes))
@@ -248,7 +366,7 @@ def migrate_comments(index, delete):
         search.bulk_update_comments(paginator.page(page_number).object_list, index=index)
     logger.info('{} comments migrated'.format(comments.count()))
 
-def migrate_files(index, delete, increment=10000):
+def migrate_files(index, delete, increment=10000, processes=1, checkpoint=None):
     logger.info('Migrating files to index: {}'.format(index))
     last = BaseFileNode.objects.last()
     if last is None:
@@ -260,6 +378,9 @@ def migrate_files(index, delete, increment=10000):
         JSON_UPDATE_FILES_SQL,
         max_fid,
         increment,
+        processes=processes,
+        checkpoint=checkpoint,
+        stage='files',
         spam_flagged_removed_from_search=settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH)
     logger.info('{} files migrated'.format(total_files))
     if delete:
@@ -270,11 +391,14 @@ def migrate_files(index, delete, increment=10000):
             JSON_DELETE_FILES_SQL,
             max_fid,
             increment,
+            processes=processes,
+            checkpoint=checkpoint,
+            stage='files_delete',
             es_args={'raise_on_error': False},  # ignore 404s
             spam_flagged_removed_from_search=settings.SPAM_FLAGGED_REMOVE_FROM_SEARCH)
         logger.info('{} files marked deleted'.format(total_files))
 
-def migrate_users(index, delete, increment=10000):
+def migrate_users(index, delete, increment=10000, processes=1, checkpoint=None):
     logger.info('Migrating users to index: {}'.format(index))
     last = OSFUser.objects.last()
     if last is None:
@@ -285,7 +409,10 @@ def migrate_users(index, delete, increment=10000):
         index,
         JSON_UPDATE_USERS_SQL,
         max_uid,
-        increment)
+        increment,
+        processes=processes,
+        checkpoint=checkpoint,
+        stage='users')
     logger.info('{} users migrated'.format(total_users))
     if delete:
         logger.info('Preparing to delete old user documents')
@@ -295,6 +422,9 @@ def migrate_users(index, delete, increment=10000):
             JSON_DELETE_USERS_SQL,
             max_uid,
             increment,
+            processes=processes,
+            checkpoint=checkpoint,
+            stage='users_delete',
             es_args={'raise_on_error': False})  # ignore 404s
         logger.info('{} users marked deleted'.format(total_users))
 
@@ -327,13 +457,16 @@ def migrate_institutions(index):
     for inst in Institution.objects.filter(is_deleted=False):
         update_institution(inst, index)
 
-def migrate(delete, remove=False, remove_all=False, index=None, app=None):
+def migrate(delete, remove=False, remove_all=False, index=None, app=None, processes=1, checkpoint_file=None):
     """Reindexes relevant documents in ES
 
     :param bool delete: Delete documents that should not be indexed
     :param bool remove: Removes old index after migrating
     :param str index: index alias to version and migrate
     :param App app: Flask app for context
+    :param int processes: Number of processes migrating nodes, files and users
+    :param str checkpoint_file: Path of the checkpoint file. If the file exists,
+        the migration restarts from it. The file is removed when the migration completes.
     """
     index = es_index(index)
     app = app or init_app('website.settings', set_backends=True, routes=True)
@@ -345,22 +478,36 @@ def migrate(delete, remove=False, remove_all=False, index=None, app=None):
     ctx = app.test_request_context()
     ctx.push()
 
-    new_index = set_up_index(index)
+    checkpoint = MigrationCheckpoint(checkpoint_file)
+    if checkpoint.index:
+        new_index = checkpoint.index
+        logger.info('Restarting the migration to {} from {}'.format(new_index, checkpoint_file))
+    else:
+        new_index = set_up_index(index)
+        checkpoint.index = new_index
+
+    def run_stage(stage, func, *args, **kwargs):
+        if checkpoint.is_done(stage):
+            logger.info('Skipping {}, completed before'.format(stage))
+            return
+        func(*args, **kwargs)
+        checkpoint.done(stage)
 
     if settings.ENABLE_INSTITUTIONS:
-        migrate_institutions(new_index)
-    migrate_nodes(new_index, delete=delete)
-    migrate_files(new_index, delete=delete)
-    migrate_wikis(new_index, delete=delete)
-    migrate_comments(new_index, delete=delete)
-    migrate_users(new_index, delete=delete)
-    migrate_preprints(new_index, delete=delete)
-    migrate_preprint_files(new_index, delete=delete)
-    migrate_collected_metadata(new_index, delete=delete)
-    migrate_groups(new_index, delete=delete)
-    migrate_file_metadata(search, new_index, delete=delete)
+        run_stage('institutions', migrate_institutions, new_index)
+    run_stage('nodes', migrate_nodes, new_index, delete=delete, processes=processes, checkpoint=checkpoint)
+    run_stage('files', migrate_files, new_index, delete=delete, processes=processes, checkpoint=checkpoint)
+    run_stage('wikis', migrate_wikis, new_index, delete=delete)
+    run_stage('comments', migrate_comments, new_index, delete=delete)
+    run_stage('users', migrate_users, new_index, delete=delete, processes=processes, checkpoint=checkpoint)
+    run_stage('preprints', migrate_preprints, new_index, delete=delete)
+    run_stage('preprint_files', migrate_preprint_files, new_index, delete=delete)
+    run_stage('collected_metadata', migrate_collected_metadata, new_index, delete=delete)
+    run_stage('groups', migrate_groups, new_index, delete=delete)
+    run_stage('file_metadata', migrate_file_metadata, search, new_index, delete=delete)
 
     set_up_alias(index, new_index)
+    checkpoint.remove()
 
     if remove:
         remove_old_index(new_index)
@@ -429,7 +429,8 @@ class CeleryConfig:
         'osf.management.commands.migrate_deleted_date',
         'osf.management.commands.addon_deleted_date',
         'osf.management.commands.migrate_registration_responses',
-        'osf.management.commands.update_institution_project_counts'
+        'osf.management.commands.update_institution_project_counts',
+        'osf.management.commands.reconcile_storage_usage',
     }
 
     med_pri_modules = {
@@ -443,6 +444,7 @@ class CeleryConfig:
         'website.preprints.tasks',
         'website.project.tasks',
         'admin.rdm_custom_storage_location.tasks',
+        'nii.mapcore_sync_groups',
     }
 
     high_pri_modules = {
@@ -517,7 +519,9 @@ class CeleryConfig:
         'osf.management.commands.deactivate_requested_accounts',
         'osf.management.commands.check_crossref_dois',
         'osf.management.commands.update_institution_project_counts',
+        'osf.management.commands.reconcile_storage_usage',
         'nii.mapcore_refresh_tokens',
+        'nii.mapcore_sync_groups',
         'admin.rdm_custom_storage_location.tasks',
     )
 
@@ -661,12 +665,20 @@ class CeleryConfig:
                 'task': 'management.commands.update_institution_project_counts',
                 'schedule': crontab(minute=0, hour=9), # Daily 05:00 a.m. EDT
             },
+            'reconcile_storage_usage': {
+                'task': 'management.commands.reconcile_storage_usage',
+                'schedule': crontab(minute=30, hour=8),  # Daily 3:30 a.m. EST
+            },
             'mapcore_refresh_token': {
                 'task': 'nii.mapcore_refresh_tokens',
                 'schedule': crontab(minute=0, hour=10),  # Daily 5:00 a.m. EST (-5h)
                 #'schedule': crontab(minute='*/1'), # for DEBUG
                 'kwargs': {'dry_run': False},
             },
+            'mapcore_sync_groups': {
+                'task': 'nii.mapcore_sync_groups',
+                'schedule': crontab(minute='*/15'),
+            },
         }
 
         # Tasks that need metrics and release requirements
@@ -700,8 +712,6 @@ assert (DRAFT_REGISTRATION_APPROVAL_PERIOD > EMBARGO_END_DATE_MIN), 'The draft r
 # TODO: Remove references to this flag
 ENABLE_INSTITUTIONS = True
 
-ENABLE_STORAGE_USAGE_CACHE = True
-
 ENABLE_VARNISH = False
 ENABLE_ESI = False
 VARNISH_SERVERS = []  # This should be set in local.py or cache invalidation won't work
@@ -2036,6 +2046,12 @@ MAPCORE_REFRESH_PATH = '/oauth/token.php'
 MAPCORE_AUTHCODE_MAGIC = 'GRDM_mAP_AuthCode'
 MAPCORE_CLIENTID = None
 MAPCORE_SECRET = None
+# number of threads calling the mAP core API in a group synchronization
+MAPCORE_SYNC_CONCURRENCY = 8
+# seconds to wait for the lock of a user, a node or a token refresh before giving up
+MAPCORE_LOCK_TIMEOUT = 60
+# seconds after which the lock of a process which does not use its database connection expires
+MAPCORE_LOCK_LEASE = 600
 
 # allow logged-in-user to search private projects
 ENABLE_PRIVATE_SEARCH = False
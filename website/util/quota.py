@@ -4,11 +4,16 @@ import logging
 from addons.base import signals as file_signals
 from addons.osfstorage.models import OsfStorageFileNode, Region
 from api.base import settings as api_settings
+from bulk_update.helper import bulk_update
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Sum
-from django.db.models.functions import Coalesce
+from django.db import connection, transaction
+from django.db.models import (
+    BigIntegerField, Case, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Subquery, Value, When
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce
 from osf.models import (
-    AbstractNode, BaseFileNode, FileLog, FileInfo, Guid, OSFUser, UserQuota,
+    AbstractNode, BaseFileNode, FileLog, FileInfo, Guid, Institution, OSFUser, UserQuota,
     ProjectStorageType
 )
 from django.utils import timezone
@@ -21,33 +26,155 @@ PROVIDERS = ['s3compatinstitutions']
 logger = logging.getLogger(__name__)
 
 
+CREATE_USER_QUOTAS_SQL = """
+    INSERT INTO osf_userquota (created, modified, user_id, storage_type, max_quota, used)
+    SELECT now(), now(), unnest(%(user_ids)s), unnest(%(storage_types)s), %(max_quota)s, unnest(%(used)s)
+    ON CONFLICT (user_id, storage_type) DO NOTHING
+"""
+
+
+# Files counted in the used quota of the creators of their projects.
+# Files of NII storage projects are only counted when they live in osfstorage.
+USED_QUOTA_FILES_SQL = """
+    FROM osf_fileinfo AS info
+    INNER JOIN osf_basefilenode AS file ON file.id = info.file_id
+    INNER JOIN osf_abstractnode AS node ON node.id = file.target_object_id
+    INNER JOIN osf_projectstoragetype AS storage ON storage.node_id = node.id
+    WHERE file.target_content_type_id = %s
+        AND file.deleted_on IS NULL
+        AND file.deleted_by_id IS NULL
+        AND node.is_deleted = FALSE
+        AND storage.storage_type = %s
+        {conditions}
+"""
+
+# Bytes used by the projects of each creator, in one grouped aggregate
+USED_QUOTA_SQL = """
+    SELECT node.creator_id, COALESCE(SUM(info.file_size), 0)
+""" + USED_QUOTA_FILES_SQL + """
+    GROUP BY node.creator_id
+"""
+
+# Bytes used by the projects of the user of the outer query
+USER_USED_QUOTA_SQL = """
+    SELECT COALESCE(SUM(info.file_size), 0)
+""" + USED_QUOTA_FILES_SQL
+
+RECALCULATE_CHUNK_SIZE = 1000
+
+
+def _used_quota_query(sql, storage_type, condition, params):
+    conditions = ['AND ' + condition]
+    sql_params = [ContentType.objects.get_for_model(AbstractNode).id, storage_type]
+    if storage_type == UserQuota.NII_STORAGE:
+        conditions.append('AND file.type IN %s')
+        sql_params.append(tuple(OsfStorageFileNode._typedmodels_subtypes))
+    sql_params.extend(params)
+    return sql.format(conditions=' '.join(conditions)), sql_params
+
+
+def _used_quota_rows(storage_type, condition, params):
+    sql, sql_params = _used_quota_query(USED_QUOTA_SQL, storage_type, condition, params)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, sql_params)
+        return cursor.fetchall()
+
+
 def used_quota(user_id, storage_type=UserQuota.NII_STORAGE):
-    guid = Guid.objects.get(
-        _id=user_id,
-        content_type_id=ContentType.objects.get_for_model(OSFUser).id
+    rows = _used_quota_rows(
+        storage_type,
+        'node.creator_id = (SELECT guid.object_id FROM osf_guid AS guid'
+        ' WHERE guid._id = %s AND guid.content_type_id = %s)',
+        [user_id, ContentType.objects.get_for_model(OSFUser).id]
     )
-    projects_ids = AbstractNode.objects.filter(
-        projectstoragetype__storage_type=storage_type,
-        is_deleted=False,
-        creator_id=guid.object_id
-    ).values_list('id', flat=True)
-    if storage_type != UserQuota.NII_STORAGE:
-        files_ids = BaseFileNode.objects.filter(
-            target_object_id__in=projects_ids,
-            target_content_type_id=ContentType.objects.get_for_model(AbstractNode),
-            deleted_on=None,
-            deleted_by_id=None,
-        ).values_list('id', flat=True)
-    else:
-        files_ids = OsfStorageFileNode.objects.filter(
-            target_object_id__in=projects_ids,
-            target_content_type_id=ContentType.objects.get_for_model(AbstractNode),
-            deleted_on=None,
-            deleted_by_id=None,
-        ).values_list('id', flat=True)
-    db_sum = FileInfo.objects.filter(file_id__in=files_ids).aggregate(
-        filesize_sum=Coalesce(Sum('file_size'), 0))
-    return db_sum['filesize_sum'] if db_sum['filesize_sum'] is not None else 0
+    return rows[0][1] if rows else 0
+
+
+def used_quota_by_user(user_ids, storage_type=UserQuota.NII_STORAGE):
+    """Return the used quota of many users at once
+
+    :param user_ids: primary keys of the users
+    :param storage_type: storage type
+    :return: dict of user primary key to used bytes, users without files are omitted
+    """
+    if not user_ids:
+        return {}
+    rows = _used_quota_rows(storage_type, 'node.creator_id = ANY(%s)', [list(user_ids)])
+    return {creator_id: used for creator_id, used in rows}
+
+
+def get_custom_storage_user_ids(user_ids):
+    """Return the users whose first affiliated institution has its own storage region,
+    i.e. the users who have a quota for UserQuota.CUSTOM_STORAGE as well.
+    """
+    first_institutions = {}
+    affiliations = OSFUser.affiliated_institutions.through.objects.filter(
+        osfuser_id__in=user_ids
+    ).order_by('institution_id').values_list('osfuser_id', 'institution_id')
+    for osfuser_id, institution_id in affiliations:
+        first_institutions.setdefault(osfuser_id, institution_id)
+    institution_guids = dict(Institution.objects.filter(
+        id__in=set(first_institutions.values())
+    ).values_list('id', '_id'))
+    region_guids = set(Region.objects.filter(
+        _id__in=institution_guids.values()
+    ).values_list('_id', flat=True))
+    return {
+        osfuser_id for osfuser_id, institution_id in first_institutions.items()
+        if institution_guids.get(institution_id) in region_guids
+    }
+
+
+def recalculate_used_quota(users=None, chunk_size=RECALCULATE_CHUNK_SIZE, progress_callback=None):
+    """Recalculate the used quota of many users with one aggregate per storage type and chunk
+
+    Every user gets a UserQuota for UserQuota.NII_STORAGE, and users whose institution has
+    its own storage region also get one for UserQuota.CUSTOM_STORAGE.
+
+    :param users: OSFUser queryset, defaults to all users who are not deleted
+    :param chunk_size: number of users recalculated in a transaction
+    :param progress_callback: called with (done, total) after every chunk
+    :return: number of recalculated users
+    """
+    if users is None:
+        users = OSFUser.objects.exclude(deleted__isnull=False)
+    user_ids = list(users.order_by('id').values_list('id', flat=True))
+    total = len(user_ids)
+    for start in range(0, total, chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        custom_user_ids = get_custom_storage_user_ids(chunk)
+        used = {
+            UserQuota.NII_STORAGE: used_quota_by_user(chunk, UserQuota.NII_STORAGE),
+            UserQuota.CUSTOM_STORAGE: used_quota_by_user(custom_user_ids, UserQuota.CUSTOM_STORAGE),
+        }
+        targets = {(user_id, UserQuota.NII_STORAGE) for user_id in chunk}
+        targets.update((user_id, UserQuota.CUSTOM_STORAGE) for user_id in custom_user_ids)
+
+        with transaction.atomic():
+            user_quotas = UserQuota.objects.filter(user_id__in=chunk)
+            if check_select_for_update():
+                user_quotas = user_quotas.select_for_update()
+            changed = []
+            existing = set()
+            for user_quota in user_quotas:
+                key = (user_quota.user_id, user_quota.storage_type)
+                if key not in targets:
+                    continue
+                existing.add(key)
+                user_used = used[user_quota.storage_type].get(user_quota.user_id, 0)
+                if user_quota.used != user_used:
+                    user_quota.used = user_used
+                    changed.append(user_quota)
+            if changed:
+                bulk_update(changed, update_fields=['used'])
+            create_user_quotas([
+                (user_id, storage_type, used[storage_type].get(user_id, 0))
+                for user_id, storage_type in sorted(targets - existing)
+            ])
+
+        if progress_callback is not None:
+            progress_callback(start + len(chunk), total)
+    return total
 
 
 def update_user_used_quota(user, storage_type=UserQuota.NII_STORAGE, is_recalculating_quota=False):
@@ -111,6 +238,69 @@ def get_quota_info(user, storage_type=UserQuota.NII_STORAGE):
     except UserQuota.DoesNotExist:
         return (api_settings.DEFAULT_MAX_QUOTA, used_quota(user._id, storage_type))
 
+def create_user_quotas(rows):
+    """Create UserQuota rows with the default max quota
+
+    The rows of users who already have a UserQuota for the storage type, e.g. created
+    by a concurrent request, are skipped.
+
+    :param rows: list of (user primary key, storage type, used bytes)
+    :return: number of created rows
+    """
+    if not rows:
+        return 0
+    user_ids, storage_types, used = zip(*rows)
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_USER_QUOTAS_SQL, {
+            'user_ids': list(user_ids),
+            'storage_types': list(storage_types),
+            'max_quota': api_settings.DEFAULT_MAX_QUOTA,
+            'used': list(used),
+        })
+        return cursor.rowcount
+
+def get_quota_summary(users, storage_type=UserQuota.NII_STORAGE):
+    """Return the quota of users as rows which can be ordered and paginated by the database
+
+    Each row is a dict with the keys id (primary key of the user), guid, fullname, eppn
+    (None if unset), username, quota (max quota in GB), usage, remaining (both in bytes) and
+    ratio (usage in percent of the max quota). Like get_quota_info, the users without a
+    UserQuota get the default max quota and the usage of their files. Nothing is written,
+    the missing rows are created by the recalculate_quota command.
+
+    :param users: OSFUser queryset
+    :param storage_type: storage type
+    """
+    user_quotas = UserQuota.objects.filter(user_id=OuterRef('id'), storage_type=storage_type)
+    guids = Guid.objects.filter(
+        content_type=ContentType.objects.get_for_model(OSFUser),
+        object_id=OuterRef('id'),
+    ).order_by('id').values('_id')[:1]
+    used_sql, used_params = _used_quota_query(
+        USER_USED_QUOTA_SQL, storage_type, 'node.creator_id = osf_osfuser.id', [])
+    max_quota_bytes = ExpressionWrapper(
+        Cast('quota', BigIntegerField()) * Value(api_settings.SIZE_UNIT_GB, output_field=BigIntegerField()),
+        output_field=BigIntegerField()
+    )
+    return users.annotate(
+        guid=Subquery(guids),
+        quota=Coalesce(
+            Subquery(user_quotas.values('max_quota')[:1], output_field=IntegerField()),
+            Value(api_settings.DEFAULT_MAX_QUOTA, output_field=IntegerField()),
+        ),
+        usage=Coalesce(
+            Subquery(user_quotas.values('used')[:1], output_field=BigIntegerField()),
+            RawSQL(used_sql, used_params, output_field=BigIntegerField()),
+        ),
+    ).annotate(
+        remaining=ExpressionWrapper(max_quota_bytes - F('usage'), output_field=BigIntegerField()),
+        ratio=Case(
+            When(quota=0, then=Value(100.0)),
+            default=ExpressionWrapper(Cast('usage', FloatField()) * Value(100) / max_quota_bytes, output_field=FloatField()),
+            output_field=FloatField(),
+        ),
+    ).values('id', 'guid', 'fullname', 'eppn', 'username', 'quota', 'usage', 'remaining', 'ratio')
+
 def get_project_storage_type(node):
     try:
         return ProjectStorageType.objects.get(node=node).storage_type
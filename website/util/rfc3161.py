@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+'''In-process RFC 3161 time-stamp requests and responses.
+
+This module builds time-stamp requests (TSQ) like ``openssl ts -query`` and
+verifies time-stamp responses (TSR) on in-memory buffers like
+``openssl ts -verify -CAfile``: the message imprint, the signed attributes,
+the signature and the time-stamping usage of the TSA certificate, and the chain
+of the TSA certificate up to a trusted certificate, whose issuers must be CA
+certificates allowed to sign certificates. RSASSA-PSS signatures are rejected.
+'''
+from __future__ import absolute_import
+import datetime
+import hashlib
+import os
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.serialization import Encoding
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+TAG_BOOLEAN = 0x01
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_NULL = 0x05
+TAG_OID = 0x06
+TAG_SEQUENCE = 0x30
+TAG_SET = 0x31
+TAG_CONTEXT_0 = 0xa0
+
+OID_SIGNED_DATA = '1.2.840.113549.1.7.2'
+OID_TST_INFO = '1.2.840.113549.1.9.16.1.4'
+OID_CONTENT_TYPE = '1.2.840.113549.1.9.3'
+OID_MESSAGE_DIGEST = '1.2.840.113549.1.9.4'
+OID_SIGNING_CERTIFICATE = '1.2.840.113549.1.9.16.2.12'
+OID_SIGNING_CERTIFICATE_V2 = '1.2.840.113549.1.9.16.2.47'
+OID_TIME_STAMPING = '1.3.6.1.5.5.7.3.8'
+OID_RSA_ENCRYPTION = '1.2.840.113549.1.1.1'
+OID_RSASSA_PSS = '1.2.840.113549.1.1.10'
+OID_EC_PUBLIC_KEY = '1.2.840.10045.2.1'
+
+HASH_OIDS = {
+    'sha1': '1.3.14.3.2.26',
+    'sha224': '2.16.840.1.101.3.4.2.4',
+    'sha256': '2.16.840.1.101.3.4.2.1',
+    'sha384': '2.16.840.1.101.3.4.2.2',
+    'sha512': '2.16.840.1.101.3.4.2.3',
+}
+HASH_NAMES = {oid: name for name, oid in HASH_OIDS.items()}
+
+# Signature algorithms of SignerInfo: (key type, hash algorithm or None for the digest algorithm)
+SIGNATURE_ALGORITHMS = {
+    OID_RSA_ENCRYPTION: ('rsa', None),
+    '1.2.840.113549.1.1.5': ('rsa', 'sha1'),
+    '1.2.840.113549.1.1.14': ('rsa', 'sha224'),
+    '1.2.840.113549.1.1.11': ('rsa', 'sha256'),
+    '1.2.840.113549.1.1.12': ('rsa', 'sha384'),
+    '1.2.840.113549.1.1.13': ('rsa', 'sha512'),
+    OID_EC_PUBLIC_KEY: ('ec', None),
+    '1.2.840.10045.4.1': ('ec', 'sha1'),
+    '1.2.840.10045.4.3.1': ('ec', 'sha224'),
+    '1.2.840.10045.4.3.2': ('ec', 'sha256'),
+    '1.2.840.10045.4.3.3': ('ec', 'sha384'),
+    '1.2.840.10045.4.3.4': ('ec', 'sha512'),
+}
+
+PKI_STATUS_GRANTED = 0
+PKI_STATUS_GRANTED_WITH_MODS = 1
+
+
+class TimestampVerificationError(Exception):
+    '''The time-stamp token is malformed, untrusted or does not match the data.
+    '''
+    pass
+
+
+# DER encoding
+
+def _encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    body = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(body)]) + body
+
+def _encode(tag, content):
+    return bytes([tag]) + _encode_length(len(content)) + content
+
+def _encode_integer(value):
+    return _encode(TAG_INTEGER, value.to_bytes(value.bit_length() // 8 + 1, 'big', signed=True))
+
+def _encode_oid(dotted):
+    arcs = [int(arc) for arc in dotted.split('.')]
+    body = bytearray([arcs[0] * 40 + arcs[1]])
+    for arc in arcs[2:]:
+        chunk = [arc & 0x7f]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7f))
+            arc >>= 7
+        body.extend(reversed(chunk))
+    return _encode(TAG_OID, bytes(body))
+
+
+# DER decoding
+
+class _Element(object):
+    def __init__(self, tag, content, raw):
+        self.tag = tag
+        self.content = content
+        self.raw = raw
+
+    @property
+    def children(self):
+        return _decode_all(self.content)
+
+    def as_int(self):
+        return int.from_bytes(self.content, 'big', signed=True)
+
+    def as_oid(self):
+        if self.tag != TAG_OID:
+            raise TimestampVerificationError('OBJECT IDENTIFIER expected')
+        first = self.content[0]
+        arcs = [min(first // 40, 2), first - min(first // 40, 2) * 40]
+        value = 0
+        for byte in self.content[1:]:
+            value = (value << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                arcs.append(value)
+                value = 0
+        return '.'.join(str(arc) for arc in arcs)
+
+def _decode(data, offset=0):
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+        header = 2
+        if length & 0x80:
+            size = length & 0x7f
+            if size == 0:
+                raise TimestampVerificationError('indefinite length is not DER')
+            length = int.from_bytes(data[offset + 2:offset + 2 + size], 'big')
+            header += size
+    except IndexError:
+        raise TimestampVerificationError('truncated DER data')
+    end = offset + header + length
+    if end > len(data):
+        raise TimestampVerificationError('truncated DER data')
+    return _Element(tag, data[offset + header:end], data[offset:end]), end
+
+def _decode_all(data):
+    elements = []
+    offset = 0
+    while offset < len(data):
+        element, offset = _decode(data, offset)
+        elements.append(element)
+    return elements
+
+def _validity(cert):
+    '''Return the validity period of a certificate in naive UTC datetimes.
+    '''
+    if hasattr(cert, 'not_valid_before_utc'):  # cryptography >= 42
+        return cert.not_valid_before_utc.replace(tzinfo=None), cert.not_valid_after_utc.replace(tzinfo=None)
+    return cert.not_valid_before, cert.not_valid_after
+
+def _expect(element, tag):
+    if element.tag != tag:
+        raise TimestampVerificationError(
+            'unexpected DER tag 0x{:02x} (0x{:02x} expected)'.format(element.tag, tag))
+    return element
+
+
+def hash_file(file_name, hash_name, chunk_size=HASH_CHUNK_SIZE):
+    '''Compute the digest of a file without loading it in memory.
+    '''
+    h = hashlib.new(hash_name)
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.digest()
+
+def create_request(digest, hash_name, nonce=None, cert_req=True):
+    '''Build a DER encoded TimeStampReq for a digest
+    (same as ``openssl ts -query -digest ... -cert``).
+    '''
+    if hash_name not in HASH_OIDS:
+        raise ValueError('unknown hash algorithm: {}'.format(hash_name))
+    if nonce is None:
+        nonce = int.from_bytes(os.urandom(8), 'big')
+    message_imprint = _encode(
+        TAG_SEQUENCE,
+        _encode(TAG_SEQUENCE, _encode_oid(HASH_OIDS[hash_name]) + _encode(TAG_NULL, b'')) +
+        _encode(TAG_OCTET_STRING, digest)
+    )
+    body = _encode_integer(1) + message_imprint + _encode_integer(nonce)
+    if cert_req:
+        body += _encode(TAG_BOOLEAN, b'\xff')
+    return _encode(TAG_SEQUENCE, body)
+
+def load_certificates(pem_file):
+    '''Load all the certificates of a PEM file.
+    '''
+    with open(pem_file, 'rb') as f:
+        data = f.read()
+    certificates = []
+    end_marker = b'-----END CERTIFICATE-----'
+    for block in data.split(end_marker)[:-1]:
+        begin = block.find(b'-----BEGIN CERTIFICATE-----')
+        if begin < 0:
+            continue
+        certificates.append(x509.load_pem_x509_certificate(
+            block[begin:] + end_marker, default_backend()))
+    return certificates
+
+
+class TimeStampResponse(object):
+    '''A parsed TimeStampResp (or a bare TimeStampToken).
+    '''
+    def __init__(self, data):
+        data = bytes(data)
+        try:
+            self._parse(data)
+        except TimestampVerificationError:
+            raise
+        except (IndexError, ValueError) as err:
+            raise TimestampVerificationError('malformed time-stamp response: {}'.format(err))
+
+    def _parse(self, data):
+        root, _ = _decode(data)
+        items = _expect(root, TAG_SEQUENCE).children
+        if items and items[0].tag == TAG_SEQUENCE:
+            # TimeStampResp: status, timeStampToken
+            status = items[0].children[0].as_int()
+            if status not in (PKI_STATUS_GRANTED, PKI_STATUS_GRANTED_WITH_MODS):
+                raise TimestampVerificationError('time-stamp request rejected: status={}'.format(status))
+            if len(items) < 2:
+                raise TimestampVerificationError('no time-stamp token in the response')
+            token = items[1]
+        else:
+            token = root
+
+        content_info = _expect(token, TAG_SEQUENCE).children
+        if content_info[0].as_oid() != OID_SIGNED_DATA:
+            raise TimestampVerificationError('time-stamp token is not a SignedData')
+        signed_data = _expect(_expect(content_info[1], TAG_CONTEXT_0).children[0], TAG_SEQUENCE).children
+
+        encap_content_info = _expect(signed_data[2], TAG_SEQUENCE).children
+        if encap_content_info[0].as_oid() != OID_TST_INFO:
+            raise TimestampVerificationError('time-stamp token does not contain a TSTInfo')
+        self.tst_info_der = _expect(
+            _expect(encap_content_info[1], TAG_CONTEXT_0).children[0], TAG_OCTET_STRING
+        ).content
+
+        self.certificates = []
+        signer_infos = None
+        for element in signed_data[3:]:
+            if element.tag == TAG_CONTEXT_0:
+                self.certificates = [
+                    x509.load_der_x509_certificate(cert.raw, default_backend())
+                    for cert in element.children if cert.tag == TAG_SEQUENCE
+                ]
+            elif element.tag == TAG_SET:
+                signer_infos = element.children
+        if not signer_infos or len(signer_infos) != 1:
+            raise TimestampVerificationError('time-stamp token must have exactly one signer')
+        self._parse_signer_info(_expect(signer_infos[0], TAG_SEQUENCE).children)
+        self._parse_tst_info()
+
+    def _parse_signer_info(self, signer_info):
+        sid = signer_info[1]
+        if sid.tag == TAG_SEQUENCE:
+            issuer, serial = sid.children
+            self.signer_issuer = issuer.raw
+            self.signer_serial = serial.as_int()
+            self.signer_key_id = None
+        else:
+            self.signer_issuer = None
+            self.signer_serial = None
+            self.signer_key_id = sid.content
+        self.signer_hash_name = self._hash_name(signer_info[2].children[0].as_oid())
+
+        index = 3
+        self.signed_attrs = {}
+        self.signed_attrs_der = None
+        if signer_info[index].tag == TAG_CONTEXT_0:
+            attrs = signer_info[index]
+            # the signature is computed over the attributes encoded as a SET OF
+            self.signed_attrs_der = _encode(TAG_SET, attrs.content)
+            for attr in attrs.children:
+                attr_type, attr_values = attr.children
+                self.signed_attrs[attr_type.as_oid()] = attr_values.children
+            index += 1
+        self.signature_algorithm = signer_info[index].children[0].as_oid()
+        self.signature = _expect(signer_info[index + 1], TAG_OCTET_STRING).content
+        if self.signature_algorithm == OID_RSASSA_PSS:
+            raise TimestampVerificationError('RSASSA-PSS signatures are not supported')
+        if self.signature_algorithm not in SIGNATURE_ALGORITHMS:
+            raise TimestampVerificationError(
+                'unsupported signature algorithm: {}'.format(self.signature_algorithm))
+        self.signature_key_type, signature_hash_name = SIGNATURE_ALGORITHMS[self.signature_algorithm]
+        if signature_hash_name not in (None, self.signer_hash_name):
+            raise TimestampVerificationError('signature algorithm does not match the digest algorithm')
+
+    def _parse_tst_info(self):
+        root, _ = _decode(self.tst_info_der)
+        tst_info = _expect(root, TAG_SEQUENCE).children
+        message_imprint = _expect(tst_info[2], TAG_SEQUENCE).children
+        self.hash_name = self._hash_name(message_imprint[0].children[0].as_oid())
+        self.hashed_message = _expect(message_imprint[1], TAG_OCTET_STRING).content
+        self.serial_number = tst_info[3].as_int()
+        self.gen_time = tst_info[4].content.decode('ascii')
+
+    @staticmethod
+    def _hash_name(oid):
+        name = HASH_NAMES.get(oid)
+        if name is None:
+            raise TimestampVerificationError('unsupported hash algorithm: {}'.format(oid))
+        return name
+
+    def _find_signer(self, candidates):
+        for cert in candidates:
+            if self.signer_key_id is not None:
+                try:
+                    ski = cert.extensions.get_extension_for_class(x509.SubjectKeyIdentifier)
+                except x509.ExtensionNotFound:
+                    continue
+                if ski.value.digest == self.signer_key_id:
+                    return cert
+            elif cert.serial_number == self.signer_serial and \
+                    cert.issuer.public_bytes(default_backend()) == self.signer_issuer:
+                return cert
+        raise TimestampVerificationError('signer certificate not found')
+
+    @staticmethod
+    def _verify_signature(public_key, signature, data, hash_name, key_type=None):
+        '''Verify a PKCS #1 v1.5 or ECDSA signature, of the key type ``key_type``
+        if it is given.
+        '''
+        hash_algorithm = getattr(hashes, hash_name.upper())()
+        try:
+            if isinstance(public_key, rsa.RSAPublicKey) and key_type in (None, 'rsa'):
+                public_key.verify(signature, data, padding.PKCS1v15(), hash_algorithm)
+            elif isinstance(public_key, ec.EllipticCurvePublicKey) and key_type in (None, 'ec'):
+                public_key.verify(signature, data, ec.ECDSA(hash_algorithm))
+            else:
+                raise TimestampVerificationError('unsupported public key type')
+        except InvalidSignature:
+            raise TimestampVerificationError('invalid signature')
+
+    def _verify_signer_certificate(self, signer):
+        try:
+            eku = signer.extensions.get_extension_for_class(x509.ExtendedKeyUsage)
+        except x509.ExtensionNotFound:
+            raise TimestampVerificationError('signer certificate has no extended key usage')
+        if not eku.critical or [oid.dotted_string for oid in eku.value] != [OID_TIME_STAMPING]:
+            raise TimestampVerificationError('signer certificate is not for time-stamping')
+
+        ess_cert_ids = self.signed_attrs.get(OID_SIGNING_CERTIFICATE)
+        ess_hash_name = 'sha1'
+        if ess_cert_ids is None:
+            ess_cert_ids = self.signed_attrs.get(OID_SIGNING_CERTIFICATE_V2)
+            ess_hash_name = 'sha256'
+        if ess_cert_ids is None:
+            raise TimestampVerificationError('no signing certificate attribute')
+        # SigningCertificate ::= SEQUENCE { certs SEQUENCE OF ESSCertID, ... }
+        first_cert_id = ess_cert_ids[0].children[0].children[0].children
+        if first_cert_id[0].tag == TAG_SEQUENCE:  # ESSCertIDv2 with hashAlgorithm
+            ess_hash_name = self._hash_name(first_cert_id[0].children[0].as_oid())
+            first_cert_id = first_cert_id[1:]
+        cert_der = signer.public_bytes(Encoding.DER)
+        if hashlib.new(ess_hash_name, cert_der).digest() != first_cert_id[0].content:
+            raise TimestampVerificationError('signing certificate attribute does not match the signer')
+
+    def _verify_chain(self, signer, trusted, now):
+        untrusted = list(self.certificates)
+        self._check_validity(signer, now)
+        cert = signer
+        # number of the CA certificates between the signer and the next issuer
+        depth = 0
+        for _ in range(len(untrusted) + len(trusted) + 1):
+            for ca in trusted:
+                if ca.subject == cert.issuer and self._is_signed_by(cert, ca):
+                    self._check_issuer(ca, depth, now)
+                    return
+            issuers = [c for c in untrusted if c.subject == cert.issuer and c is not cert]
+            issuer = next((c for c in issuers if self._is_signed_by(cert, c)), None)
+            if issuer is None:
+                break
+            self._check_issuer(issuer, depth, now)
+            untrusted.remove(issuer)
+            cert = issuer
+            depth += 1
+        if signer in trusted:
+            return
+        raise TimestampVerificationError('unable to get local issuer certificate')
+
+    @staticmethod
+    def _check_validity(cert, now):
+        not_before, not_after = _validity(cert)
+        if not not_before <= now <= not_after:
+            raise TimestampVerificationError('certificate is not valid now: {}'.format(cert.subject))
+
+    @classmethod
+    def _check_issuer(cls, issuer, depth, now):
+        '''Check that a certificate can issue a chain with ``depth`` CA certificates
+        below it (basicConstraints CA:TRUE and pathLenConstraint, keyUsage keyCertSign).
+        '''
+        cls._check_validity(issuer, now)
+        try:
+            basic_constraints = issuer.extensions.get_extension_for_class(x509.BasicConstraints).value
+        except x509.ExtensionNotFound:
+            basic_constraints = None
+        if basic_constraints is None or not basic_constraints.ca:
+            raise TimestampVerificationError('invalid CA certificate: {}'.format(issuer.subject))
+        if basic_constraints.path_length is not None and depth > basic_constraints.path_length:
+            raise TimestampVerificationError('path length constraint exceeded: {}'.format(issuer.subject))
+        try:
+            key_usage = issuer.extensions.get_extension_for_class(x509.KeyUsage).value
+        except x509.ExtensionNotFound:
+            key_usage = None
+        if key_usage is not None and not key_usage.key_cert_sign:
+            raise TimestampVerificationError('CA certificate cannot sign certificates: {}'.format(issuer.subject))
+
+    @classmethod
+    def _is_signed_by(cls, cert, issuer):
+        if cert.signature_algorithm_oid.dotted_string == OID_RSASSA_PSS:
+            raise TimestampVerificationError('RSASSA-PSS certificate signatures are not supported')
+        if cert.signature_hash_algorithm is None:
+            raise TimestampVerificationError(
+                'unsupported certificate signature algorithm: {}'.format(cert.signature_algorithm_oid.dotted_string))
+        try:
+            cls._verify_signature(
+                issuer.public_key(), cert.signature, cert.tbs_certificate_bytes,
+                cert.signature_hash_algorithm.name)
+        except TimestampVerificationError:
+            return False
+        return True
+
+    def verify(self, digest, ca_file, now=None):
+        '''Verify that the token time-stamps ``digest`` and is signed by a TSA
+        trusted by the certificates of ``ca_file``.
+
+        Raise TimestampVerificationError when the verification fails.
+        '''
+        if digest != self.hashed_message:
+            raise TimestampVerificationError('message imprint mismatch')
+
+        if self.signed_attrs_der is None:
+            raise TimestampVerificationError('no signed attributes')
+        content_type = self.signed_attrs.get(OID_CONTENT_TYPE)
+        if not content_type or content_type[0].as_oid() != OID_TST_INFO:
+            raise TimestampVerificationError('content type attribute mismatch')
+        message_digest = self.signed_attrs.get(OID_MESSAGE_DIGEST)
+        expected_digest = hashlib.new(self.signer_hash_name, self.tst_info_der).digest()
+        if not message_digest or message_digest[0].content != expected_digest:
+            raise TimestampVerificationError('message digest attribute mismatch')
+
+        trusted = load_certificates(ca_file)
+        signer = self._find_signer(self.certificates + trusted)
+        self._verify_signer_certificate(signer)
+        self._verify_signature(
+            signer.public_key(), self.signature, self.signed_attrs_der, self.signer_hash_name,
+            key_type=self.signature_key_type)
+        self._verify_chain(signer, trusted, now or datetime.datetime.utcnow())
+
+    def verify_file(self, file_name, ca_file, now=None):
+        '''Same as verify() for the content of a file, hashed with the
+        algorithm of the token.
+        '''
+        self.verify(hash_file(file_name, self.hash_name), ca_file, now=now)
@@ -4,6 +4,7 @@
 from __future__ import absolute_import
 import datetime
 import hashlib
+import itertools
 import logging
 import os
 import re
@@ -11,23 +12,29 @@ import shlex
 import shutil
 import subprocess
 import tempfile
+import threading
 import time
 import traceback
 
+from bulk_update.helper import bulk_update
+from concurrent import futures
 from urllib3.util.retry import Retry
 import requests
 
 from api.base import settings as api_settings
 from api.base.utils import waterbutler_api_url_for
 from celery.contrib.abortable import AbortableTask, AbortableAsyncResult
+from django.db import connections, transaction
+from django.db.models import Count, Max, Min
 from django.utils import timezone
 from osf.models import (
-    AbstractNode, BaseFileNode, Guid, RdmFileTimestamptokenVerifyResult, RdmUserKey,
-    OSFUser, TimestampTask
+    AbstractNode, BaseFileNode, FileVersion, Guid, RdmFileTimestamptokenVerifyResult,
+    RdmUserKey, OSFUser, TimestampTask
 )
 from osf.models.nodelog import NodeLog
 from website import util
 from website import settings
+from website.util import rfc3161
 from website.util import waterbutler
 
 from django.contrib.contenttypes.models import ContentType
@@ -117,25 +124,84 @@ def get_async_task_data(node):
             TimestampTask.objects.filter(node=node).delete()
     return task_data
 
-def get_error_list(pid):
-    '''Retrieve from the database the list of all timestamps that has an error.
+ERROR_LIST_BATCH_SIZE = 1000
+
+def _iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class TimestampErrorResolver(object):
+    '''Resolve the file nodes, versions, users and institutions referenced by
+    a batch of RdmFileTimestamptokenVerifyResult rows.
+
+    Everything is fetched with a fixed number of queries per batch, instead of
+    several queries per row.
     '''
-    data_list = RdmFileTimestamptokenVerifyResult.objects.filter(project_id=pid).order_by('provider', 'path')
-    provider_error_list = []
-    provider = None
-    error_list = []
+    def __init__(self, data_list):
+        file_ids = set(data.file_id for data in data_list)
+        self.file_nodes = {
+            f['_id']: f for f in BaseFileNode.objects.filter(
+                _id__in=file_ids
+            ).annotate(
+                latest_version_id=Max('versions__id'),
+                version_count=Count('versions'),
+            ).values('_id', 'latest_version_id', 'version_count')
+        }
 
-    for data in data_list:
-        if data.inspection_result_status == api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS:
-            continue
+        latest_version_ids = [
+            f['latest_version_id'] for f in self.file_nodes.values()
+            if f['latest_version_id'] is not None
+        ]
+        self.version_creators = dict(
+            FileVersion.objects.filter(
+                id__in=latest_version_ids
+            ).values_list('id', 'creator_id')
+        )
+
+        user_ids = set(self.version_creators.values())
+        for data in data_list:
+            user_ids.update([
+                data.upload_file_modified_user,
+                data.upload_file_created_user,
+                data.verify_user,
+            ])
+        user_ids.discard(None)
+        self.users = {user.id: user for user in OSFUser.objects.filter(id__in=user_ids)}
+
+        # same as user.affiliated_institutions.first() (ordered by pk)
+        self.institutions = {}
+        affiliations = OSFUser.affiliated_institutions.through.objects.filter(
+            osfuser_id__in=user_ids
+        ).select_related('institution').order_by('institution_id')
+        for affiliation in affiliations:
+            self.institutions.setdefault(affiliation.osfuser_id, affiliation.institution)
+
+    def get_creator(self, data):
+        if data.upload_file_modified_user is not None:
+            return self.users.get(data.upload_file_modified_user)
+        if data.upload_file_created_user is not None:
+            return self.users.get(data.upload_file_created_user)
+        file_node = self.file_nodes.get(data.file_id)
+        if file_node is not None and file_node['latest_version_id'] is not None:
+            return self.users.get(
+                self.version_creators.get(file_node['latest_version_id']))
+        return None
 
-        if not provider:
-            provider = data.provider
-        elif provider != data.provider:
-            provider_error_list.append({'provider': provider, 'error_list': error_list})
-            provider = data.provider
-            error_list = []
+    def get_file_version(self, data):
+        file_node = self.file_nodes.get(data.file_id)
+        if file_node is None:
+            return ''
+        # same as current_version_number of OsfStorageFile
+        return file_node['version_count'] or 1
 
+    def get_error_info(self, data, provider):
         if data.inspection_result_status in RESULT_MESSAGE:
             verify_result_title = RESULT_MESSAGE[data.inspection_result_status]
         else:  # 'FILE missing(Unverify)'
@@ -147,51 +213,21 @@ def get_error_list(pid):
         else:
             verify_date = ''
 
-        # Get file info
-        base_file_data = BaseFileNode.objects.filter(_id=data.file_id)
-        base_file_data_exists = base_file_data.exists()
-        file_versions = None
-        if base_file_data_exists:
-            base_file_data = base_file_data.get()
-            file_versions = base_file_data.versions.all()
+        def empty_if_none(value):
+            return '' if value is None else value
 
-        # Get creator info
-        creator = None
-        if data.upload_file_modified_user is not None:
-            creator = OSFUser.objects.get(id=data.upload_file_modified_user)
-        elif data.upload_file_created_user is not None:
-            creator = OSFUser.objects.get(id=data.upload_file_created_user)
-        elif file_versions is not None and file_versions.exists():
-            creator = file_versions.latest('id').creator
-
-        # Change None to '' (empty string)
-        data.path = '' if data.path is None else data.path
-        data.upload_file_created_at = '' if data.upload_file_created_at is None else \
-            data.upload_file_created_at
-        data.verify_file_created_at = '' if data.verify_file_created_at is None else \
-            data.verify_file_created_at
-        data.upload_file_modified_at = '' if data.upload_file_modified_at is None else \
-            data.upload_file_modified_at
-        data.verify_file_modified_at = '' if data.verify_file_modified_at is None else \
-            data.verify_file_modified_at
-        data.upload_file_size = '' if data.upload_file_size is None else \
-            data.upload_file_size
-        data.verify_file_size = '' if data.verify_file_size is None else \
-            data.verify_file_size
-
-        # Generate error_info dictionary
         error_info = {
             'creator_name': '',
             'creator_email': '',
             'creator_id': '',
-            'file_path': data.path,
+            'file_path': empty_if_none(data.path),
             'file_id': data.file_id,
-            'file_create_date_on_upload': data.upload_file_created_at,
-            'file_create_date_on_verify': data.verify_file_created_at,
-            'file_modify_date_on_upload': data.upload_file_modified_at,
-            'file_modify_date_on_verify': data.verify_file_modified_at,
-            'file_size_on_upload': data.upload_file_size,
-            'file_size_on_verify': data.verify_file_size,
+            'file_create_date_on_upload': empty_if_none(data.upload_file_created_at),
+            'file_create_date_on_verify': empty_if_none(data.verify_file_created_at),
+            'file_modify_date_on_upload': empty_if_none(data.upload_file_modified_at),
+            'file_modify_date_on_verify': empty_if_none(data.verify_file_modified_at),
+            'file_size_on_upload': empty_if_none(data.upload_file_size),
+            'file_size_on_verify': empty_if_none(data.verify_file_size),
             'file_version': '',
             'project_id': data.project_id,
             'organization_id': '',
@@ -202,35 +238,73 @@ def get_error_list(pid):
             'verify_result_title': verify_result_title,
         }
 
-        try:
-            verify_user = OSFUser.objects.get(id=data.verify_user)
+        verify_user = self.users.get(data.verify_user)
+        if verify_user is not None:
             error_info['verify_user_id'] = verify_user._id.upper()
             error_info['verify_user_name'] = verify_user.fullname
-        except OSFUser.DoesNotExist:
+        else:
             logger.warning('Timestamp Control: verify_user not found.')
 
-        if base_file_data_exists and provider == 'osfstorage':
-            error_info['file_version'] = base_file_data.current_version_number
+        if provider == 'osfstorage':
+            error_info['file_version'] = self.get_file_version(data)
 
+        creator = self.get_creator(data)
         if creator is not None:
             error_info['creator_name'] = creator.fullname
             error_info['creator_email'] = creator.username
             error_info['creator_id'] = creator._id
 
-            institution = creator.affiliated_institutions.first()
+            institution = self.institutions.get(creator.id)
             if institution is not None:
                 error_info['organization_id'] = institution._id
                 error_info['organization_name'] = institution.name
 
-        error_list.append(error_info)
+        return error_info
+
+def _iter_error_infos(data_list, batch_size):
+    for batch in _iter_batches(data_list.iterator(), batch_size):
+        resolver = TimestampErrorResolver(batch)
+        for data in batch:
+            yield data.provider, resolver.get_error_info(data, data.provider)
+
+def iter_error_list(pid, batch_size=ERROR_LIST_BATCH_SIZE):
+    '''Yield the timestamps that have an error, grouped by provider.
+
+    The results are read with a server-side cursor and their related objects
+    are resolved per batch by TimestampErrorResolver. The error_list of each
+    provider is an iterator which yields the entries as they are resolved,
+    so it has to be consumed before the next provider is requested.
+    '''
+    data_list = RdmFileTimestamptokenVerifyResult.objects.filter(
+        project_id=pid
+    ).exclude(
+        inspection_result_status=api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS
+    ).defer('timestamp_token').order_by('provider', 'path')
+
+    grouped = itertools.groupby(_iter_error_infos(data_list, batch_size), key=lambda entry: entry[0])
+    for provider, entries in grouped:
+        yield {
+            'provider': provider,
+            'error_list': (error_info for _, error_info in entries),
+        }
 
-    if error_list:
-        provider_error_list.append({'provider': provider, 'error_list': error_list})
+def get_error_list(pid):
+    '''Retrieve from the database the list of all timestamps that has an error.
+    '''
+    return [
+        {'provider': provider_errors['provider'], 'error_list': list(provider_errors['error_list'])}
+        for provider_errors in iter_error_list(pid)
+    ]
 
-    return provider_error_list
+# providers whose file tree is mirrored in osf_basefilenode
+# (institutional storages based on osfstorage use the 'osfstorage' provider)
+DB_INVENTORY_PROVIDERS = ['osfstorage']
 
 def get_full_list(uid, pid, node):
     '''Get a full list of timestamps from all files uploaded to a storage.
+
+    The file list of the providers in DB_INVENTORY_PROVIDERS is built from the
+    database. The other providers are crawled through WaterButler.
     '''
     user_info = OSFUser.objects.get(id=uid)
     cookie = user_info.get_or_create_cookie().decode()
@@ -265,58 +339,185 @@ def get_full_list(uid, pid, node):
                 inspection_result_status=api_settings.FILE_NOT_EXISTS
             ).update(inspection_result_status=api_settings.FILE_NOT_EXISTS)
 
-        file_list = []
-        child_file_list = []
-        for file_data in waterbutler_json_res['data']:
-            if file_data['attributes']['kind'] == 'folder':
-                logger.info(u'Detected: folder={}'.format(file_data['attributes']['materialized']))
-                child_file_list.extend(
-                    waterbutler_folder_file_info(
-                        pid,
-                        provider_data['attributes']['provider'],
-                        file_data['attributes']['path'],
-                        node, cookies, headers
-                    )
-                )
-            else:
-                logger.info(u'Detected: file={}'.format(file_data['attributes']['materialized']))
-                file_info = None
-                basefile_node = BaseFileNode.resolve_class(
-                    provider_data['attributes']['provider'],
-                    BaseFileNode.FILE
-                ).get_or_create(
-                    node,
-                    file_data['attributes']['path']
-                )
-                basefile_node.materialized_path = file_data['attributes']['materialized']
-                basefile_node.name = os.path.basename(file_data['attributes']['materialized'])
-                basefile_node.save()
-                file_info = {
-                    'file_id': basefile_node._id,
-                    'file_name': file_data['attributes'].get('name'),
-                    'file_path': file_data['attributes'].get('materialized'),
-                    'size': file_data['attributes'].get('size'),
-                    'created': file_data['attributes'].get('created_utc'),
-                    'modified': file_data['attributes'].get('modified_utc'),
-                    'file_version': ''
-                }
-                if provider_data['attributes']['provider'] == 'osfstorage':
-                    file_info['file_version'] = file_data['attributes']['extra'].get('version')
-                if file_info:
-                    file_list.append(file_info)
-
-        file_list.extend(child_file_list)
+        if provider in DB_INVENTORY_PROVIDERS:
+            file_list = get_db_file_list(node, provider)
+        else:
+            scanner = WaterButlerFileScanner(pid, provider, node, cookies, headers)
+            file_list = scanner.scan(waterbutler_json_res['data'])
 
         if file_list:
             provider_files = {
-                'provider': provider_data['attributes']['provider'],
+                'provider': provider,
                 'provider_file_list': file_list
             }
             provider_list.append(provider_files)
 
     return provider_list
 
-def check_file_timestamp(uid, node, data, verify_external_only=False):
+def get_db_file_list(node, provider):
+    '''Build the file list of a provider from osf_basefilenode and its versions.
+
+    The values are the same as the WaterButler metadata of the files: the size
+    and the modified date come from the latest version, the created date from
+    the earliest version, as saved in FileVersionSummary.
+    '''
+    content_type = ContentType.objects.get_for_model(node)
+    target_kwargs = {
+        'target_object_id': node.id,
+        'target_content_type': content_type,
+        'deleted_on__isnull': True,
+    }
+    folder_cls = BaseFileNode.resolve_class(provider, BaseFileNode.FOLDER)
+    file_cls = BaseFileNode.resolve_class(provider, BaseFileNode.FILE)
+
+    folders = {
+        folder_id: (parent_id, name)
+        for folder_id, parent_id, name in folder_cls.objects.filter(
+            **target_kwargs
+        ).values_list('id', 'parent_id', 'name')
+    }
+    folder_paths = {}
+
+    def get_folder_path(folder_id):
+        if folder_id not in folder_paths:
+            parent_id, name = folders.get(folder_id, (None, ''))
+            if parent_id is None:
+                folder_paths[folder_id] = '/'  # root folder
+            else:
+                folder_paths[folder_id] = get_folder_path(parent_id) + name + '/'
+        return folder_paths[folder_id]
+
+    files = list(file_cls.objects.filter(**target_kwargs).values(
+        'id', '_id', 'parent_id', 'name', 'version_summary__version_count', 'version_summary__size',
+        'version_summary__latest_version_created', 'version_summary__earliest_version_created',
+    ))
+    # Files without a version summary: not backfilled yet, or without versions
+    unsummarized_ids = [f['id'] for f in files if f['version_summary__version_count'] is None]
+    unsummarized = {
+        f['id']: f for f in file_cls.objects.filter(id__in=unsummarized_ids).annotate(
+            latest_version_id=Max('versions__id'),
+            earliest_version_id=Min('versions__id'),
+            version_count=Count('versions'),
+        ).values('id', 'latest_version_id', 'earliest_version_id', 'version_count')
+    } if unsummarized_ids else {}
+    version_ids = set()
+    for f in unsummarized.values():
+        version_ids.update([f['latest_version_id'], f['earliest_version_id']])
+    version_ids.discard(None)
+    versions = {
+        v['id']: v for v in FileVersion.objects.filter(
+            id__in=version_ids
+        ).values('id', 'size', 'created')
+    }
+    for f in files:
+        if f['id'] in unsummarized:
+            latest = versions.get(unsummarized[f['id']]['latest_version_id'], {})
+            earliest = versions.get(unsummarized[f['id']]['earliest_version_id'], {})
+            f.update({
+                'version_summary__version_count': unsummarized[f['id']]['version_count'],
+                'version_summary__size': latest.get('size'),
+                'version_summary__latest_version_created': latest.get('created'),
+                'version_summary__earliest_version_created': earliest.get('created'),
+            })
+
+    file_list = []
+    for f in files:
+        file_list.append({
+            'file_id': f['_id'],
+            'file_name': f['name'],
+            'file_path': get_folder_path(f['parent_id']) + f['name'],
+            'size': f['version_summary__size'],
+            'created': f['version_summary__earliest_version_created'],
+            'modified': f['version_summary__latest_version_created'],
+            'file_version': f['version_summary__version_count'] if provider == 'osfstorage' else '',
+        })
+    return file_list
+
+
+class WaterButlerFileScanner(object):
+    '''Crawl the files of a provider through WaterButler.
+
+    The providers do not report the changes of the files nested in a folder, so
+    every folder is listed on each scan. The file nodes of a folder are resolved
+    with one query.
+    '''
+    def __init__(self, pid, provider, node, cookies, headers):
+        self.pid = pid
+        self.provider = provider
+        self.node = node
+        self.cookies = cookies
+        self.headers = headers
+
+    def scan(self, root_data):
+        return self._scan_entries(root_data)
+
+    def _scan_entries(self, entries):
+        '''Return the files in entries and in the subtrees of the folders in entries'''
+        file_entries = []
+        folder_paths = []
+        for file_data in entries:
+            attributes = file_data['attributes']
+            if attributes['kind'] == 'folder':
+                logger.info(u'Detected: folder={}'.format(attributes['materialized']))
+                folder_paths.append(attributes['path'])
+            else:
+                logger.info(u'Detected: file={}'.format(attributes['materialized']))
+                file_entries.append(attributes)
+        file_list = self._resolve_files(file_entries)
+        for path in folder_paths:
+            file_list.extend(self._scan_entries(self._get_folder_entries(path)))
+        return file_list
+
+    def _get_folder_entries(self, path):
+        waterbutler_meta_url = waterbutler_api_url_for(
+            self.pid, self.provider,
+            path,
+            meta=int(time.mktime(datetime.datetime.now().timetuple()))
+        )
+        waterbutler_res = requests.get(
+            waterbutler_meta_url, headers=self.headers, cookies=self.cookies)
+        waterbutler_json_res = waterbutler_res.json()
+        waterbutler_res.close()
+        return waterbutler_json_res['data']
+
+    def _resolve_files(self, file_entries):
+        '''Get or create the BaseFileNode of the files with one query per folder,
+        and save only the nodes whose name or materialized path changed.
+        '''
+        if not file_entries:
+            return []
+        cls = BaseFileNode.resolve_class(self.provider, BaseFileNode.FILE)
+        paths = ['/' + attributes['path'].lstrip('/') for attributes in file_entries]
+        existing = {}
+        for file_node in cls.objects.filter(
+                target_object_id=self.node.id,
+                target_content_type=ContentType.objects.get_for_model(self.node),
+                _path__in=paths).order_by('id'):
+            existing.setdefault(file_node._path, file_node)
+
+        file_list = []
+        for path, attributes in zip(paths, file_entries):
+            basefile_node = existing.get(path)
+            if basefile_node is None:
+                basefile_node = cls.get_or_create(self.node, path)
+            materialized = attributes['materialized']
+            name = os.path.basename(materialized)
+            if basefile_node.materialized_path != materialized or basefile_node.name != name:
+                basefile_node.materialized_path = materialized
+                basefile_node.name = name
+                basefile_node.save()
+            file_list.append({
+                'file_id': basefile_node._id,
+                'file_name': attributes.get('name'),
+                'file_path': materialized,
+                'size': attributes.get('size'),
+                'created': attributes.get('created_utc'),
+                'modified': attributes.get('modified_utc'),
+                'file_version': '',
+            })
+        return file_list
+
+def check_file_timestamp(uid, node, data, verify_external_only=False, save=True):
     user = OSFUser.objects.get(id=uid)
     file_node = BaseFileNode.objects.get(_id=data['file_id'])
     if not userkey_generation_check(user._id):
@@ -326,7 +527,7 @@ def check_file_timestamp(uid, node, data, verify_external_only=False):
     if ext_info.hash_value:
         if ext_info.file_exists:
             return TimeStampTokenVerifyCheckHash.timestamp_check(
-                ext_info, user._id, data, node._id)
+                ext_info, user._id, data, node._id, save=save)
 
     cookie = user.get_or_create_cookie().decode()
     tmp_dir = None
@@ -348,7 +549,7 @@ def check_file_timestamp(uid, node, data, verify_external_only=False):
             return None
         verify_check = TimeStampTokenVerifyCheck()
         result = verify_check.timestamp_check(
-            user._id, data, node._id, download_file_path, tmp_dir
+            user._id, data, node._id, download_file_path, tmp_dir, save=save
         )
 
         shutil.rmtree(tmp_dir)
@@ -439,27 +640,118 @@ def add_log_download_errors(node, uid, data, save=True):
         save=save,
     )
 
+class RequestRateLimiter(object):
+    '''Space out the requests sent by all the workers of a task so that no more
+    than ``requests_per_min`` requests are started per minute.
+    '''
+    def __init__(self, requests_per_min):
+        self.interval = 60.0 / requests_per_min
+        self.next_run = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            secs_to_wait = self.next_run - now
+            self.next_run = max(now, self.next_run) + self.interval
+        if secs_to_wait > 0:
+            time.sleep(secs_to_wait)
+
+
+def save_verify_results(verify_results):
+    '''Write the verification results of a chunk of files in one transaction.
+    '''
+    new_results = [r for r in verify_results if r.pk is None]
+    existing_results = [r for r in verify_results if r.pk is not None]
+    with transaction.atomic():
+        if new_results:
+            RdmFileTimestamptokenVerifyResult.objects.bulk_create(new_results)
+        if existing_results:
+            bulk_update(existing_results)
+
+
+class TimestampVerifyPipeline(object):
+    '''Verify the timestamps of a list of files with a bounded pool of threads.
+
+    The download, hashing and openssl/uPKI verification of the files of a
+    chunk run concurrently, then the results of the chunk are written to the
+    database with bulk operations. All the workers share one limit of
+    TS_REQUESTS_PER_MIN verifications started per minute.
+    '''
+    def __init__(self, uid, node, max_workers=None, chunk_size=None,
+                 is_aborted=None, progress_callback=None):
+        self.uid = uid
+        self.node = node
+        self.max_workers = max_workers or api_settings.TS_VERIFY_MAX_WORKERS
+        self.chunk_size = chunk_size or api_settings.TS_VERIFY_CHUNK_SIZE
+        self.is_aborted = is_aborted or (lambda: False)
+        self.progress_callback = progress_callback
+        self.rate_limiter = RequestRateLimiter(api_settings.TS_REQUESTS_PER_MIN)
+
+    def _verify(self, file_info):
+        if self.is_aborted():
+            return None
+        self.rate_limiter.wait()
+        try:
+            return check_file_timestamp(self.uid, self.node, file_info, save=False)
+        except Exception:
+            logger.exception(u'timestamp verification failed: file_id={}'.format(
+                file_info.get('file_id')))
+            return None
+
+    def _verify_in_thread(self, file_info):
+        try:
+            return self._verify(file_info)
+        finally:
+            # connections are per thread
+            connections.close_all()
+
+    def run(self, file_list):
+        total = len(file_list)
+        done = 0
+        executor = None
+        if self.max_workers > 1:
+            executor = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for chunk in _iter_batches(file_list, self.chunk_size):
+                if self.is_aborted():
+                    break
+                if executor is None:
+                    results = [self._verify(file_info) for file_info in chunk]
+                else:
+                    results = list(executor.map(self._verify_in_thread, chunk))
+                save_verify_results([
+                    result['verify_data'] for result in results if result is not None
+                ])
+                done += len(chunk)
+                if self.progress_callback:
+                    self.progress_callback(done, total)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        return done
+
 @celery_app.task(bind=True, base=AbortableTask)
 def celery_verify_timestamp_token(self, uid, node_id):
-    secs_to_wait = 60.0 / api_settings.TS_REQUESTS_PER_MIN
-    last_run = None
-
     celery_app.current_task.update_state(state='PROGRESS', meta={'progress': 0})
     node = AbstractNode.objects.get(id=node_id)
-    celery_app.current_task.update_state(state='PROGRESS', meta={'progress': 50})
     logger.info('Running timestamp verification...: uid={}, node_guid={}'.format(uid, node._id))
+    file_list = []
     for provider_dict in get_full_list(uid, node._id, node):
         for p_item in provider_dict['provider_file_list']:
-            if self.is_aborted():
-                break
             p_item['provider'] = provider_dict['provider']
-            last_run = time.time()
-            result = check_file_timestamp(uid, node, p_item)
-            if result is None:
-                continue
-            # Do not let the task run too many requests
-            while time.time() < last_run + secs_to_wait:
-                time.sleep(0.1)
+            file_list.append(p_item)
+    celery_app.current_task.update_state(state='PROGRESS', meta={'progress': 10})
+
+    def update_progress(done, total):
+        progress = 10 + int(90 * done / total)
+        celery_app.current_task.update_state(state='PROGRESS', meta={'progress': progress})
+
+    TimestampVerifyPipeline(
+        uid, node,
+        is_aborted=self.is_aborted,
+        progress_callback=update_progress,
+    ).run(file_list)
     add_log_verify_all(node, uid)
     if self.is_aborted():
         logger.warning('Task from project ID {} was cancelled by user ID {}'.format(node_id, uid))
@@ -510,6 +802,8 @@ def get_celery_task_progress(node):
         status['ready'] = task.ready()
         if status['ready']:
             TimestampTask.objects.filter(node=node).delete()
+        elif isinstance(task.info, dict) and 'progress' in task.info:
+            status['progress'] = task.info['progress']
     return status
 
 def cancel_celery_task(node):
@@ -882,64 +1176,6 @@ def file_node_gone(project_id, addon_name, src_path):
         inspection_result_status=api_settings.FILE_NOT_EXISTS
     ).update(inspection_result_status=tst_status)
 
-def waterbutler_folder_file_info(pid, provider, path, node, cookies, headers):
-    # get waterbutler folder file
-    if provider == 'osfstorage':
-        waterbutler_meta_url = waterbutler_api_url_for(
-            pid, provider,
-            '/' + path,
-            meta=int(time.mktime(datetime.datetime.now().timetuple()))
-        )
-    else:
-        waterbutler_meta_url = waterbutler_api_url_for(
-            pid, provider,
-            path,
-            meta=int(time.mktime(datetime.datetime.now().timetuple()))
-        )
-
-    waterbutler_res = requests.get(waterbutler_meta_url, headers=headers, cookies=cookies)
-    waterbutler_json_res = waterbutler_res.json()
-    waterbutler_res.close()
-    file_list = []
-    child_file_list = []
-    for file_data in waterbutler_json_res['data']:
-        if file_data['attributes']['kind'] == 'folder':
-            child_file_list.extend(waterbutler_folder_file_info(
-                pid, provider, file_data['attributes']['path'],
-                node, cookies, headers))
-        else:
-            basefile_node = BaseFileNode.resolve_class(
-                provider,
-                BaseFileNode.FILE
-            ).get_or_create(
-                node,
-                file_data['attributes']['path']
-            )
-            basefile_node.materialized_path = file_data['attributes']['materialized']
-            basefile_node.name = os.path.basename(file_data['attributes']['materialized'])
-            basefile_node.save()
-            if provider == 'osfstorage':
-                file_info = {
-                    'file_name': file_data['attributes']['name'],
-                    'file_path': file_data['attributes']['materialized'],
-                    'file_kind': file_data['attributes']['kind'],
-                    'file_id': basefile_node._id,
-                    'version': file_data['attributes']['extra']['version']
-                }
-            else:
-                file_info = {
-                    'file_name': file_data['attributes']['name'],
-                    'file_path': file_data['attributes']['materialized'],
-                    'file_kind': file_data['attributes']['kind'],
-                    'file_id': basefile_node._id,
-                    'version': ''
-                }
-
-            file_list.append(file_info)
-
-    file_list.extend(child_file_list)
-    return file_list
-
 def user_guid_to_id(user_guid):
     return OSFUser.objects.get(guids___id=user_guid).id
 
@@ -1006,6 +1242,33 @@ def create_rdmuserkey_info(user_id, key_name, key_kind, date):
 def filename_formatter(file_name):
     return file_name.replace(' ', '\\ ')
 
+def verify_timestamp_token_in_process(timestamp_token, provider, file_name=None, digest=None, digests=None):
+    '''Verify a timestamp token against a file or a digest without running openssl.
+
+    ``digests`` may map hash types to digests of the file; the one matching
+    the hash algorithm of the token is used instead of ``digest``.
+    Return (inspection_result_status, verify_result_title) with the same
+    values as the "openssl ts -verify" command.
+    '''
+    ca_file = os.path.join(api_settings.KEY_SAVE_PATH, api_settings.VERIFY_ROOT_CERTIFICATE)
+    try:
+        response = rfc3161.TimeStampResponse(timestamp_token)
+        if digests and response.hash_name in digests:
+            digest = digests[response.hash_name]
+        if digest is None:
+            digest = rfc3161.hash_file(file_name, response.hash_name)
+        response.verify(digest, ca_file)
+        return (api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS,
+                api_settings.TIME_STAMP_TOKEN_CHECK_SUCCESS_MSG)  # 'OK'
+    except rfc3161.TimestampVerificationError as err:
+        logger.error('timestamp verification error occured.({}) : {}'.format(provider, err))
+        return (api_settings.TIME_STAMP_TOKEN_CHECK_NG,
+                api_settings.TIME_STAMP_TOKEN_CHECK_NG_MSG)  # 'NG'
+    except Exception as err:
+        logger.error('timestamp verification error occured.({}): {}'.format(provider, err))
+        return (api_settings.TIME_STAMP_VERIFICATION_ERR,
+                api_settings.TIME_STAMP_VERIFICATION_ERR_MSG)
+
 def get_timestamp_verify_result(file_id, project_id, provider, path, inspection_result_status, user_id):
     res, created = RdmFileTimestamptokenVerifyResult.objects.get_or_create(
         file_id=file_id)
@@ -1026,6 +1289,9 @@ def get_timestamp_verify_result(file_id, project_id, provider, path, inspection_
 class AddTimestamp:
     #1 create tsq (timestamp request) from file, and keyinfo
     def get_timestamp_request(self, file_name):
+        if api_settings.TIME_STAMP_IN_PROCESS:
+            digest = rfc3161.hash_file(file_name, HASH_TYPE_SHA512)
+            return rfc3161.create_request(digest, HASH_TYPE_SHA512)
         cmd = shlex.split(api_settings.SSL_CREATE_TIMESTAMP_REQUEST.format(filename_formatter(file_name)))
         process = subprocess.Popen(
             cmd, shell=False, stdin=subprocess.PIPE,
@@ -1262,13 +1528,16 @@ class TimeStampTokenVerifyCheck:
         return ret, baseFileNode, verify_result, verify_result_title
 
     # timestamp token check
-    def timestamp_check(self, user_guid, file_info, project_id, file_name, tmp_dir, verify_result=None):
+    def timestamp_check(self, user_guid, file_info, project_id, file_name, tmp_dir, verify_result=None, save=True):
         userid = user_guid_to_id(user_guid)
         ret, baseFileNode, verify_result, verify_result_title = \
             self.timestamp_check_switch(None, file_info, verify_result, project_id, userid)
 
         if STATUS_IS_NO_ERROR(ret):
-            if not api_settings.USE_UPKI:
+            if not api_settings.USE_UPKI and api_settings.TIME_STAMP_IN_PROCESS:
+                ret, verify_result_title = verify_timestamp_token_in_process(
+                    verify_result.timestamp_token, verify_result.provider, file_name=file_name)
+            elif not api_settings.USE_UPKI:
                 timestamptoken_file = user_guid + '.tsr'
                 timestamptoken_file_path = os.path.join(tmp_dir, timestamptoken_file)
                 with open(timestamptoken_file_path, 'wb') as fout:
@@ -1341,10 +1610,15 @@ class TimeStampTokenVerifyCheck:
         return self.generate_verify_result(
             baseFileNode, file_info, userid,
             verify_result, verify_result_title,
-            use_hash, external_timestamp, ret)
+            use_hash, external_timestamp, ret, save=save)
 
     @classmethod
-    def generate_verify_result(cls, baseFileNode, file_info, userid, verify_result, verify_result_title, use_hash, external_timestamp, ret):
+    def generate_verify_result(cls, baseFileNode, file_info, userid, verify_result, verify_result_title, use_hash, external_timestamp, ret, save=True):
+        """Update verify_result and return the result of the verification.
+
+        When save is False, verify_result is not saved but returned as
+        'verify_data' so that the caller can save it with other results.
+        """
         file_created_at = file_info.get('created')
         file_modified_at = file_info.get('modified')
         file_size = file_info.get('size')
@@ -1361,7 +1635,8 @@ class TimeStampTokenVerifyCheck:
         verify_result.verify_file_created_at = file_created_at
         verify_result.verify_file_modified_at = file_modified_at
         verify_result.verify_file_size = file_size
-        verify_result.save()
+        if save:
+            verify_result.save()
 
         # RDMINFO: TimeStampVerify
         if file_info['provider'] == 'osfstorage':
@@ -1383,7 +1658,7 @@ class TimeStampTokenVerifyCheck:
             else:
                 verify_result_title += ' (Timestamp from local DB)'
 
-        return {
+        result = {
             'timestamp_token': verify_result.timestamp_token,
             'verify_result': ret,
             'verify_result_title': verify_result_title,  # TODO use TIMESTAMP_MSG_MAP
@@ -1391,6 +1666,9 @@ class TimeStampTokenVerifyCheck:
             'external_timestamp': external_timestamp,
             'filepath': filepath
         }
+        if not save:
+            result['verify_data'] = verify_result
+        return result
 
 
 class AddTimestampHash:
@@ -1438,6 +1716,8 @@ class AddTimestampHash:
     def _gen_timestamp_request(cls, ext_info):
         digest = ext_info.hash_value
         digest_type = hash_type_to_openssl_digest_type(ext_info.hash_type)
+        if api_settings.TIME_STAMP_IN_PROCESS:
+            return rfc3161.create_request(bytes.fromhex(digest), ext_info.hash_type)
         fmt = api_settings.SSL_CREATE_TIMESTAMP_HASH_REQUEST
         cmd = shlex.split(fmt.format(digest=digest, digest_type=digest_type))
         DEBUG(str(cmd))
@@ -1484,18 +1764,32 @@ class AddTimestampHash:
 
 
 class TimeStampTokenVerifyCheckHash:
+    @classmethod
+    def _verify_in_process(cls, ext_info, verify_result):
+        hash_type_to_openssl_digest_type(ext_info.hash_type)  # check only
+        ret, verify_result_title = verify_timestamp_token_in_process(
+            select_timestamp_token(verify_result, ext_info), verify_result.provider,
+            digest=bytes.fromhex(ext_info.hash_value),
+            digests={
+                hash_type: bytes.fromhex(hash_value)
+                for hash_type, hash_value in ext_info.hashes.items()
+            })
+        verify_result.inspection_result_status = ret
+        return verify_result, verify_result_title, ret
+
     @classmethod
     def _verify(cls, tmp_dir, ext_info, user_guid, project_id, verify_result):
         timestamptoken_file = user_guid + '.tmp'
         timestamptoken_file_path = os.path.join(
             tmp_dir, timestamptoken_file)
+        timestamp_token = select_timestamp_token(verify_result, ext_info)
         with open(timestamptoken_file_path, 'wb') as fout:
-            fout.write(select_timestamp_token(verify_result, ext_info))
+            fout.write(timestamp_token)
         DEBUG('TIMESTAMP TOKEN filesize={}'.format(os.path.getsize(timestamptoken_file_path)))
-        digest = ext_info.hash_value
+        hash_type, digest = select_timestamp_digest(timestamp_token, ext_info)
         ret = api_settings.TIME_STAMP_TOKEN_UNCHECKED
         if not api_settings.USE_UPKI:
-            digest_type = hash_type_to_openssl_digest_type(ext_info.hash_type)
+            digest_type = hash_type_to_openssl_digest_type(hash_type)
             fmt = api_settings.SSL_GET_TIMESTAMP_HASH_RESPONSE
             cmd = shlex.split(fmt.format(
                 digest=digest,
@@ -1559,13 +1853,17 @@ class TimeStampTokenVerifyCheckHash:
         return verify_result, verify_result_title, ret
 
     @classmethod
-    def timestamp_check(cls, ext_info, user_guid, file_info, project_id, verify_result=None):
+    def timestamp_check(cls, ext_info, user_guid, file_info, project_id, verify_result=None, save=True):
         user_id = user_guid_to_id(user_guid)
         ret, baseFileNode, verify_result, verify_result_title = \
             TimeStampTokenVerifyCheck.timestamp_check_switch(
                 ext_info, file_info, verify_result, project_id, user_id)
 
-        if STATUS_IS_NO_ERROR(ret):
+        if STATUS_IS_NO_ERROR(ret) and \
+                not api_settings.USE_UPKI and api_settings.TIME_STAMP_IN_PROCESS:
+            verify_result, verify_result_title, ret = cls._verify_in_process(
+                ext_info, verify_result)
+        elif STATUS_IS_NO_ERROR(ret):
             tmp_dir = tempfile.mkdtemp()
             try:
                 verify_result, verify_result_title, ret = cls._verify(
@@ -1581,7 +1879,7 @@ class TimeStampTokenVerifyCheckHash:
         return TimeStampTokenVerifyCheck.generate_verify_result(
             baseFileNode, file_info, user_id,
             verify_result, verify_result_title,
-            use_hash, external_timestamp, ret)
+            use_hash, external_timestamp, ret, save=save)
 
 
 HASH_TYPE_SHA256 = 'sha256'
@@ -1614,15 +1912,29 @@ def select_timestamp_token(verify_result, ext_info):
     DEBUG('use local Timestamp')
     return verify_result.timestamp_token
 
+def select_timestamp_digest(timestamp_token, ext_info):
+    '''Return (hash_type, hash_value) of the file for the hash algorithm of the
+    message imprint of the token, or the hash of ext_info if the token cannot be
+    parsed or the file was not hashed with this algorithm.
+    '''
+    try:
+        hash_type = rfc3161.TimeStampResponse(timestamp_token).hash_name
+    except rfc3161.TimestampVerificationError as err:
+        DEBUG('cannot read the hash algorithm of the timestamp token: {}'.format(err))
+        return ext_info.hash_type, ext_info.hash_value
+    if hash_type in ext_info.hashes:
+        return hash_type, ext_info.hashes[hash_type]
+    return ext_info.hash_type, ext_info.hash_value
+
 class ExternalInfo():
     def __init__(self, node, user, file_node, verify_external_only):
         self.node = node
         self.user = user
         self.file_node = file_node
+        self.verify_external_only = verify_external_only
+        self._file_exists = None
         self._init_hash()
         self._init_timestamp()
-        self._file_exists = None
-        self.verify_external_only = verify_external_only
 
     @property
     def has_timestamp(self):
@@ -1653,6 +1965,27 @@ class ExternalInfo():
             return func()
 
         self.hash_type, self.hash_value = get()
+        self.hashes = {}
+        if self.hash_value:
+            # the hash of the storage is used as is: nothing is downloaded
+            self.hashes[self.hash_type] = self.hash_value
+        elif api_settings.TIME_STAMP_STREAMING_HASH and not self.verify_external_only:
+            self._init_streaming_hash()
+
+    def _init_streaming_hash(self):
+        # sha512 is used for new timestamps (same as "openssl ts -query -sha512"),
+        # sha256 is kept to verify the timestamps created with it
+        cookie = self.user.get_or_create_cookie().decode()
+        hashes = waterbutler.hash_file(
+            cookie, self.file_node, [HASH_TYPE_SHA256, HASH_TYPE_SHA512],
+            chunk_size=api_settings.TIME_STAMP_HASH_CHUNK_SIZE)
+        if hashes is None:
+            return  # not found -> downloading file (to update the status)
+        self.hashes = hashes
+        self.hash_type = HASH_TYPE_SHA512
+        self.hash_value = hashes[HASH_TYPE_SHA512]
+        self._file_exists = True
+        DEBUG(u'streaming hash: path={}'.format(self.file_node.path))
 
     def _init_timestamp(self):
         # return (timestamp_data, timestamp_status, context)
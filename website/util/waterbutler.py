@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import requests
 import shutil
 import os
@@ -39,6 +40,38 @@ def download_file(osf_cookie, file_node, download_path, **kwargs):
     response.close()
     return full_path
 
+def hash_file(osf_cookie, file_node, hash_types, chunk_size=1024 * 1024, **kwargs):
+    """Compute the digests of an waterbutler file by hashing its contents while
+    streaming, so nothing is written to disk. All the digests are computed in
+    a single pass.
+
+    Return a dict of hex digests by hash type, or None if the file could not
+    be downloaded.
+    """
+    try:
+        response = requests.get(
+            file_node.generate_waterbutler_url(action='download', direct=None, _internal=True, **kwargs),
+            cookies={settings.COOKIE_NAME: osf_cookie},
+            stream=True
+        )
+    except Exception as err:
+        logger.error(err)
+        return None
+
+    try:
+        if response.status_code != 200:
+            return None
+        hashers = {hash_type: hashlib.new(hash_type) for hash_type in hash_types}
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            for hasher in hashers.values():
+                hasher.update(chunk)
+    except Exception as err:
+        logger.error(err)
+        return None
+    finally:
+        response.close()
+    return {hash_type: hasher.hexdigest() for hash_type, hasher in hashers.items()}
+
 def upload_folder_recursive(osf_cookie, pid, local_path, dest_path):
     """Upload all the content (files and folders) inside a folder.
     """